@@ -42,6 +42,7 @@ import odemis.gui
 from odemis.gui.conf import get_acqui_conf
 from odemis.gui.plugin import Plugin, AcquisitionDialog
 from odemis.gui.util import formats_to_wildcards
+from odemis.util import img
 import os
 import threading
 import time
@@ -182,8 +183,9 @@ class AveragePlugin(Plugin):
         logging.info("Will acquire frame average on %d detectors", len(dets))
 
         self._das = [None] * len(dets)  # Data just received
-        sumdas = [None] * len(dets)  # to store accumulated frame (in float)
-        md = [None] * len(dets)  # to store the metadata
+        # To accumulate the frames (in place), and average them at the end
+        intors = [img.ImageIntegrator(nb, det_type=model.MD_DT_NORMAL) for d in dets]
+        fdas = [None] * len(dets)  # the latest integrated frame
         self._prepare_acq(dets)
 
         end = time.time() + self.expectedDuration.value
@@ -220,13 +222,7 @@ class AveragePlugin(Plugin):
 
                     # Add the latest frame to the sum
                     # TODO: do this while waiting for the next frame (to save time)
-                    da = self._das[n]
-                    if sumdas[n] is None:
-                        # Convert to float, to handle very large numbers
-                        sumdas[n] = da.astype(numpy.float64)
-                        md[n] = da.metadata
-                    else:
-                        sumdas[n] += da
+                    fdas[n] = intors[n].append(self._das[n])
 
                 logging.info("Acquired frame %d", i + 1)
 
@@ -236,11 +232,7 @@ class AveragePlugin(Plugin):
         finally:
             self._end_acq(dets)
 
-        # Compute the average data
-        fdas = []
-        for sd, md, ld in zip(sumdas, md, self._das):
-            fdas.append(self._average_data(self.accumulations.value, sd, md, ld.dtype))
-
+        # After the last frame, the integrated frames are averaged
         logging.info("Exporting data to %s", self.filename.value)
         exporter = dataio.find_fittest_converter(self.filename.value)
         exporter.export(self.filename.value, fdas)
@@ -276,21 +268,3 @@ class AveragePlugin(Plugin):
         dets[0].data.synchronizedOn(None)
         for d, l in zip(dets, self._listeners):
             d.data.unsubscribe(l)
-
-    def _average_data(self, nb, sumda, md, dtype):
-        """
-        nb (int): the number of acquisitions
-        sumda (DataArray): the accumulated acquisition from a detector
-        md (dict): the metadata
-        dtype (numpy.dtype): the data type to be converted to
-        return (DataArray): the averaged frame (with the correct metadata)
-        """
-        a = sumda / nb
-        a = model.DataArray(a.astype(dtype), md)
-
-        # The metadata is the on from the first DataArray, which is good for
-        # _almost_ everything
-        if model.MD_DWELL_TIME in a.metadata:
-            a.metadata[model.MD_DWELL_TIME] *= nb
-
-        return a
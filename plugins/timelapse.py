@@ -54,7 +54,7 @@ import wx
 
 class TimelapsePlugin(Plugin):
     name = "Timelapse"
-    __version__ = "2.1"
+    __version__ = "2.2"
     __author__ = u"Éric Piel"
     __license__ = "Public domain"
 
@@ -105,9 +105,11 @@ class TimelapsePlugin(Plugin):
         self._dlg = None
         self.addMenu("Acquisition/Timelapse...\tCtrl+T", self.start)
 
-        self._to_store = queue.Queue()  # queue of tuples (str, [DataArray]) for saving data
-        self._sthreads = []  # the saving threads
+        self._to_store = queue.Queue()  # queue of tuples (int, [DataArray]) for saving data
+        self._sthread = None  # the saving thread
         self._exporter = None  # dataio exporter to use
+        self._appender = None  # to write all the acquisitions in a single file, if supported
+        self._fn_pat = None  # pattern of the filename, for saving each acquisition in a separate file
 
     def _get_new_filename(self):
         conf = get_acqui_conf()
@@ -275,56 +277,86 @@ class TimelapsePlugin(Plugin):
 
         dlg.Destroy()
 
-    # Functions to handle the storage of the data in parallel threads
+    # Functions to handle the storage of the data in a separate thread.
+    # If the format supports it, all the acquisitions are appended along T in
+    # the same file. Otherwise, each acquisition is saved in a separate file.
 
-    def _saving_thread(self, i):
+    def _saving_thread(self):
         try:
             while True:
-                fn, das = self._to_store.get()
-                if fn is None:
+                i, das = self._to_store.get()
+                if i is None:
                     self._to_store.task_done()
                     return
-                logging.info("Saving data %s in thread %d", fn, i)
-                self._exporter.export(fn, das)
-                self._to_store.task_done()
-        except Exception:
-            logging.exception("Failure in the saving thread")
+                try:
+                    if self._appender:
+                        logging.info("Appending data %d to %s", i, self.filename.value)
+                        self._appender.append(das)
+                    else:
+                        fn = self._fn_pat % (i,)
+                        logging.info("Saving data %s", fn)
+                        self._exporter.export(fn, das)
+                except Exception:
+                    logging.exception("Failed to save data %d", i)
+                finally:
+                    self._to_store.task_done()
         finally:
-            logging.debug("Saving thread %d done", i)
+            logging.debug("Saving thread done")
 
-    def _start_saving_threads(self, n=4):
+    def _start_saving_thread(self):
         """
-        n (int >= 1): number of threads
+        Prepare the file(s) and the thread to store the data
         """
-        if self._sthreads:
-            logging.warning("The previous saving threads were not stopped, stopping now")
-            self._stop_saving_threads()
+        if self._sthread:
+            logging.warning("The previous saving thread was not stopped, stopping now")
+            self._stop_saving_thread()
+
+        fn = self.filename.value
+        self._exporter = dataio.find_fittest_converter(fn)
+        bs, ext = splitext(fn)
+        self._fn_pat = bs + "-%.5d" + ext
+        if hasattr(self._exporter, "open_appendable"):
+            self._appender = self._exporter.open_appendable(fn, "T")
+        else:
+            self._appender = None
 
-        for i in range(n):
-            t = threading.Thread(target=self._saving_thread, args=(i,))
-            t.start()
-            self._sthreads.append(t)
+        self._sthread = threading.Thread(target=self._saving_thread, name="Timelapse saving")
+        self._sthread.start()
 
-    def _stop_saving_threads(self):
+    def _stop_saving_thread(self):
         """
         Blocks until all the data has been stored
         Can be called multiple times in a row
         """
-        # Indicate to all the threads that they should stop
-        for _ in self._sthreads:
-            self._to_store.put((None, None))  # Special "quit" message for each thread
+        if self._sthread:
+            self._to_store.put((None, None))  # Special "quit" message for the thread
+            # Wait for the thread to complete
+            self._to_store.join()
+            self._sthread.join()
+            self._sthread = None
+
+        if self._appender:
+            try:
+                self._appender.close()
+            finally:
+                self._appender = None
 
-        # Wait for all the threads to complete
-        self._to_store.join()
-        for t in self._sthreads:
-            t.join()
-        self._sthreads = []
+    def _save_data(self, i, das):
+        """
+        Queue the requested DataArrays to be stored
+        i (int): the index of the acquisition
+        das (list of DataArrays): the data of the acquisition
+        """
+        self._to_store.put((i, das))
 
-    def _save_data(self, fn, das):
+    def _save_last_data(self, i, das):
         """
-        Queue the requested DataArrays to be stored in the given file
+        Store in a separate file the data of the last acquisition, which
+        contains more streams than the other ones.
         """
-        self._to_store.put((fn, das))
+        fn = self._fn_pat % (i,)
+        logging.info("Saving last data %s", fn)
+        self._exporter.export(fn, das)
 
     def acquire(self, dlg):
         main_data = self.main_app.main_data
@@ -332,7 +364,7 @@ class TimelapsePlugin(Plugin):
         stream_paused = str_ctrl.pauseStreams()
         dlg.pauseSettings()
 
-        self._start_saving_threads(4)
+        self._start_saving_thread()
 
         ss, last_ss = self._get_acq_streams()
         sacqt = acqmng.estimateTime(ss)
@@ -351,8 +383,8 @@ class TimelapsePlugin(Plugin):
             else:
                 self._acquire_multi(dlg, ss, last_ss)
         finally:
-            # Make sure the threads are stopped even in case of error
-            self._stop_saving_threads()
+            # Make sure the thread is stopped even in case of error
+            self._stop_saving_thread()
 
         # self.showAcquisition(self.filename.value)
 
@@ -372,11 +404,6 @@ class TimelapsePlugin(Plugin):
         # each acquisition.
         nb = self.numberOfAcquisitions.value
 
-        fn = self.filename.value
-        self._exporter = dataio.find_fittest_converter(fn)
-        bs, ext = splitext(fn)
-        fn_pat = bs + "-%.5d" + ext
-
         self._acq_completed = threading.Event()
 
         f = model.ProgressiveFuture()
@@ -387,7 +414,7 @@ class TimelapsePlugin(Plugin):
             extra_dur = acqmng.estimateTime([st] + last_ss)
         else:
             extra_dur = 0
-        self._hijack_live_stream(st, f, nb, fn_pat, extra_dur)
+        self._hijack_live_stream(st, f, nb, extra_dur)
 
         try:
             # Start acquisition and wait until it's done
@@ -410,9 +437,9 @@ class TimelapsePlugin(Plugin):
             ss = [st] + last_ss
             f.set_progress(end=time.time() + acqmng.estimateTime(ss))
             das, e = acqmng.acquire(ss, self.main_app.main_data.settings_obs).result()
-            self._save_data(fn_pat % (nb,), das)
+            self._save_last_data(nb, das)
 
-        self._stop_saving_threads()  # Wait for all the data to be stored
+        self._stop_saving_thread()  # Wait for all the data to be stored
         f.set_result(None)  # Indicate it's over
 
     def _cancel_fast_acquire(self, f):
@@ -420,7 +447,7 @@ class TimelapsePlugin(Plugin):
         self._acq_completed.set()
         return True
 
-    def _hijack_live_stream(self, st, f, nb, fn_pat, extra_dur=0):
+    def _hijack_live_stream(self, st, f, nb, extra_dur=0):
         st._old_shouldUpdateHistogram = st._shouldUpdateHistogram
         st._shouldUpdateHistogram = lambda: None
         self._data_received = 0
@@ -441,7 +468,7 @@ class TimelapsePlugin(Plugin):
                 logging.debug("Skipping extra data")
                 return
 
-            self._save_data(fn_pat % (i,), [st.raw[0]])
+            self._save_data(i, [st.raw[0]])
 
             # Update progress bar
             left = nb - i
@@ -461,11 +488,6 @@ class TimelapsePlugin(Plugin):
         p = self.period.value
         nb = self.numberOfAcquisitions.value
 
-        fn = self.filename.value
-        self._exporter = dataio.find_fittest_converter(fn)
-        bs, ext = splitext(fn)
-        fn_pat = bs + "-%.5d" + ext
-
         sacqt = acqmng.estimateTime(ss)
         intp = max(0, p - sacqt)
         if p < sacqt:
@@ -495,7 +517,11 @@ class TimelapsePlugin(Plugin):
                 dlg.resumeSettings()
                 return
 
-            self._save_data(fn_pat % (i,), das)
+            if left == 1 and last_ss:
+                # Not the same streams as the other acquisitions => separate file
+                self._save_last_data(i, das)
+            else:
+                self._save_data(i, das)
 
             # Wait the period requested, excepted the last time
             if left > 1:
@@ -505,5 +531,5 @@ class TimelapsePlugin(Plugin):
                 else:
                     logging.info("Immediately starting next acquisition, %g s late", -sleept)
 
-        self._stop_saving_threads()  # Wait for all the data to be stored
+        self._stop_saving_thread()  # Wait for all the data to be stored
         f.set_result(None)  # Indicate it's over
@@ -23,7 +23,6 @@ from __future__ import division
 
 from collections import OrderedDict
 from concurrent.futures import CancelledError
-import copy
 import logging
 import math
 import numpy
@@ -45,7 +44,7 @@ import wx
 
 class ZStackPlugin(Plugin):
     name = "Z Stack"
-    __version__ = "1.3"
+    __version__ = "1.4"
     __author__ = u"Anders Muskens"
     __license__ = "GPLv2"
 
@@ -281,36 +280,56 @@ class ZStackPlugin(Plugin):
         if dlg:  # If dlg hasn't been destroyed yet
             dlg.Destroy()
 
-    def constructCube(self, images):
-        # images is a list of 3 dim data arrays.
-        ret = []
-        for image in images:
-            stack = numpy.dstack(image)
-            stack = numpy.swapaxes(stack, 1, 2)
-            ret.append(stack[0])
-
-        # Add back metadata
-        metadata3d = copy.copy(images[0].metadata)
-        # Extend pixel size to 3D
-        ps_x, ps_y = metadata3d[model.MD_PIXEL_SIZE]
-        ps_z = self.zstep.value
-
-        # Computer cube centre
-        c_x, c_y = metadata3d[model.MD_POS]
-        c_z = self.zstart.value + (self.zstep.value * self.numberofAcquisitions.value) / 2
-        metadata3d[model.MD_POS] = (c_x, c_y, c_z)
+    def _getZLevels(self):
+        """
+        return (list of floats): the Z positions, in the order they are acquired.
+          They are always increasing, so that the images can be directly appended
+          to the Z stack.
+        """
+        nb = self.numberofAcquisitions.value
+        zlevels = [self.zstart.value + self.zstep.value * i for i in range(nb)]
+        return sorted(zlevels)
+
+    def prepareImage(self, image):
+        """
+        Add the Z information to the metadata of an image, so that it can be
+        appended to the Z stack.
+        image (DataArray): 2D image acquired at one Z level
+        return (DataArray): the same data, with a 3D pixel size and the position
+          of the centre of the whole stack.
+        """
+        md = image.metadata.copy()
+        # Extend pixel size to 3D (Z is always increasing)
+        ps_x, ps_y = md[model.MD_PIXEL_SIZE]
+        md[model.MD_PIXEL_SIZE] = (ps_x, ps_y, abs(self.zstep.value))
 
-        # For a negative pixel size, convert to a positive and flip the z axis
-        if ps_z < 0:
-            ret = numpy.flipud(ret)
-            ps_z = -ps_z
+        # Compute cube centre
+        c_x, c_y = md[model.MD_POS]
+        c_z = self.zstart.value + (self.zstep.value * self.numberofAcquisitions.value) / 2
+        md[model.MD_POS] = (c_x, c_y, c_z)
+        md[model.MD_DIMS] = "ZYX"
 
-        metadata3d[model.MD_PIXEL_SIZE] = (ps_x, ps_y, abs(ps_z))
-        metadata3d[model.MD_DIMS] = "ZYX"
+        return DataArray(image.reshape((1,) + image.shape), md)
 
-        ret = DataArray(ret, metadata3d)
+    def constructCube(self, images):
+        """
+        images (list of DataArray): the images of one stream, at each Z level,
+          as returned by prepareImage()
+        return (DataArray): the Z stack (ZYX)
+        """
+        return DataArray(numpy.concatenate(images), images[0].metadata)
 
-        return ret
+    def _removePartialFiles(self, filenames):
+        """
+        Delete the files of an acquisition which didn't complete
+        filenames (list of str): the files to delete
+        """
+        for fn in filenames:
+            logging.info("Deleting partial Z stack file %s", fn)
+            try:
+                os.remove(fn)
+            except OSError:
+                logging.warning("Failed to delete partial Z stack file %s", fn, exc_info=True)
 
     """
     The acquire function API is generic.
@@ -327,18 +346,17 @@ class ZStackPlugin(Plugin):
         # Move the focus to the start z position
         logging.debug("Preparing Z Stack acquisition. Moving focus to start position")
         self._old_pos = self.focus.position.value
-        self.focus.moveAbs({'z': self.zstart.value}).result()
+        self.focus.moveAbs({'z': self._getZLevels()[0]}).result()
         self.focus.position.unsubscribe(self._on_focus_pos)  # to not update zstart when going through the steps
         self.zstart.unsubscribe(self._on_zstart)
         return self._estimate_step_duration()
 
-    def stepAcquisition(self, i, images):
+    def stepAcquisition(self, i):
         """
         An action that executes for the ith step of the acquisition
         i (int): the step number
-        images []: A list of images as DataArrays
         """
-        self.focus.moveRel({'z': self.zstep.value}).result()
+        self.focus.moveRel({'z': abs(self.zstep.value)}).result()
         
     def completeAcquisition(self, completed):
         """
@@ -353,16 +371,6 @@ class ZStackPlugin(Plugin):
         self.focus.position.subscribe(self._on_focus_pos)
         self.zstart.subscribe(self._on_zstart)
         
-    def postProcessing(self, images):
-        """
-        Post-process the images after the acquisition is done.
-        images []: list of list of DataArrays (2D): first dim is the different streams,
-        the second dimension is the different acquisition number.
-        Returns: [list] list of a list of images that have been processed
-        """
-        cubes = [self.constructCube(ims) for ims in images]
-        return cubes
-
     def acquire(self, dlg):
         """
         Acquisition operation.
@@ -378,6 +386,8 @@ class ZStackPlugin(Plugin):
         sacqt = acqmng.estimateTime(ss)
         
         completed = False
+        appender = None
+        fn = self.filename.value
 
         try:
             step_time = self.initAcquisition()
@@ -389,9 +399,16 @@ class ZStackPlugin(Plugin):
             f.set_running_or_notify_cancel()  # Indicate the work is starting now
             dlg.showProgress(f)
 
-            # list of list of DataArray: for each stream, for each acquisition, the data acquired
-            images = None
-        
+            exporter = dataio.find_fittest_converter(fn)
+            if hasattr(exporter, "open_appendable"):
+                # Each image is directly stored in the file, along Z
+                appender = exporter.open_appendable(fn, "Z")
+            else:
+                # The images are kept in memory, and exported all at the end.
+                # list of list of DataArray: for each acquisition, for each
+                # stream, the data acquired
+                images = []
+
             for i in range(nb):
                 left = nb - i
                 dur = sacqt * left + step_time * (left - 1)
@@ -401,37 +418,44 @@ class ZStackPlugin(Plugin):
                 startt = time.time()
                 f.set_progress(end=startt + dur)
                 das, e = acqmng.acquire(ss, self.main_app.main_data.settings_obs).result()
-                if images is None:
-                    # Copy metadata from the first acquisition
-                    images = [[] for i in range(len(das))]
-
-                for im, da in zip(images, das):
-                    im.append(da)
-
                 if f.cancelled():
                     raise CancelledError()
 
-                # Execute an action to prepare the next acquisition for the ith acquisition
-                self.stepAcquisition(i, images)
+                zdas = [self.prepareImage(da) for da in das]
+                if appender:
+                    appender.append(zdas)
+                else:
+                    images.append(zdas)
 
-            f.set_result(None)  # Indicate it's over
-            
-            # Construct a cube from each stream's image.
-            images = self.postProcessing(images)
+                # Execute an action to prepare the next acquisition
+                if left > 1:
+                    self.stepAcquisition(i)
+
+            if not appender:
+                # Construct a cube from each stream's images
+                cubes = [self.constructCube(ims) for ims in zip(*images)]
+                exporter.export(fn, cubes)
 
-            # Export image
-            exporter = dataio.find_fittest_converter(self.filename.value)
-            exporter.export(self.filename.value, images)
+            f.set_result(None)  # Indicate it's over
             completed = True
             dlg.Close()
-            
+
         except CancelledError:
             logging.debug("Acquisition cancelled.")
             dlg.resumeSettings()
 
-        except e:
-            logging.exception(e)
+        except Exception:
+            logging.exception("Failed to acquire the Z stack")
+            dlg.resumeSettings()
 
         finally:
+            if appender:
+                try:
+                    appender.close()
+                except Exception:
+                    logging.exception("Failed to close the Z stack file")
+                # Only a part of the Z stack was written => don't leave it
+                if not completed:
+                    self._removePartialFiles(appender.filenames)
             # Do completion actions
             self.completeAcquisition(completed)
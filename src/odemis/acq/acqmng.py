@@ -30,12 +30,13 @@ from collections import OrderedDict
 import collections
 from concurrent.futures import CancelledError
 import logging
+import threading
 
 from odemis import model
-from odemis.acq import _futures
+from odemis.acq import _futures, path
 from odemis.acq.stream import FluoStream, SEMCCDMDStream, SEMMDStream, SEMTemporalMDStream, \
     OverlayStream, OpticalStream, EMStream, ScannedFluoStream, ScannedFluoMDStream, \
-    ScannedRemoteTCStream, ScannedTCSettingsStream
+    ScannedRemoteTCStream, ScannedTCSettingsStream, AlignedSEMStream
 from odemis.util import img, fluo, executeAsyncTask
 import time
 import copy
@@ -67,6 +68,9 @@ def acquire(streams, settings_obs=None):
         to receive the result of the task, which is a tuple:
             (list of model.DataArray): the raw acquisition data
             (Exception or None): exception raised during the acquisition
+        It also has a .timings attribute, listing the time spent in each phase
+        of the acquisition, as (str, str, float, float): the stream name, the
+        phase ("prepare" or "acquire"), and the start and end times.
     """
 
     # create a future
@@ -239,6 +243,59 @@ def _weight_stream(stream):
         return 0
 
 
+def _getStreamHardware(stream):
+    """
+    Lists the hardware components used by a stream during its acquisition.
+    stream (Stream): the stream
+    return (set of Components, set of Components): the detectors and the
+      other components (eg, emitters, focuser) used.
+    """
+    detectors = set()
+    others = set()
+    # For the MD streams, look at each sub-stream
+    for s in (getattr(stream, "streams", None) or [stream]):
+        for attr, comps in (("detector", detectors), ("emitter", others), ("focuser", others)):
+            comp = getattr(s, attr, None)
+            if comp is not None:
+                comps.add(comp)
+    return detectors, others
+
+
+# Closure of the affects graph of the microscope, for the systems without
+# optical path manager. It's cached, as reading it requires to contact every component.
+_affects_cache = None  # (Microscope, dict str -> set of str)
+_affects_lock = threading.Lock()
+
+
+def _getAffectsClosure(comps):
+    """
+    Return which components each component of the microscope affects. The
+    result is cached, so the back-end is only contacted once per microscope.
+    comps (set of Components): components which must be known. If one of them
+      is not in the cached graph (eg, it was not yet running), it's updated.
+    return (dict str -> set of str): for each component name, the names of
+      all the components it affects directly or indirectly (including itself).
+    """
+    global _affects_cache
+    with _affects_lock:
+        try:
+            microscope = model.getMicroscope()
+            if (_affects_cache is None or _affects_cache[0] is not microscope or
+                    not all(c.name in _affects_cache[1] for c in comps)):
+                _affects_cache = microscope, path.affectsClosure(path.affectsGraph(microscope))
+            return _affects_cache[1]
+        except Exception:
+            logging.info("Failed to list the components, will only use the ones of the streams")
+
+    graph = {}
+    for comp in comps:
+        try:
+            graph[comp.name] = set(comp.affects.value)
+        except AttributeError:  # No .affects
+            graph[comp.name] = set()
+    return path.affectsClosure(graph)
+
+
 class AcquisitionTask(object):
 
     def __init__(self, streams, future, settings_obs=None):
@@ -254,9 +311,33 @@ class AcquisitionTask(object):
             self._streamTimes[s] = s.estimateAcquisitionTime()
 
         self._streams_left = set(self._streams) # just for progress update
-        self._current_stream = None
-        self._current_future = None
+        self._running = OrderedDict()  # Stream -> Future of the acquisitions in progress
+        self._prep_futures = {}  # Stream -> Future of the preparations started in advance
+        self._ends = {}  # Future -> float: expected end time of each acquisition in progress
+        self._acq_done = threading.Event()  # set whenever an acquisition is over
         self._cancelled = False
+        self._started = False
+
+        # Time spent in each phase: list of (stream name, phase, start, end)
+        self._future.timings = []
+
+        # To detect which streams can be prepared or acquired simultaneously
+        self._hardware = {}  # Stream -> (set of Components, set of Components)
+        for s in self._streams:
+            self._hardware[s] = _getStreamHardware(s)
+        # The optical path manager already knows which component affects which,
+        # so use it if available. Otherwise, use the cached affects graph.
+        self._opm = None
+        self._affected = None  # str -> set of str: component name -> names of components it affects
+        for s in self._streams:
+            if getattr(s, "_opm", None) is not None:
+                self._opm = s._opm
+                break
+        else:
+            comps = set()
+            for dets, others in self._hardware.values():
+                comps |= dets | others
+            self._affected = _getAffectsClosure(comps)
 
     def run(self):
         """
@@ -268,7 +349,8 @@ class AcquisitionTask(object):
             Exception: if it failed before any result were acquired
         """
         exp = None
-        assert(self._current_stream is None) # Task should be used only once
+        assert not self._started  # Task should be used only once
+        self._started = True
         expected_time = sum(self._streamTimes.values())
         # no need to set the start time of the future: it's automatically done
         # when setting its state to running.
@@ -280,6 +362,7 @@ class AcquisitionTask(object):
         # Keep order so that the DataArrays are returned in the order they were
         # acquired. Not absolutely needed, but nice for the user in some cases.
         raw_images = OrderedDict()  # stream -> list of raw images
+        self._acq_starts = {}  # Stream -> float: start time of the acquisition
         try:
             # Tell the leeches that the acquisition is starting
             for s in self._streams:
@@ -297,44 +380,51 @@ class AcquisitionTask(object):
             if not self._settings_obs:
                 logging.warning("Acquisition task has no SettingsObserver, not saving extra "
                                 "metadata.")
-            for s in self._streams:
-                # Get the future of the acquisition, depending on the Stream type
-                if hasattr(s, "acquire"):
-                    f = s.acquire()
-                else: # fall-back to old style stream
-                    f = _futures.wrapSimpleStreamIntoFuture(s)
-                self._current_future = f
-                self._current_stream = s
-                self._streams_left.discard(s)
-
-                # in case acquisition was cancelled, before the future was set
+            # The streams are started in order. While a stream is acquiring, the
+            # next one is prepared (eg, optical path) if it doesn't interfere,
+            # and it's even acquired simultaneously if the hardware allows it.
+            pending = list(self._streams)
+            while pending or self._running:
                 if self._cancelled:
-                    f.cancel()
                     raise CancelledError()
 
-                # If it's a ProgressiveFuture, listen to the time update
-                try:
-                    f.add_update_callback(self._on_progress_update)
-                except AttributeError:
-                    pass # not a ProgressiveFuture, fine
-
-                # Wait for the acquisition to be finished.
-                # Will pass down exceptions, included in case it's cancelled
-                das = f.result()
-                if not isinstance(das, collections.Iterable):
-                    logging.warning("Future of %s didn't return a list of DataArrays, but %s", s, das)
-                    das = []
-
-                # Add extra settings to metadata
-                if self._settings_obs:
-                    settings = self._settings_obs.get_all_settings()
-                    for da in das:
-                        da.metadata[model.MD_EXTRA_SETTINGS] = copy.deepcopy(settings)
-                raw_images[s] = das
-
-                # update the time left
-                expected_time -= self._streamTimes[s]
-                self._future.set_progress(end=time.time() + expected_time)
+                while pending and all(self._canAcquireSimultaneously(pending[0], r) for r in self._running):
+                    s = pending.pop(0)
+                    self._startAcquisition(s)
+
+                if (pending and pending[0] not in self._prep_futures and
+                    all(self._canPrepareDuring(pending[0], r) for r in self._running)):
+                    self._startPreparation(pending[0])
+
+                # Wait for (at least) one acquisition to be finished.
+                # Note: futures.wait() cannot be used, as it's not notified
+                # when a running (Cancellable)Future is cancelled.
+                self._acq_done.wait()
+                self._acq_done.clear()
+                for s, f in list(self._running.items()):
+                    if not f.done():
+                        continue
+                    del self._running[s]
+                    self._ends.pop(f, None)
+
+                    # Will pass down exceptions, included in case it's cancelled
+                    try:
+                        das = f.result()
+                    finally:
+                        self._addTiming(s, "acquire", self._acq_starts.pop(s), time.time())
+                    if not isinstance(das, collections.Iterable):
+                        logging.warning("Future of %s didn't return a list of DataArrays, but %s", s, das)
+                        das = []
+
+                    # Add extra settings to metadata
+                    if self._settings_obs:
+                        settings = self._settings_obs.get_all_settings()
+                        for da in das:
+                            da.metadata[model.MD_EXTRA_SETTINGS] = copy.deepcopy(settings)
+                    raw_images[s] = das
+
+                    # update the time left
+                    self._updateProgress()
 
             # Tell the leeches it's over. Note: we don't do it in case of
             # (partial) error.
@@ -361,12 +451,19 @@ class AcquisitionTask(object):
                             exc_info=True)
             exp = ex
         finally:
+            # Stop the acquisitions which might still be running (in case of error)
+            for f in self._running.values():
+                f.cancel()
             # Don't hold references to the streams once it's over
             self._streams = []
             self._streams_left.clear()
             self._streamTimes = {}
-            self._current_stream = None
-            self._current_future = None
+            self._running.clear()
+            self._prep_futures.clear()
+            self._ends.clear()
+            self._hardware = {}
+
+        self._logTimings()
 
         # Update metadata using OverlayStream (if there was one)
         self._adjust_metadata(raw_images)
@@ -411,6 +508,190 @@ class AcquisitionTask(object):
                 if model.MD_DESCRIPTION not in d.metadata:
                     d.metadata[model.MD_DESCRIPTION] = s.name.value
 
+    def _isExclusive(self, s):
+        """
+        Whether the stream might use other hardware than the one it declares
+        (or hardware shared by all streams), in which case it should never be
+        prepared nor acquired while another stream is acquiring.
+        s (Stream)
+        return (bool)
+        """
+        # The overlay and aligned SEM streams use the CCD in addition to the e-beam.
+        # The leeches can use any hardware.
+        return (isinstance(s, (OverlayStream, AlignedSEMStream)) or
+                bool(getattr(s, "leeches", None)))
+
+    def _affects(self, affecting, affected):
+        """
+        affecting (str): component name
+        affected (str): component name
+        return (bool): True if "affecting" affects -directly or indirectly- "affected"
+        """
+        if self._opm is not None:
+            return self._opm.affects(affecting, affected)
+        try:
+            return affected in self._affected[affecting]
+        except KeyError:  # Unknown component
+            return affecting == affected
+
+    def _affectsAny(self, comps, detectors):
+        """
+        comps (set of Components)
+        detectors (set of Components)
+        return (bool): True if any of the components affects (directly or
+          indirectly) any of the detectors, or is one of them.
+        """
+        return any(self._affects(c.name, d.name) for c in comps for d in detectors)
+
+    def _getMovedComponents(self, s):
+        """
+        s (Stream)
+        return (set of Components): the components which might be changed by
+          the preparation of the stream (ie, its optical path)
+        """
+        opm = getattr(s, "_opm", None)
+        if opm is None:
+            return set()
+        try:
+            return opm.getMovedComponents(s)
+        except Exception:
+            logging.exception("Failed to find components moved for %s", s.name.value)
+            raise
+
+    def _canPrepareDuring(self, s, running):
+        """
+        Check whether preparing a stream could disturb the acquisition of another stream.
+        s (Stream): the stream to prepare
+        running (Stream): the stream being acquired
+        return (bool): True if s can be prepared while running is acquiring
+        """
+        if self._isExclusive(s) or self._isExclusive(running):
+            return False
+        dets, others = self._hardware[running]
+        # The preparation might also turn on the emitters of the stream (eg,
+        # the SEMStream unblanks the e-beam), which is not a move, so never
+        # prepare if they would affect the acquisition.
+        s_others = self._hardware[s][1]
+        if self._affectsAny(s_others, dets):
+            return False
+        try:
+            moved = self._getMovedComponents(s)
+        except Exception:
+            return False
+        return not (moved & others) and not self._affectsAny(moved, dets)
+
+    def _canAcquireSimultaneously(self, s, running):
+        """
+        Check whether two streams can be acquired at the same time.
+        s (Stream): the stream to start
+        running (Stream): the stream being acquired
+        return (bool): True if s can be acquired while running is acquiring
+        """
+        if not self._canPrepareDuring(s, running) or not self._canPrepareDuring(running, s):
+            return False
+
+        # Each stream must have its own hardware, and the emitters of one
+        # must not affect the detectors of the other one.
+        s_dets, s_others = self._hardware[s]
+        r_dets, r_others = self._hardware[running]
+        if (s_dets | s_others) & (r_dets | r_others):
+            return False
+        return not self._affectsAny(s_others, r_dets) and not self._affectsAny(r_others, s_dets)
+
+    def _startPreparation(self, s):
+        """
+        Prepare a stream in advance, while the other streams are acquiring
+        s (Stream): the stream to prepare
+        """
+        logging.debug("Preparing stream %s during the acquisition of %s",
+                      s.name.value, ", ".join(r.name.value for r in self._running))
+        startt = time.time()
+        try:
+            f = s.prepare()
+        except Exception:
+            logging.exception("Failed to prepare %s in advance", s.name.value)
+            f = model.InstantaneousFuture()
+
+        def on_prepared(f, s=s):
+            try:
+                f.result()
+            except Exception as ex:
+                # Not a big deal, it will be prepared again when starting the acquisition
+                logging.debug("Advance preparation of %s failed: %s", s.name.value, ex)
+            self._addTiming(s, "prepare", startt, time.time())
+
+        f.add_done_callback(on_prepared)
+        self._prep_futures[s] = f
+
+    def _startAcquisition(self, s):
+        """
+        Start the acquisition of a stream
+        s (Stream): the stream to acquire
+        """
+        if self._running:
+            logging.debug("Starting acquisition of %s simultaneously with %s",
+                          s.name.value, ", ".join(r.name.value for r in self._running))
+
+        # If a preparation is still going on, wait for it, to not have the
+        # acquisition preparing concurrently.
+        pf = self._prep_futures.get(s)
+        if pf is not None:
+            try:
+                pf.result()
+            except Exception:
+                pass  # Already reported
+
+        self._acq_starts[s] = time.time()
+        # Get the future of the acquisition, depending on the Stream type
+        if hasattr(s, "acquire"):
+            f = s.acquire()
+        else:  # fall-back to old style stream
+            f = _futures.wrapSimpleStreamIntoFuture(s)
+        self._running[s] = f
+        self._ends[f] = time.time() + self._streamTimes[s]
+        f.add_done_callback(self._on_acquisition_done)
+        self._streams_left.discard(s)
+
+        # in case acquisition was cancelled, before the future was set
+        if self._cancelled:
+            f.cancel()
+            raise CancelledError()
+
+        # If it's a ProgressiveFuture, listen to the time update
+        try:
+            f.add_update_callback(self._on_progress_update)
+        except AttributeError:
+            pass  # not a ProgressiveFuture, fine
+
+    def _on_acquisition_done(self, f):
+        self._acq_done.set()
+
+    def _addTiming(self, s, phase, start, end):
+        self._future.timings.append((s.name.value, phase, start, end))
+
+    def _logTimings(self):
+        """
+        Log how long each phase took, and how much was overlapped
+        """
+        timings = self._future.timings
+        if not timings:
+            return
+        for name, phase, start, end in timings:
+            logging.debug("Stream %s %s took %g s", name, phase, end - start)
+        tot_phases = sum(end - start for _, _, start, end in timings)
+        dur = max(end for _, _, _, end in timings) - min(start for _, _, start, _ in timings)
+        logging.info("Acquisition took %g s, with %g s of preparation/acquisition overlapped",
+                     dur, max(0, tot_phases - dur))
+
+    def _updateProgress(self):
+        """
+        Update the expected end time of the whole acquisition
+        """
+        now = time.time()
+        end = max(list(self._ends.values()) + [now])
+        total_end = end + sum(self._streamTimes[s] for s in self._streams_left)
+        self._future.set_progress(end=total_end)
+
     def _on_progress_update(self, f, start, end):
         """
         Called when the current future has made a progress (and so it should
@@ -421,15 +702,13 @@ class AcquisitionTask(object):
         if self._future.done():
             return
 
-        # There is a tiny chance that self._current_future is already set to
-        # None, but the future isn't officially ended yet. Also fine.
-        if self._current_future != f and self._current_future is not None:
-            logging.warning("Progress update not from the current future: %s instead of %s",
-                            f, self._current_future)
+        # There is a tiny chance that the future is already removed, but it
+        # isn't officially ended yet. Also fine.
+        if f not in self._ends:
             return
 
-        total_end = end + sum(self._streamTimes[s] for s in self._streams_left)
-        self._future.set_progress(end=total_end)
+        self._ends[f] = end
+        self._updateProgress()
 
     def cancel(self, future):
         """
@@ -438,10 +717,11 @@ class AcquisitionTask(object):
         # put the cancel flag
         self._cancelled = True
 
-        if self._current_future is not None:
-            cancelled = self._current_future.cancel()
-        else:
-            cancelled = False
+        cancelled = False
+        for f in list(self._prep_futures.values()):
+            f.cancel()
+        for f in list(self._running.values()):
+            cancelled |= f.cancel()
 
         # Report it's too late for cancellation (and so result will come)
         if not cancelled and not self._streams_left:
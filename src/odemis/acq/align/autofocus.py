@@ -23,7 +23,7 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 from __future__ import division
 
 import collections
-from concurrent.futures import TimeoutError, CancelledError
+from concurrent.futures import TimeoutError, CancelledError, ThreadPoolExecutor, Future
 from concurrent.futures._base import CANCELLED, FINISHED, RUNNING
 import cv2
 import logging
@@ -42,6 +42,7 @@ import time
 
 MTD_BINARY = 0
 MTD_EXHAUSTIVE = 1
+MTD_SWEEP = 2
 
 MAX_STEPS_NUMBER = 100  # Max steps to perform autofocus
 MAX_BS_NUMBER = 1  # Maximum number of applying binary search with a smaller max_step
@@ -235,6 +236,104 @@ def _discard_data(df, data):
     pass
 
 
+def _getDepthOfField(detector, emt):
+    """
+    Find the depth of field of the optical system, which is used to define the
+    step size of the autofocus.
+    detector: model.DigitalCamera or model.Detector
+    emt (None or model.Emitter): In case of a SED this is the scanner used
+    return (0<float): the depth of field (m)
+    """
+    # use the .depthOfField on detector or emitter as maximum stepsize
+    avail_depths = (detector, emt)
+    if model.hasVA(emt, "dwellTime"):
+        # Hack in case of using the e-beam with a DigitalCamera detector.
+        # All the digital cameras have a depthOfField, which is updated based
+        # on the optical lens properties... but the depthOfField in this
+        # case depends on the e-beam lens.
+        # TODO: or better rely on which component the focuser affects? If it
+        # affects (also) the emitter, use this one first? (but in the
+        # current models the focusers affects nothing)
+        avail_depths = (emt, detector)
+    for c in avail_depths:
+        if model.hasVA(c, "depthOfField"):
+            dof = c.depthOfField.value
+            break
+    else:
+        logging.debug("No depth of field info found")
+        dof = 1e-6  # m, not too bad value
+    logging.debug("Depth of field is %f", dof)
+    return dof
+
+
+def _getFocusMeasure(detector):
+    """
+    Pick the function to measure the focus level, based on the type of detector
+    detector: model.DigitalCamera or model.Detector
+    return (callable DataArray -> float): the focus measurement function
+    """
+    # Pick measurement method based on the heuristics that SEM detectors
+    # are typically just a point (ie, shape == data depth).
+    # TODO: is this working as expected? Alternatively, we could check
+    # MD_DET_TYPE.
+    if len(detector.shape) > 1:
+        if detector.role == 'diagnostic-ccd':
+            logging.debug("Using Spot method to estimate focus")
+            return MeasureSpotsFocus
+        elif detector.resolution.value[1] == 1:
+            logging.debug("Using 1d method to estimate focus")
+            return Measure1d
+        else:
+            logging.debug("Using Optical method to estimate focus")
+            return MeasureOpticalFocus
+    else:
+        logging.debug("Using SEM method to estimate focus")
+        return MeasureSEMFocus
+
+
+def _measureFocusLevels(future, detector, dfbkg, focus, positions, Measure, timeout):
+    """
+    Moves the focus to each of the given positions, acquires an image and
+    measures its focus level. To avoid leaving the hardware idle, the focus
+    level of an image is computed in a separate thread while the focus is
+    already moving to the next position.
+    future (model.ProgressiveFuture): autofocus future, to check for cancellation
+    detector: model.DigitalCamera or model.Detector
+    dfbkg (model.DataFlow): dataflow of se- or bs- detector
+    focus (model.Actuator): The focus actuator (with a "z" axis)
+    positions (iterable of floats): the focus positions (m)
+    Measure (callable DataArray -> float): the focus measurement function
+    timeout (0<float): maximum time to wait for an image
+    yields (float, float): focus position (m) and focus level, in the order of
+      the positions. It's fine to stop iterating early: when the generator is
+      closed, it waits for the on-going move to be finished.
+    raises:
+        CancelledError if cancelled
+        IOError if the acquisition failed
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    f_move = None
+    prev = None  # focus position and Future of the focus level of the previous image
+    try:
+        for pos in positions:
+            f_move = focus.moveAbs({"z": pos})
+            if prev:
+                yield prev[0], prev[1].result()
+            f_move.result()
+            if future._autofocus_state == CANCELLED:
+                raise CancelledError()
+
+            image = AcquireNoBackground(detector, dfbkg, timeout)
+            prev = pos, executor.submit(Measure, image)
+
+        if prev:
+            yield prev[0], prev[1].result()
+    finally:
+        if f_move is not None:
+            f_move.result()
+        executor.shutdown(wait=False)
+
+
 def _DoBinaryFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus):
     """
     Iteratively acquires an optical image, measures its focus level and adjusts
@@ -275,30 +374,14 @@ def _DoBinaryFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus):
     #   even go back to the same focus position when wanted
     logging.debug("Starting binary autofocus on detector %s...", detector.name)
 
+    # The focus levels are computed in a separate thread, so that the next move
+    # can start while the image is being processed.
+    executor = ThreadPoolExecutor(max_workers=1)
     try:
         # Big timeout, most important being that it's shorter than eternity
         timeout = 3 + 2 * estimateAcquisitionTime(detector, emt)
 
-        # use the .depthOfField on detector or emitter as maximum stepsize
-        avail_depths = (detector, emt)
-        if model.hasVA(emt, "dwellTime"):
-            # Hack in case of using the e-beam with a DigitalCamera detector.
-            # All the digital cameras have a depthOfField, which is updated based
-            # on the optical lens properties... but the depthOfField in this
-            # case depends on the e-beam lens.
-            # TODO: or better rely on which component the focuser affects? If it
-            # affects (also) the emitter, use this one first? (but in the
-            # current models the focusers affects nothing)
-            avail_depths = (emt, detector)
-        for c in avail_depths:
-            if model.hasVA(c, "depthOfField"):
-                dof = c.depthOfField.value
-                break
-        else:
-            logging.debug("No depth of field info found")
-            dof = 1e-6  # m, not too bad value
-        logging.debug("Depth of field is %f", dof)
-        min_step = dof / 2
+        min_step = _getDepthOfField(detector, emt) / 2
 
         # adjust to rng_focus if provided
         rng = focus.axes["z"].range
@@ -319,38 +402,32 @@ def _DoBinaryFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus):
         best_fm = 0
         last_pos = None
 
-        # Pick measurement method based on the heuristics that SEM detectors
-        # are typically just a point (ie, shape == data depth).
-        # TODO: is this working as expected? Alternatively, we could check
-        # MD_DET_TYPE.
-        if len(detector.shape) > 1:
-            if detector.role == 'diagnostic-ccd':
-                logging.debug("Using Spot method to estimate focus")
-                Measure = MeasureSpotsFocus
-            elif detector.resolution.value[1] == 1:
-                logging.debug("Using 1d method to estimate focus")
-                Measure = Measure1d
-            else:
-                logging.debug("Using Optical method to estimate focus")
-                Measure = MeasureOpticalFocus
-        else:
-            logging.debug("Using SEM method to estimate focus")
-            Measure = MeasureSEMFocus
+        Measure = _getFocusMeasure(detector)
+
+        def get_focus_level(pos, fm, name=""):
+            """
+            Wait for the focus level to be computed (if needed), and store it
+            pos (float): focus position of the image
+            fm (float or Future returning a float): the focus level
+            return (float): the focus level
+            """
+            if isinstance(fm, Future):
+                fm = fm.result()
+                logging.debug("Focus level %sat %f is %f", name, pos, fm)
+                focus_levels[pos] = fm
+            return fm
 
         step_factor = 2 ** 7
         if good_focus is not None:
             current_pos = focus.position.value['z']
             image = AcquireNoBackground(detector, dfbkg, timeout)
-            fm_current = Measure(image)
-            logging.debug("Focus level at %f is %f", current_pos, fm_current)
-            focus_levels[current_pos] = fm_current
+            fm_current = executor.submit(Measure, image)
 
             focus.moveAbsSync({"z": good_focus})
             good_focus = focus.position.value["z"]
             image = AcquireNoBackground(detector, dfbkg, timeout)
-            fm_good = Measure(image)
-            logging.debug("Focus level at %f is %f", good_focus, fm_good)
-            focus_levels[good_focus] = fm_good
+            fm_current = get_focus_level(current_pos, fm_current)
+            fm_good = get_focus_level(good_focus, executor.submit(Measure, image))
             last_pos = good_focus
 
             if fm_good < fm_current:
@@ -381,13 +458,13 @@ def _DoBinaryFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus):
             center = focus.position.value['z']
             # Don't redo the acquisition either if we've just done it, or if it
             # was already done and we are still doing a rough search
+            # The focus levels are only waited for once all the images are
+            # acquired, so that they are computed while the focus moves.
             if (rough_search or last_pos == center) and center in focus_levels:
                 fm_center = focus_levels[center]
             else:
                 image = AcquireNoBackground(detector, dfbkg, timeout)
-                fm_center = Measure(image)
-                logging.debug("Focus level (center) at %f is %f", center, fm_center)
-                focus_levels[center] = fm_center
+                fm_center = executor.submit(Measure, image)
 
             last_pos = center
 
@@ -401,9 +478,7 @@ def _DoBinaryFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus):
                 right = focus.position.value["z"]
                 last_pos = right
                 image = AcquireNoBackground(detector, dfbkg, timeout)
-                fm_right = Measure(image)
-                logging.debug("Focus level (right) at %f is %f", right, fm_right)
-                focus_levels[right] = fm_right
+                fm_right = executor.submit(Measure, image)
 
             # Move to left position
             left = center - step_factor * min_step
@@ -415,9 +490,11 @@ def _DoBinaryFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus):
                 left = focus.position.value["z"]
                 last_pos = left
                 image = AcquireNoBackground(detector, dfbkg, timeout)
-                fm_left = Measure(image)
-                logging.debug("Focus level (left) at %f is %f", left, fm_left)
-                focus_levels[left] = fm_left
+                fm_left = executor.submit(Measure, image)
+
+            fm_center = get_focus_level(center, fm_center, "(center) ")
+            fm_right = get_focus_level(right, fm_right, "(right) ")
+            fm_left = get_focus_level(left, fm_left, "(left) ")
 
             fm_range = (fm_left, fm_center, fm_right)
             if all(almost_equal(fm_left, fm, rtol=1e-6) for fm in fm_range[1:]):
@@ -478,6 +555,7 @@ def _DoBinaryFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus):
         # Go to the best position known so far
         focus.moveAbsSync({"z": best_pos})
     finally:
+        executor.shutdown(wait=False)
         with future._autofocus_lock:
             if future._autofocus_state == CANCELLED:
                 raise CancelledError()
@@ -512,40 +590,8 @@ def _DoExhaustiveFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focu
         # Big timeout, most important being that it's shorter than eternity
         timeout = 3 + 2 * estimateAcquisitionTime(detector, emt)
 
-        # use the .depthOfField on detector or emitter as maximum stepsize
-        avail_depths = (detector, emt)
-        if model.hasVA(emt, "dwellTime"):
-            # Hack in case of using the e-beam with a DigitalCamera detector.
-            # All the digital cameras have a depthOfField, which is updated based
-            # on the optical lens properties... but the depthOfField in this
-            # case depends on the e-beam lens.
-            avail_depths = (emt, detector)
-        for c in avail_depths:
-            if model.hasVA(c, "depthOfField"):
-                dof = c.depthOfField.value
-                break
-        else:
-            logging.debug("No depth of field info found")
-            dof = 1e-6  # m, not too bad value
-        logging.debug("Depth of field is %f", dof)
-
-        # Pick measurement method based on the heuristics that SEM detectors
-        # are typically just a point (ie, shape == data depth).
-        # TODO: is this working as expected? Alternatively, we could check
-        # MD_DET_TYPE.
-        if len(detector.shape) > 1:
-            if detector.role == 'diagnostic-ccd':
-                logging.debug("Using Spot method to estimate focus")
-                Measure = MeasureSpotsFocus
-            elif detector.resolution.value[1] == 1:
-                logging.debug("Using 1d method to estimate focus")
-                Measure = Measure1d
-            else:
-                logging.debug("Using Optical method to estimate focus")
-                Measure = MeasureOpticalFocus
-        else:
-            logging.debug("Using SEM method to estimate focus")
-            Measure = MeasureSEMFocus
+        dof = _getDepthOfField(detector, emt)
+        Measure = _getFocusMeasure(detector)
 
         # adjust to rng_focus if provided
         rng = focus.axes["z"].range
@@ -571,16 +617,29 @@ def _DoExhaustiveFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focu
         # start moving upwards until we reach the upper bound or we find some
         # significant deviation in focus level
         # The number of steps is the distance to the upper bound divided by the step size.
-        for next_pos in numpy.linspace(orig_pos, upper_bound, (upper_bound - orig_pos) / step):
-            focus.moveAbsSync({"z": next_pos})
-            image = AcquireNoBackground(detector, dfbkg, timeout)
-            new_fm = Measure(image)
-            focus_levels.append(new_fm)
-            logging.debug("Focus level at %f is %f", next_pos, new_fm)
-            if new_fm >= best_fm:
-                best_fm = new_fm
-                best_pos = next_pos
-            if len(focus_levels) >= 10 and AssessFocus(focus_levels):
+        up_pos = numpy.linspace(orig_pos, upper_bound, int((upper_bound - orig_pos) / step))
+        # if nothing was found go downwards, starting one step below the original position
+        num = max(int((orig_pos - lower_bound) / step), 0)  # Take 0 steps if orig_pos is too close to lower_bound
+        down_pos = numpy.linspace(orig_pos - step, lower_bound, num)
+
+        for positions in (up_pos, down_pos):
+            found = False
+            levels = _measureFocusLevels(future, detector, dfbkg, focus, positions, Measure, timeout)
+            try:
+                for next_pos, new_fm in levels:
+                    focus_levels.append(new_fm)
+                    logging.debug("Focus level at %f is %f", next_pos, new_fm)
+                    if new_fm >= best_fm:
+                        best_fm = new_fm
+                        best_pos = next_pos
+                    if len(focus_levels) >= 10 and AssessFocus(focus_levels):
+                        found = True
+                        break
+            finally:
+                # Make sure the focus is not moving anymore
+                levels.close()
+
+            if found:
                 # trigger binary search on if significant deviation was
                 # found in current position
                 return _DoBinaryFocus(future, detector, emt, focus, dfbkg, best_pos, (best_pos - 2 * step, best_pos + 2 * step))
@@ -588,26 +647,131 @@ def _DoExhaustiveFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focu
         if future._autofocus_state == CANCELLED:
             raise CancelledError()
 
-        # if nothing was found go downwards, starting one step below the original position
-        num = max((orig_pos - lower_bound) / step, 0)  # Take 0 steps if orig_pos is too close to lower_bound
-        for next_pos in numpy.linspace(orig_pos - step, lower_bound, num):
-            focus.moveAbsSync({"z": next_pos})
-            image = AcquireNoBackground(detector, dfbkg, timeout)
-            new_fm = Measure(image)
-            focus_levels.append(new_fm)
-            logging.debug("Focus level at %f is %f", next_pos, new_fm)
-            if new_fm >= best_fm:
-                best_fm = new_fm
-                best_pos = next_pos
-            if len(focus_levels) >= 10 and AssessFocus(focus_levels):
-                # trigger binary search on if significant deviation was
-                # found in current position
-                return _DoBinaryFocus(future, detector, emt, focus, dfbkg, best_pos, (best_pos - 2 * step, best_pos + 2 * step))
+        logging.debug("No significant focus level was found so far, thus we just move to the best position found %f", best_pos)
+        focus.moveAbsSync({"z": best_pos})
+        return _DoBinaryFocus(future, detector, emt, focus, dfbkg, best_pos, (best_pos - 2 * step, best_pos + 2 * step))
+
+    except CancelledError:
+        # Go to the best position known so far
+        focus.moveAbsSync({"z": best_pos})
+    finally:
+        # Only used if for some reason the binary focus is not called (e.g. cancellation)
+        with future._autofocus_lock:
+            if future._autofocus_state == CANCELLED:
+                raise CancelledError()
+            future._autofocus_state = FINISHED
+
 
+def _DoSweepFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus):
+    """
+    Moves the focus at constant speed through the whole given range, while
+    continuously acquiring images. The focus position of each image is estimated
+    from its acquisition time and the focus positions recorded during the move.
+    The best focus position found is then refined with a binary search.
+    This avoids stopping the focus at each step, which is mostly useful when the
+    move overhead is large compared to the acquisition time.
+    future (model.ProgressiveFuture): Progressive future provided by the wrapper
+    detector: model.DigitalCamera or model.Detector
+    emt (None or model.Emitter): In case of a SED this is the scanner used
+    focus (model.Actuator): The optical focus
+    dfbkg (model.DataFlow): dataflow of se- or bs- detector. As the images are
+      acquired continuously, no background subtraction is done, but the dataflow
+      is kept active during the whole sweep.
+    good_focus (float): unused, as the whole range is always scanned
+    rng_focus (tuple): if provided, the search of the best focus position is limited
+      within this range
+    returns:
+        (float): Focus position (m)
+        (float): Focus level
+    raises:
+            CancelledError if cancelled
+            IOError if procedure failed
+    """
+    logging.debug("Starting sweep autofocus on detector %s...", detector.name)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    orig_speed = None
+    try:
+        dof = _getDepthOfField(detector, emt)
+        Measure = _getFocusMeasure(detector)
+        best_pos = focus.position.value['z']
+
+        # adjust to rng_focus if provided
+        rng = focus.axes["z"].range
+        if rng_focus:
+            rng = (max(rng[0], rng_focus[0]), min(rng[1], rng_focus[1]))
+        lower_bound, upper_bound = rng
+
+        # Same step as the exhaustive method, but it's the distance travelled
+        # during one acquisition.
+        step = 8 * dof
+        acq_dur = estimateAcquisitionTime(detector, emt)
+        nsteps = max(3, (upper_bound - lower_bound) / step)
+
+        focus.moveAbsSync({"z": lower_bound})
         if future._autofocus_state == CANCELLED:
             raise CancelledError()
 
-        logging.debug("No significant focus level was found so far, thus we just move to the best position found %f", best_pos)
+        # Adjust the speed so that an image is acquired at every step
+        if model.hasVA(focus, "speed") and "z" in focus.speed.value:
+            orig_speed = focus.speed.value
+            speed = (upper_bound - lower_bound) / (nsteps * acq_dur)
+            speed = max(focus.speed.range[0], min(speed, focus.speed.range[1]))
+            try:
+                focus.speed.value = dict(orig_speed, z=speed)
+            except (IndexError, ValueError) as ex:
+                logging.warning("Failed to set the focus speed to %g m/s: %s", speed, ex)
+        else:
+            logging.info("Focus speed cannot be controlled, sweep might be too fast")
+
+        frames = []  # list of (float, Future): mid-acquisition time, focus level
+        positions = []  # list of (float, float): time, focus position
+
+        def on_position(pos):
+            positions.append((time.time(), pos["z"]))
+
+        def on_image(df, data):
+            t = data.metadata.get(model.MD_ACQ_DATE, time.time()) + acq_dur / 2
+            frames.append((t, executor.submit(Measure, data)))
+
+        positions.append((time.time(), focus.position.value["z"]))
+        focus.position.subscribe(on_position)
+        if dfbkg is not None:
+            dfbkg.subscribe(_discard_data)
+        detector.data.subscribe(on_image)
+        try:
+            f = focus.moveAbs({"z": upper_bound})
+            while True:
+                try:
+                    f.result(timeout=0.1)
+                    break
+                except TimeoutError:
+                    if future._autofocus_state == CANCELLED:
+                        f.cancel()
+                        raise CancelledError()
+            positions.append((time.time(), focus.position.value["z"]))
+        finally:
+            detector.data.unsubscribe(on_image)
+            if dfbkg is not None:
+                dfbkg.unsubscribe(_discard_data)
+            focus.position.unsubscribe(on_position)
+            if orig_speed is not None:
+                focus.speed.value = orig_speed
+                orig_speed = None
+
+        # Estimate the position of each image by interpolating the focus
+        # position at the time it was acquired.
+        positions.sort()
+        pos_t, pos_z = numpy.array(positions).T
+        focus_levels = [(numpy.interp(t, pos_t, pos_z), f.result()) for t, f in frames]
+        logging.debug("Acquired %d images during the focus sweep", len(focus_levels))
+        if len(focus_levels) < 3:
+            logging.warning("Only %d images acquired during the focus sweep, falling back to exhaustive method",
+                            len(focus_levels))
+            return _DoExhaustiveFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focus)
+
+        best_pos, best_fm = max(focus_levels, key=lambda pl: pl[1])
+        logging.debug("Best focus level during sweep is %f at %f", best_fm, best_pos)
         focus.moveAbsSync({"z": best_pos})
         return _DoBinaryFocus(future, detector, emt, focus, dfbkg, best_pos, (best_pos - 2 * step, best_pos + 2 * step))
 
@@ -615,6 +779,9 @@ def _DoExhaustiveFocus(future, detector, emt, focus, dfbkg, good_focus, rng_focu
         # Go to the best position known so far
         focus.moveAbsSync({"z": best_pos})
     finally:
+        executor.shutdown(wait=False)
+        if orig_speed is not None:
+            focus.speed.value = orig_speed
         # Only used if for some reason the binary focus is not called (e.g. cancellation)
         with future._autofocus_lock:
             if future._autofocus_state == CANCELLED:
@@ -1045,7 +1212,9 @@ def AutoFocus(detector, emt, focus, dfbkg=None, good_focus=None, rng_focus=None,
     rng_focus (tuple): if provided, the search of the best focus position is limited
       within this range
     method (MTD_*): focusing method, if BINARY we follow a dichotomic method while in
-      case of EXHAUSTIVE we iterate through the whole provided range
+      case of EXHAUSTIVE we iterate through the whole provided range. In case of
+      SWEEP, the images are acquired while the focus is continuously moving
+      through the whole range.
     returns (model.ProgressiveFuture):  Progress of DoAutoFocus, whose result() will return:
             Focus position (m)
             Focus level
@@ -1063,6 +1232,8 @@ def AutoFocus(detector, emt, focus, dfbkg=None, good_focus=None, rng_focus=None,
         autofocus_fn = _DoExhaustiveFocus
     elif method == MTD_BINARY:
         autofocus_fn = _DoBinaryFocus
+    elif method == MTD_SWEEP:
+        autofocus_fn = _DoSweepFocus
     else:
         raise ValueError("Unknown autofocus method")
 
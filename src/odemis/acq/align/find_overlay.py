@@ -49,6 +49,11 @@ SPOT_SIZE = 1.5e-6  # m
 
 MAX_TRIALS_NUMBER = 2  # Maximum number of scan grid repetitions
 
+# Extra time the e-beam stays on each spot, when scanning the spots in one scan
+# synchronised with the CCD, to be sure the CCD is ready for the next spot.
+# It's also the maximum delay accepted for the start of each CCD image.
+SPOT_SYNC_MARGIN = 0.05  # s
+
 
 def FindOverlay(repetitions, dwell_time, max_allowed_diff, escan, ccd, detector, skew=False, bgsub=False):
     """
@@ -458,6 +463,41 @@ def _set_blanker(escan, active):
         logging.exception("Failed to set the blanker to %s", active)
 
 
+def _findMismatchedSpotImage(images, period, margin=SPOT_SYNC_MARGIN):
+    """
+    Check that each CCD image was acquired while the e-beam was on its spot.
+    As the spots are scanned at a fixed period, the acquisition dates of the
+    images should be separated by the same period. If the CCD was not ready
+    when the e-beam arrived on a spot, the image is acquired late, and so
+    (partly) on the next spots.
+    images (list of DataArray): the CCD images, in the order of the spots
+    period (float): time the e-beam stays on each spot (s)
+    margin (float): maximum delay (or advance) accepted for each image,
+      compared to the first one (s)
+    return (None or int): the index of the first image not matching its
+      spot, or None if all of them match
+    """
+    try:
+        start = images[0].metadata[model.MD_ACQ_DATE]
+    except IndexError:
+        return None
+    except KeyError:
+        return 0
+
+    for i, im in enumerate(images):
+        try:
+            date = im.metadata[model.MD_ACQ_DATE]
+        except KeyError:
+            logging.warning("CCD image %d has no acquisition date", i)
+            return i
+        if abs(date - (start + i * period)) > margin:
+            logging.warning("CCD image %d acquired %g s off its expected time",
+                            i, date - (start + i * period))
+            return i
+
+    return None
+
+
 class GridScanner(object):
     def __init__(self, repetitions, dwell_time, escan, ccd, detector, bgsub=False):
         self.repetitions = repetitions
@@ -474,6 +514,8 @@ class GridScanner(object):
         self._ccd_done = threading.Event()
         self._optical_image = None
         self._spot_images = []
+        self._spot_path = []  # spots scanned during the synchronised acquisition
+        self._spot_period = None  # s, time the e-beam stays on each spot of the path
 
         self._hw_settings = ()
 
@@ -536,26 +578,24 @@ class GridScanner(object):
         self._ccd_done.set()
         logging.debug("Got Spot image!")
 
-    def _doSpotAcquisition(self, electron_coordinates, scale):
+    def _can_scan_path(self):
         """
-        Perform acquisition spot per spot.
-        Slow, but works even if SEM FoV is small
+        return (bool): True if the e-beam scanner can scan a list of spots in
+          one scan, and the CCD can be synchronised on each spot.
         """
-        escan = self.escan
-        ccd = self.ccd
-        detector = self.detector
-        dwell_time = self.dwell_time
-        escan.scale.value = (1, 1)
-        escan.resolution.value = (1, 1)
+        return (model.hasVA(self.escan, "scanPath") and
+                isinstance(getattr(self.escan, "newPosition", None), model.EventBase) and
+                hasattr(self.ccd.data, "synchronizedOn"))
 
-        # Set dt large enough so we unsubscribe before we even get an SEM
-        # image (just to discard it) and start a second scan which would
-        # cost in time.
-        sem_dt = 2 * dwell_time
-        escan.dwellTime.value = escan.dwellTime.clip(sem_dt)
+    def _configure_spot_ccd(self, electron_coordinates):
+        """
+        Configure the CCD to acquire one image per spot: the ROI fitting the
+        spots, the background image (if needed) and the exposure time.
+        returns (float): the time to acquire one CCD image (s)
+        """
+        ccd = self.ccd
 
-        # CCD setup
-        sem_shape = escan.shape[0:2]
+        sem_shape = self.escan.shape[0:2]
         # sem ROI is ltrb
         sem_roi = (electron_coordinates[0][0] / sem_shape[0] + 0.5,
                    electron_coordinates[0][1] / sem_shape[1] + 0.5,
@@ -569,10 +609,31 @@ class GridScanner(object):
             self.bg_image = ccd.data.get(asap=False)
             _set_blanker(self.escan, False)
 
-        et = dwell_time
+        et = self.dwell_time
         ccd.exposureTime.value = et  # s
         readout = numpy.prod(ccd.resolution.value) / ccd.readoutRate.value
-        tot_time = et + readout + 0.05
+        return et + readout
+
+    def _doSpotAcquisition(self, electron_coordinates, scale):
+        """
+        Perform acquisition spot per spot.
+        Slow, but works even if SEM FoV is small
+        """
+        escan = self.escan
+        ccd = self.ccd
+        detector = self.detector
+        dwell_time = self.dwell_time
+        escan.scale.value = (1, 1)
+        escan.resolution.value = (1, 1)
+
+        # Set dt large enough so we unsubscribe before we even get an SEM
+        # image (just to discard it) and start a second scan which would
+        # cost in time.
+        sem_dt = 2 * dwell_time
+        escan.dwellTime.value = escan.dwellTime.clip(sem_dt)
+
+        # CCD setup
+        tot_time = self._configure_spot_ccd(electron_coordinates) + 0.05
         logging.debug("Scanning spot grid with image per spot procedure...")
 
         self._spot_images = []
@@ -602,6 +663,86 @@ class GridScanner(object):
 
         return self._spot_images, electron_coordinates, scale
 
+    def _onSpotPathImage(self, df, data):
+        """
+        Receives the CCD data, for each spot of the scan path, in order
+        """
+        if len(self._spot_images) >= len(self._spot_path):
+            logging.debug("Discarding extra CCD image")
+            return
+
+        if self.bgsub:
+            data = Subtract(data, self.bg_image)
+        self._spot_images.append(data)
+        logging.debug("Got Spot image %d/%d for spot %s", len(self._spot_images),
+                      len(self._spot_path), self._spot_path[len(self._spot_images) - 1])
+        if len(self._spot_images) == len(self._spot_path):
+            self._ccd_done.set()
+
+    def _doSpotPathAcquisition(self, electron_coordinates, scale):
+        """
+        Perform acquisition spot per spot, with all the spots scanned by the
+        e-beam in a single scan, and the CCD acquiring one image at each spot,
+        synchronised on the e-beam position.
+        Same result as _doSpotAcquisition(), but much faster as the hardware
+        is only configured once. It requires the e-beam scanner to support
+        .scanPath and .newPosition.
+        """
+        escan = self.escan
+        ccd = self.ccd
+        detector = self.detector
+
+        # CCD setup
+        ccd_time = self._configure_spot_ccd(electron_coordinates)
+
+        # The e-beam stays on each spot long enough for the CCD to acquire
+        # (and read out) the image.
+        escan.dwellTime.value = escan.dwellTime.clip(ccd_time + SPOT_SYNC_MARGIN)
+        escan.scanPath.value = electron_coordinates
+        self._spot_period = escan.dwellTime.value
+        tot_time = len(electron_coordinates) * self._spot_period
+        logging.debug("Scanning spot grid with synchronised image per spot procedure...")
+
+        self._spot_images = []
+        self._spot_path = electron_coordinates
+        self._ccd_done.clear()
+        try:
+            if self._acq_state == CANCELLED:
+                raise CancelledError()
+
+            # One CCD image per e-beam spot, all the images in order
+            ccd.data.synchronizedOn(escan.newPosition)
+            ccd.data.subscribe(self._onSpotPathImage)
+            detector.data.subscribe(self._discard_data)
+
+            # Wait for CCD to capture all the images
+            if not self._ccd_done.wait(2 * tot_time + 4):
+                raise TimeoutError("Acquisition of CCD timed out, got %d images out of %d" %
+                                   (len(self._spot_images), len(electron_coordinates)))
+        finally:
+            detector.data.unsubscribe(self._discard_data)
+            ccd.data.unsubscribe(self._onSpotPathImage)
+            ccd.data.synchronizedOn(None)
+            escan.scanPath.value = []
+
+        # The images are paired with the spots in the order received, so
+        # check that none of them was acquired late (ie, while the e-beam was
+        # already on another spot). If so, acquire again, spot per spot.
+        if _findMismatchedSpotImage(self._spot_images, self._spot_period) is not None:
+            if self._acq_state == CANCELLED:
+                raise CancelledError()
+            logging.warning("CCD images not synchronised with the e-beam spots, "
+                            "will acquire spot per spot")
+            return self._doSpotAcquisition(electron_coordinates, scale)
+
+        with self._acq_lock:
+            if self._acq_state == CANCELLED:
+                raise CancelledError()
+            logging.debug("Scan done.")
+            self._acq_state = FINISHED
+
+        return self._spot_images, electron_coordinates, scale
+
     def _doWholeAcquisition(self, electron_coordinates, scale):
         """
         Perform acquisition with one optical image for all the spots.
@@ -734,7 +875,10 @@ class GridScanner(object):
             # If the distance between e-beam spots is below the size of a spot,
             # use the “one image per spot” procedure
             if (spot_dist[0] < SPOT_SIZE) or (spot_dist[1] < SPOT_SIZE) or (et > max_et):
-                return self._doSpotAcquisition(electron_coordinates, scale)
+                if self._can_scan_path():
+                    return self._doSpotPathAcquisition(electron_coordinates, scale)
+                else:
+                    return self._doSpotAcquisition(electron_coordinates, scale)
             else:
                 return self._doWholeAcquisition(electron_coordinates, scale)
         finally:
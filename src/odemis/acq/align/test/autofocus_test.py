@@ -30,7 +30,8 @@ from odemis import model, acq
 import odemis
 from odemis.acq import align, stream
 from odemis.acq.align import autofocus
-from odemis.acq.align.autofocus import Sparc2AutoFocus, MTD_BINARY
+from odemis.acq.align.autofocus import Sparc2AutoFocus, MTD_BINARY, MTD_EXHAUSTIVE, \
+    MTD_SWEEP
 from odemis.dataio import hdf5
 from odemis.util import test, timeout, img
 import os
@@ -154,6 +155,42 @@ class TestAutofocus(unittest.TestCase):
         self.assertAlmostEqual(foc_pos, self._sem_good_focus, 3)
         self.assertGreater(foc_lev, 0)
 
+    @timeout(1000)
+    def test_autofocus_sweep(self):
+        """
+        Test AutoFocus with the sweep method, on the CCD and on the e-beam
+        """
+        self.ccd.exposureTime.value = self.ccd.exposureTime.range[0]
+        self.ebeam.dwellTime.value = self.ebeam.dwellTime.range[0]
+        for det, focus, good_focus in ((self.ccd, self.focus, self._opt_good_focus),
+                                       (self.sed, self.efocus, self._sem_good_focus)):
+            focus.moveAbs({"z": good_focus + 100e-6}).result()
+            rng = (good_focus - 300e-6, good_focus + 300e-6)
+            future_focus = align.AutoFocus(det, self.ebeam, focus, rng_focus=rng, method=MTD_SWEEP)
+            foc_pos, foc_lev = future_focus.result(timeout=900)
+            self.assertAlmostEqual(foc_pos, good_focus, 3)
+            self.assertGreater(foc_lev, 0)
+
+    @timeout(1000)
+    def test_autofocus_speed(self):
+        """
+        Compare the duration of the exhaustive and sweep methods, on the CCD and on the e-beam
+        """
+        self.ccd.exposureTime.value = self.ccd.exposureTime.range[0]
+        self.ebeam.dwellTime.value = self.ebeam.dwellTime.range[0]
+        for det, focus, good_focus in ((self.ccd, self.focus, self._opt_good_focus),
+                                       (self.sed, self.efocus, self._sem_good_focus)):
+            rng = (good_focus - 300e-6, good_focus + 300e-6)
+            for method in (MTD_EXHAUSTIVE, MTD_SWEEP):
+                focus.moveAbs({"z": good_focus - 100e-6}).result()
+                tstart = time.time()
+                future_focus = align.AutoFocus(det, self.ebeam, focus, rng_focus=rng, method=method)
+                foc_pos, foc_lev = future_focus.result(timeout=900)
+                dur = time.time() - tstart
+                logging.info("Autofocus on %s with method %d took %g s, found %g m (expected %g m)",
+                             det.name, method, dur, foc_pos, good_focus)
+                self.assertAlmostEqual(foc_pos, good_focus, 3)
+
 
 class TestSparc2AutoFocus(unittest.TestCase):
     """
@@ -23,8 +23,11 @@ from __future__ import division
 
 from concurrent import futures
 import logging
+import numpy
+import odemis
 from odemis import model, dataio
 from odemis.acq import align
+from odemis.acq.align import find_overlay
 from odemis.driver import semcomedi, andorcam2
 from odemis.util import test
 import os
@@ -37,8 +40,10 @@ logging.getLogger().setLevel(logging.DEBUG)
 # _frm = "%(asctime)s  %(levelname)-7s %(module)-15s: %(message)s"
 # logging.getLogger().handlers[0].setFormatter(logging.Formatter(_frm))
 
-# CONFIG_PATH = os.path.dirname(odemis.__file__) + "/../../install/linux/usr/share/odemis/"
+CONFIG_PATH = os.path.dirname(odemis.__file__) + "/../../install/linux/usr/share/odemis/"
 # SECOM_LENS_CONFIG = CONFIG_PATH + "sim/secom-sim-lens-align.odm.yaml"  # 4x4
+SECOM_CONFIG = CONFIG_PATH + "sim/secom-sim.odm.yaml"
+DELPHI_CONFIG = CONFIG_PATH + "sim/delphi-sim.odm.yaml"
 
 
 # arguments used for the creation of basic components
@@ -190,6 +195,126 @@ class TestOverlay(unittest.TestCase):
         self.assertIn(model.MD_SHEAR_COR, sem_md)
 
 
+class TestSpotImageMatching(unittest.TestCase):
+    """
+    Test the detection of CCD images not acquired at the time of their spot
+    """
+
+    def _create_images(self, dates):
+        return [model.DataArray(numpy.zeros((4, 5), dtype=numpy.uint16),
+                                {model.MD_ACQ_DATE: d}) for d in dates]
+
+    def test_synchronised(self):
+        period = 0.2  # s
+        dates = [100 + i * period + j for i, j in enumerate((0, 0.01, -0.005, 0.02))]
+        images = self._create_images(dates)
+        self.assertIsNone(find_overlay._findMismatchedSpotImage(images, period))
+        self.assertIsNone(find_overlay._findMismatchedSpotImage([], period))
+
+    def test_late_image(self):
+        period = 0.2  # s
+        # The third image started late: after the e-beam had left the spot
+        dates = [100, 100.2, 100.55, 100.6]
+        images = self._create_images(dates)
+        self.assertEqual(find_overlay._findMismatchedSpotImage(images, period), 2)
+
+    def test_no_date(self):
+        period = 0.2  # s
+        images = self._create_images([100, 100.2])
+        del images[1].metadata[model.MD_ACQ_DATE]
+        self.assertEqual(find_overlay._findMismatchedSpotImage(images, period), 1)
+
+
+class TestSpotGridTiming(unittest.TestCase):
+    """
+    Compare the duration of the spot grid acquisition, with the e-beam scanning
+    all the spots at once (synchronised with the CCD), and spot per spot.
+    To be subclassed with the simulator configuration to use.
+    """
+    config = None
+    detector_role = None
+    backend_was_running = False
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.config is None:
+            raise unittest.SkipTest("No configuration")
+
+        try:
+            test.start_backend(cls.config)
+        except LookupError:
+            logging.info("A running backend is already found, skipping tests")
+            cls.backend_was_running = True
+            return
+        except IOError as exp:
+            logging.error(str(exp))
+            raise
+
+        cls.ebeam = model.getComponent(role="e-beam")
+        cls.sed = model.getComponent(role=cls.detector_role)
+        cls.ccd = model.getComponent(role="ccd")
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.config is None or cls.backend_was_running:
+            return
+        test.stop_backend()
+
+    def setUp(self):
+        if self.backend_was_running:
+            self.skipTest("Running backend found")
+        # Small FoV, so that the spots are closer than a spot size => one
+        # image per spot
+        self.ebeam.horizontalFoV.value = 4e-6  # m
+
+    def _acquire_grid(self, rep, dt, scan_path):
+        gscanner = find_overlay.GridScanner(rep, dt, self.ebeam, self.ccd, self.sed)
+        if not scan_path:
+            # Pretend the e-beam cannot scan a path
+            gscanner._can_scan_path = lambda: False
+        self.assertEqual(gscanner._can_scan_path(), scan_path)
+
+        start = time.time()
+        images, coordinates, scale = gscanner.DoAcquisition()
+        duration = time.time() - start
+
+        self.assertEqual(len(images), rep[0] * rep[1])
+        self.assertEqual(len(coordinates), len(images))
+        if scan_path and gscanner._spot_period is not None:
+            # Each image was acquired while the e-beam was on its spot, which
+            # are scanned one period after each other.
+            start = images[0].metadata[model.MD_ACQ_DATE]
+            for i, im in enumerate(images):
+                exp_date = start + i * gscanner._spot_period
+                self.assertAlmostEqual(im.metadata[model.MD_ACQ_DATE], exp_date,
+                                       delta=find_overlay.SPOT_SYNC_MARGIN)
+        # Settings are back to normal
+        self.assertEqual(self.ebeam.scanPath.value, [])
+        return images, duration
+
+    def test_spot_grid(self):
+        rep = (6, 6)
+        dt = 0.01  # s
+        images_path, dur_path = self._acquire_grid(rep, dt, True)
+        images_loop, dur_loop = self._acquire_grid(rep, dt, False)
+        logging.info("Spot grid %s acquired in %g s with a scan path, and %g s spot per spot",
+                     rep, dur_path, dur_loop)
+
+        # Both acquisitions give the same kind of images
+        self.assertEqual(images_path[0].shape, images_loop[0].shape)
+        self.assertLess(dur_path, dur_loop)
+
+
+class TestSpotGridTimingSECOM(TestSpotGridTiming):
+    config = SECOM_CONFIG
+    detector_role = "se-detector"
+
+
+class TestSpotGridTimingDELPHI(TestSpotGridTiming):
+    config = DELPHI_CONFIG
+    detector_role = "bs-detector"
+
+
 if __name__ == '__main__':
     unittest.main()
 #     suite = unittest.TestLoader().loadTestsFromTestCase(TestOverlay)
@@ -22,12 +22,15 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 
 from __future__ import division
 
+from concurrent.futures import ThreadPoolExecutor
 import itertools
 import logging
 import math
 import numpy
+from odemis import model
 from scipy import misc
 import threading
+import time
 import cv2
 
 from odemis.acq.align.shift import MeasureShift
@@ -36,6 +39,86 @@ MIN_RESOLUTION = (20, 20) # seems 10x10 sometimes work, but let's not tent it
 MAX_PIXELS = 128 ** 2  # px
 
 
+class DriftRateModel(object):
+    """
+    Model of the drift over time, fitted on the history of the drift estimations.
+    It allows to extrapolate the drift between two estimations. The drift is
+    fitted by a polynomial: linear when only a few estimations are available,
+    and quadratic (ie, constant acceleration) afterwards.
+    """
+    # Number of latest estimations used for the fit. Limited so that the model
+    # follows changes in the drift behaviour.
+    MAX_HISTORY = 10
+    # Minimum number of estimations to fit a quadratic polynomial (one more
+    # than strictly needed, so that a single noisy estimation doesn't make the
+    # prediction go wild)
+    MIN_QUADRATIC = 5
+
+    def __init__(self):
+        self._history = []  # list of (float, (float, float)): time, drift (px)
+        self._coefs = None  # None or 2 arrays of polynomial coefficients (X, Y)
+        self._lock = threading.Lock()
+        # Distance between the latest drift estimation and the drift predicted
+        # for the same time, before that estimation was known. It's the error
+        # of the model over the latest period.
+        self.error = None  # None or float, in px
+
+    def add(self, t, drift):
+        """
+        Record a new drift estimation, and update the model.
+        t (float): time of the estimation (in s, since epoch)
+        drift (float, float): total drift at that time (in px)
+        """
+        with self._lock:
+            if self._coefs is not None:
+                pred = self._predict(t)
+                self.error = math.hypot(drift[0] - pred[0], drift[1] - pred[1])
+                logging.debug("Drift predicted %s, while measured %s", pred, drift)
+
+            self._history.append((t, tuple(drift)))
+            self._history = self._history[-self.MAX_HISTORY:]
+            self._fit()
+
+    def predict(self, t):
+        """
+        Extrapolate the drift at a given time.
+        t (float): time (in s, since epoch)
+        return (float, float): predicted total drift (in px). If there is not yet
+          enough estimations to fit the model, the latest estimation is returned.
+        """
+        with self._lock:
+            if self._coefs is None:
+                if self._history:
+                    return self._history[-1][1]
+                return (0, 0)
+            return self._predict(t)
+
+    def _fit(self):
+        """
+        Update the polynomial coefficients based on the history
+        Must be called with the lock taken.
+        """
+        if len(self._history) < 2:
+            self._coefs = None
+            return
+
+        deg = 2 if len(self._history) >= self.MIN_QUADRATIC else 1
+        # Fit relative to the latest time, to keep the numbers small
+        self._t0 = self._history[-1][0]
+        ts = numpy.array([t - self._t0 for t, d in self._history])
+        ds = numpy.array([d for t, d in self._history])
+        self._coefs = (numpy.polyfit(ts, ds[:, 0], deg),
+                       numpy.polyfit(ts, ds[:, 1], deg))
+
+    def _predict(self, t):
+        """
+        Must be called with the lock taken, and the model fitted.
+        """
+        dt = t - self._t0
+        return (float(numpy.polyval(self._coefs[0], dt)),
+                float(numpy.polyval(self._coefs[1], dt)))
+
+
 class AnchoredEstimator(object):
     """
     Drift estimator based on an "anchor" area. Periodically, a small region
@@ -44,7 +127,8 @@ class AnchoredEstimator(object):
 
     To use, call .acquire() periodically (and preferably at specific places of
     the global acquire, such as at the beginning of a line), and call .estimate()
-    to measure the drift.
+    to measure the drift. Alternatively, call .estimateAsync() to measure the
+    drift in a separate thread, while the main acquisition goes on.
     """
     def __init__(self, scanner, detector, region, dwell_time):
         """
@@ -67,6 +151,13 @@ class AnchoredEstimator(object):
         self.raw = []  # first 2 and last 2 anchor areas acquired (in order)
         self._acq_sem_complete = threading.Event()
 
+        # History of the total drift, to predict the drift between estimations
+        self.model = DriftRateModel()
+        self._last_acq_date = None  # time of the latest anchor acquisition
+        # To run the estimation in the background
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._estimation = None  # Future of the latest asynchronous estimation
+
         # Calculate initial translation for anchor region acquisition
         self._roi = region
         center = ((self._roi[0] + self._roi[2]) / 2,
@@ -117,25 +208,32 @@ class AnchoredEstimator(object):
         """
         Scan the anchor area
         """
+        # The position of the anchor area depends on the latest estimation
+        self.waitEstimation()
+
         # Save current SEM settings
         cur_dwell_time = self._emitter.dwellTime.value
         cur_scale = self._emitter.scale.value
         cur_resolution = self._emitter.resolution.value
         cur_trans = self._emitter.translation.value
 
+        # In case of error while updating, restore everything
+        dt_changed = roi_changed = True
         try:
-            self._updateSEMSettings()
-            logging.debug("E-beam spot to anchor region: %s",
-                          self._emitter.translation.value)
-            logging.debug("Scanning anchor region with resolution "
+            dt_changed, roi_changed = self._updateSEMSettings(cur_dwell_time, cur_scale,
+                                                              cur_resolution, cur_trans)
+            logging.debug("Scanning anchor region at %s with resolution "
                           "%s and dwelltime %s and scale %s",
-                          self._emitter.resolution.value,
-                          self._emitter.dwellTime.value,
-                          self._emitter.scale.value)
+                          self._trans, self._res, self._dwell_time, self._scale)
             data = self._semd.data.get(asap=False)
             if data.shape[::-1] != self._res:
                 logging.warning("Shape of data is %s instead of %s", data.shape[::-1], self._res)
 
+            self._last_acq_date = data.metadata.get(model.MD_ACQ_DATE, time.time())
+            if not self.raw:
+                # First acquisition => it's the origin of the drift
+                self.model.add(self._last_acq_date, self.tot_drift)
+
             # TODO: allow to record just every Nth image, and separately record the
             # drift after every measurement
             # In the mean time, we only save the 1st, 2nd and last two images
@@ -145,11 +243,13 @@ class AnchoredEstimator(object):
                 self.raw = self.raw[0:2]
             self.raw.append(data)
         finally:
-            # Restore SEM settings
-            self._emitter.dwellTime.value = cur_dwell_time
-            self._emitter.scale.value = cur_scale
-            self._emitter.resolution.value = cur_resolution
-            self._emitter.translation.value = cur_trans
+            # Restore SEM settings (only the ones which have been changed)
+            if dt_changed:
+                self._emitter.dwellTime.value = cur_dwell_time
+            if roi_changed:
+                self._emitter.scale.value = cur_scale
+                self._emitter.resolution.value = cur_resolution
+                self._emitter.translation.value = cur_trans
 
     def estimate(self):
         """
@@ -193,8 +293,50 @@ class AnchoredEstimator(object):
             if math.hypot(*self.tot_drift) > math.hypot(*self.max_drift):
                 self.max_drift = self.tot_drift
 
+            self.model.add(self._last_acq_date, self.tot_drift)
+
         return self.drift
 
+    def estimateAsync(self):
+        """
+        Same as .estimate(), but runs in a separate thread, so that the caller
+        can go on with the main acquisition in the mean time. .drift and
+        .tot_drift are updated once the estimation is over. The next call to
+        .acquire() waits for it to be over.
+        return (Future): the result is the same as the one of .estimate()
+        """
+        self.waitEstimation()
+        self._estimation = self._executor.submit(self.estimate)
+        return self._estimation
+
+    def waitEstimation(self):
+        """
+        Wait until the latest asynchronous estimation (if any) is over.
+        raise Exception: the error of the estimation, if it failed
+        """
+        f = self._estimation
+        if f is not None:
+            self._estimation = None
+            f.result()
+
+    def terminate(self):
+        """
+        Stop the thread running the asynchronous estimations. Any estimation
+        in progress is still completed. No asynchronous estimation is possible
+        afterwards.
+        """
+        self._executor.shutdown(wait=False)
+
+    def predictDrift(self, t=None):
+        """
+        Extrapolate the total drift from the history of the estimations.
+        t (float or None): time (in s, since epoch). If None, uses the current time.
+        return (float, float): predicted total drift in X/Y SEM px
+        """
+        if t is None:
+            t = time.time()
+        return self.model.predict(t)
+
     def estimateAcquisitionTime(self):
         """
         return (float): estimated time to acquire 1 anchor area
@@ -246,10 +388,15 @@ class AnchoredEstimator(object):
 
         return itertools.cycle(acq_dc_period)
 
-    def _updateSEMSettings(self):
+    def _updateSEMSettings(self, cur_dwell_time, cur_scale, cur_resolution, cur_trans):
         """
         Update the scanning area of the SEM according to the anchor region
         for drift correction.
+        To limit the access to the hardware, only the settings which differ
+        from the current ones are changed.
+        cur_* : the current settings of the e-beam
+        return (bool, bool): whether the dwell time was changed, and whether the
+          scanning area (scale, resolution, translation) was changed.
         """
         # translation is distance from center (situated at 0.5, 0.5), can be floats
         # we clip translation inside of bounds in case of huge drift
@@ -261,11 +408,22 @@ class AnchoredEstimator(object):
             logging.warning("Generated image may be incorrect due to extensive "
                             "drift of %s clipped to %s", trans, self._trans)
 
-        # always in this order
-        self._emitter.scale.value = self._scale
-        self._emitter.resolution.value = self._res
-        self._emitter.translation.value = self._trans
-        self._emitter.dwellTime.value = self._dwell_time
+        # always in this order. As changing one setting may affect the next
+        # ones (eg, the scale adjusts the resolution), once one is set, all the
+        # following ones are set too.
+        roi_changed = False
+        for va, v, cur in ((self._emitter.scale, self._scale, cur_scale),
+                           (self._emitter.resolution, self._res, cur_resolution),
+                           (self._emitter.translation, self._trans, cur_trans)):
+            if roi_changed or tuple(v) != tuple(cur):
+                va.value = v
+                roi_changed = True
+
+        dt_changed = (self._dwell_time != cur_dwell_time)
+        if dt_changed:
+            self._emitter.dwellTime.value = self._dwell_time
+
+        return dt_changed, roi_changed
 
 
 def GuessAnchorRegion(whole_img, sample_region):
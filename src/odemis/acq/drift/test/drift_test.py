@@ -16,10 +16,12 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 from __future__ import division
 
+from concurrent.futures import ThreadPoolExecutor
 import itertools
 import logging
+import math
 import numpy
-from odemis.acq.drift import AnchoredEstimator, GuessAnchorRegion
+from odemis.acq.drift import AnchoredEstimator, GuessAnchorRegion, DriftRateModel
 from odemis.dataio import hdf5
 import os
 import unittest
@@ -38,6 +40,31 @@ class TestAnchoredEstimator(unittest.TestCase):
         # TODO
         pass
 
+    def test_estimateAsync_error(self):
+        """
+        An error during the asynchronous estimation is reported when waiting for it
+        """
+        # No hardware needed to only run the estimation
+        dce = AnchoredEstimator.__new__(AnchoredEstimator)
+        dce._executor = ThreadPoolExecutor(max_workers=1)
+        dce._estimation = None
+
+        def failing_estimate():
+            raise ValueError("Cannot measure shift")
+
+        dce.estimate = failing_estimate
+        f = dce.estimateAsync()
+        with self.assertRaises(ValueError):
+            dce.waitEstimation()
+        self.assertTrue(f.done())
+
+        # Only reported once
+        dce.waitEstimation()
+
+        dce.terminate()
+        with self.assertRaises(RuntimeError):
+            dce.estimateAsync()
+
     def test_estimateCorrectionPeriod(self):
         # Input -> expected output (as a list)
         ieo = (# drift period > whole acquisition time
@@ -69,6 +96,49 @@ class TestAnchoredEstimator(unittest.TestCase):
             self.assertEqual(lo, eo, "Unexpected output %s for input %s" % (lo, i))
 
 
+class TestDriftRateModel(unittest.TestCase):
+    """
+    Test DriftRateModel
+    """
+
+    def test_no_history(self):
+        m = DriftRateModel()
+        self.assertEqual(m.predict(10), (0, 0))
+        self.assertIsNone(m.error)
+
+        # With just one estimation, no extrapolation is possible
+        m.add(1, (3, -2))
+        self.assertEqual(m.predict(10), (3, -2))
+        self.assertIsNone(m.error)
+
+    def test_linear(self):
+        m = DriftRateModel()
+        t0 = 1e9  # Typical time since epoch
+        for t in range(4):
+            m.add(t0 + t, (2 * t, -0.5 * t))
+        numpy.testing.assert_almost_equal(m.predict(t0 + 10), (20, -5), decimal=5)
+        # Perfectly predicted
+        self.assertAlmostEqual(m.error, 0, places=5)
+
+        # Change of drift => the error is the difference with the prediction
+        m.add(t0 + 4, (5, -2))
+        self.assertAlmostEqual(m.error, math.hypot(5 - 8, -2 + 2), places=5)
+
+    def test_acceleration(self):
+        m = DriftRateModel()
+        t0 = 1e9
+        for t in range(DriftRateModel.MIN_QUADRATIC):
+            m.add(t0 + t, (0.5 * t ** 2, -t ** 2))
+        numpy.testing.assert_almost_equal(m.predict(t0 + 10), (50, -100), decimal=5)
+        m.add(t0 + 6, (18, -36))
+        self.assertAlmostEqual(m.error, 0, places=5)
+
+        # Only the latest estimations are used
+        for t in range(7, 7 + DriftRateModel.MAX_HISTORY):
+            m.add(t0 + t, (1, 1))
+        numpy.testing.assert_almost_equal(m.predict(t0 + 100), (1, 1), decimal=5)
+
+
 # @unittest.skip("skip")
 class TestGuessAnchorRegion(unittest.TestCase):
     """
@@ -139,7 +139,12 @@ class AnchorDriftCorrector(LeechAcquirer):
     """
     Acquires regularly a Region-Of-Interest, and detects the position change to
     estimate current drift.
+    The estimation of the drift is done in the background, while the main
+    acquisition goes on, so it's applied from the next block acquired.
     """
+    # Maximum number of times the period can be lengthened, when the drift is
+    # predictable
+    MAX_PERIOD_FACTOR = 16
 
     def __init__(self, scanner, detector):
         """
@@ -151,6 +156,7 @@ class AnchorDriftCorrector(LeechAcquirer):
         self._detector = detector
         self._dc_estimator = None
         self._period_acq = None  # number of acq left until next drift correction is performed
+        self._period_factor = 1  # number of periods until the next anchor acquisition
 
         # roi: the anchor region, it must be set to something different from
         #  UNDEFINED_ROI to run.
@@ -169,6 +175,12 @@ class AnchorDriftCorrector(LeechAcquirer):
                                                range=scanner.dwellTime.range, unit="s")
         # in seconds, default to "fairly frequent" to work hopefully in most cases
         self.period = model.FloatContinuous(10, range=(0.1, 1e6), unit="s")
+        # maxPredictionError: if > 0, the drift between two anchor acquisitions
+        #  is extrapolated from the history of the drift estimations, and the
+        #  period is automatically lengthened (up to MAX_PERIOD_FACTOR times)
+        #  as long as the error of the prediction stays below this value.
+        #  If 0, the latest estimated drift is used, and the period is fixed.
+        self.maxPredictionError = model.FloatContinuous(0, range=(0, 1e6), unit="px")
 
     @property
     def drift(self):
@@ -181,7 +193,10 @@ class AnchorDriftCorrector(LeechAcquirer):
     def tot_drift(self):
         """
         Total drift vector from the first acquisition, in sem px
+        If .maxPredictionError is > 0, it's the drift extrapolated to the current time.
         """
+        if self.maxPredictionError.value > 0:
+            return self._dc_estimator.predictDrift()
         return self._dc_estimator.tot_drift
 
     @property
@@ -273,6 +288,10 @@ class AnchorDriftCorrector(LeechAcquirer):
         if self.roi.value == UNDEFINED_ROI:
             raise ValueError("AnchorDriftCorrector.roi is not defined")
 
+        # In case the previous series failed before completing
+        if self._dc_estimator:
+            self._dc_estimator.terminate()
+
         self._dc_estimator = drift.AnchoredEstimator(self._scanner,
                                                      self._detector,
                                                      self.roi.value,
@@ -280,12 +299,19 @@ class AnchorDriftCorrector(LeechAcquirer):
 
         # First acquisition of anchor area
         self._dc_estimator.acquire()
+        self._period_factor = 1
 
     def series_complete(self, das):
         """
         Erases the drift estimator, when the acquisition series is completed.
+        raise Exception: if the latest drift estimation failed
         """
-        self._dc_estimator = None
+        if self._dc_estimator:
+            try:
+                self._dc_estimator.waitEstimation()
+            finally:
+                self._dc_estimator.terminate()
+                self._dc_estimator = None
 
     def start(self, acq_t, shape):
         """
@@ -336,20 +362,47 @@ class AnchorDriftCorrector(LeechAcquirer):
         assert self._period_acq is not None
 
         # Acquisition of anchor area & estimate drift
-        # Cannot cancel during this time, but hopefully it's short
+        # Cannot cancel during this time, but hopefully it's short.
+        # The estimation runs during the next acquisitions. As acquire() waits
+        # for the previous estimation to be over, the model is up-to-date here.
         self._dc_estimator.acquire()
-        self._dc_estimator.estimate()
+        self._updatePeriodFactor()
+        self._dc_estimator.estimateAsync()
 
         # TODO: if next() would mean all the acquisitions, skip the last call by returning None
-        return next(self._period_acq)
+        return sum(next(self._period_acq) for i in range(self._period_factor))
+
+    def _updatePeriodFactor(self):
+        """
+        Adjust the number of periods between two anchor acquisitions, based on
+        how well the drift model predicted the latest drift estimation.
+        """
+        max_err = self.maxPredictionError.value
+        err = self._dc_estimator.model.error
+        if max_err <= 0 or err is None:
+            self._period_factor = 1
+            return
+
+        if err > max_err:
+            # Too far => be more careful
+            self._period_factor = max(1, self._period_factor // 2)
+        elif err < max_err / 2:
+            # Well predicted => anchor acquisition can be spaced more
+            self._period_factor = min(self._period_factor * 2, self.MAX_PERIOD_FACTOR)
+        logging.debug("Drift prediction error = %s px, anchor acquisition every %d periods",
+                      err, self._period_factor)
 
     def complete(self, das):
         """
         Called after the last sub-acquisition has been performed, and the data processed
         :param das: (list of DataArrays) The data which has just been acquired.
                     It might be modified by this function.
+        :raises: Exception if the latest drift estimation failed
         """
         self._period_acq = None
+        # Make sure the drift is fully estimated (and report if it failed)
+        if self._dc_estimator:
+            self._dc_estimator.waitEstimation()
         # TODO: add (a copy of) self.raw to the das? Or in series_complete()
         return None
 
@@ -26,9 +26,11 @@ from concurrent.futures.thread import ThreadPoolExecutor
 import copy
 import logging
 import math
+import numbers
 import re
 from odemis import model, util
 from odemis.acq import stream
+import threading
 import time
 from odemis.util import TimeoutError
 import queue
@@ -40,6 +42,10 @@ ACQ_QUALITY_BEST = 1
 
 TEMP_EPSILON = 3  # °C
 
+# Positions closer than this are considered identical, and so no move is needed.
+# It's much smaller than the precision of any actuator.
+POS_ATOL = 1e-12  # m or rad
+
 # Dict includes all the modes available and the corresponding component axis or
 # VA values
 # {Mode: (detector_needed, {role: {axis/VA: value}})}
@@ -296,6 +302,38 @@ def affectsGraph(microscope):
     return graph
 
 
+def affectsClosure(graph):
+    """
+    Computes the reachability of every node of an affects graph.
+    graph (dict str->(set of str)): as returned by affectsGraph()
+    returns (dict str->(set of str)): for each component name, the names of all
+      the components it affects directly or indirectly (including itself)
+    """
+    closure = {}
+    for root in graph:
+        reached = {root}
+        todo = [root]
+        while todo:
+            n = todo.pop()
+            for a in graph.get(n, ()):
+                if a not in reached:
+                    reached.add(a)
+                    todo.append(a)
+        closure[root] = reached
+    return closure
+
+
+def _isSamePosition(current, requested):
+    """
+    current (value): current position of an axis
+    requested (value): requested position of the axis
+    return (bool): True if the axis doesn't need to move
+    """
+    if isinstance(current, numbers.Real) and isinstance(requested, numbers.Real):
+        return util.almost_equal(current, requested, atol=POS_ATOL)
+    return current == requested
+
+
 class OpticalPathManager(object):
     """
     The purpose of this module is setting the physical components contained in
@@ -308,7 +346,6 @@ class OpticalPathManager(object):
             handle all the components needed
         """
         self.microscope = microscope
-        self._graph = affectsGraph(self.microscope)
         self._chamber_view_own_focus = False
 
         # Use subset for modes guessed
@@ -325,14 +362,12 @@ class OpticalPathManager(object):
         self.quality = ACQ_QUALITY_FAST
 
         # keep list of all components, to avoid creating new proxies
-        # every time the mode changes
-        self._cached_components = model.getComponents()
-
-        # All the actuators in the microscope, to cache proxy's to them
-        self._actuators = []
-        for comp in self._cached_components:
-            if hasattr(comp, 'axes') and isinstance(comp.axes, dict):
-                self._actuators.append(comp)
+        # every time the mode changes, and the affects graph (with all the
+        # components each component affects). Updated whenever the components
+        # change. The lock protects them while the path is being changed.
+        self._lock = threading.RLock()
+        self._updateComponents()
+        microscope.alive.subscribe(self._onAlive)
 
         # last known axes position (before going to an alignment mode)
         self._stored = {}  # (str, str) -> pos: (comp role, axis name) -> position
@@ -411,11 +446,57 @@ class OpticalPathManager(object):
                 except IOError as e:
                     logging.info("Actuator move failed giving the error %s", e)
 
+        self.terminate()
+
+    def terminate(self):
+        """
+        Stop following the changes of the microscope components, and stop the
+        executor of the path changes. Once called, setPath() cannot be used.
+        """
+        try:
+            self.microscope.alive.unsubscribe(self._onAlive)
+        except Exception:
+            logging.debug("Failed to unsubscribe from the microscope components", exc_info=True)
+
         try:
             self._executor.shutdown(wait=False)
         except AttributeError:
             pass  # Not created
 
+    def _updateComponents(self):
+        """
+        Update the cached components, and everything derived from them
+        """
+        comps = model.getComponents()
+
+        # All the actuators in the microscope, to cache proxy's to them
+        actuators = []
+        for comp in comps:
+            if hasattr(comp, 'axes') and isinstance(comp.axes, dict):
+                actuators.append(comp)
+
+        graph = {c.name: set(c.affects.value) for c in comps}
+        affected = affectsClosure(graph)
+
+        with self._lock:
+            self._cached_components = comps
+            self._actuators = actuators
+            self._graph = graph
+            self._affected = affected
+
+            # Plans to go to a mode for a given target, compiled from the mode
+            # configuration and the affects graph.
+            self._mode_plans = {}  # (str, str) -> list of (str, Component, dict): (mode, target name) -> plan
+            self._selector_plans = {}  # str -> list of (Component, dict, str or None): target name -> plan
+
+    def _onAlive(self, alive):
+        # The components affecting each other might have changed
+        logging.debug("Components changed, updating the optical path graph")
+        try:
+            self._updateComponents()
+        except Exception:
+            logging.exception("Failed to update the components")
+
     def _getComponent(self, role):
         """
         same as model.getComponent, but optimised by caching the result.
@@ -480,194 +561,201 @@ class OpticalPathManager(object):
         """
         Actual implementation of setPath()
         """
-        if isinstance(path, stream.Stream):
-            if detector is not None:
-                raise ValueError("Not possible to specify both a stream, and a detector")
-            try:
-                mode = self.guessMode(path)
-            except LookupError:
-                logging.debug("%s doesn't require optical path change", path)
-                return
-            target = self.getStreamDetector(path)  # target detector
-        else:
-            mode = path
-            if mode not in self._modes:
-                raise ValueError("Mode '%s' does not exist" % (mode,))
-            comp_role = self._modes[mode][0]
-            if detector is None:
-                target = self._getComponent(comp_role)
+        # The lock ensures the components and plans are not updated while the
+        # moves are being decided. It's released before waiting for the moves.
+        with self._lock:
+            if isinstance(path, stream.Stream):
+                if detector is not None:
+                    raise ValueError("Not possible to specify both a stream, and a detector")
+                try:
+                    mode = self.guessMode(path)
+                except LookupError:
+                    logging.debug("%s doesn't require optical path change", path)
+                    return
+                target = self.getStreamDetector(path)  # target detector
             else:
-                target = detector
-
-        logging.debug("Going to optical path '%s', with target detector %s.", mode, target.name)
-
-        # Special SECOM mode: just look at the fan and be done
-        if self.microscope.role in ("secom", "delphi"):
-            try:
-                if self.quality == ACQ_QUALITY_FAST:
-                    self._setCCDFan(True)
-                elif self.quality == ACQ_QUALITY_BEST:
-                    self._setCCDFan(target.role == "ccd")
-            except Exception:
-                # This can happen mainly if the hardware is in a bad state
-                # let's not make a big fuss: only report the error. The optical
-                # path is correct anyway, just potentially more vibrations.
-                logging.exception("Failed to change CCD fan")
-
-        fmoves = []  # moves in progress, list of (future, Component, dict(axis->pos) tuples
-
-        # Restore the spectrometer focus before any other move, as (on the SR193),
-        # the value is grating/output dependent
-        if self._chamber_view_own_focus and self._last_mode == "chamber-view":
-            focus_comp = self._getComponent("focus")
-            self._focus_in_chamber_view = focus_comp.position.value.copy()
-            if self._focus_out_chamber_view is not None:
-                logging.debug("Restoring focus from before coming to chamber view to %s",
-                              self._focus_out_chamber_view)
-                fmoves.append((focus_comp.moveAbs(self._focus_out_chamber_view), focus_comp, self._focus_out_chamber_view))
+                mode = path
+                if mode not in self._modes:
+                    raise ValueError("Mode '%s' does not exist" % (mode,))
+                comp_role = self._modes[mode][0]
+                if detector is None:
+                    target = self._getComponent(comp_role)
+                else:
+                    target = detector
 
-        modeconf = self._modes[mode][1]
-        for comp_role, conf in modeconf.items():
-            # Try to access the component needed
-            try:
-                comp = self._getComponent(comp_role)
-            except LookupError:
-                logging.debug("Failed to find component %s, skipping it", comp_role)
-                continue
+            logging.debug("Going to optical path '%s', with target detector %s.", mode, target.name)
 
-            # Check whether that actuator affects the target
-            targets = {target.name} | set(target.affects.value)
-            if not any(self.affects(comp.name, n) for n in targets):
-                logging.debug("Actuator %s doesn't affect %s, so not moving it",
-                              comp.name, target.name)
-                continue
-
-            mv = {}
-            for axis, pos in conf.items():
-                if axis == "power":
-                    if model.hasVA(comp, "power"):
-                        try:
-                            if pos == 'on':
-                                comp.power.value = comp.power.range[1]
-                            else:
-                                comp.power.value = comp.power.range[0]
-                            logging.debug("Updating power of comp %s to %f", comp.name, comp.power.value)
-                        except AttributeError:
-                            logging.debug("Could not retrieve power range of %s component", comp_role)
-                    continue
-                if not hasattr(comp, "axes") or not isinstance(comp.axes, dict):
-                    continue
-                if isinstance(pos, str) and pos.startswith("MD:"):
-                    pos = self.mdToValue(comp, pos[3:])[axis]
-                if axis in comp.axes:
-                    if axis == "band":
-                        # Handle the filter wheel in a special way. Search
-                        # for the position (key) that corresponds to the requested
-                        # position name (value), typically 'pass-through'.
-                        choices = comp.axes[axis].choices
-                        for key, value in choices.items():
-                            if value == pos:
-                                pos = key
-                                # Just to store current band in order to restore
-                                # it once we leave this mode
-                                if self._last_mode not in ALIGN_MODES:
-                                    self._stored[comp_role, axis] = comp.position.value[axis]
-                                break
-                        else:
-                            if mode == "mirror-align" and pos == "pass-through":
-                                # On the SPARC, if there is a filter-wheel in front of the CCD,
-                                # there should be a pass-through position. So if it's missing
-                                # that's typically a sign that the microscope file is incorrect
-                                # eg, a typo in the filter name.
-                                logging.warning("No 'pass-through' provided by %s.%s, "
-                                                "alignment might be harder due to limited signal. "
-                                                "That might be a sign of issue in the microscope file.",
-                                                comp.name, axis)
-                            else:
-                                logging.debug("Choice %s is not present in %s.%s axis, leaving at %s",
-                                              pos, comp.name, axis, comp.position.value[axis])
-                            continue
-                    elif axis == "grating":
-                        # If mirror is to be used but not found in grating
-                        # choices, then we use zero order. In case of
-                        # GRATING_NOT_MIRROR we either use the last known
-                        # grating or the first grating that is not mirror.
-                        choices = comp.axes[axis].choices
-                        if pos == "mirror":
-                            # Store current grating (if we use one at the moment)
-                            # to restore it once we use a normal grating again
-                            if choices[comp.position.value[axis]] != "mirror":
-                                self._stored[comp_role, axis] = comp.position.value[axis]
-                                self._stored[comp_role, 'wavelength'] = comp.position.value['wavelength']
-                            # Use the special "mirror" grating, if it exists
+            # Special SECOM mode: just look at the fan and be done
+            if self.microscope.role in ("secom", "delphi"):
+                try:
+                    if self.quality == ACQ_QUALITY_FAST:
+                        self._setCCDFan(True)
+                    elif self.quality == ACQ_QUALITY_BEST:
+                        self._setCCDFan(target.role == "ccd")
+                except Exception:
+                    # This can happen mainly if the hardware is in a bad state
+                    # let's not make a big fuss: only report the error. The optical
+                    # path is correct anyway, just potentially more vibrations.
+                    logging.exception("Failed to change CCD fan")
+
+            fmoves = []  # moves in progress, list of (future, Component, dict(axis->pos) tuples
+            # Positions requested during this call, to not skip a move based on
+            # the current position, while an earlier move of the same axis
+            # is still pending.
+            requested = {}  # str -> dict str->value: component name -> axis -> position
+
+            # Restore the spectrometer focus before any other move, as (on the SR193),
+            # the value is grating/output dependent
+            if self._chamber_view_own_focus and self._last_mode == "chamber-view":
+                focus_comp = self._getComponent("focus")
+                self._focus_in_chamber_view = focus_comp.position.value.copy()
+                if self._focus_out_chamber_view is not None:
+                    logging.debug("Restoring focus from before coming to chamber view to %s",
+                                  self._focus_out_chamber_view)
+                    mv = self._filterNoOpMoves(focus_comp, self._focus_out_chamber_view,
+                                               requested, self._focus_in_chamber_view)
+                    if mv:
+                        fmoves.append((focus_comp.moveAbs(mv), focus_comp, mv))
+
+            for comp_role, comp, conf in self._getModePlan(mode, target):
+                mv = {}
+                cpos = None  # current position of the component, read only once
+                for axis, pos in conf.items():
+                    if axis == "power":
+                        if model.hasVA(comp, "power"):
+                            try:
+                                if pos == 'on':
+                                    power = comp.power.range[1]
+                                else:
+                                    power = comp.power.range[0]
+                                if comp.power.value != power:
+                                    comp.power.value = power
+                                    logging.debug("Updating power of comp %s to %f", comp.name, power)
+                            except AttributeError:
+                                logging.debug("Could not retrieve power range of %s component", comp_role)
+                        continue
+                    if not hasattr(comp, "axes") or not isinstance(comp.axes, dict):
+                        continue
+                    if cpos is None:
+                        cpos = comp.position.value
+                    if isinstance(pos, str) and pos.startswith("MD:"):
+                        pos = self.mdToValue(comp, pos[3:])[axis]
+                    if axis in comp.axes:
+                        if axis == "band":
+                            # Handle the filter wheel in a special way. Search
+                            # for the position (key) that corresponds to the requested
+                            # position name (value), typically 'pass-through'.
+                            choices = comp.axes[axis].choices
                             for key, value in choices.items():
-                                if value == "mirror":
+                                if value == pos:
                                     pos = key
+                                    # Just to store current band in order to restore
+                                    # it once we leave this mode
+                                    if self._last_mode not in ALIGN_MODES:
+                                        self._stored[comp_role, axis] = cpos[axis]
                                     break
                             else:
-                                # Fallback to zero order (aka "low-quality mirror")
-                                axis = 'wavelength'
-                                pos = 0
-                        elif pos == GRATING_NOT_MIRROR:
-                            if choices[comp.position.value[axis]] == "mirror":
-                                # if there is a grating stored use this one
-                                # otherwise find the non-mirror grating
-                                if (comp_role, axis) in self._stored:
-                                    pos = self._stored[comp_role, axis]
+                                if mode == "mirror-align" and pos == "pass-through":
+                                    # On the SPARC, if there is a filter-wheel in front of the CCD,
+                                    # there should be a pass-through position. So if it's missing
+                                    # that's typically a sign that the microscope file is incorrect
+                                    # eg, a typo in the filter name.
+                                    logging.warning("No 'pass-through' provided by %s.%s, "
+                                                    "alignment might be harder due to limited signal. "
+                                                    "That might be a sign of issue in the microscope file.",
+                                                    comp.name, axis)
+                                else:
+                                    logging.debug("Choice %s is not present in %s.%s axis, leaving at %s",
+                                                  pos, comp.name, axis, cpos[axis])
+                                continue
+                        elif axis == "grating":
+                            # If mirror is to be used but not found in grating
+                            # choices, then we use zero order. In case of
+                            # GRATING_NOT_MIRROR we either use the last known
+                            # grating or the first grating that is not mirror.
+                            choices = comp.axes[axis].choices
+                            if pos == "mirror":
+                                # Store current grating (if we use one at the moment)
+                                # to restore it once we use a normal grating again
+                                if choices[cpos[axis]] != "mirror":
+                                    self._stored[comp_role, axis] = cpos[axis]
+                                    self._stored[comp_role, 'wavelength'] = cpos['wavelength']
+                                # Use the special "mirror" grating, if it exists
+                                for key, value in choices.items():
+                                    if value == "mirror":
+                                        pos = key
+                                        break
+                                else:
+                                    # Fallback to zero order (aka "low-quality mirror")
+                                    axis = 'wavelength'
+                                    pos = 0
+                            elif pos == GRATING_NOT_MIRROR:
+                                if choices[cpos[axis]] == "mirror":
+                                    # if there is a grating stored use this one
+                                    # otherwise find the non-mirror grating
+                                    if (comp_role, axis) in self._stored:
+                                        pos = self._stored[comp_role, axis]
+                                    else:
+                                        pos = self.findNonMirror(choices)
+                                    if (comp_role, 'wavelength') in self._stored:
+                                        mv['wavelength'] = self._stored[comp_role, 'wavelength']
                                 else:
-                                    pos = self.findNonMirror(choices)
-                                if (comp_role, 'wavelength') in self._stored:
-                                    mv['wavelength'] = self._stored[comp_role, 'wavelength']
+                                    pos = cpos[axis]  # no change
+                                try:
+                                    del self._stored[comp_role, axis]
+                                except KeyError:
+                                    pass
+                                try:
+                                    del self._stored[comp_role, 'wavelength']
+                                except KeyError:
+                                    pass
                             else:
-                                pos = comp.position.value[axis]  # no change
-                            try:
-                                del self._stored[comp_role, axis]
-                            except KeyError:
-                                pass
-                            try:
-                                del self._stored[comp_role, 'wavelength']
-                            except KeyError:
-                                pass
-                        else:
-                            logging.debug("Using grating position as-is: '%s'", pos)
-                            pass  # use pos as-is
-                    elif axis == "slit-in":
-                        if mode in ALIGN_MODES and (comp_role, axis) not in self._stored:
-                            self._stored[comp_role, axis] = comp.position.value[axis]
-                    elif hasattr(comp.axes[axis], "choices") and isinstance(comp.axes[axis].choices, dict):
-                        choices = comp.axes[axis].choices
-                        for key, value in choices.items():
-                            if value == pos:
-                                pos = key
-                                break
-                    # write actuator axis and position in dict
-                    mv[axis] = pos
-                else:
-                    logging.debug("Not moving axis %s.%s as it is not present", comp_role, axis)
-
-            if mv:
-                try:
-                    # move actuator
-                    fmoves.append((comp.moveAbs(mv), comp, mv))
-                except AttributeError:
-                    logging.warning("%s not an actuator, but tried to move to %s", comp_role, mv)
-
-        # Now take care of the selectors based on the target detector
-        fmoves.extend(self.selectorsToPath(target.name))
-
-        # If we are about to leave alignment modes, restore values
-        if self._last_mode in ALIGN_MODES and mode not in ALIGN_MODES:
-            logging.debug("Leaving align mode %s for %s, will restore positions: %s",
-                          self._last_mode, mode, self._stored)
-            for (cr, an), pos in self._stored.copy().items(): # copy for deleting entries
-                if an == "grating":
-                    continue  # handled separately via GRATING_NOT_MIRROR
-                comp = self._getComponent(cr)
-                fmoves.append((comp.moveAbs({an: pos}), comp, {an: pos}))
-                del self._stored[cr, an]
-
-        # Save last mode
-        self._last_mode = mode
+                                logging.debug("Using grating position as-is: '%s'", pos)
+                                pass  # use pos as-is
+                        elif axis == "slit-in":
+                            if mode in ALIGN_MODES and (comp_role, axis) not in self._stored:
+                                self._stored[comp_role, axis] = cpos[axis]
+                        elif hasattr(comp.axes[axis], "choices") and isinstance(comp.axes[axis].choices, dict):
+                            choices = comp.axes[axis].choices
+                            for key, value in choices.items():
+                                if value == pos:
+                                    pos = key
+                                    break
+                        # write actuator axis and position in dict
+                        mv[axis] = pos
+                    else:
+                        logging.debug("Not moving axis %s.%s as it is not present", comp_role, axis)
+
+                if mv:
+                    mv = self._filterNoOpMoves(comp, mv, requested, cpos)
+                if mv:
+                    try:
+                        # move actuator
+                        fmoves.append((comp.moveAbs(mv), comp, mv))
+                    except AttributeError:
+                        logging.warning("%s not an actuator, but tried to move to %s", comp_role, mv)
+
+            # Now take care of the selectors based on the target detector
+            fmoves.extend(self.selectorsToPath(target.name, requested))
+
+            # If we are about to leave alignment modes, restore values
+            if self._last_mode in ALIGN_MODES and mode not in ALIGN_MODES:
+                logging.debug("Leaving align mode %s for %s, will restore positions: %s",
+                              self._last_mode, mode, self._stored)
+                for (cr, an), pos in self._stored.copy().items(): # copy for deleting entries
+                    if an == "grating":
+                        continue  # handled separately via GRATING_NOT_MIRROR
+                    comp = self._getComponent(cr)
+                    mv = self._filterNoOpMoves(comp, {an: pos}, requested)
+                    if mv:
+                        fmoves.append((comp.moveAbs(mv), comp, mv))
+                    del self._stored[cr, an]
+
+            # Save last mode
+            self._last_mode = mode
+
+        if not fmoves:
+            logging.debug("Optical path already set for %s, no move needed", mode)
 
         # wait for all the moves to be completed
         for f, comp, mv in fmoves:
@@ -708,19 +796,100 @@ class OpticalPathManager(object):
                 except IOError as e:
                     logging.warning("Actuator move failed giving the error %s", e)
 
-    def selectorsToPath(self, target):
+    def getMovedComponents(self, path):
+        """
+        Find the components which might be changed when calling setPath(),
+        without changing anything. It errs on the side of caution: some of the
+        components returned might actually already be at the right position.
+        path (stream.Stream or str): The stream or the optical path mode
+        return (set of Components): the components which setPath() might move
+          (or adjust)
+        """
+        if isinstance(path, stream.Stream):
+            try:
+                mode = self.guessMode(path)
+                target = self.getStreamDetector(path)
+            except LookupError:
+                return set()
+        else:
+            mode = path
+            if mode not in self._modes:
+                raise ValueError("Mode '%s' does not exist" % (mode,))
+            target = self._getComponent(self._modes[mode][0])
+
+        with self._lock:
+            comps = set()
+            if self.microscope.role in ("secom", "delphi"):
+                # The fan is only turned off in "best" quality
+                if self.quality == ACQ_QUALITY_BEST:
+                    try:
+                        comps.add(self._getComponent("ccd"))
+                    except LookupError:
+                        pass
+
+            for comp_role, comp, conf in self._getModePlan(mode, target):
+                comps.add(comp)
+
+            # Same as selectorsToPath(), but without moving
+            for comp, mv, fav in self._getSelectorsPlan(target.name):
+                comps.add(comp)
+
+            if self._last_mode in ALIGN_MODES and mode not in ALIGN_MODES:
+                for cr, an in self._stored:
+                    comps.add(self._getComponent(cr))
+
+            if self._chamber_view_own_focus and "chamber-view" in (mode, self._last_mode):
+                comps.add(self._getComponent("focus"))
+
+        return comps
+
+    def selectorsToPath(self, target, requested=None):
         """
         Sets the selectors so the optical path leads to the target component
         (usually a detector).
         target (str): component name
+        requested (None or dict str -> dict): positions already requested (and
+          maybe not yet reached) for each component. It's updated with the
+          new moves. See _filterNoOpMoves().
         return (list of tuple (futures, Component, dict)): for each move: the
           future, the component, and the new position requested
         """
+        if requested is None:
+            requested = {}
         fmoves = []
-        for comp in self._actuators:
-            # TODO: pre-cache this as comp/target -> axis/pos
-            # TODO: don't do moves already done
+        for comp, mv, fav in self._getSelectorsPlan(target):
+            mv = mv.copy()
+            if fav is not None:
+                # Read every time, as the favourite positions can be calibrated
+                mv.update(comp.getMetadata()[fav])
 
+            mv = self._filterNoOpMoves(comp, mv, requested)
+            if mv:
+                logging.debug("Move %s added so %s targets the optical path", mv, comp.name)
+                fmoves.append((comp.moveAbs(mv), comp, mv))
+
+        return fmoves
+
+    def _getSelectorsPlan(self, target, _seen=None):
+        """
+        Find the selectors to move so that the optical path leads to the target.
+        The result is cached, as it only depends on the hardware configuration.
+        target (str): component name
+        return (list of tuple (Component, dict str->value, str or None)): for
+          each selector, in the order they should be moved: the component, the
+          position of each axis with choices pointing to the target, and the
+          name of the metadata with the favourite position to use (if any).
+        """
+        try:
+            return self._selector_plans[target]
+        except KeyError:
+            pass
+
+        if _seen is None:
+            _seen = set()
+        _seen.add(target)
+        plan = []
+        for comp in self._actuators:
             # TODO: extend the path computation to "for every actuator which _affects_
             # the target, move if position known, and update path to that actuator"?
             # Eg, this would improve path computation on SPARCv2 with fiber aligner
@@ -733,18 +902,94 @@ class OpticalPathManager(object):
                             mv[an] = pos
 
             comp_md = comp.getMetadata()
+            fav = None
             if target in comp_md.get(model.MD_FAV_POS_ACTIVE_DEST, {}):
-                mv.update(comp_md[model.MD_FAV_POS_ACTIVE])
+                fav = model.MD_FAV_POS_ACTIVE
             elif target in comp_md.get(model.MD_FAV_POS_DEACTIVE_DEST, {}):
-                mv.update(comp_md[model.MD_FAV_POS_DEACTIVE])
+                fav = model.MD_FAV_POS_DEACTIVE
 
-            if mv:
-                logging.debug("Move %s added so %s targets to %s", mv, comp.name, target)
-                fmoves.append((comp.moveAbs(mv), comp, mv))
+            if mv or fav is not None:
+                plan.append((comp, mv, fav))
                 # make sure this component is also on the optical path
-                fmoves.extend(self.selectorsToPath(comp.name))
+                if comp.name not in _seen:
+                    plan.extend(self._getSelectorsPlan(comp.name, _seen))
 
-        return fmoves
+        self._selector_plans[target] = plan
+        return plan
+
+    def _getModePlan(self, mode, target):
+        """
+        Find the components of the mode configuration which should be adjusted
+        for the given target. The result is cached, as it only depends on the
+        hardware configuration.
+        mode (str): optical path mode
+        target (Component): the target detector
+        return (list of tuple (str, Component, dict str->value)): the role,
+          the component, and its configuration in the mode
+        """
+        key = (mode, target.name)
+        try:
+            return self._mode_plans[key]
+        except KeyError:
+            pass
+
+        try:
+            targets = {target.name} | self._graph[target.name]
+        except KeyError:  # Not a component of the microscope?
+            targets = {target.name} | set(target.affects.value)
+
+        plan = []
+        for comp_role, conf in self._modes[mode][1].items():
+            # Try to access the component needed
+            try:
+                comp = self._getComponent(comp_role)
+            except LookupError:
+                logging.debug("Failed to find component %s, skipping it", comp_role)
+                continue
+
+            # Check whether that actuator affects the target
+            if not any(self.affects(comp.name, n) for n in targets):
+                logging.debug("Actuator %s doesn't affect %s, so not moving it",
+                              comp.name, target.name)
+                continue
+            plan.append((comp_role, comp, conf))
+
+        self._mode_plans[key] = plan
+        return plan
+
+    def _filterNoOpMoves(self, comp, mv, requested, pos=None):
+        """
+        Remove the axes which are already at the requested position. If a move
+        of an axis was already requested earlier during the same path change,
+        the position compared is the one of that move, as the current position
+        might not be updated yet.
+        comp (Actuator): the component to move
+        mv (dict str->value): axis name -> requested position
+        requested (dict str -> dict str->value): component name -> axis name ->
+          position already requested during the path change. It's updated with
+          the moves needed.
+        pos (dict str->value or None): current position of the component, if
+          already known
+        return (dict str->value): the axes which actually need to move
+        """
+        comp_req = requested.setdefault(comp.name, {})
+        if pos is None and any(a not in comp_req for a in mv):
+            pos = comp.position.value
+
+        mv_needed = {}
+        for a, p in mv.items():
+            if a in comp_req:
+                if _isSamePosition(comp_req[a], p):
+                    continue
+            elif a in pos and _isSamePosition(pos[a], p):
+                continue
+            mv_needed[a] = p
+        comp_req.update(mv_needed)
+
+        if len(mv_needed) < len(mv):
+            logging.debug("Skipping move of %s to %s, already there", comp.name,
+                          {a: p for a, p in mv.items() if a not in mv_needed})
+        return mv_needed
 
     def guessMode(self, guess_stream):
         """
@@ -844,11 +1089,10 @@ class OpticalPathManager(object):
         affected (str): component name
         return bool
         """
-        path = self.findPath(affecting, affected)
-        if path is None:
-            return False
-        else:
-            return True
+        try:
+            return affected in self._affected[affecting]
+        except KeyError:  # Unknown component
+            return affecting == affected
 
     def findPath(self, node1, node2, path=None):
         """
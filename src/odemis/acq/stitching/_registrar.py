@@ -29,7 +29,9 @@ content, in other words performing "image registration".
 """
 
 from __future__ import division
+from concurrent import futures
 from odemis.acq.drift import MeasureShift
+import multiprocessing
 import numpy
 import math
 from odemis import model
@@ -446,14 +448,34 @@ class GlobalShiftRegistrar(object):
     neighbours and performs a global optimization to find the best path connecting the tiles.
     """
 
-    def __init__(self):
+    def __init__(self, pyramid_levels=0, max_workers=None):
+        """
+        :param pyramid_levels: (0 <= int) number of times the overlap is downscaled by 2 to obtain
+          a first estimation of the shift, before refining it at full resolution. 0 disables the
+          coarse estimation. Useful when the stage positions are very imprecise.
+        :param max_workers: (None or 1 <= int) maximum number of shifts computed simultaneously.
+          If None, the number of CPUs is used.
+        """
+        if pyramid_levels < 0:
+            raise ValueError("pyramid_levels should be >= 0, but got %s" % (pyramid_levels,))
+        self._pyramid_levels = pyramid_levels
+
+        # The shift computations are independent from each other and mostly done
+        # by numpy (FFT), which releases the GIL, so threads are sufficient.
+        # The executor is created when needed, and stopped once all the shifts are collected.
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+        self._max_workers = max_workers
+        self._executor = None
+
         # Store all the tiles. Each cell contains either None or a DataArray
         self.tiles = [[None]]
 
         # Store the shifts in a data structure with shape num_rows x (num_cols - 1) x 2 for the
         # horizontal shifts and (num_cols - 1) x num_rows x 2 for the vertical shifts. The data
         # structure contains the shift on all edges in the tile grid from top left to bottom right.
-        # Each cell contains a tuple (x, y shift) and a float (error value).
+        # Each cell contains a tuple (x, y shift) and a float (error value), or a Future
+        # returning it, while it's being computed.
         # The main advantage of using this data structure over an adjacency matrix is
         # that it can be extended in the same way as the self.tiles attribute is extended
         # when a new tile is added.
@@ -608,38 +630,109 @@ class GlobalShiftRegistrar(object):
         :returns: ((float, float), float) x shift, y shift, normalized cross correlation (-1 <= ncc <= 1, higher
         is better)
         """
+        exp_shift = self._get_expected_shift(prev_tile, tile)
+        return self._measure_shift(prev_tile, tile, exp_shift)
+
+    def _get_expected_shift(self, prev_tile, tile):
+        """
+        Computes the shift between the two tiles, based on their metadata.
+
+        :param prev_tile: (DataArray) static tile to which other tile is compared
+        :param tile: (DataArray) shifted tile
+        :returns: (float, float) x shift, y shift in pixels
+        :raises ValueError: if the tiles do not overlap
+        """
         px_size = tile.metadata[model.MD_PIXEL_SIZE]
         # The y-axis of the reference coordinate system used here is inverted compared to
         # the metadata position.
         exp_shift = ((tile.metadata[model.MD_POS][0] - prev_tile.metadata[model.MD_POS][0]) / px_size[0],
                      (-tile.metadata[model.MD_POS][1] + prev_tile.metadata[model.MD_POS][1]) / px_size[1])
 
-        # Get the region of interest
         if abs(exp_shift[0]) >= tile.shape[1] or abs(exp_shift[1]) >= tile.shape[0]:
             raise ValueError("There is no overlap between tiles for the shift given %s" % (exp_shift,))
-        if exp_shift[0] < 0:
-            l1, r1 = 0, tile.shape[1] + int(exp_shift[0])
-            l2, r2 = -int(exp_shift[0]), tile.shape[1]
+
+        return exp_shift
+
+    @staticmethod
+    def _get_overlap(prev_tile, tile, shift):
+        """
+        Selects the region of the two tiles which overlap, for a given shift.
+        No data is copied: the regions returned are views on the tiles.
+
+        :param prev_tile: (array of shape YX) static tile
+        :param tile: (array of shape YX) shifted tile, of the same shape as prev_tile
+        :param shift: (float, float) x shift, y shift in pixels of tile compared to prev_tile
+        :returns: (ndarray, ndarray) region of prev_tile and of tile which overlap.
+          They have the same shape. If there is no overlap, the shape is empty.
+        """
+        shape = tile.shape
+        if shift[0] < 0:
+            l1, r1 = 0, max(0, shape[1] + int(shift[0]))
+            l2, r2 = min(shape[1], -int(shift[0])), shape[1]
         else:
-            l1, r1 = int(exp_shift[0]), tile.shape[1]
-            l2, r2 = 0, tile.shape[1] - int(exp_shift[0])
+            l1, r1 = min(shape[1], int(shift[0])), shape[1]
+            l2, r2 = 0, max(0, shape[1] - int(shift[0]))
 
-        if exp_shift[1] < 0:
-            t1, b1 = 0, tile.shape[0] + int(exp_shift[1])
-            t2, b2 = -int(exp_shift[1]), tile.shape[0]
+        if shift[1] < 0:
+            t1, b1 = 0, max(0, shape[0] + int(shift[1]))
+            t2, b2 = min(shape[0], -int(shift[1])), shape[0]
         else:
-            t1, b1 = int(exp_shift[1]), tile.shape[0]
-            t2, b2 = 0, tile.shape[0] - int(exp_shift[1])
-        prev_tile_roi = numpy.array(prev_tile)[t1:b1, l1:r1]
-        tile_roi = numpy.array(tile)[t2:b2, l2:r2]
+            t1, b1 = min(shape[0], int(shift[1])), shape[0]
+            t2, b2 = 0, max(0, shape[0] - int(shift[1]))
+
+        # numpy.asarray() doesn't copy the data, and avoids the (slower) DataArray slicing
+        prev_tile_roi = numpy.asarray(prev_tile)[t1:b1, l1:r1]
+        tile_roi = numpy.asarray(tile)[t2:b2, l2:r2]
+        return prev_tile_roi, tile_roi
+
+    @staticmethod
+    def _downscale(im, factor):
+        """
+        Bins the image by averaging blocks of factor x factor pixels.
+        The pixels on the border which don't fit in a complete block are discarded.
+
+        :param im: (ndarray of shape YX) image to downscale
+        :param factor: (int >= 1) binning along each dimension
+        :returns: (ndarray of shape Y'X' of float) the binned image
+        """
+        h, w = im.shape[0] // factor, im.shape[1] // factor
+        im = im[:h * factor, :w * factor]
+        return im.reshape(h, factor, w, factor).mean(axis=(1, 3))
+
+    def _measure_shift(self, prev_tile, tile, exp_shift):
+        """
+        Measures the shift between the two tiles, using only the region where they overlap.
+        If pyramid_levels > 0, the shift is first estimated on downscaled versions of the overlap,
+        and then refined at full resolution on the overlap corrected by this first estimation.
+
+        :param prev_tile: (DataArray) static tile to which other tile is compared
+        :param tile: (DataArray) shifted tile
+        :param exp_shift: (float, float) x shift, y shift in pixels, expected from the metadata
+        :returns: ((float, float), float) x shift, y shift, normalized cross correlation (-1 <= ncc <= 1, higher
+        is better)
+        """
+        # Shift of the tile (compared to prev_tile) used to select the overlap
+        ovl_shift = exp_shift
+        prev_tile_roi, tile_roi = self._get_overlap(prev_tile, tile, ovl_shift)
+
+        factor = 2 ** self._pyramid_levels
+        if factor > 1 and min(tile_roi.shape) >= 4 * factor:
+            coarse_shift = MeasureShift(self._downscale(tile_roi, factor),
+                                        self._downscale(prev_tile_roi, factor))
+            ovl_shift = numpy.subtract(exp_shift, numpy.multiply(coarse_shift, factor))
+            prev_tile_roi, tile_roi = self._get_overlap(prev_tile, tile, ovl_shift)
+            if tile_roi.size == 0:
+                logging.info("Coarse shift %s doesn't leave any overlap, using expected position "
+                             "instead.", coarse_shift)
+                return exp_shift, 0
 
         # If you need to crop the tile without changing the output shift,
         # you can do it here with the pattern tile_roi[t:-b, l:-r]
         shift = MeasureShift(tile_roi, prev_tile_roi)
-        shift_total = numpy.subtract(exp_shift, shift)
+        shift_total = numpy.subtract(ovl_shift, shift)
 
-        # Measure accuracy (ncc value)
-        avg = numpy.average(prev_tile), numpy.average(tile)
+        # Measure accuracy (ncc value), only on the overlapping region
+        avg = numpy.average(prev_tile_roi), numpy.average(tile_roi)
         dist = prev_tile_roi - avg[0], tile_roi - avg[1]
         covar = numpy.sum(dist[0] * dist[1]) / prev_tile_roi.size
         var = numpy.sum(dist[0] ** 2) / prev_tile_roi.size, numpy.sum(dist[1] ** 2) / tile_roi.size
@@ -650,7 +743,7 @@ class GlobalShiftRegistrar(object):
         ncc = (covar / (stDev[0] * stDev[1]))
 
         overlap = min(numpy.abs(numpy.subtract(tile.shape, numpy.abs(exp_shift))))
-        if max(numpy.abs(shift)) > overlap:
+        if max(numpy.abs(numpy.subtract(exp_shift, shift_total))) > overlap:
             logging.info("Calculated shift is larger than the overlap size, using expected position "
                          "instead.")
             return exp_shift, 0
@@ -659,13 +752,15 @@ class GlobalShiftRegistrar(object):
 
     def _compute_registration(self, row, col):
         """
-        Performs registration of the tile at grid position row, col with respect to every
-        available neighbour. The computed shifts and the respective cross-correlation values
-        are stored in self.shifts.
+        Starts the registration of the tile at grid position row, col with respect to every
+        available neighbour. The computations are run in the background, and the futures
+        are stored in self.shifts. They are replaced by the result of the computation
+        (the shift and the respective cross-correlation value) in _collect_shifts().
 
         :param row: (int) row index
         :param col: (int) col index
         :updates self.shifts:
+        :raises ValueError: if the tile doesn't overlap with one of its neighbours
         """
         tile = self.tiles[row][col]
         num_cols = len(self.tiles[0])
@@ -682,16 +777,49 @@ class GlobalShiftRegistrar(object):
         shift_top = self.shifts_ver[row - 1][col] if row > 0 else None
         shift_bottom = self.shifts_ver[row][col] if row < num_rows - 2 else None
 
-        # Calculate the shifts to all adjacent tiles that have not been calculated yet
+        # Calculate the shifts to all adjacent tiles that have not been calculated yet.
+        # Each pair is independent, so they are computed in parallel.
         if nbr_left is not None and not shift_left:
-            self.shifts_hor[row][col - 1] = self._get_shift(nbr_left, tile)
+            self.shifts_hor[row][col - 1] = self._submit_shift(nbr_left, tile)
         if nbr_right is not None and not shift_right:
-            self.shifts_hor[row][col] = self._get_shift(tile, nbr_right)
+            self.shifts_hor[row][col] = self._submit_shift(tile, nbr_right)
         if nbr_top is not None and not shift_top:
-            self.shifts_ver[row - 1][col] = self._get_shift(nbr_top, tile)
+            self.shifts_ver[row - 1][col] = self._submit_shift(nbr_top, tile)
         if nbr_bottom is not None and not shift_bottom:
-            self.shifts_ver[row][col] = self._get_shift(tile, nbr_bottom)
-            
+            self.shifts_ver[row][col] = self._submit_shift(tile, nbr_bottom)
+
+    def _submit_shift(self, prev_tile, tile):
+        """
+        Schedules the computation of the shift between two tiles.
+
+        :param prev_tile: (DataArray) static tile to which other tile is compared
+        :param tile: (DataArray) shifted tile
+        :returns: (Future) the future returning the same as _get_shift()
+        :raises ValueError: if the tiles do not overlap
+        """
+        # Check immediately that the tiles overlap, so that the error is reported to the caller of addTile()
+        exp_shift = self._get_expected_shift(prev_tile, tile)
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(max_workers=self._max_workers)
+        return self._executor.submit(self._measure_shift, prev_tile, tile, exp_shift)
+
+    def _collect_shifts(self):
+        """
+        Waits for all the shift computations to be over, and stops the executor.
+        :updates self.shifts: the futures are replaced by their result
+        """
+        try:
+            for shifts in (self.shifts_hor, self.shifts_ver):
+                for row in shifts:
+                    for col, s in enumerate(row):
+                        if isinstance(s, futures.Future):
+                            row[col] = s.result()
+        finally:
+            # No more computation running (unless a tile is added again)
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
     def _assemble_mosaic(self):
         """
         Performs a global optimization to find the best path through the tile grid using 
@@ -704,6 +832,8 @@ class GlobalShiftRegistrar(object):
         # The normalized cross correlation value needs to be transformed, so it can be
         # used in the minimum spanning tree. Lower values are better and the value should
         # never be 0 --> convert to error between [100, 200]
+        self._collect_shifts()
+
         num_cols = len(self.tiles[0])
         num_rows = len(self.tiles)
         errors = numpy.zeros((num_rows * num_cols, num_rows * num_cols))
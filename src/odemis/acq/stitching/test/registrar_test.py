@@ -29,6 +29,7 @@ import random
 import copy
 import os
 import itertools
+import time
 
 from odemis.acq.stitching import IdentityRegistrar, ShiftRegistrar, GlobalShiftRegistrar
 from odemis.dataio import find_fittest_converter
@@ -622,6 +623,8 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
                     # one pixel difference allowed
                     self.assertLessEqual(diff[0], 1)
                     self.assertLessEqual(diff[1], 1)
+                    # The worker threads are stopped once the positions are computed
+                    self.assertIsNone(registrar._executor)
 
     def test_white_image(self):
         """ Position should be left as-is in case of white images """
@@ -699,6 +702,57 @@ class TestGlobalShiftRegistrar(unittest.TestCase):
                         "Position %s pxs off for image '%s', " % (max(diff.flatten()) / px_size[0], img_name) +
                         "%s x %s tiles, %s ovlp, %s method." % (num, num, o, a))
 
+    def test_shift_real_pyramid(self):
+        """ Test on decomposed image with known shift, using coarse-to-fine registration """
+        numTiles = [2, 3]
+        overlap = [0.4, 0.2]
+        acq = ["horizontalZigzag", "verticalLines"]
+
+        for img, num, o, a in itertools.product(IMGS, numTiles, overlap, acq):
+            _, img_name = os.path.split(img)
+            conv = find_fittest_converter(img)
+            data = conv.read_data(img)[0]
+            data = ensure2DImage(data)
+
+            [tiles, real_pos] = decompose_image(data, o, num, a)
+            px_size = tiles[0].metadata[model.MD_PIXEL_SIZE]
+            registrar = GlobalShiftRegistrar(pyramid_levels=2)
+            for tile in tiles:
+                registrar.addTile(tile)
+
+            # Compare positions to real positions, allow 5 px offset
+            registered_pos = registrar.getPositions()[0]
+            diff = numpy.absolute(numpy.subtract(registered_pos, real_pos))
+            allowed_px_offset = numpy.repeat(numpy.multiply(px_size, 5), len(diff))
+            numpy.testing.assert_array_less(diff.flatten(), allowed_px_offset.flatten(),
+                        "Position %s pxs off for image '%s', " % (max(diff.flatten()) / px_size[0], img_name) +
+                        "%s x %s tiles, %s ovlp, %s method." % (num, num, o, a))
+
+    def test_speed(self):
+        """ Compare serial and parallel registration, which should give the same result """
+        for img in IMGS:
+            conv = find_fittest_converter(img)
+            data = conv.read_data(img)[0]
+            data = ensure2DImage(data)
+            [tiles, real_pos] = decompose_image(data, 0.2, 5, "horizontalZigzag")
+            px_size = tiles[0].metadata[model.MD_PIXEL_SIZE]
+
+            durs = []
+            all_pos = []
+            for max_workers in (1, None):
+                tstart = time.time()
+                registrar = GlobalShiftRegistrar(max_workers=max_workers)
+                for tile in tiles:
+                    registrar.addTile(tile)
+                all_pos.append(registrar.getPositions()[0])
+                durs.append(time.time() - tstart)
+
+            diff = numpy.absolute(numpy.subtract(all_pos[1], real_pos)) / px_size[0]
+            logging.info("Registration of %d tiles of %s took %g s serially, %g s in parallel, max error = %g px",
+                         len(tiles), tiles[0].shape, durs[0], durs[1], diff.max())
+            numpy.testing.assert_array_almost_equal(all_pos[0], all_pos[1])
+            self.assertLessEqual(diff.max(), 5)
+
     def test_shift_real_manual(self):
         """ Test case not generated by decompose.py file and manually cropped """
 
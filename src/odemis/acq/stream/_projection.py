@@ -41,6 +41,7 @@ except ImportError:
 from odemis import model
 from odemis.util import img, angleres
 from scipy import ndimage
+from scipy.sparse import csr_matrix
 from odemis.model import MD_PIXEL_SIZE, MD_POL_EPHI, MD_POL_EX, MD_POL_EY, MD_POL_EZ, MD_POL_ETHETA, MD_POL_DS0, \
     MD_POL_S0, MD_POL_DOP, MD_POL_DOLP, MD_POL_UP
 from odemis.acq.stream._static import StaticSpectrumStream
@@ -345,6 +346,38 @@ class ARProjection(RGBProjection):
 
         return image_resized
 
+    def _convertAll(self, images, output_size, polar):
+        """
+        Convert several angle resolved images to polar or rectangular projection.
+        When the images all have the same geometry (typically, the images of
+        the different polarizations at one ebeam position), they are converted
+        in one batch, which shares the interpolation plan and runs in parallel.
+        :param images: (list of 2D DataArrays) Background corrected images.
+        :param output_size: (int or (int, int)) Size of each output image, as
+          accepted by AngleResolved2Polar() or AngleResolved2Rectangular().
+        :param polar: (bool) If True, converts to polar projection, otherwise
+          to rectangular (phi/theta) projection.
+        :returns: (list of 2D DataArrays) The projections, in the same order as images.
+        """
+        if polar:
+            convert, convert_batch = angleres.AngleResolved2Polar, angleres.AngleResolved2PolarBatch
+        else:
+            convert, convert_batch = angleres.AngleResolved2Rectangular, angleres.AngleResolved2RectangularBatch
+
+        if len(images) > 1:
+            try:
+                # There are only a few images (eg, 6 polarizations), so convert
+                # each of them in a separate worker.
+                f = convert_batch(images, output_size, hole=False, chunk_size=1)
+            except ValueError:
+                # Different shapes or metadata => convert them one at a time
+                logging.debug("Cannot convert the AR images in one batch, will convert them one by one")
+            else:
+                out = f.result()
+                return [model.DataArray(o, im.metadata.copy()) for o, im in zip(out, images)]
+
+        return [convert(im, output_size, hole=False) for im in images]
+
 
 class ARRawProjection(ARProjection):
     """
@@ -378,44 +411,62 @@ class ARRawProjection(ARProjection):
         :param pol_pos: (str or None) Polarization position (must be part of the .stream._pos).
         :returns: (2D DataArray) The polar projection.
         """
+        return self._project2PolarAll(ebeam_pos, [pol_pos])[pol_pos]
+
+    def _project2PolarAll(self, ebeam_pos, pol_positions):
+        """
+        Return the polar projections of the images at the given ebeam position, for
+        several polarization positions. The images not yet in the cache are converted
+        together, in one batch.
+        :param ebeam_pos: (float, float), string or None) Ebeam position (must be part of the .stream._pos).
+        :param pol_positions: (list of str or None) Polarization positions (must be part of the .stream._pos).
+        :returns: (dict str or None -> 2D DataArray) Polarization position -> polar projection.
+        """
         # Note: Need a copy of the link to the dict. If self._polar_cache is reset while
         # still running this method, the dict might get new entries again, though it should be empty.
         polar_cache = self._polar_cache
+        ebeam_cache = polar_cache.setdefault(ebeam_pos, {})
 
-        try:
-            polar_data = polar_cache.setdefault(ebeam_pos, {})[pol_pos]
-        except KeyError:
+        missing = [p for p in pol_positions if p not in ebeam_cache]
+        if missing:
             # Compute the polar representation
-            data = self.stream._pos[ebeam_pos + (pol_pos,)]
             # TODO: stream._pos can be then also be structured ebeam_pos/pol_pos.
             #   That would also simplify the check for the correct bg image etc.
-
+            raw = {p: self.stream._pos[ebeam_pos + (p,)] for p in missing}
             try:
-                # Correct image for background. It must match the polarization (defaulting to MD_POL_NONE).
-                calibrated = self._processBackground(data, data.metadata.get(model.MD_POL_MODE, model.MD_POL_NONE))
+                # Group the images by output size, as only images of the same size can be converted together
+                to_convert = {}  # int -> list of (pol_pos, DataArray)
+                for pol_pos, data in raw.items():
+                    # Correct image for background. It must match the polarization (defaulting to MD_POL_NONE).
+                    calibrated = self._processBackground(data, data.metadata.get(model.MD_POL_MODE, model.MD_POL_NONE))
 
-                # resize if too large to not run into memory problems
-                if numpy.prod(calibrated.shape) > (1280 * 1080):
-                    calibrated = self._resizeImage(calibrated, size=1024)
+                    # resize if too large to not run into memory problems
+                    if numpy.prod(calibrated.shape) > (1280 * 1080):
+                        calibrated = self._resizeImage(calibrated, size=1024)
 
-                # define the size of the image for polar representation in GUI
-                # 2 x size of original/raw image (on smallest axis) and at most
-                # the size of a full-screen canvas (1134)
-                output_size = min(min(calibrated.shape) * 2, 1134)
+                    # define the size of the image for polar representation in GUI
+                    # 2 x size of original/raw image (on smallest axis) and at most
+                    # the size of a full-screen canvas (1134)
+                    output_size = min(min(calibrated.shape) * 2, 1134)
+                    to_convert.setdefault(output_size, []).append((pol_pos, calibrated))
 
                 # TODO: could use the size of the canvas that will display the image to save some computation time.
 
-                # Warning: allocates lot of memory, which will not be free'd until
-                # the current thread is terminated.
-                polar_data = angleres.AngleResolved2Polar(calibrated, output_size, hole=False)
+                for output_size, pol_calibrated in to_convert.items():
+                    # Warning: allocates lot of memory, which will not be free'd until
+                    # the current thread is terminated.
+                    pols, calibrated = zip(*pol_calibrated)
+                    polar_data = self._convertAll(list(calibrated), output_size, polar=True)
 
-                # TODO: don't hold too many of them in cache (eg, max 3 * 1134**2)
-                polar_cache[ebeam_pos][pol_pos] = polar_data
+                    # TODO: don't hold too many of them in cache (eg, max 3 * 1134**2)
+                    for pol_pos, pd in zip(pols, polar_data):
+                        ebeam_cache[pol_pos] = pd
             except Exception:
                 logging.exception("Failed to convert to azimuthal projection")
-                return data  # display its raw as fallback
+                # display the raw images as fallback
+                return {p: ebeam_cache.get(p, raw.get(p)) for p in pol_positions}
 
-        return polar_data
+        return {p: ebeam_cache[p] for p in pol_positions}
 
     def _updateImage(self):
         """
@@ -490,6 +541,7 @@ class ARRawProjection(ARProjection):
         else:
             pol_positions = [None]
 
+        all_calibrated = []
         for pol_pos in pol_positions:
             data = pos[ebeam_pos + (pol_pos,)]
 
@@ -500,12 +552,12 @@ class ARRawProjection(ARProjection):
             # resize if too large to not run into memory problems
             if numpy.prod(calibrated.shape) > (800 * 800):
                 calibrated = self._resizeImage(calibrated, size=768)
+            all_calibrated.append(calibrated)
 
-            output_size = (90, 360)  # Note: increase if data is high def
-
-            # calculate raw theta/phi representation
-            data = angleres.AngleResolved2Rectangular(calibrated, output_size, hole=False)
+        output_size = (90, 360)  # Note: increase if data is high def
 
+        # calculate raw theta/phi representation, of all the polarizations at once
+        for pol_pos, data in zip(pol_positions, self._convertAll(all_calibrated, output_size, polar=False)):
             data.metadata[model.MD_ACQ_TYPE] = model.MD_AT_AR
             data_dict[pol_pos] = data
 
@@ -526,8 +578,9 @@ class ARRawProjection(ARProjection):
         data_dict = {}
 
         if hasattr(self, "polarization"):
-            for pol_pos in self.polarization.choices:
-                data = self._project2Polar(ebeam_pos, pol_pos)
+            # Convert all the polarizations at once
+            polar_data = self._project2PolarAll(ebeam_pos, list(self.polarization.choices))
+            for pol_pos, data in polar_data.items():
                 data = self._project2RGB(data, self.stream.tint.value)
                 data_dict[pol_pos] = data
         else:  # standard single AR image
@@ -620,6 +673,8 @@ class ARPolarimetryProjection(ARProjection):
                 # The number of pixels (theta, phi) of the output image.
                 output_size = (400, 600)  # defines the resolution of the displayed image
 
+                pols = []
+                all_calibrated = []
                 for pol, raw in data_raw.items():
 
                     # Correct image for background. It must match the polarization (defaulting to MD_POL_NONE).
@@ -628,9 +683,13 @@ class ARPolarimetryProjection(ARProjection):
                     # check if image is too large and we might run into memory trouble -> resize
                     if numpy.prod(calibrated.shape) > (1280 * 1080):
                         calibrated = self._resizeImage(calibrated, size=1024)
+                    pols.append(pol)
+                    all_calibrated.append(calibrated)
 
-                    # calculate the rectangular representation (phi/theta) of the background corrected raw images
-                    calibrated_raw[pol] = angleres.AngleResolved2Rectangular(calibrated, output_size, hole=False)
+                # calculate the rectangular representation (phi/theta) of the background corrected raw images,
+                # all 6 at once, as they share the same geometry
+                for pol, data in zip(pols, self._convertAll(all_calibrated, output_size, polar=False)):
+                    calibrated_raw[pol] = data
 
                 # Get the center wavelength of the filter used (no filter aka "pass-through" use fallback)
                 # Does not matter from which of the 6 images as they all were recorded with the same filter
@@ -988,6 +1047,28 @@ class RGBSpatialProjection(RGBProjection):
             int(round(rect[1] / (-ps[1]) + img_shape[1] / 2)) - 1,
         )
 
+    def _getTilesToPrefetch(self, rect, z):
+        """
+        Lists the tiles which will soon be needed: first the tiles in the rect,
+        in the order they are read, and then the ones just around it (in case
+        the user moves the view).
+        rect (int, int, int, int): x1, y1, x2, y2 indices of the tiles displayed
+        z (int): zoom level
+        return (list of (int, int)): X and Y indices of the tiles
+        """
+        das = self.stream.raw[0]
+        dims = das.metadata.get(model.MD_DIMS, "CTZYX"[-das.ndim::])
+        img_shape = (das.shape[dims.index('X')], das.shape[dims.index('Y')])
+        n_tiles = [int(math.ceil(s / (2 ** z) / ts)) for s, ts in zip(img_shape, das.tile_shape)]
+
+        x1, y1, x2, y2 = rect
+        tiles = [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+        for x in range(max(0, x1 - 1), min(x2 + 2, n_tiles[0])):
+            for y in range(max(0, y1 - 1), min(y2 + 2, n_tiles[1])):
+                if not (x1 <= x <= x2 and y1 <= y <= y2):
+                    tiles.append((x, y))
+        return tiles
+
     def _getTile(self, x, y, z, prev_raw_cache, prev_proj_cache):
         """
         Get a tile from a DataArrayShadow. Uses cache.
@@ -1062,6 +1143,17 @@ class RGBSpatialProjection(RGBProjection):
 
         return self._projectXY2RGB(tile, tint)
 
+    def projectTile(self, x, y, z):
+        """
+        Read and project one tile of the (pyramidal) raw data, independently of
+        .rect and .mpp, and without using the cache. Can be called from any thread.
+        x (int): X index of the tile
+        y (int): Y index of the tile
+        z (int): zoom level of the tile
+        return (DataArray): Projected tile, with MD_POS and MD_PIXEL_SIZE
+        """
+        return self._projectTile(self.stream.raw[0].getTile(x, y, z))
+
     def _getTilesFromSelectedArea(self):
         """
         Get the tiles inside the region defined by .rect and .mpp
@@ -1088,6 +1180,9 @@ class RGBSpatialProjection(RGBProjection):
             rect = [l / (2 ** z) for l in rect]
             rect = [int(math.floor(l / das.tile_shape[0])) for l in rect]
             x1, y1, x2, y2 = rect
+            if hasattr(das, "prefetch"):
+                # Let the tiles be fetched in parallel, while they are projected one at a time
+                das.prefetch(self._getTilesToPrefetch(rect, z), z)
             # the 4 lines below avoids that lots of old tiles
             # stays in instance caches
             prev_raw_cache.update(self._rawTilesCache)
@@ -1342,6 +1437,64 @@ class RGBSpatialSpectrumProjection(RGBSpatialProjection):
             logging.exception("Updating %s %s image", self.__class__.__name__, self.stream.name.value)
 
 
+def _computeSamplingPlan(shape, coords):
+    """
+    Compute a sparse matrix which samples 2D data by bilinear interpolation,
+    and averages several samples together. See _applySamplingPlan().
+    shape (int, int): Y, X shape of the data
+    coords (ndarray of shape N, S, 2): Y, X (float) coordinates of the S samples
+      to average for each of the N output values.
+    return:
+      pixels (ndarray of int of shape K): the (flattened) indices of the pixels used
+      weights (csr_matrix of shape (N, K)): weight of each of these pixels for
+        each output value. The samples outside of the data are not counted in
+        the mean. If all the samples of an output value are outside, it's 0.
+    """
+    n, s = coords.shape[:2]
+    shape = numpy.asarray(shape)
+    coords = coords.reshape(-1, 2)
+    inside = numpy.all((coords >= 0) & (coords <= shape - 1), axis=1)
+    rows = numpy.repeat(numpy.arange(n), s)[inside]
+    coords = coords[inside]
+
+    # Top-left pixel, kept one pixel away from the end, so that a sample exactly
+    # on the last pixel is also interpolated (with a weight of 0 for the next one).
+    c0 = numpy.minimum(numpy.floor(coords).astype(int), numpy.maximum(shape - 2, 0))
+    c1 = numpy.minimum(c0 + 1, shape - 1)
+    fy, fx = (coords - c0).T
+    # Mean over the samples inside
+    norm = 1 / numpy.bincount(rows, minlength=n)[rows]
+
+    cols = numpy.concatenate([c0[:, 0] * shape[1] + c0[:, 1],
+                              c0[:, 0] * shape[1] + c1[:, 1],
+                              c1[:, 0] * shape[1] + c0[:, 1],
+                              c1[:, 0] * shape[1] + c1[:, 1]])
+    weights = numpy.concatenate([(1 - fy) * (1 - fx) * norm,
+                                 (1 - fy) * fx * norm,
+                                 fy * (1 - fx) * norm,
+                                 fy * fx * norm])
+    # Only keep the pixels used, as typically they are a tiny part of the data
+    pixels, cols = numpy.unique(cols, return_inverse=True)
+    # Duplicate entries (ie, same pixel used several times) are summed
+    weights = csr_matrix((weights, (numpy.tile(rows, 4), cols.ravel())), shape=(n, len(pixels)))
+    return pixels, weights
+
+
+def _applySamplingPlan(plan, data):
+    """
+    Sample data, for all the leading dimensions at once.
+    plan (ndarray, csr_matrix): as returned by _computeSamplingPlan()
+    data (ndarray of shape ...YX): the data to sample
+    return (ndarray of shape N...): the sampled values (as float)
+    """
+    pixels, weights = plan
+    lead_shape = data.shape[:-2]
+    # Pick only the pixels needed: (..., K) -> (K, ...)
+    values = data.reshape(-1, data.shape[-2] * data.shape[-1])[:, pixels].T
+    sampled = weights.dot(numpy.ascontiguousarray(values))
+    return sampled.reshape((weights.shape[0],) + lead_shape)
+
+
 class LineSpectrumProjection(RGBProjection):
     """
     Project a spectrum from the selected_line of the stream.
@@ -1351,6 +1504,9 @@ class LineSpectrumProjection(RGBProjection):
 
         super(LineSpectrumProjection, self).__init__(stream)
 
+        # (key, csr_matrix): the last sampling plan computed, with the data
+        # shape, line and width it corresponds to.
+        self._plan = None
         if model.hasVA(self.stream, "selected_time"):
             self.stream.selected_time.subscribe(self._on_selected_time)
         self.stream.selectionWidth.subscribe(self._on_selected_width)
@@ -1403,40 +1559,21 @@ class LineSpectrumProjection(RGBProjection):
             return None
 
         # FIXME: if the data has a width of 1 (ie, just a line), and the
-        # requested width is an even number, the output is empty (because all
-        # the interpolated points are outside of the data.
-
-        # Coordinates of each point: ndim of data (5-2), pos on line (Y), spectrum (X)
-        # The line is scanned from the end till the start so that the spectra
-        # closest to the origin of the line are at the bottom.
-        coord = numpy.empty((3, width, n, spec2d.shape[0]))
-        coord[0] = numpy.arange(spec2d.shape[0])  # spectra = all
-        coord_spc = coord.swapaxes(2, 3)  # just a view to have (line) space as last dim
-        coord_spc[-1] = numpy.linspace(start[0], end[0], n)  # X axis
-        coord_spc[-2] = numpy.linspace(start[1], end[1], n)  # Y axis
-
-        # Spread over the width
-        # perpendicular unit vector
-        pv = (-v[1] / l, v[0] / l)
-        width_coord = numpy.empty((2, width))
-        spread = (width - 1) / 2
-        width_coord[-1] = numpy.linspace(pv[0] * -spread, pv[0] * spread, width)  # X axis
-        width_coord[-2] = numpy.linspace(pv[1] * -spread, pv[1] * spread, width)  # Y axis
-
-        coord_cw = coord[1:].swapaxes(0, 2).swapaxes(1, 3)  # view with coordinates and width as last dims
-        coord_cw += width_coord
-
-        # Interpolate the values based on the data
-        if width == 1:
-            # simple version for the most usual case
-            spec1d = ndimage.map_coordinates(spec2d, coord[:, 0, :, :], order=1)
-        else:
-            # FIXME: the mean should be dependent on how many pixels inside the
-            # original data were pick on each line. Currently if some pixels fall
-            # out of the original data, the outside pixels count as 0.
-            # force the intermediate values to float, as mean() still needs to run
-            spec1d_w = ndimage.map_coordinates(spec2d, coord, output=numpy.float, order=1)
-            spec1d = spec1d_w.mean(axis=0)
+        # requested width is an even number, the output is all 0 (because all
+        # the interpolated points are outside of the data).
+
+        # The sampling only depends on the line and width, so it's reused when
+        # just the time changes.
+        plan_key = (spec2d.shape[-2:], tuple(start), tuple(end), width)
+        if self._plan is None or self._plan[0] != plan_key:
+            self._plan = plan_key, self._computeLinePlan(spec2d.shape[-2:], start, end, n, width)
+        plan = self._plan[1]
+
+        # Interpolate all the wavelengths at once
+        spec1d = _applySamplingPlan(plan, spec2d)
+        if width == 1 and not numpy.issubdtype(spec2d.dtype, numpy.floating):
+            # Keep the original type, in the most usual case
+            spec1d = numpy.round(spec1d).astype(spec2d.dtype)
         assert spec1d.shape == (n, spec2d.shape[0])
 
         # Use metadata to indicate spatial distance between pixel
@@ -1454,6 +1591,33 @@ class LineSpectrumProjection(RGBProjection):
         md[MD_PIXEL_SIZE] = (None, pxs)  # for the spectrum, use get_spectrum_range()
         return model.DataArray(spec1d, md)
 
+    @staticmethod
+    def _computeLinePlan(shape, start, end, n, width):
+        """
+        Compute the sampling plan to get the points along a line.
+        shape (int, int): Y, X shape of the data
+        start (float, float): X, Y position of the beginning of the line
+        end (float, float): X, Y position of the end of the line
+        n (int): number of points along the line
+        width (int): number of points averaged perpendicularly to the line
+        return (ndarray, csr_matrix): see _computeSamplingPlan()
+        """
+        # Coordinates of each point: pos on line, width, Y/X
+        coord = numpy.empty((n, width, 2))
+        coord[:, :, 1] = numpy.linspace(start[0], end[0], n)[:, numpy.newaxis]  # X axis
+        coord[:, :, 0] = numpy.linspace(start[1], end[1], n)[:, numpy.newaxis]  # Y axis
+
+        # Spread over the width
+        # perpendicular unit vector
+        v = (end[0] - start[0], end[1] - start[1])
+        l = math.hypot(*v)
+        pv = (-v[1] / l, v[0] / l)
+        spread = (width - 1) / 2
+        coord[:, :, 1] += numpy.linspace(pv[0] * -spread, pv[0] * spread, width)  # X axis
+        coord[:, :, 0] += numpy.linspace(pv[1] * -spread, pv[1] * spread, width)  # Y axis
+
+        return _computeSamplingPlan(shape, coord)
+
     def projectAsRaw(self):
         try:
             return self._computeSpec()
@@ -1512,6 +1676,9 @@ class PixelTemporalSpectrumProjection(RGBProjection):
     def __init__(self, stream):
 
         super(PixelTemporalSpectrumProjection, self).__init__(stream)
+        # (key, csr_matrix): the last sampling plan computed, with the data
+        # shape, pixel and width it corresponds to.
+        self._plan = None
         self.stream.selectionWidth.subscribe(self._on_selection_width)
         self.stream.selected_pixel.subscribe(self._on_selected_pixel)
         self.stream.calibrated.subscribe(self._on_new_data)
@@ -1558,27 +1725,35 @@ class PixelTemporalSpectrumProjection(RGBProjection):
             data = numpy.swapaxes(data, 0, 1)
             return model.DataArray(data, md)
 
-        # There are various ways to do it with numpy. As typically the spectrum
-        # dimension is big, and the number of pixels to sum is small, it seems
-        # the easiest way is to just do some kind of "clever" mean. Using a
-        # masked array would also work, but that'd imply having a huge mask.
-        radius = width / 2
-        n = 0
-        # TODO: use same cleverness as mean() for dtype?
-        datasum = numpy.zeros((spec2d.shape[0], spec2d.shape[1]), dtype=numpy.float64)
-        # Scan the square around the point, and only pick the points in the circle
-        for px in range(max(0, int(x - radius)),
-                        min(int(x + radius) + 1, spec2d.shape[-1])):
-            for py in range(max(0, int(y - radius)),
-                            min(int(y + radius) + 1, spec2d.shape[-2])):
-                if math.hypot(x - px, y - py) <= radius:
-                    n += 1
-                    datasum += spec2d[:, :, py, px]
+        # The sampling only depends on the pixel and width, so it's reused
+        plan_key = (spec2d.shape[-2:], (x, y), width)
+        if self._plan is None or self._plan[0] != plan_key:
+            self._plan = plan_key, self._computeDiscPlan(spec2d.shape[-2:], x, y, width)
+        plan = self._plan[1]
 
-        mean = datasum / n
+        # Average all the wavelengths and times at once
+        mean = _applySamplingPlan(plan, spec2d)[0]
         mean = numpy.swapaxes(mean, 0, 1)
         return model.DataArray(mean.astype(spec2d.dtype), md)
 
+    @staticmethod
+    def _computeDiscPlan(shape, x, y, width):
+        """
+        Compute the sampling plan to average the pixels around a given pixel.
+        shape (int, int): Y, X shape of the data
+        x, y (int, int): position of the center pixel
+        width (int): diameter of the circle which contains the center of the
+          pixels to be taken into account
+        return (ndarray, csr_matrix): see _computeSamplingPlan()
+        """
+        radius = width / 2
+        # Scan the square around the point, and only pick the points in the circle
+        pys, pxs = numpy.mgrid[max(0, int(y - radius)):min(int(y + radius) + 1, shape[0]),
+                               max(0, int(x - radius)):min(int(x + radius) + 1, shape[1])]
+        incircle = numpy.hypot(x - pxs, y - pys) <= radius
+        coords = numpy.column_stack((pys[incircle], pxs[incircle]))
+        return _computeSamplingPlan(shape, coords[numpy.newaxis].astype(numpy.float64))
+
     def projectAsRaw(self):
         """
         Returns the raw for the current selected_pixel (with the calibration).
@@ -2735,6 +2735,7 @@ class ScannedRemoteTCStream(LiveStream):
         self._acq_thread = None  # thread
         self._prog_sum = 0  # s, for progress time estimation
         self._data_queue = queue.Queue()
+        self._img_intor = None  # ImageIntegrator to accumulate the frames
         self._current_future = None
 
     @property
@@ -2831,6 +2832,8 @@ class ScannedRemoteTCStream(LiveStream):
 
             px_dt, nfr = self._prepareHardware()
             frame_time = px_dt * numpy.prod(self._scanner.resolution.value)
+            # The frames are counts, so they are always summed
+            self._img_intor = img.ImageIntegrator(nfr, det_type=model.MD_DT_INTEGRATING)
             logging.info("Theoretical minimum frame time: %f s", frame_time)
 
             # Start Symphotime acquisition
@@ -2907,16 +2910,14 @@ class ScannedRemoteTCStream(LiveStream):
         """
         logging.debug("Adding frame of shape %s and type %s", data.shape, data.dtype)
         if not self.raw:
-            # TODO: be more careful with the dtype
-            data = data.astype(numpy.uint32)
-            self.raw = [data]
+            # The integrator takes care of the dtype, and accumulates in place
+            self.raw = [self._img_intor.append(data)]
 
             # Force update histogram to ensure it exists.
-            self._updateHistogram(data)
+            self._updateHistogram(self.raw[0])
         else:
             if self.raw[0].shape == data.shape:
-                self.raw[0] += data  # Uses numpy element-wise addition
-                self.raw[0].metadata[MD_DWELL_TIME] += data.metadata[MD_DWELL_TIME]
+                self.raw = [self._img_intor.append(data)]
             else:
                 logging.error("New data array from tc-detector has different shape %s from previous one, "
                               "can't accumulate data", data.shape)
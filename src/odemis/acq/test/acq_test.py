@@ -27,7 +27,7 @@ import numpy
 from odemis import model
 import odemis
 from odemis.acq import acqmng
-from odemis.util import test
+from odemis.util import test, executeAsyncTask
 import os
 import time
 import unittest
@@ -65,11 +65,153 @@ class Fake0DDataFlow(model.DataFlow):
         return da
 
 
+class FakeEmitter(model.Emitter):
+    def __init__(self, name, affects=None):
+        model.Emitter.__init__(self, name, "fakeemt", parent=None)
+        self._shape = ()
+        self.affects.value = affects or []
+
+
+class FakeAcqStream(object):
+    """
+    Mock of a stream, which just waits during the acquisition
+    """
+    def __init__(self, name, detector, emitter, duration):
+        self.name = model.StringVA(name)
+        self.detector = detector
+        self.emitter = emitter
+        self.raw = []
+        self._duration = duration
+        self.prepared = None  # time of the last preparation
+        self.acq_period = None  # (start, end) time of the acquisition
+
+    def estimateAcquisitionTime(self):
+        return self._duration
+
+    def prepare(self):
+        self.prepared = time.time()
+        return model.InstantaneousFuture()
+
+    def acquire(self):
+        f = model.ProgressiveFuture(end=time.time() + self._duration)
+        f.task_canceller = lambda f: True
+        executeAsyncTask(f, self._runAcquisition)
+        return f
+
+    def _runAcquisition(self):
+        start = time.time()
+        time.sleep(self._duration)
+        self.acq_period = (start, time.time())
+        self.raw = [model.DataArray(numpy.zeros((2, 3)), {model.MD_ACQ_DATE: start})]
+        return self.raw
+
+
+class FakeBlankerStream(FakeAcqStream):
+    """
+    Mock of a SEM stream, which unblanks the e-beam when preparing
+    """
+    def __init__(self, name, detector, emitter, duration, blanker):
+        FakeAcqStream.__init__(self, name, detector, emitter, duration)
+        self._blanker = blanker
+
+    def prepare(self):
+        self._blanker.value = False
+        return FakeAcqStream.prepare(self)
+
+    def acquire(self):
+        self._blanker.value = False
+        f = FakeAcqStream.acquire(self)
+        f.add_done_callback(lambda f: setattr(self._blanker, "value", True))
+        return f
+
+
 class TestNoBackend(unittest.TestCase):
     # No backend, and only fake streams that don't generate anything
 
-    # TODO
-    pass
+    def test_simultaneous(self):
+        """
+        Streams using independent hardware are acquired simultaneously, while
+        streams sharing hardware are acquired one after the other.
+        """
+        det1 = Fake0DDetector("det1")
+        det2 = Fake0DDetector("det2")
+        emt1 = FakeEmitter("emt1", ["det1"])
+        emt2 = FakeEmitter("emt2", ["det2"])
+        s1 = FakeAcqStream("s1", det1, emt1, 0.5)
+        s2 = FakeAcqStream("s2", det2, emt2, 0.5)
+        s3 = FakeAcqStream("s3", det1, emt1, 0.5)
+
+        f = acqmng.acquire([s1, s2, s3])
+        data, exp = f.result()
+        self.assertIsNone(exp)
+        self.assertEqual(len(data), 3)
+
+        # s1 and s2 overlap, s3 is after s1
+        self.assertLess(s2.acq_period[0], s1.acq_period[1])
+        self.assertGreaterEqual(s3.acq_period[0], s1.acq_period[1])
+
+        # All the phases are recorded
+        acq_timings = [t for t in f.timings if t[1] == "acquire"]
+        self.assertEqual({t[0] for t in acq_timings}, {"s1", "s2", "s3"})
+
+    def test_shared_emitter(self):
+        """
+        An emitter affecting the detector of the other stream prevents simultaneous acquisition
+        """
+        det1 = Fake0DDetector("det1")
+        det2 = Fake0DDetector("det2")
+        emt1 = FakeEmitter("emt1", ["det1", "det2"])
+        emt2 = FakeEmitter("emt2", ["det2"])
+        s1 = FakeAcqStream("s1", det1, emt1, 0.3)
+        s2 = FakeAcqStream("s2", det2, emt2, 0.3)
+
+        f = acqmng.acquire([s1, s2])
+        data, exp = f.result()
+        self.assertIsNone(exp)
+        self.assertEqual(len(data), 2)
+        self.assertGreaterEqual(s2.acq_period[0], s1.acq_period[1])
+
+    def test_blanker_after_fluo(self):
+        """
+        A SEM stream after a fluorescence stream is not prepared (ie, the
+        e-beam unblanked) while the camera is acquiring
+        """
+        ccd = Fake0DDetector("ccd")
+        sed = Fake0DDetector("sed")
+        light = FakeEmitter("light", ["ccd"])
+        ebeam = FakeEmitter("ebeam", ["sed", "ccd"])
+        blanker = model.BooleanVA(True)
+        unblanked = []  # time when the e-beam was unblanked
+
+        def on_blanker(blanked):
+            if not blanked:
+                unblanked.append(time.time())
+
+        blanker.subscribe(on_blanker)
+        fluos = FakeAcqStream("fluo", ccd, light, 0.5)
+        sems = FakeBlankerStream("sem", sed, ebeam, 0.3, blanker)
+
+        f = acqmng.acquire([fluos, sems])
+        data, exp = f.result()
+        self.assertIsNone(exp)
+        self.assertEqual(len(data), 2)
+        self.assertTrue(unblanked)
+        self.assertGreaterEqual(min(unblanked), fluos.acq_period[1])
+        self.assertGreaterEqual(sems.acq_period[0], fluos.acq_period[1])
+
+    def test_cancel(self):
+        det1 = Fake0DDetector("det1")
+        det2 = Fake0DDetector("det2")
+        emt1 = FakeEmitter("emt1", ["det1"])
+        s1 = FakeAcqStream("s1", det1, emt1, 1)
+        s2 = FakeAcqStream("s2", det2, emt1, 1)
+
+        f = acqmng.acquire([s1, s2])
+        time.sleep(0.2)
+        f.cancel()
+        self.assertTrue(f.cancelled())
+        with self.assertRaises(CancelledError):
+            f.result()
 
 # @skip("simple")
 class SECOMTestCase(unittest.TestCase):
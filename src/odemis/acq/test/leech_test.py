@@ -17,8 +17,9 @@ You should have received a copy of the GNU General Public License along with Ode
 from __future__ import division
 
 import logging
+import math
 import numpy
-from odemis import model
+from odemis import model, util
 from odemis.acq import stream
 from odemis.acq.leech import ProbeCurrentAcquirer, AnchorDriftCorrector
 from odemis.driver import simsem
@@ -125,6 +126,107 @@ class ADCTestCase(unittest.TestCase):
         dc.series_complete([None])
 
 
+CONFIG_SEM_NO_DRIFT = {"name": "sem", "role": "sem", "image": "simsem-fake-output.h5",
+                       "children": {"detector0": CONFIG_SED, "scanner": CONFIG_SCANNER}
+                       }
+
+
+class ADCPredictionTestCase(unittest.TestCase):
+    """
+    Tests the drift prediction of the AnchorDriftCorrector, with a synthetic drift
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # No automatic drift, it's simulated by the test
+        cls.sem = simsem.SimSEM(**CONFIG_SEM_NO_DRIFT)
+
+        for child in cls.sem.children.value:
+            if child.name == CONFIG_SED["name"]:
+                cls.sed = child
+            elif child.name == CONFIG_SCANNER["name"]:
+                cls.scanner = child
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sem.terminate()
+
+    def _run_acquisition(self, drift_f, max_err, dur=3):
+        """
+        Simulates an acquisition with drift correction, while the sample drifts
+        drift_f (callable float -> float): drift (in px) as a function of the time
+          since the beginning (in s)
+        max_err (float): maxPredictionError
+        dur (float): duration of the (simulated) acquisition, without the anchor
+          acquisitions
+        return (int, float): number of anchor acquisitions, average error of
+          the drift correction (in px)
+        """
+        dc = AnchorDriftCorrector(self.scanner, self.sed)
+        dc.roi.value = (0.4, 0.4, 0.5, 0.5)
+        dc.dwellTime.value = dc.dwellTime.range[0]
+        dc.period.value = 0.1
+        dc.maxPredictionError.value = max_err
+
+        t_start = time.time()
+
+        def update_drift():
+            self.sed.current_drift = drift_f(time.time() - t_start)
+
+        update_drift()
+        drift_timer = util.RepeatingTimer(0.005, update_drift, "Drift simulation")
+        drift_timer.start()
+        try:
+            acq_t = 0.01
+            shape = (int(dur / acq_t) // 20, 20)
+            tot_num = numpy.prod(shape)
+            dc.series_start()
+            drift_orig = self.sed.current_drift
+            n_anchor = 1
+            np = dc.start(acq_t, shape)
+            n_anchor += 1
+            n = 0
+            errors = []
+            while True:
+                # Correction which would be applied to the next pixels. The
+                # simulator moves the image by -drift on X and +drift on Y.
+                drift = drift_f(time.time() - t_start) - drift_orig
+                tot_drift = dc.tot_drift
+                errors.append(math.hypot(tot_drift[0] + drift, tot_drift[1] - drift))
+                time.sleep(np * acq_t)
+                n += np
+                if n >= tot_num:
+                    break
+                np = dc.next([None])
+                n_anchor += 1
+
+            dc.complete([None])
+            dc.series_complete([None])
+        finally:
+            drift_timer.cancel()
+            self.sed.current_drift = 0
+
+        # Skip the first blocks, as no estimation was available yet
+        avg_err = numpy.mean(errors[2:])
+        logging.info("Acquisition with max prediction error %g px: %d anchor scans, "
+                     "average error %g px", max_err, n_anchor, avg_err)
+        return n_anchor, avg_err
+
+    def _test_drift(self, drift_f):
+        n_fixed, err_fixed = self._run_acquisition(drift_f, 0)
+        n_pred, err_pred = self._run_acquisition(drift_f, 1)
+        # The drift is predictable => less anchor acquisitions, and the error
+        # shouldn't increase (significantly)
+        self.assertLess(n_pred, n_fixed)
+        self.assertLess(err_pred, max(err_fixed, 2))
+
+    def test_linear_drift(self):
+        self._test_drift(lambda t: 10 * t)  # 10 px/s
+
+    def test_accelerating_drift(self):
+        self._test_drift(lambda t: 4 * t ** 2)
+
+
 # @skip("simple")
 class PCAcquirerTestCase(unittest.TestCase):
 
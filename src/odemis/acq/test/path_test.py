@@ -59,6 +59,78 @@ SPARC2_POLARIZATIONANALYZER_CONFIG = CONFIG_PATH + "sim/sparc2-polarizer-sim.odm
 SPARC2_4SPEC_CONFIG = CONFIG_PATH + "sim/sparc2-4spec-sim.odm.yaml"
 
 
+class AffectsGraphTestCase(unittest.TestCase):
+    """
+    Tests of the graph helpers, which don't need a backend
+    """
+
+    def test_closure(self):
+        graph = {"a": {"b"},
+                 "b": {"c", "d"},
+                 "c": set(),
+                 "d": {"b"},  # loop
+                 "e": set()}
+        closure = path.affectsClosure(graph)
+        self.assertEqual(closure["a"], {"a", "b", "c", "d"})
+        self.assertEqual(closure["b"], {"b", "c", "d"})
+        self.assertEqual(closure["d"], {"b", "c", "d"})
+        self.assertEqual(closure["c"], {"c"})
+        self.assertEqual(closure["e"], {"e"})
+
+    def test_same_position(self):
+        self.assertTrue(path._isSamePosition(0.1, 0.1))
+        self.assertTrue(path._isSamePosition(1.5707963267948966, 1.5707963267948968))
+        self.assertFalse(path._isSamePosition(0, 1e-6))
+        self.assertTrue(path._isSamePosition(2, 2))
+        self.assertTrue(path._isSamePosition("on", "on"))
+        self.assertFalse(path._isSamePosition("on", "off"))
+        self.assertFalse(path._isSamePosition(None, 0))
+
+
+class FakeActuator(object):
+    """
+    Just the attributes of an actuator needed by _filterNoOpMoves()
+    """
+    def __init__(self, name, pos):
+        self.name = name
+        self.position = model.VigilantAttribute(pos, readonly=True)
+
+
+class FilterMovesTestCase(unittest.TestCase):
+    """
+    Tests of the filtering of the moves not needed, which doesn't need a backend
+    """
+
+    def setUp(self):
+        # _filterNoOpMoves() doesn't use the state of the manager
+        self.optmngr = path.OpticalPathManager.__new__(path.OpticalPathManager)
+        self.optmngr._chamber_view_own_focus = False  # for __del__()
+
+    def test_filter_current(self):
+        comp = FakeActuator("slit", {"x": 0.1, "band": 1})
+        requested = {}
+        mv = self.optmngr._filterNoOpMoves(comp, {"x": 0.1, "band": 2}, requested)
+        self.assertEqual(mv, {"band": 2})
+        self.assertEqual(requested, {"slit": {"band": 2}})
+
+    def test_filter_pending(self):
+        """
+        A move back to the current position, after a move of the same axis
+        earlier in the same path change, should not be skipped
+        """
+        comp = FakeActuator("slit", {"x": 0.1, "band": 1})
+        requested = {}
+        mv = self.optmngr._filterNoOpMoves(comp, {"band": 2}, requested)
+        self.assertEqual(mv, {"band": 2})
+        # The position is not updated yet, as the move is still pending
+        mv = self.optmngr._filterNoOpMoves(comp, {"x": 0.1, "band": 1}, requested)
+        self.assertEqual(mv, {"band": 1})
+        # Same position as the last move requested => not needed
+        mv = self.optmngr._filterNoOpMoves(comp, {"band": 1}, requested)
+        self.assertEqual(mv, {})
+        self.assertEqual(requested, {"slit": {"band": 1}})
+
+
 # @skip("faster")
 class SimPathTestCase(unittest.TestCase):
     """
@@ -495,6 +567,32 @@ class Sparc2PathTestCase(unittest.TestCase):
 
         self.assertLess(dur, 20, "Changing to CLI then AR mode took %s s > 20 s" % (dur,))
 
+    def test_set_path_no_move(self):
+        """
+        Test setting the same mode twice doesn't move anything the second time
+        """
+        self.optmngr.setPath("spectral").result()
+        self.optmngr.setPath("cli").result()
+        self.assert_pos_as_in_mode(self.lenswitch, "cli")
+
+        # Detect any move
+        moves = []
+        def on_move(pos):
+            moves.append(pos)
+        self.lenswitch.position.subscribe(on_move)
+        self.specgraph.position.subscribe(on_move)
+        try:
+            tstart = time.time()
+            self.optmngr.setPath("cli").result()
+            dur = time.time() - tstart
+        finally:
+            self.lenswitch.position.unsubscribe(on_move)
+            self.specgraph.position.unsubscribe(on_move)
+
+        self.assertEqual(moves, [])
+        self.assertLess(dur, 1, "Setting the same mode took %s s" % (dur,))
+        self.assert_pos_as_in_mode(self.lenswitch, "cli")
+
     # @skip("simple")
     def test_set_path(self):
         """
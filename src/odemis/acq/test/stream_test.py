@@ -38,10 +38,11 @@ from odemis.dataio import tiff, hdf5
 from odemis.driver import simcam
 from odemis.model import MD_POL_NONE, MD_POL_HORIZONTAL, MD_POL_VERTICAL, \
     MD_POL_POSDIAG, MD_POL_NEGDIAG, MD_POL_RHC, MD_POL_LHC, DataArrayShadow, TINT_FIT_TO_RGB
-from odemis.util import test, conversion, img, spectrum, find_closest
+from odemis.util import test, conversion, img, spectrum, find_closest, angleres
 from odemis.util.test import assert_array_not_equal
 import os
 from past.builtins import long
+from scipy import ndimage
 import threading
 import time
 import unittest
@@ -4242,6 +4243,34 @@ class StaticStreamsTestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             ars.background.value = bg_data[0]
 
+    def test_arpol_allpol_export(self):
+        """Test the projections of all the polarization modes, as used for the export."""
+        pol_positions = [model.MD_POL_NONE] + list(POL_POSITIONS)
+        data = [self._create_ar_data((256, 512), tweak=i, pol=pol) for i, pol in enumerate(pol_positions)]
+
+        ars = stream.StaticARStream("AR polarizer static stream", data)
+        ars_raw_pj = stream.ARRawProjection(ars)
+        ars.point.value = next(p for p in ars.point.choices if p != (None, None))
+
+        # All the polarizations are converted in one batch, but must give the
+        # same result as converting them one at a time
+        raw = ars_raw_pj.projectAsRaw()
+        self.assertEqual(set(raw.keys()), set(pol_positions))
+        for d, pol in zip(data, pol_positions):
+            im = raw[pol]
+            self.assertEqual(im.shape, (90, 360))
+            self.assertEqual(im.metadata[model.MD_ACQ_TYPE], model.MD_AT_AR)
+            self.assertEqual(im.metadata[model.MD_POL_MODE], pol)
+            calibrated = ars_raw_pj._processBackground(img.ensure2DImage(d), pol, clip_data=False)
+            exp = angleres.AngleResolved2Rectangular(calibrated, (90, 360), hole=False)
+            numpy.testing.assert_allclose(im, exp)
+
+        vis = ars_raw_pj.projectAsVis()
+        self.assertEqual(set(vis.keys()), set(pol_positions))
+        for pol in pol_positions:
+            self.assertEqual(vis[pol].shape[2], 3)  # RGB DataArray
+            self.assertIn(pol, ars_raw_pj._polar_cache[ars.point.value])
+
     def test_arpol_1pol(self):
         """Test StaticARStream with ARRawProjection and one possible polarization mode."""
         # ARPOL data
@@ -4575,6 +4604,30 @@ class StaticStreamsTestCase(unittest.TestCase):
         sp1d_raw = proj_line_spectrum.projectAsRaw()
         self.assertIsInstance(sp1d_raw.dtype.type(), numpy.floating)
 
+    def test_spectrum_1d_sampling(self):
+        """Test LineSpectrumProjection interpolation, including on the border"""
+        spec = self._create_spectrum_data()
+        specs = stream.StaticSpectrumStream("test", spec)
+        proj_line_spectrum = LineSpectrumProjection(specs)
+
+        # Compare to the bilinear interpolation of scipy, along a diagonal
+        specs.selected_line.value = [(30, 65), (1, 2)]
+        sp1d = proj_line_spectrum.projectAsRaw()
+        n = sp1d.shape[0]
+        coord = [numpy.linspace(65, 2, n), numpy.linspace(30, 1, n)]
+        for c in (2, 200):
+            sp1d_ex = ndimage.map_coordinates(spec[c, 0, 0].astype(numpy.float64), coord, order=1)
+            numpy.testing.assert_allclose(sp1d[:, c], numpy.round(sp1d_ex))
+
+        # Vertical line on the left border: only the pixels inside the data are averaged
+        specs.selected_line.value = [(0, 10), (0, 50)]
+        specs.selectionWidth.value = 3
+        sp1d = proj_line_spectrum.projectAsRaw()
+        self.assertEqual(sp1d.shape, (41, spec.shape[0]))
+        # Wavelength #2 has the X position as value => mean of X=0 and X=1
+        numpy.testing.assert_allclose(sp1d[:, 2], 0.5)
+        numpy.testing.assert_allclose(sp1d[:, 0], 1)
+
     def test_spectrum_calib_bg(self):
         """Test Static Spectrum Stream calibration and background image correction
         with spectrum data."""
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 19 Oct 2026
+
+Copyright © 2026 Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Performance regression suite. The benchmarks (in suite.py) measure the
+# speed of the main code paths, if needed by running the backend with one of
+# the simulator microscope files. The results are stored in a JSON file, which
+# can be compared to a previous result file (the "baseline").
+
+from __future__ import division
+
+import collections
+import json
+import logging
+import odemis
+import platform
+import time
+
+
+# Default relative change allowed compared to the baseline before a measure is
+# considered a regression.
+TOLERANCE = 0.2  # ratio
+
+# name (str): unique identifier of the measure (eg, "live.ccd.fps")
+# value (float): the result of the measure
+# unit (str): unit of the value (eg, "fps", "s", "MB/s")
+# higher_is_better (bool): True if a bigger value means a faster code
+Measure = collections.namedtuple("Measure", ["name", "value", "unit", "higher_is_better"])
+
+# name (str): name of the benchmark
+# config (str or None): name of the simulator microscope file needed (in the
+#   sim/ directory), or None if the benchmark doesn't need a backend
+# function (callable): function running the benchmark. It takes no argument,
+#   and returns a list of Measure.
+Benchmark = collections.namedtuple("Benchmark", ["name", "config", "function"])
+
+# All the known benchmarks, in the order they were registered
+BENCHMARKS = []
+
+
+def benchmark(config=None):
+    """
+    Decorator to register a function as a benchmark
+    config (str or None): name of the simulator microscope file to run, or None
+      if no backend is needed.
+    """
+    def register(f):
+        BENCHMARKS.append(Benchmark(f.__name__, config, f))
+        return f
+    return register
+
+
+def run_benchmarks(benchmarks, start_backend, stop_backend, failed=None):
+    """
+    Run the given benchmarks, starting the backend needed for each of them.
+    The benchmarks using the same microscope file are run during the same
+    backend session.
+    benchmarks (list of Benchmark): the benchmarks to run
+    start_backend (callable str -> list of Measure): starts the backend with
+      the given config name, and returns measures about the start.
+    stop_backend (callable): stops the backend.
+    failed (None or list): if a list, the name of each benchmark which failed
+      (or couldn't run as its backend failed to start) is appended to it.
+    return (list of Measure): all the measures, in the order they were done.
+      A benchmark which failed doesn't have any measure.
+    """
+    if failed is None:
+        failed = []
+
+    # Group the benchmarks per config, while keeping the order
+    configs = collections.OrderedDict()
+    for b in benchmarks:
+        configs.setdefault(b.config, []).append(b)
+
+    measures = []
+    for conf, cbenchmarks in configs.items():
+        if conf is not None:
+            try:
+                measures.extend(start_backend(conf))
+            except Exception:
+                logging.exception("Failed to start backend with %s, skipping %d benchmarks",
+                                  conf, len(cbenchmarks))
+                failed.extend(b.name for b in cbenchmarks)
+                continue
+
+        try:
+            for b in cbenchmarks:
+                logging.info("Running benchmark %s", b.name)
+                try:
+                    bmeasures = b.function()
+                except Exception:
+                    logging.exception("Benchmark %s failed", b.name)
+                    failed.append(b.name)
+                    continue
+                for m in bmeasures:
+                    logging.info("%s: %g %s", m.name, m.value, m.unit)
+                measures.extend(bmeasures)
+        finally:
+            if conf is not None:
+                try:
+                    stop_backend()
+                except Exception:
+                    logging.exception("Failed to stop backend")
+
+    return measures
+
+
+def save_results(filename, measures):
+    """
+    Write the measures in a (JSON) result file
+    filename (str): path to the file to write
+    measures (list of Measure)
+    """
+    results = {
+        "version": odemis.__version__,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "measures": collections.OrderedDict(
+            (m.name, {"value": m.value, "unit": m.unit, "higher_is_better": m.higher_is_better})
+            for m in measures),
+    }
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(filename):
+    """
+    Read a result file, as written by save_results()
+    filename (str): path to the file to read
+    return (list of Measure)
+    raises:
+        IOError: if the file cannot be read
+        ValueError: if the file is not a result file
+    """
+    with open(filename, "r") as f:
+        results = json.load(f, object_pairs_hook=collections.OrderedDict)
+
+    try:
+        return [Measure(n, float(m["value"]), m["unit"], bool(m["higher_is_better"]))
+                for n, m in results["measures"].items()]
+    except (KeyError, TypeError, AttributeError) as ex:
+        raise ValueError("File %s is not a benchmark result file: %s" % (filename, ex))
+
+
+# name (str): name of the measure
+# value (float or None): the new value, or None if missing from the new measures
+# baseline (float or None): the value in the baseline, or None if not present
+# change (float or None): relative change, positive if it's an improvement
+# regression (bool): True if the change is worse than the tolerance, or the
+#   measure is missing from the new measures
+Comparison = collections.namedtuple("Comparison", ["name", "value", "baseline", "change", "regression"])
+
+
+def compare_results(measures, baseline, tolerance=TOLERANCE):
+    """
+    Compare measures to a baseline
+    measures (list of Measure): the new measures
+    baseline (list of Measure): the reference measures
+    tolerance (0<=float): relative change accepted before reporting a regression
+    return (list of Comparison): one comparison for each of the new measures,
+      followed by one for each measure of the baseline missing from the new
+      measures (typically, because its benchmark failed), reported as a regression.
+    """
+    bvalues = {m.name: m.value for m in baseline}
+    comps = []
+    for m in measures:
+        bv = bvalues.get(m.name)
+        if not bv:  # Not present, or 0 (so no ratio possible)
+            comps.append(Comparison(m.name, m.value, bv, None, False))
+            continue
+
+        change = (m.value - bv) / abs(bv)
+        if not m.higher_is_better:
+            change = -change
+        comps.append(Comparison(m.name, m.value, bv, change, change < -tolerance))
+
+    names = {m.name for m in measures}
+    for m in baseline:
+        if m.name not in names:
+            comps.append(Comparison(m.name, None, m.value, None, True))
+
+    return comps
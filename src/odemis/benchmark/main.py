@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Created on 19 Oct 2026
+
+Copyright © 2026 Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# Runs the performance regression suite on the simulated microscopes.
+# Typical usage:
+# python3 -m odemis.benchmark.main --output new.json --baseline baseline.json
+# The exit code is 1 if a measure is worse than the baseline, or missing from
+# the run, or if a benchmark failed.
+
+from __future__ import division, print_function
+
+import argparse
+import logging
+import odemis
+from odemis import benchmark
+from odemis.benchmark import suite
+import sys
+
+
+def print_comparison(comps):
+    """
+    Display the comparison with the baseline as a table
+    comps (list of Comparison)
+    """
+    for c in comps:
+        if c.value is None:
+            print("%-30s %12s %12g %8s %s" % (c.name, "-", c.baseline, "", "MISSING"))
+        elif c.change is None:
+            print("%-30s %12g %12s" % (c.name, c.value, "-"))
+        else:
+            print("%-30s %12g %12g %+7.1f%% %s" % (c.name, c.value, c.baseline,
+                                                 c.change * 100,
+                                                 "REGRESSION" if c.regression else ""))
+
+
+def main(args):
+    """
+    Handles the command line arguments
+    args is the list of arguments passed
+    return (int): value to return to the OS as program exit code
+    """
+    parser = argparse.ArgumentParser(prog="odemis-benchmark",
+                                     description="Performance regression suite of " + odemis.__fullname__)
+    parser.add_argument("--log-level", dest="loglev", metavar="<level>", type=int,
+                        default=1, help="set verbosity level (0-2, default = 1)")
+    parser.add_argument("--list", dest="list", action="store_true", default=False,
+                        help="list the available benchmarks and exit")
+    parser.add_argument("--only", dest="only", nargs="+", metavar="<benchmark>",
+                        help="only run the given benchmarks")
+    parser.add_argument("--output", "-o", dest="output",
+                        help="name of the JSON file where to store the results")
+    parser.add_argument("--baseline", "-b", dest="baseline",
+                        help="JSON file of a previous run, to compare the results with")
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=benchmark.TOLERANCE,
+                        help="relative change allowed compared to the baseline (default = %g)" %
+                             (benchmark.TOLERANCE,))
+
+    options = parser.parse_args(args[1:])
+
+    loglev_names = (logging.WARNING, logging.INFO, logging.DEBUG)
+    loglev = loglev_names[min(len(loglev_names) - 1, max(0, options.loglev))]
+    logging.getLogger().setLevel(loglev)
+
+    if options.list:
+        for b in benchmark.BENCHMARKS:
+            print("%-25s %s" % (b.name, b.config or ""))
+        return 0
+
+    benchmarks = benchmark.BENCHMARKS
+    if options.only:
+        names = {b.name for b in benchmarks}
+        unknown = set(options.only) - names
+        if unknown:
+            logging.error("Unknown benchmarks: %s", ", ".join(sorted(unknown)))
+            return 127
+        benchmarks = [b for b in benchmarks if b.name in options.only]
+
+    try:
+        baseline = benchmark.load_results(options.baseline) if options.baseline else None
+    except (IOError, ValueError) as ex:
+        logging.error("Failed to read baseline: %s", ex)
+        return 127
+
+    failed = []
+    measures = benchmark.run_benchmarks(benchmarks, suite.start_backend, suite.stop_backend,
+                                        failed)
+
+    if options.output:
+        benchmark.save_results(options.output, measures)
+
+    if baseline is None:
+        comps = benchmark.compare_results(measures, [])
+    else:
+        if options.only:
+            # The measures of the other benchmarks are expected to be missing
+            baseline = [m for m in baseline if m.name in {nm.name for nm in measures}]
+        comps = benchmark.compare_results(measures, baseline, options.tolerance)
+    print_comparison(comps)
+
+    if failed:
+        logging.error("Benchmarks failed: %s", ", ".join(failed))
+        return 1
+    if any(c.regression for c in comps):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    ret = main(sys.argv)
+    logging.shutdown()
+    exit(ret)
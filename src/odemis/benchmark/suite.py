@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 19 Oct 2026
+
+Copyright © 2026 Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+# The benchmarks of the performance regression suite. Each of them returns a
+# list of Measure. The names of the measures should stay stable over time, so
+# that they can be compared to the baseline.
+
+from __future__ import division
+
+import logging
+import numpy
+import odemis
+from odemis import model, dataio
+from odemis.acq import stream
+from odemis.acq.stitching import acquireTiledArea
+from odemis.benchmark import benchmark, Measure
+from odemis.util import test, driver, spot
+from odemis.util.comp import compute_camera_fov
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+
+SIM_CONFIG_PATH = os.path.join(os.path.dirname(odemis.__file__),
+                               "../../install/linux/usr/share/odemis/sim/")
+if not os.path.isdir(SIM_CONFIG_PATH):  # Installed version
+    SIM_CONFIG_PATH = "/usr/share/odemis/sim/"
+
+BACKEND_TIMEOUT = 60  # s, maximum time for the backend to start
+
+SECOM_CONFIG = "secom-sim.odm.yaml"
+SPARC2_CONFIG = "sparc2-sim-scanner.odm.yaml"
+CRYOSECOM_CONFIG = "cryosecom-sim.yaml"
+
+LIVE_DURATION = 10  # s, duration of the live stream measurement
+
+TILED_EXPORT_SIZE = 50000  # px, width and height of the tiled export
+
+SPOT_COUNTS = (64, 1024, 10000)  # number of spots for the sub-pixel refinement
+
+
+def start_backend(config):
+    """
+    Start the backend, and measure how long it takes until it's fully running
+    config (str): name of the microscope file in the sim/ directory
+    return (list of Measure): the start up time
+    raises:
+        LookupError: if a backend is already running
+        IOError: if backend failed to start
+    """
+    if driver.get_backend_status() in (driver.BACKEND_RUNNING, driver.BACKEND_STARTING):
+        raise LookupError("A running backend is already found")
+
+    path = os.path.join(SIM_CONFIG_PATH, config)
+    logging.info("Starting backend with config file '%s'", path)
+    cmd = test.ODEMISD_CMD + test.ODEMISD_ARG + [path]
+    # Same as test.start_backend(), but with a fine polling, to measure precisely
+    # the start up time.
+    start = time.time()
+    ret = subprocess.call(cmd, preexec_fn=test.setlimits)
+    if ret != 0:
+        raise IOError("Failed starting backend with '%s' (returned %d)" % (cmd, ret))
+
+    while time.time() < start + BACKEND_TIMEOUT:
+        if driver.get_backend_status() == driver.BACKEND_RUNNING:
+            break
+        time.sleep(0.05)
+    else:
+        raise IOError("Backend still not running after %d s" % (BACKEND_TIMEOUT,))
+    dur = time.time() - start
+
+    confname = config.split(".")[0]
+    return [Measure("backend.start.%s" % (confname,), dur, "s", False)]
+
+
+def stop_backend():
+    test.stop_backend()
+
+
+@benchmark(config=SECOM_CONFIG)
+def live_ccd():
+    """
+    Frame rate of the CCD, when displayed live: from the DataFlow, to the RGB
+    projection.
+    """
+    ccd = model.getComponent(role="ccd")
+    ccd.binning.value = (1, 1)
+    ccd.resolution.value = ccd.resolution.range[1]
+    ccd.exposureTime.value = ccd.exposureTime.range[0]
+
+    st = stream.BrightfieldStream("bench bf", ccd, ccd.data, None)
+    pj = stream.RGBSpatialProjection(st)
+
+    nframes = [0]
+    nimages = [0]
+
+    def on_data(df, data):
+        nframes[0] += 1
+
+    def on_image(im):
+        nimages[0] += 1
+
+    ccd.data.subscribe(on_data)
+    pj.image.subscribe(on_image)
+    try:
+        st.should_update.value = True
+        st.is_active.value = True
+        time.sleep(1)  # Warm up
+        f0, i0 = nframes[0], nimages[0]
+        time.sleep(LIVE_DURATION)
+        f1, i1 = nframes[0], nimages[0]
+    finally:
+        st.is_active.value = False
+        st.should_update.value = False
+        pj.image.unsubscribe(on_image)
+        ccd.data.unsubscribe(on_data)
+
+    res = ccd.resolution.value
+    logging.info("Live CCD at %s px, %g s exposure", res, ccd.exposureTime.value)
+    return [Measure("live.ccd.fps", (f1 - f0) / LIVE_DURATION, "fps", True),
+            Measure("live.projection.fps", (i1 - i0) / LIVE_DURATION, "fps", True)]
+
+
+@benchmark(config=SPARC2_CONFIG)
+def semccd_acquisition():
+    """
+    Overhead per pixel of the SEM + CCD synchronized acquisition, compared to
+    the exposure time.
+    """
+    spec = model.getComponent(role="spectrometer")
+    ebeam = model.getComponent(role="e-beam")
+    sed = model.getComponent(role="se-detector")
+
+    sems = stream.SEMStream("bench sem", sed, sed.data, ebeam)
+    specs = stream.SpectrumSettingsStream("bench spec", spec, spec.data, ebeam,
+                                          detvas={"exposureTime"})
+    sps = stream.SEMSpectrumMDStream("bench sem-spec", [sems, specs])
+
+    specs.roi.value = (0.2, 0.2, 0.8, 0.8)
+    specs.detExposureTime.value = 0.01  # s
+    specs.repetition.value = (20, 20)
+    rep = specs.repetition.value
+    npx = rep[0] * rep[1]
+    exp_dur = npx * specs.detExposureTime.value
+
+    start = time.time()
+    f = sps.acquire()
+    f.result(10 * exp_dur + 60)
+    dur = time.time() - start
+    logging.info("Acquired %s px in %g s, while exposure time is %g s", rep, dur, exp_dur)
+
+    return [Measure("semccd.overhead", (dur - exp_dur) / npx, "s/px", False)]
+
+
+@benchmark(config=CRYOSECOM_CONFIG)
+def tiled_acquisition():
+    """
+    Duration of a 3x3 tiled acquisition, including the stitching
+    """
+    ccd = model.getComponent(role="ccd")
+    light = model.getComponent(role="light")
+    light_filter = model.getComponent(role="filter")
+    focus = model.getComponent(role="focus")
+    stage = model.getComponent(role="stage")
+
+    fs = stream.FluoStream("bench fluo", ccd, ccd.data, light, light_filter, focuser=focus)
+    fs.excitation.value = sorted(fs.excitation.choices)[0]
+
+    # 20% overlap => 3 x 3 tiles
+    fov = compute_camera_fov(ccd)
+    area = (0, 0, fov[0] * 2.6, fov[1] * 2.6)
+    stage.moveAbs({'x': 0, 'y': 0}).result()
+    start = time.time()
+    f = acquireTiledArea([fs], stage, area=area, overlap=0.2)
+    f.result()
+    dur = time.time() - start
+
+    return [Measure("tiledacq.3x3.duration", dur, "s", False)]
+
+
+def _create_export_data():
+    """
+    return (list of DataArray): a typical multi-stream acquisition
+    """
+    md = {
+        model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+        model.MD_POS: (1e-3, -30e-3),  # m
+        model.MD_EXP_TIME: 1.2,  # s
+        model.MD_ACQ_DATE: time.time(),
+        model.MD_BPP: 12,
+    }
+    rng = numpy.random.RandomState(0)
+    das = []
+    for i in range(4):
+        # Gradient + noise, to not be as easy to compress as a constant image
+        im = numpy.add.outer(numpy.arange(2048, dtype=numpy.uint16),
+                             numpy.arange(2048, dtype=numpy.uint16)) // 2
+        im += rng.randint(0, 256, im.shape).astype(numpy.uint16)
+        imd = md.copy()
+        imd[model.MD_DESCRIPTION] = "stream %d" % (i,)
+        imd[model.MD_IN_WL] = (500e-9 + i * 50e-9, 520e-9 + i * 50e-9)  # m
+        imd[model.MD_OUT_WL] = (550e-9 + i * 50e-9, 570e-9 + i * 50e-9)  # m
+        das.append(model.DataArray(im, imd))
+    return das
+
+
+@benchmark()
+def export_import():
+    """
+    Throughput of writing and reading data in TIFF and HDF5 formats
+    """
+    das = _create_export_data()
+    size = sum(da.nbytes for da in das) / 2 ** 20  # MB
+
+    measures = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # TIFF with Deflate is the compression used for the acquisitions (by the GUI)
+        for fmt, name, kwargs in (("TIFF", "tiff", {}),
+                                  ("TIFF", "tiff-deflate", {"compression": "deflate"}),
+                                  ("HDF5", "hdf5", {})):
+            exporter = dataio.get_converter(fmt)
+            fn = os.path.join(tmpdir, "bench" + exporter.EXTENSIONS[0])
+            start = time.time()
+            exporter.export(fn, das, **kwargs)
+            dur_w = time.time() - start
+
+            start = time.time()
+            rdas = exporter.read_data(fn)
+            for rd in rdas:
+                rd[...]  # make sure the data is really read
+            dur_r = time.time() - start
+
+            measures.append(Measure("dataio.%s.export" % (name,), size / dur_w, "MB/s", True))
+            measures.append(Measure("dataio.%s.import" % (name,), size / dur_r, "MB/s", True))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return measures
+
+
+def _create_pyramidal_file(filename, shape, md):
+    """
+    Create a pyramidal TIFF file with a synthetic greyscale image, without
+    having the whole image in memory.
+    filename (str): path of the file to create
+    shape (int, int): shape of the image (Y, X)
+    md (dict): metadata of the image
+    """
+    ts = dataio.tiff.TILE_SIZE
+
+    def get_tile(x, y):
+        # Gradient + noise, computed from the position
+        h = min(ts, shape[0] - y * ts)
+        w = min(ts, shape[1] - x * ts)
+        yc = numpy.arange(y * ts, y * ts + h, dtype=numpy.uint32)
+        xc = numpy.arange(x * ts, x * ts + w, dtype=numpy.uint32)
+        im = (numpy.add.outer(yc, xc) // 16 % 3840).astype(numpy.uint16)
+        im += numpy.random.randint(0, 256, im.shape).astype(numpy.uint16)
+        return im
+
+    dataio.tiff.export_tiled(filename, shape, numpy.uint16, get_tile, md)
+
+
+@benchmark()
+def tiled_export():
+    """
+    Throughput of the print-ready export, at full resolution, of a 50k x 50k px
+    overlay of a SEM and a fluorescence stream, both stored as pyramidal files
+    """
+    # Needs the GUI libraries (cairo)
+    from odemis.gui.util.img import images_to_tiled_export
+
+    pxs = 1e-7  # m
+    n = TILED_EXPORT_SIZE
+    sem_md = {model.MD_DESCRIPTION: "SEM", model.MD_PIXEL_SIZE: (pxs, pxs),
+              model.MD_POS: (0, 0), model.MD_DWELL_TIME: 1e-6, model.MD_BPP: 12}
+    fluo_md = {model.MD_DESCRIPTION: "fluo", model.MD_PIXEL_SIZE: (4 * pxs, 4 * pxs),
+               model.MD_POS: (0, 0), model.MD_EXP_TIME: 1, model.MD_BPP: 12,
+               model.MD_IN_WL: (500e-9, 520e-9), model.MD_OUT_WL: (550e-9, 570e-9)}
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sem_fn = os.path.join(tmpdir, "sem.ome.tiff")
+        fluo_fn = os.path.join(tmpdir, "fluo.ome.tiff")
+        _create_pyramidal_file(sem_fn, (n, n), sem_md)
+        _create_pyramidal_file(fluo_fn, (n // 4, n // 4), fluo_md)
+        sem_s = stream.StaticSEMStream("SEM", dataio.tiff.open_data(sem_fn).content[0])
+        fluo_s = stream.StaticFluoStream("fluo", dataio.tiff.open_data(fluo_fn).content[0])
+        projs = [stream.RGBSpatialProjection(s) for s in (fluo_s, sem_s)]
+
+        fn = os.path.join(tmpdir, "export.ome.tiff")
+        start = time.time()
+        size = images_to_tiled_export(fn, projs, (n * pxs, n * pxs), (0, 0), 0.5)
+        dur = time.time() - start
+        logging.info("Exported %s px in %g s (%d MB)", size, dur, os.path.getsize(fn) / 2 ** 20)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    mpx = size[0] * size[1] / 1e6
+    return [Measure("export.tiled.50k", mpx / dur, "Mpx/s", True)]
+
+
+@benchmark()
+def spot_refinement():
+    """
+    Throughput of the sub-pixel refinement of the spot centers (as done by
+    MaximaFind), one spot at a time and all spots in one batch
+    """
+    rng = numpy.random.RandomState(0)
+    yy, xx = numpy.mgrid[-8:9, -8:9]  # 17x17 px, as the default MaximaFind windows
+
+    measures = []
+    for n in SPOT_COUNTS:
+        # Gaussian spots, randomly off-centered, with noise
+        ofs = rng.uniform(-1, 1, (n, 2, 1, 1))
+        spots = 1000 * numpy.exp(-((xx - ofs[:, 0]) ** 2 + (yy - ofs[:, 1]) ** 2) / 8)
+        spots += rng.randint(0, 50, spots.shape)
+        spots = spots.astype(numpy.uint16)
+
+        start = time.time()
+        for s in spots:
+            spot.FindCenterCoordinates(s)
+        dur_s = time.time() - start
+
+        start = time.time()
+        spot.FindCenterCoordinatesBatch(spots)
+        dur_b = time.time() - start
+        logging.info("Refined %d spots in %g s one at a time, and %g s in batch", n, dur_s, dur_b)
+
+        measures.append(Measure("spot.refine.single.%d" % (n,), n / dur_s, "spots/s", True))
+        measures.append(Measure("spot.refine.batch.%d" % (n,), n / dur_b, "spots/s", True))
+
+    return measures
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+'''
+Created on 19 Oct 2026
+
+Copyright © 2026 Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+'''
+from __future__ import division
+
+import logging
+from odemis import benchmark
+from odemis.benchmark import Measure, Benchmark, suite
+import os
+import tempfile
+import unittest
+
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_save_load(self):
+        measures = [Measure("live.ccd.fps", 25.3, "fps", True),
+                    Measure("backend.start.secom-sim", 12.1, "s", False)]
+        benchmark.save_results(self.filename, measures)
+        rmeasures = benchmark.load_results(self.filename)
+        self.assertEqual(rmeasures, measures)
+
+        with open(self.filename, "w") as f:
+            f.write('{"foo": 1}')
+        with self.assertRaises(ValueError):
+            benchmark.load_results(self.filename)
+
+    def test_compare(self):
+        baseline = [Measure("fps", 20, "fps", True),
+                    Measure("dur", 10, "s", False),
+                    Measure("zero", 0, "s", False)]
+        measures = [Measure("fps", 15, "fps", True),  # 25% worse
+                    Measure("dur", 8, "s", False),  # 20% better
+                    Measure("zero", 1, "s", False),
+                    Measure("new", 3, "s", False)]
+        comps = benchmark.compare_results(measures, baseline, tolerance=0.2)
+        self.assertEqual([c.name for c in comps], ["fps", "dur", "zero", "new"])
+        self.assertAlmostEqual(comps[0].change, -0.25)
+        self.assertTrue(comps[0].regression)
+        self.assertAlmostEqual(comps[1].change, 0.2)
+        self.assertFalse(comps[1].regression)
+        self.assertIsNone(comps[2].change)
+        self.assertEqual(comps[3].baseline, None)
+        self.assertFalse(comps[3].regression)
+
+        # With a bigger tolerance, no regression
+        comps = benchmark.compare_results(measures, baseline, tolerance=0.3)
+        self.assertFalse(any(c.regression for c in comps))
+
+        # A measure of the baseline missing (eg, the benchmark failed) is a regression
+        comps = benchmark.compare_results(measures[1:], baseline, tolerance=0.3)
+        self.assertEqual([c.name for c in comps], ["dur", "zero", "new", "fps"])
+        self.assertIsNone(comps[3].value)
+        self.assertEqual(comps[3].baseline, 20)
+        self.assertTrue(comps[3].regression)
+
+    def test_run(self):
+        """
+        Check the backend is started once per config, and failures are skipped
+        """
+        started = []
+
+        def start_backend(conf):
+            started.append(conf)
+            return [Measure("start." + conf, 1, "s", False)]
+
+        def stop_backend():
+            started.append("stop")
+
+        def failing():
+            raise IOError("Hardware not happy")
+
+        benchmarks = [Benchmark("a", None, lambda: [Measure("a", 1, "s", False)]),
+                      Benchmark("b", "sim1", lambda: [Measure("b", 2, "s", False)]),
+                      Benchmark("c", "sim2", failing),
+                      Benchmark("d", "sim1", lambda: [Measure("d", 3, "s", False)])]
+        failed = []
+        measures = benchmark.run_benchmarks(benchmarks, start_backend, stop_backend, failed)
+        self.assertEqual(started, ["sim1", "stop", "sim2", "stop"])
+        self.assertEqual([m.name for m in measures], ["a", "start.sim1", "b", "d", "start.sim2"])
+        self.assertEqual(failed, ["c"])
+
+    def test_export_import(self):
+        """
+        Run the data export/import benchmark (which doesn't need a backend)
+        """
+        measures = benchmark.run_benchmarks([b for b in benchmark.BENCHMARKS if b.name == "export_import"],
+                                            suite.start_backend, suite.stop_backend)
+        names = {m.name for m in measures}
+        self.assertEqual(names, {"dataio.tiff.export", "dataio.tiff.import",
+                                 "dataio.tiff-deflate.export", "dataio.tiff-deflate.import",
+                                 "dataio.hdf5.export", "dataio.hdf5.import"})
+        for m in measures:
+            self.assertGreater(m.value, 0)
+
+    def test_spot_refinement(self):
+        """
+        Run the spot refinement benchmark (which doesn't need a backend)
+        """
+        measures = benchmark.run_benchmarks([b for b in benchmark.BENCHMARKS if b.name == "spot_refinement"],
+                                            suite.start_backend, suite.stop_backend)
+        names = {m.name for m in measures}
+        self.assertEqual(names, {"spot.refine.%s.%d" % (m, n)
+                                 for m in ("single", "batch") for n in suite.SPOT_COUNTS})
+        for m in measures:
+            self.assertGreater(m.value, 0)
+
+    def test_configs(self):
+        """
+        Check all the microscope files used exist
+        """
+        for b in benchmark.BENCHMARKS:
+            if b.config is not None:
+                self.assertTrue(os.path.exists(os.path.join(suite.SIM_CONFIG_PATH, b.config)),
+                                b.config)
+
+
+if __name__ == "__main__":
+    unittest.main()
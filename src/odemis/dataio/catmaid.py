@@ -27,16 +27,22 @@ try:
 except ImportError:  # Python 3 naming
     import configparser as ConfigParser
 
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
 import logging
 import math
 import numpy
+import os
 import re
 import requests
+import threading
 from future.moves.urllib.parse import urlparse, parse_qs
 
 from PIL import Image
 from io import BytesIO
 from requests import HTTPError
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
 from odemis import model
@@ -82,6 +88,17 @@ SUPPORTED_CONTENT_TYPES = {
 
 KEY_PATH = "~/.local/share/odemis/catmaid.key"
 
+# The tiles (as received from the server) are cached on disk, in a sub-directory
+# per stack. When the total size of all the stacks is above DISK_CACHE_SIZE, the
+# least recently used tiles are deleted.
+CACHE_PATH = "~/.cache/odemis/catmaid"
+DISK_CACHE_SIZE = 2 * 2 ** 30  # bytes
+# The decoded tiles are also kept in memory, up to MEMORY_CACHE_SIZE
+MEMORY_CACHE_SIZE = 256 * 2 ** 20  # bytes
+
+# Maximum number of tiles fetched simultaneously from the server
+MAX_CONNECTIONS = 8
+
 # Tile Source Types
 FILE_BASED = 1
 REQUEST_QUERY = 2
@@ -172,13 +189,54 @@ class DataArrayShadowPyramidalCatmaid(DataArrayShadow):
         DataArrayShadow.__init__(self, shape, dtype, metadata, maxzoom=maxzoom, tile_shape=tile_shape)
 
         self._base_url = base_url
+        # The connection pool allows to fetch several tiles simultaneously,
+        # while reusing the connections.
         self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONNECTIONS)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
         _, username, password = read_config_file(self._base_url, username=True, password=True)
         self._auth = (username, password)
         self._stack_info = stack_info
         file_extension = self._stack_info["mirrors"][0]["file_extension"]
         self._file_extension = file_extension[1:] if file_extension.startswith(".") else file_extension
 
+        # The image base identifies uniquely the stack (and its mirror)
+        image_base = self._stack_info["mirrors"][0]["image_base"]
+        self._stack_dir = hashlib.md5(image_base.encode("utf-8")).hexdigest()
+        self._disk_cache = get_disk_cache()
+
+        # (zoom, depth, row, col) -> numpy.array
+        self._mem_cache = OrderedDict()
+        self._mem_cache_size = 0  # bytes
+        # (zoom, depth, row, col) -> Future, for the tiles being fetched
+        self._pending = {}
+        self._prefetched = set()  # keys of the tiles only requested by prefetch()
+        self._demanded = set()  # keys of the tiles a getTiles() caller waits for
+        self._cache_lock = threading.Lock()  # protects the 5 attributes above
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Stop fetching the tiles and release the connections to the server.
+        The tiles cannot be read anymore afterwards.
+        """
+        try:
+            executor = self._executor
+        except AttributeError:
+            return  # Failed during init, or already closed
+        del self._executor
+
+        # Cancel the tiles not yet fetched, and don't wait for the other ones
+        with self._cache_lock:
+            for f in self._pending.values():
+                f.cancel()
+        executor.shutdown(wait=False)
+        self._session.close()
+
     def getTile(self, x, y, zoom, depth=0):
         """
         Fetches one tile
@@ -190,27 +248,152 @@ class DataArrayShadowPyramidalCatmaid(DataArrayShadow):
         return:
             tile (DataArray): tile containing the image data and the relevant metadata.
         """
+        return self.getTiles(((x, y),), zoom, depth)[0]
+
+    def getTiles(self, positions, zoom, depth=0):
+        """
+        Fetches multiple tiles of the same zoom level. The tiles are fetched
+        simultaneously, so it's much faster than calling getTile() for each of them.
+        positions (list of (0<=int, 0<=int)): X and Y indices of each tile.
+        zoom (0<=int): zoom level to use (see getTile()).
+        depth (0<=int): The Z index of the stack.
+        return (list of DataArrays): the tiles, in the same order as the positions.
+        raise AuthenticationError: if the server refuses the access to the tiles.
+        """
+        futures = [self._requestTile((zoom, depth, y, x)) for x, y in positions]
+        return [self._createTile(f.result(), x, y, zoom) for f, (x, y) in zip(futures, positions)]
+
+    def prefetch(self, positions, zoom, depth=0):
+        """
+        Hint that the given tiles will be requested soon. They are fetched in
+        the background and stored in the cache, so that the next call to
+        getTile() for these tiles returns immediately.
+        The tiles of the previous hint, which haven't started to be fetched yet,
+        are discarded.
+        positions (list of (0<=int, 0<=int)): X and Y indices of each tile.
+        zoom (0<=int): zoom level to use (see getTile()).
+        depth (0<=int): The Z index of the stack.
+        """
+        keys = [(zoom, depth, y, x) for x, y in positions]
+        with self._cache_lock:
+            # Only the tiles which nobody waits for can be cancelled
+            for k in self._prefetched - self._demanded - set(keys):
+                f = self._pending.get(k)
+                if f is not None and f.cancel():
+                    del self._pending[k]
+            self._prefetched = set()
+
+        for k in keys:
+            self._requestTile(k, prefetch=True)
+
+    def _requestTile(self, key, prefetch=False):
+        """
+        Starts fetching a tile, if it's not already in the cache or being fetched.
+        key (int, int, int, int): zoom, depth, row, col of the tile
+        prefetch (bool): if True, the request may be cancelled by the next prefetch.
+        return (Future): returns the image (numpy.ndarray) of the tile
+        """
+        with self._cache_lock:
+            image = self._mem_cache.pop(key, None)
+            if image is not None:
+                self._mem_cache[key] = image  # Put it back as the most recently used
+                f = Future()
+                f.set_result(image)
+                return f
+
+            if not prefetch:
+                # Someone waits for it => it should never be cancelled, even if
+                # it's prefetched again later.
+                self._demanded.add(key)
+                self._prefetched.discard(key)
+            elif key not in self._demanded:
+                self._prefetched.add(key)
+
+            # If it's already being fetched, no need to ask it a second time
+            f = self._pending.get(key)
+            if f is None:
+                f = self._executor.submit(self._getTileImage, key)
+                self._pending[key] = f
+            return f
+
+    def _getTileImage(self, key):
+        """
+        Reads the image of a tile, from the disk cache or the server. It's
+        stored in the memory cache once read.
+        key (int, int, int, int): zoom, depth, row, col of the tile
+        return (numpy.ndarray): the image of the tile
+        """
+        try:
+            image, cacheable = self._fetchTileImage(key)
+            if not cacheable:
+                return image
+
+            with self._cache_lock:
+                self._mem_cache[key] = image
+                self._mem_cache_size += image.nbytes
+                while self._mem_cache_size > MEMORY_CACHE_SIZE and len(self._mem_cache) > 1:
+                    _, old_im = self._mem_cache.popitem(last=False)
+                    self._mem_cache_size -= old_im.nbytes
+            return image
+        finally:
+            with self._cache_lock:
+                self._pending.pop(key, None)
+                self._prefetched.discard(key)
+                self._demanded.discard(key)
+
+    def _fetchTileImage(self, key):
+        """
+        Reads the image of a tile, from the disk cache or the server.
+        key (int, int, int, int): zoom, depth, row, col of the tile
+        return:
+            image (numpy.ndarray): the image of the tile
+            cacheable (bool): False if the image is just a placeholder due to a
+              (potentially temporary) error of the server.
+        """
+        content = self._disk_cache.get(self._stack_dir, key)
+        if content is not None:
+            try:
+                return content_to_array(content), True
+            except Exception:
+                logging.warning("Failed to decode cached tile %s, will fetch it again", key, exc_info=True)
+
+        zoom, depth, row, col = key
         tile_width, tile_height = self.tile_shape
         tile_url = format_tile_url(
             tile_source_type=self._stack_info["mirrors"][0]["tile_source_type"],
             image_base=self._stack_info["mirrors"][0]["image_base"],
             zoom=zoom,
             depth=depth,
-            col=x,
-            row=y,
+            col=col,
+            row=row,
             file_extension=self._file_extension,
             tile_width=tile_width,
             tile_height=tile_height,
         )
         try:
-            image = response_to_array(self._session.get(tile_url, auth=self._auth))
+            response = self._session.get(tile_url, auth=self._auth)
+            image = response_to_array(response)
         except HTTPError as e:
             if e.response.status_code == 401:
                 raise AuthenticationError("Authentication failed while getting tiles at {}".format(tile_url))
             else:
                 logging.error("No tile at %s (error %s), returning blank tile", tile_url, e.response.status_code)
-                image = numpy.zeros((tile_width, tile_height), dtype=self.dtype)
+                # A missing tile will stay missing, so no need to ask it again
+                blank = numpy.zeros((tile_height, tile_width), dtype=self.dtype)
+                return blank, e.response.status_code == 404
+
+        self._disk_cache.put(self._stack_dir, key, response.content)
+        return image, True
 
+    def _createTile(self, image, x, y, zoom):
+        """
+        Creates the DataArray of a tile, with its metadata.
+        image (numpy.ndarray): the image of the tile
+        x (0<=int): X index of the tile.
+        y (0<=int): Y index of the tile
+        zoom (0<=int): zoom level of the tile.
+        return (DataArray): the tile
+        """
         tile = model.DataArray(image, self.metadata.copy())
         orig_pixel_size = self.metadata.get(model.MD_PIXEL_SIZE, (1e-6, 1e-6))
         # calculate the pixel size of the tile for the zoom level
@@ -290,14 +473,170 @@ def response_to_array(response):
     content_type = response.headers['Content-Type']
 
     if content_type in SUPPORTED_CONTENT_TYPES:
-        buffer = BytesIO(response.content)  # opening directly from raw response doesn't work for JPEGs
-        raw_img = Image.open(buffer).convert('L')
-        return numpy.array(raw_img)
+        return content_to_array(response.content)
     else:
         raise ValueError('Image fetching is only implemented for greyscale PNG and JPEG, not {}'.format(
             content_type.upper().split('/')[1]))
 
 
+def content_to_array(content):
+    """
+    content (bytes): the encoded image (PNG or JPEG).
+    return:
+       image (numpy array): the decoded image, as greyscale.
+    """
+    buffer = BytesIO(content)  # opening directly from raw response doesn't work for JPEGs
+    raw_img = Image.open(buffer).convert('L')
+    return numpy.array(raw_img)
+
+
+# path -> TileDiskCache, to share the cache between all the stacks opened
+_disk_caches = {}
+_disk_caches_lock = threading.Lock()
+
+
+def get_disk_cache():
+    """
+    return (TileDiskCache): the disk cache at CACHE_PATH, shared by all the stacks
+    """
+    path = os.path.expanduser(CACHE_PATH)
+    with _disk_caches_lock:
+        try:
+            return _disk_caches[path]
+        except KeyError:
+            cache = TileDiskCache(path, DISK_CACHE_SIZE)
+            _disk_caches[path] = cache
+            return cache
+
+
+class TileDiskCache(object):
+    """
+    Stores the tiles, as received from the server, in a directory, with one
+    sub-directory per stack.
+    The total size of all the stacks is limited, by deleting the least recently
+    used files first.
+    The modification time of the files is used to keep track of the usage, so
+    that it's still valid when reopening the cache later.
+    """
+
+    def __init__(self, path, max_size):
+        """
+        path (str): directory where to store the tiles. It's created if it
+          doesn't exist.
+        max_size (0<int): maximum total size of the files, in bytes.
+        """
+        self._path = path
+        self._max_size = max_size
+        self._lock = threading.Lock()  # protects _files and _size
+        # filename (relative to the path) -> size, ordered from the least recently used
+        self._files = OrderedDict()
+        self._size = 0
+
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            files = []
+            for stack_dir in os.listdir(path):
+                fullsd = os.path.join(path, stack_dir)
+                if not os.path.isdir(fullsd):
+                    continue
+                for fn in os.listdir(fullsd):
+                    fullfn = os.path.join(fullsd, fn)
+                    if fn.endswith(".tmp"):  # left-over of an interrupted write
+                        os.remove(fullfn)
+                        continue
+                    st = os.stat(fullfn)
+                    files.append((st.st_mtime, os.path.join(stack_dir, fn), st.st_size))
+        except (IOError, OSError):
+            logging.warning("Failed to open tile cache at %s, will not use it", path, exc_info=True)
+            self._path = None
+            return
+
+        for _, fn, size in sorted(files):
+            self._files[fn] = size
+            self._size += size
+        logging.debug("Opened tile cache at %s, with %d tiles", path, len(self._files))
+
+    @staticmethod
+    def _get_filename(stack, key):
+        return os.path.join(stack, "%d_%d_%d_%d" % key)
+
+    def get(self, stack, key):
+        """
+        stack (str): name of the sub-directory of the stack
+        key (tuple of int): the identifier of the tile
+        return (bytes or None): the content of the tile, or None if not in the cache.
+        """
+        if self._path is None:
+            return None
+        fn = self._get_filename(stack, key)
+        with self._lock:
+            size = self._files.pop(fn, None)
+            if size is None:
+                return None
+            self._files[fn] = size  # Now the most recently used
+
+        fullfn = os.path.join(self._path, fn)
+        try:
+            with open(fullfn, "rb") as f:
+                content = f.read()
+            os.utime(fullfn, None)
+        except (IOError, OSError):
+            # Typically, the file was deleted by another process
+            logging.debug("Failed to read cached tile %s", fn, exc_info=True)
+            with self._lock:
+                size = self._files.pop(fn, None)
+                if size is not None:
+                    self._size -= size
+            return None
+        return content
+
+    def put(self, stack, key, content):
+        """
+        Store a tile in the cache. Some older tiles might be deleted, including
+        from other stacks.
+        stack (str): name of the sub-directory of the stack
+        key (tuple of int): the identifier of the tile
+        content (bytes): the content of the tile
+        """
+        if self._path is None:
+            return
+        fn = self._get_filename(stack, key)
+        fullfn = os.path.join(self._path, fn)
+        try:
+            stack_path = os.path.join(self._path, stack)
+            if not os.path.isdir(stack_path):
+                try:
+                    os.makedirs(stack_path)
+                except OSError:
+                    if not os.path.isdir(stack_path):  # Not just created by another thread
+                        raise
+            # Write to a temporary file, so that a tile is never partially read
+            tmpfn = "%s.%d.tmp" % (fullfn, threading.current_thread().ident)
+            with open(tmpfn, "wb") as f:
+                f.write(content)
+            os.rename(tmpfn, fullfn)
+        except (IOError, OSError):
+            logging.warning("Failed to store tile %s in the cache", fn, exc_info=True)
+            return
+
+        to_delete = []
+        with self._lock:
+            self._size -= self._files.pop(fn, 0)
+            self._files[fn] = len(content)
+            self._size += len(content)
+            while self._size > self._max_size and len(self._files) > 1:
+                oldfn, size = self._files.popitem(last=False)
+                self._size -= size
+                to_delete.append(oldfn)
+
+        for oldfn in to_delete:
+            try:
+                os.remove(os.path.join(self._path, oldfn))
+            except OSError:
+                logging.debug("Failed to delete cached tile %s", oldfn, exc_info=True)
+
+
 STACK_URL = "{base_url}/{project_id}/stack/{stack_id}/info"
 
 
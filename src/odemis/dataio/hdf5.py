@@ -23,9 +23,13 @@ from __future__ import division
 from past.builtins import basestring, unicode
 
 import collections
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import h5py
+import itertools
 import json
 import logging
+import multiprocessing
 import numpy
 from odemis import model
 import odemis
@@ -33,6 +37,7 @@ from odemis.util import spectrum, img, fluo
 from odemis.util.conversion import JsonExtraEncoder
 import os
 import time
+import zlib
 
 
 # User-friendly name
@@ -42,6 +47,18 @@ EXTENSIONS = [u".h5", u".hdf5"]
 LOSSY = False
 CAN_SAVE_PYRAMID = False
 
+# Compression used by default: "gzip" is supported by every HDF5 reader,
+# "lzf" is faster, but only supported by h5py (and it's not compressed in
+# parallel). Both are used with the shuffle filter, which improves the
+# compression ratio of the data with more than one byte per pixel.
+COMPRESSION = "gzip"
+COMPRESSION_LEVEL = 4  # 0 -> 9, for gzip only (same default as h5py)
+# Maximum size of a chunk (in bytes). The chunk shape is selected to have a
+# similar length along each dimension, so that reading a whole image, or all
+# the data at one pixel (eg, a spectrum), only needs to decompress a small part
+# of the dataset.
+CHUNK_SIZE = 2 ** 16
+
 # We are trying to follow the same format as SVI, as defined here:
 # http://www.svi.nl/HDF5
 # A file follows this structure:
@@ -127,6 +144,116 @@ _dtid = h5py.special_dtype(enum=('i', {
 _dictid = h5py.check_dtype(enum=_dtid)
 
 
+def _guess_chunk_shape(shape, itemsize, max_size=CHUNK_SIZE):
+    """
+    Find a chunk shape which gives a similar access speed for reading a whole
+    image (YX) and reading all the other dimensions at a given pixel (eg, a
+    spectrum). This is done by halving the longest dimension, until the chunk
+    is small enough.
+    shape (tuple of int): shape of the dataset
+    itemsize (int): number of bytes per element
+    max_size (int): maximum number of bytes in a chunk
+    return (tuple of int): shape of the chunk
+    """
+    chunk = list(shape)
+    while numpy.prod(chunk) * itemsize > max_size:
+        i = chunk.index(max(chunk))
+        if chunk[i] <= 1:
+            break
+        chunk[i] = (chunk[i] + 1) // 2
+    return tuple(chunk)
+
+
+def _compress_chunk(data, chunk, level):
+    """
+    Compress a chunk the same way as the HDF5 shuffle + deflate filters.
+    Note: it is thread-safe, and mostly runs without the GIL.
+    data (numpy.ndarray): the data of the chunk, can be smaller than the chunk
+      on the edges of the dataset
+    chunk (tuple of int): shape of the chunk
+    level (0<=int<=9): compression level
+    return (bytes): the compressed data
+    """
+    if data.shape != chunk:
+        # The chunks on the edges have to be padded to the full chunk shape
+        padded = numpy.zeros(chunk, dtype=data.dtype)
+        padded[tuple(slice(0, s) for s in data.shape)] = data
+        data = padded
+
+    # Shuffle: the first byte of every element, then the second byte of every element...
+    data = numpy.ascontiguousarray(data)
+    shuffled = data.view(numpy.uint8).reshape(-1, data.dtype.itemsize).T.copy()
+    return zlib.compress(shuffled.data, level)
+
+
+def _write_chunks(dataset, image, level, executor, max_workers, origin=None):
+    """
+    Write the data of a gzip + shuffle compressed dataset, with the chunks
+    compressed in parallel.
+    dataset (HDF Dataset): the dataset, created with gzip and shuffle filters
+    image (numpy.ndarray): the data to write, of the same dtype
+    level (0<=int<=9): compression level
+    executor (Executor): to compress the chunks in parallel
+    max_workers (int): number of workers of the executor
+    origin (None or tuple of int): position of the image in the dataset. It
+      must be aligned on the chunks. If None, the image is the whole dataset.
+    """
+    chunk = dataset.chunks
+    if origin is None:
+        origin = (0,) * image.ndim
+    offsets = itertools.product(*[range(0, s, c) for s, c in zip(image.shape, chunk)])
+
+    def submit(offset):
+        data = image[tuple(slice(o, o + c) for o, c in zip(offset, chunk))]
+        return offset, executor.submit(_compress_chunk, data, chunk, level)
+
+    # Keep a limited number of chunks compressed in advance, to limit the
+    # memory usage, but enough to keep all the workers busy.
+    queued = deque(submit(o) for o in itertools.islice(offsets, 2 * max_workers))
+    while queued:
+        offset, f = queued.popleft()
+        dataset.id.write_direct_chunk(tuple(o + p for o, p in zip(offset, origin)), f.result())
+        for o in itertools.islice(offsets, 1):
+            queued.append(submit(o))
+
+
+def _create_compressed_dataset(group, dataset_name, data, compression=None,
+                               compression_level=COMPRESSION_LEVEL, executor=None,
+                               max_workers=1):
+    """
+    Create a dataset, optionally compressed, with chunks adapted to the data.
+    group (HDF group): the group that will contain the dataset
+    dataset_name (string): name of the dataset
+    data (numpy.ndarray): the data to store
+    compression (None or str): "gzip", "lzf", or None for no compression
+    compression_level (0<=int<=9): compression level for gzip
+    executor (None or Executor): if provided, and the compression is gzip,
+      the chunks are compressed in parallel
+    max_workers (int): number of workers of the executor
+    returns the new dataset
+    """
+    if compression is None or data.size == 0:
+        return group.create_dataset(dataset_name, data=data)
+
+    data = numpy.asarray(data)
+    chunks = _guess_chunk_shape(data.shape, data.dtype.itemsize)
+    if compression == "gzip":
+        opts = {"compression_opts": compression_level}
+    else:
+        opts = {}
+
+    if compression != "gzip" or executor is None or data.dtype.hasobject:
+        # Let HDF5 compress it
+        return group.create_dataset(dataset_name, data=data, chunks=chunks,
+                                    compression=compression, shuffle=True, **opts)
+
+    dataset = group.create_dataset(dataset_name, shape=data.shape, dtype=data.dtype,
+                                   chunks=chunks, compression=compression,
+                                   shuffle=True, **opts)
+    _write_chunks(dataset, data, compression_level, executor, max_workers)
+    return dataset
+
+
 def _create_image_dataset(group, dataset_name, image, **kwargs):
     """
     Create a dataset respecting the HDF5 image specification
@@ -135,11 +262,22 @@ def _create_image_dataset(group, dataset_name, image, **kwargs):
     group (HDF group): the group that will contain the dataset
     dataset_name (string): name of the dataset
     image (numpy.ndimage): the image to create. It should have at least 2 dimensions
+    kwargs: passed to _create_compressed_dataset() (compression, compression_level,
+      executor, max_workers)
     returns the new dataset
     """
     assert(len(image.shape) >= 2)
-    image_dataset = group.create_dataset(dataset_name, data=image, **kwargs)
+    image_dataset = _create_compressed_dataset(group, dataset_name, image, **kwargs)
+    _set_image_attrs(image_dataset, image)
+    return image_dataset
+
 
+def _set_image_attrs(image_dataset, image):
+    """
+    Set the attributes of a dataset, following the HDF5 image specification
+    image_dataset (HDF Dataset): the dataset
+    image (numpy.ndimage): the image stored (or at least its first part)
+    """
     # numpy.string_ is to force fixed-length string (necessary for compatibility)
     # FIXME: needs to be NULLTERM, not NULLPAD... but h5py doesn't allow to distinguish
     image_dataset.attrs["CLASS"] = numpy.string_("IMAGE")
@@ -162,8 +300,6 @@ def _create_image_dataset(group, dataset_name, image, **kwargs):
     image_dataset.attrs["DISPLAY_ORIGIN"] = numpy.string_("UL") # not rotated
     image_dataset.attrs["IMAGE_VERSION"] = numpy.string_("1.2")
 
-    return image_dataset
-
 
 def _read_image_dataset(dataset):
     """
@@ -1314,7 +1450,8 @@ def _groupImages(das):
             # merge metadata
             # TODO: might need to be more clever for some metadata (eg, ACQ_DATE)
             gmd = {}
-            map(gmd.update, md)
+            for m in md:
+                gmd.update(m)
 
             gdata = model.DataArray(gdata, gmd)
 
@@ -1465,14 +1602,16 @@ def _mergeCorrectionMetadata(da):
     return model.DataArray(da, md) # create a view
 
 
-def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
+def _saveAsHDF5(filename, ldata, thumbnail, compression=COMPRESSION,
+                compression_level=COMPRESSION_LEVEL):
     """
     Saves a list of DataArray as a HDF5 (SVI) file.
     filename (string): name of the file to save
     ldata (list of DataArray): list of 2D (up to 5D) data of int or float. 
      Should have at least one array.
     thumbnail (None or DataArray): see export
-    compressed (boolean): whether the file is compressed or not.
+    compression (None or str): see export
+    compression_level (0<=int<=9): see export
     """
     # h5py will extend the current file by default, so we want to make sure
     # there is no file at all.
@@ -1481,36 +1620,44 @@ def _saveAsHDF5(filename, ldata, thumbnail, compressed=True):
     except OSError:
         pass
     f = h5py.File(filename, "w") # w will fail if file exists
-    if compressed:
-        # szip is not free for commercial usage and lzf doesn't seem to be
-        # well supported yet
-        compression = "gzip"
+    # szip is not free for commercial usage, so not supported
+    if compression not in (None, "gzip", "lzf"):
+        raise ValueError("Compression %s not supported" % (compression,))
+
+    # The chunks are compressed in parallel, while the file is written
+    max_workers = multiprocessing.cpu_count()
+    if compression == "gzip":
+        executor = ThreadPoolExecutor(max_workers=max_workers)
     else:
-        compression = None
-
-    if thumbnail is not None:
-        thumbnail = _mergeCorrectionMetadata(thumbnail)
-        # Save the image as-is in a special group "Preview"
-        prevg = f.create_group("Preview")
-        _updateRGBMD(thumbnail) # ensure RGB info is there if needed
-        ids = _create_image_dataset(prevg, "Image", thumbnail, compression=compression)
-        _add_image_info(prevg, ids, thumbnail)
-
-    # merge correction metadata (as we cannot save them separatly in OME-TIFF)
-    ldata = [_mergeCorrectionMetadata(da) for da in ldata]
-
-    # list ndarray/list of list of metadata (one per channel)
-    acq, mds = _groupImages(ldata)
-    for i, da in enumerate(acq):
-        ga = f.create_group("Acquisition%d" % i)
-        _add_acquistion_svi(ga, da, mds[i], compression=compression)
+        executor = None
+    ckwargs = {"compression": compression, "compression_level": compression_level,
+               "executor": executor, "max_workers": max_workers}
 
-    f.close()
+    try:
+        if thumbnail is not None:
+            thumbnail = _mergeCorrectionMetadata(thumbnail)
+            # Save the image as-is in a special group "Preview"
+            prevg = f.create_group("Preview")
+            _updateRGBMD(thumbnail) # ensure RGB info is there if needed
+            ids = _create_image_dataset(prevg, "Image", thumbnail, **ckwargs)
+            _add_image_info(prevg, ids, thumbnail)
+
+        # merge correction metadata (as we cannot save them separatly in OME-TIFF)
+        ldata = [_mergeCorrectionMetadata(da) for da in ldata]
+
+        # list ndarray/list of list of metadata (one per channel)
+        acq, mds = _groupImages(ldata)
+        for i, da in enumerate(acq):
+            ga = f.create_group("Acquisition%d" % i)
+            _add_acquistion_svi(ga, da, mds[i], **ckwargs)
+    finally:
+        if executor:
+            executor.shutdown()
+        f.close()
 
 
-# TODO: allow to append data to a file, or any other way to allow saving large
-# data without having everything in memory simultaneously.
-def export(filename, data, thumbnail=None):
+def export(filename, data, thumbnail=None, compression=COMPRESSION,
+           compression_level=COMPRESSION_LEVEL):
     '''
     Write an HDF5 file with the given image and metadata
     filename (unicode): filename of the file to create (including path)
@@ -1524,13 +1671,207 @@ def export(filename, data, thumbnail=None):
       (reasonable) size. Must be either 2D array (greyscale) or 3D with last 
       dimension of length 3 (RGB). If the exporter doesn't support it, it will
       be dropped silently.
+    compression (None or str): "gzip" (default, compressed in parallel), "lzf",
+      or None for no compression.
+    compression_level (0<=int<=9): level of compression, for gzip. Higher
+      values give smaller files, but take more time.
     '''
     # TODO: add an argument to not do any clever data aggregation?
     if not isinstance(data, (list, tuple)):
         # TODO should probably not enforce it: respect duck typing
         assert(isinstance(data, model.DataArray))
         data = [data]
-    _saveAsHDF5(filename, data, thumbnail)
+    _saveAsHDF5(filename, data, thumbnail, compression, compression_level)
+
+
+class HDF5Appender(object):
+    """
+    Writes an HDF5 file, in which the data can be added progressively along the
+    T or Z dimension, for instance after each acquisition of a time-lapse or a
+    Z-stack. Only the data of one frame is kept in memory.
+    """
+
+    def __init__(self, filename, dim="T", compression=COMPRESSION,
+                 compression_level=COMPRESSION_LEVEL):
+        """
+        filename (unicode): filename of the file to create (including path)
+        dim (str): the dimension along which the data is appended ("T" or "Z")
+        compression (None or str): see export
+        compression_level (0<=int<=9): see export
+        """
+        if dim not in ("T", "Z"):
+            raise ValueError("dim must be T or Z, but got %s" % (dim,))
+        if compression not in (None, "gzip", "lzf"):
+            raise ValueError("Compression %s not supported" % (compression,))
+        self._filename = filename
+        self._dimi = "CTZYX".index(dim)
+        self._compression = compression
+        self._compression_level = compression_level
+        self._max_workers = multiprocessing.cpu_count()
+        if compression == "gzip":
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        else:
+            self._executor = None
+
+        self._file = None
+        self._datasets = []  # HDF Dataset for each acquisition
+        self._minmax = []  # (min, max) of the data of each acquisition
+        self._nframes = 0
+        self._acq_dates = []  # MD_ACQ_DATE of each frame (of the first acquisition)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def filenames(self):
+        """
+        (list of str): the files created so far (none before the first append)
+        """
+        if not self._datasets:
+            return []
+        return [self._filename]
+
+    def _open(self, acq, mds):
+        """
+        Create the file, based on the first frame of each acquisition
+        acq (list of DataArrays of 5 dims): the acquisitions
+        mds (list of (list of dict, or None)): see _groupImages()
+        """
+        try:
+            os.remove(self._filename)
+        except OSError:
+            pass
+        self._file = h5py.File(self._filename, "w")
+
+        for i, da in enumerate(acq):
+            ga = self._file.create_group("Acquisition%d" % i)
+            gi = ga.create_group("ImageData")
+            _h5py_enum_commit(ga, b"StateEnumeration", _dtstate)
+
+            shape = list(da.shape)
+            shape[self._dimi] = 0
+            maxshape = list(da.shape)
+            maxshape[self._dimi] = None
+            if self._compression is None:
+                copts = {}
+            else:
+                copts = {"compression": self._compression, "shuffle": True}
+                if self._compression == "gzip":
+                    copts["compression_opts"] = self._compression_level
+            # A chunk never spans over multiple frames (as the chunk along the
+            # appended dimension is 1).
+            ids = gi.create_dataset("Image", shape=tuple(shape), maxshape=tuple(maxshape),
+                                    dtype=da.dtype,
+                                    chunks=_guess_chunk_shape(da.shape, da.dtype.itemsize),
+                                    **copts)
+            _set_image_attrs(ids, da)
+
+            # The time of each frame is only known at the end
+            md = da.metadata.copy()
+            md.pop(model.MD_TIME_LIST, None)
+            hda = model.DataArray(da, md)
+            _add_image_info(gi, ids, hda)
+            _add_image_metadata(ga, hda, mds[i])
+            _add_svi_info(ga)
+
+            self._datasets.append(ids)
+            self._minmax.append((da.min(), da.max()))
+
+    def append(self, data):
+        """
+        Add a frame to the file.
+        data (list of model.DataArray, or model.DataArray): one frame for each
+          stream. All the frames must have the same shape as the first ones,
+          and have the dimension along which data is appended of size 1.
+        """
+        if not isinstance(data, (list, tuple)):
+            data = [data]
+        ldata = [_mergeCorrectionMetadata(da) for da in data]
+        acq, mds = _groupImages(ldata)
+        for da in acq:
+            if da.ndim != 5 or da.shape[self._dimi] != 1:
+                raise ValueError("Data of shape %s cannot be appended along %s" %
+                                 (da.shape, "CTZYX"[self._dimi]))
+
+        if self._file is None:
+            self._open(acq, mds)
+        elif (len(acq) != len(self._datasets) or
+              any(da.shape[:self._dimi] + da.shape[self._dimi + 1:] !=
+                  ds.shape[:self._dimi] + ds.shape[self._dimi + 1:] or
+                  da.dtype != ds.dtype
+                  for da, ds in zip(acq, self._datasets))):
+            raise ValueError("Data must be identical to the first frames, but got %s" %
+                             ([(da.shape, da.dtype) for da in acq],))
+
+        n = self._nframes
+        for i, (da, ds) in enumerate(zip(acq, self._datasets)):
+            ds.resize(n + 1, axis=self._dimi)
+            if self._executor is not None and not da.dtype.hasobject:
+                origin = [0] * 5
+                origin[self._dimi] = n
+                _write_chunks(ds, da, self._compression_level, self._executor,
+                              self._max_workers, origin)
+            else:
+                sl = [slice(None)] * 5
+                sl[self._dimi] = slice(n, n + 1)
+                ds[tuple(sl)] = da
+            mn, mx = self._minmax[i]
+            self._minmax[i] = min(mn, da.min()), max(mx, da.max())
+
+        self._acq_dates.append(acq[0].metadata.get(model.MD_ACQ_DATE))
+        self._nframes += 1
+
+    def close(self):
+        """
+        Finish writing the file. Must be called after all the data has been
+        appended.
+        """
+        try:
+            if self._file is None:
+                logging.warning("No data appended, so no file %s created", self._filename)
+                return
+
+            for ds, minmax in zip(self._datasets, self._minmax):
+                if ds.attrs.get("IMAGE_SUBCLASS") == b"IMAGE_GRAYSCALE":
+                    ds.attrs["IMAGE_MINMAXRANGE"] = list(minmax)
+
+                if self._dimi == 1 and None not in self._acq_dates:
+                    # Same as for MD_TIME_LIST, in _add_image_info()
+                    group = ds.parent
+                    time_list = [d - self._acq_dates[0] for d in self._acq_dates]
+                    ds_class = ds.attrs.get("CLASS")
+                    if ds_class is not None:
+                        del ds.attrs["CLASS"]
+                    group["DimensionScaleT"] = time_list
+                    group["DimensionScaleT"].attrs["UNIT"] = "s"
+                    ds.dims.create_scale(group["DimensionScaleT"], "T")
+                    _h5svi_set_state(group["DimensionScaleT"], numpy.uint(ST_REPORTED))
+                    ds.dims[1].attach_scale(group["DimensionScaleT"])
+                    if ds_class is not None:
+                        ds.attrs["CLASS"] = ds_class
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._executor:
+                self._executor.shutdown()
+
+
+def open_appendable(filename, dim="T", compression=COMPRESSION,
+                    compression_level=COMPRESSION_LEVEL):
+    """
+    Open a file to write data progressively, one frame at a time.
+    filename (unicode): filename of the file to create (including path)
+    dim (str): the dimension along which the data is appended ("T" or "Z")
+    compression (None or str): see export
+    compression_level (0<=int<=9): see export
+    return (HDF5Appender): call .append() for each new frame, and .close()
+      at the end.
+    """
+    return HDF5Appender(filename, dim, compression, compression_level)
 
 
 def read_data(filename):
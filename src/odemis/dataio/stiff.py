@@ -37,7 +37,8 @@ LOSSY = False
 # identifier of a file.
 
 
-def export(filename, data, thumbnail=None, compressed=True, pyramid=False):
+def export(filename, data, thumbnail=None, compressed=True, pyramid=False,
+           compression=tiff.COMPRESSION):
     '''
     Write a collection of multiple OME-TIFF files with the given images and 
     metadata
@@ -50,5 +51,19 @@ def export(filename, data, thumbnail=None, compressed=True, pyramid=False):
       with last dimension of length 3 (RGB). If the exporter doesn't support it,
       it will be dropped silently.
     compressed (boolean): whether the file is compressed or not.
+    compression (str): the compression used if compressed, see tiff.export().
     '''
-    tiff.export(filename, data, thumbnail, compressed, multiple_files=True, pyramid=pyramid)
+    tiff.export(filename, data, thumbnail, compressed, multiple_files=True, pyramid=pyramid,
+                compression=compression)
+
+
+def open_appendable(filename, dim="T", compressed=True, bigtiff=True,
+                    compression=tiff.COMPRESSION):
+    """
+    Open a collection of OME-TIFF files to write data progressively, one frame
+    at a time. See tiff.open_appendable() for the arguments.
+    return (TIFFAppender): call .append() for each new frame, and .close()
+      at the end.
+    """
+    return tiff.open_appendable(filename, dim, compressed, multiple_files=True, bigtiff=bigtiff,
+                                compression=compression)
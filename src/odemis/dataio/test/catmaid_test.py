@@ -22,14 +22,118 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 """
 from __future__ import division
 
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from future.moves.socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 import numpy
 from requests import ConnectionError
 
-from odemis.dataio import AuthenticationError
+from odemis.dataio import AuthenticationError, catmaid
 from odemis.dataio.catmaid import open_data
 
+logging.getLogger().setLevel(logging.DEBUG)
+
+# Description of the stack served by the local server
+LOCAL_STACK_SHAPE = (2048, 1536)  # X, Y
+LOCAL_TILE_SHAPE = (256, 256)  # X, Y
+LOCAL_LATENCY = 0.02  # s, time to answer any tile
+
+
+class CatmaidRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests like a (very simplified) Catmaid server, with a stack
+    using tiles of "directory based" source type.
+    """
+
+    def do_GET(self):
+        server = self.server
+        if re.match(r"^/1/stack/1/info$", self.path):
+            stack_info = {
+                "dimension": {"x": LOCAL_STACK_SHAPE[0], "y": LOCAL_STACK_SHAPE[1], "z": 3},
+                "resolution": {"x": 4.0, "y": 4.0, "z": 40.0},
+                "num_zoom_levels": 3,
+                "mirrors": [{
+                    "tile_width": LOCAL_TILE_SHAPE[0],
+                    "tile_height": LOCAL_TILE_SHAPE[1],
+                    "tile_source_type": catmaid.DIR_BASED,
+                    "file_extension": "png",
+                    "image_base": "http://localhost:%d/tiles/" % server.server_port,
+                }],
+            }
+            self._send(200, "application/json", json.dumps(stack_info).encode("ascii"))
+            return
+
+        m = re.match(r"^/tiles/(\d+)/(\d+)/(\d+)/(\d+)\.png$", self.path)
+        if not m:
+            self._send(404, "text/plain", b"Not found")
+            return
+
+        zoom, depth, row, col = [int(v) for v in m.groups()]
+        with server.lock:
+            server.tile_requests += 1
+        time.sleep(LOCAL_LATENCY)
+        if (col * LOCAL_TILE_SHAPE[0] >= LOCAL_STACK_SHAPE[0] / 2 ** zoom or
+            row * LOCAL_TILE_SHAPE[1] >= LOCAL_STACK_SHAPE[1] / 2 ** zoom):
+            self._send(404, "text/plain", b"No such tile")
+            return
+
+        im = Image.fromarray(get_local_tile(zoom, depth, row, col))
+        buf = BytesIO()
+        im.save(buf, "PNG")
+        self._send(200, "image/png", buf.getvalue())
+
+    def _send(self, code, content_type, content):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass  # Don't spam the console
+
+
+class LocalCatmaidServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server in a separate thread, replacing a Catmaid server for the tests
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("localhost", 0), CatmaidRequestHandler)
+        self.lock = threading.Lock()
+        self.tile_requests = 0  # number of tiles requested
+        self._thread = threading.Thread(target=self.serve_forever, name="Local Catmaid server")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def terminate(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join(5)
+
+
+def get_local_tile(zoom, depth, row, col):
+    """
+    return (numpy.array of uint8): the expected tile from the local server
+    """
+    tile = numpy.zeros(LOCAL_TILE_SHAPE[::-1], dtype=numpy.uint8)
+    tile[:, :] = (zoom * 50 + depth * 10 + row * 3 + col) % 256
+    tile[row % 16, :] = 255  # Just to have some variation in the image
+    return tile
+
 
 class TestCatmaid(unittest.TestCase):
 
@@ -92,5 +196,228 @@ class TestCatmaid(unittest.TestCase):
         numpy.testing.assert_array_equal(tile, numpy.zeros(size))
 
 
+class TestCatmaidLocal(unittest.TestCase):
+    """
+    Test the tile fetching and caching, on a local server
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalCatmaidServer()
+        cls.url = "catmaid://localhost:%d/?pid=1&sid0=1" % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+
+    def setUp(self):
+        # Use an empty cache for each test
+        self._orig_cache_path = catmaid.CACHE_PATH
+        self._orig_disk_cache_size = catmaid.DISK_CACHE_SIZE
+        catmaid.CACHE_PATH = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(catmaid.CACHE_PATH)
+        catmaid.CACHE_PATH = self._orig_cache_path
+        catmaid.DISK_CACHE_SIZE = self._orig_disk_cache_size
+
+    def test_get_tile(self):
+        """
+        Check the tiles are correctly read, and read only once from the server
+        """
+        das = open_data(self.url).content[0]
+        nreq = self.server.tile_requests
+        tile = das.getTile(2, 1, 0, depth=1)
+        numpy.testing.assert_array_equal(tile, get_local_tile(0, 1, 1, 2))
+        self.assertEqual(self.server.tile_requests, nreq + 1)
+        self.assertEqual(tile.metadata[catmaid.model.MD_PIXEL_SIZE], (4e-9, 4e-9))
+
+        # In memory cache
+        tile = das.getTile(2, 1, 0, depth=1)
+        numpy.testing.assert_array_equal(tile, get_local_tile(0, 1, 1, 2))
+        tile = das.getTile(1, 1, 2, depth=1)
+        numpy.testing.assert_array_equal(tile, get_local_tile(2, 1, 1, 1))
+        self.assertEqual(tile.metadata[catmaid.model.MD_PIXEL_SIZE], (16e-9, 16e-9))
+        self.assertEqual(self.server.tile_requests, nreq + 2)
+
+        # Non existing tile => blank
+        tile = das.getTile(100, 100, 0)
+        numpy.testing.assert_array_equal(tile, numpy.zeros(LOCAL_TILE_SHAPE[::-1]))
+
+        # Reopening the data, the tiles should be read from the disk cache
+        das = open_data(self.url).content[0]
+        nreq = self.server.tile_requests
+        tile = das.getTile(2, 1, 0, depth=1)
+        numpy.testing.assert_array_equal(tile, get_local_tile(0, 1, 1, 2))
+        self.assertEqual(self.server.tile_requests, nreq)
+
+    def test_get_tiles(self):
+        """
+        Check getTiles() and prefetch()
+        """
+        das = open_data(self.url).content[0]
+        pos = [(x, y) for x in range(8) for y in range(6)]
+        tiles = das.getTiles(pos, 0)
+        self.assertEqual(len(tiles), len(pos))
+        for (x, y), t in zip(pos, tiles):
+            numpy.testing.assert_array_equal(t, get_local_tile(0, 0, y, x))
+
+        # The second time, the tiles should all come from the cache
+        nreq = self.server.tile_requests
+        tiles = das.getTiles(pos[::-1], 0)
+        for (x, y), t in zip(pos[::-1], tiles):
+            numpy.testing.assert_array_equal(t, get_local_tile(0, 0, y, x))
+        self.assertEqual(self.server.tile_requests, nreq)
+
+        # Prefetch, and then get the tiles => no new requests
+        pos = [(x, y) for x in range(4) for y in range(3)]
+        das.prefetch(pos, 1, depth=2)
+        time.sleep(len(pos) * LOCAL_LATENCY + 1)
+        nreq = self.server.tile_requests
+        tiles = das.getTiles(pos, 1, depth=2)
+        for (x, y), t in zip(pos, tiles):
+            numpy.testing.assert_array_equal(t, get_local_tile(1, 2, y, x))
+        self.assertEqual(self.server.tile_requests, nreq)
+
+        # Prefetch, and immediately change the hint, and get some tiles which
+        # were in the first hint => the tiles should still be returned
+        das.prefetch([(x, y) for x in range(8) for y in range(6)], 0, depth=1)
+        das.prefetch([(0, 0)], 0, depth=2)
+        tiles = das.getTiles([(7, 5), (0, 0)], 0, depth=1)
+        numpy.testing.assert_array_equal(tiles[0], get_local_tile(0, 1, 5, 7))
+        numpy.testing.assert_array_equal(tiles[1], get_local_tile(0, 1, 0, 0))
+
+    def test_prefetch_demanded(self):
+        """
+        Check a tile which is waited for is not cancelled by a later prefetch()
+        """
+        das = open_data(self.url).content[0]
+        # Fill the queue, so that the tile waited for is not fetched immediately
+        das.prefetch([(x, y) for x in range(8) for y in range(6)], 0, depth=2)
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            f = executor.submit(das.getTiles, [(7, 5)], 0, depth=2)
+            time.sleep(0.01)  # Let getTiles() request the tile
+            # Hint the same tile, and then another one => the tile is still needed
+            das.prefetch([(7, 5)], 0, depth=2)
+            das.prefetch([(0, 0)], 1, depth=2)
+            tiles = f.result(10)
+        finally:
+            executor.shutdown()
+        numpy.testing.assert_array_equal(tiles[0], get_local_tile(0, 2, 5, 7))
+
+    def test_close(self):
+        """
+        Check the tiles are not fetched anymore after closing
+        """
+        das = open_data(self.url).content[0]
+        das.getTile(0, 0, 0)
+        das.prefetch([(x, y) for x in range(8) for y in range(6)], 0, depth=1)
+        das.close()
+        time.sleep(0.5)  # Let the tiles already started finish
+        nreq = self.server.tile_requests
+        time.sleep(0.5)
+        self.assertEqual(self.server.tile_requests, nreq)
+        das.close()  # Closing twice is fine
+
+    def test_disk_cache_size(self):
+        """
+        Check the disk cache doesn't grow above the maximum size
+        """
+        catmaid.DISK_CACHE_SIZE = 10000  # bytes
+        das = open_data(self.url).content[0]
+        das.getTiles([(x, y) for x in range(8) for y in range(6)], 0)
+
+        cache_dirs = os.listdir(catmaid.CACHE_PATH)
+        self.assertEqual(len(cache_dirs), 1)
+        cache_dir = os.path.join(catmaid.CACHE_PATH, cache_dirs[0])
+        sizes = [os.path.getsize(os.path.join(cache_dir, fn)) for fn in os.listdir(cache_dir)]
+        self.assertGreater(len(sizes), 0)
+        self.assertLessEqual(sum(sizes), catmaid.DISK_CACHE_SIZE)
+
+    def test_speed(self):
+        """
+        Compare the number of tiles per second, when fetched one at a time, all
+        together, and from the cache.
+        """
+        pos = [(x, y) for x in range(8) for y in range(6)]
+
+        das = open_data(self.url).content[0]
+        tstart = time.time()
+        for x, y in pos:
+            das.getTile(x, y, 0)
+        dur = time.time() - tstart
+        logging.info("Fetched %g tiles/s one at a time", len(pos) / dur)
+
+        das = open_data(self.url).content[0]
+        tstart = time.time()
+        das.getTiles(pos, 0, depth=1)
+        dur_batch = time.time() - tstart
+        logging.info("Fetched %g tiles/s in batch", len(pos) / dur_batch)
+        self.assertLess(dur_batch, dur)
+
+        das = open_data(self.url).content[0]
+        tstart = time.time()
+        das.getTiles(pos, 0, depth=1)
+        dur = time.time() - tstart
+        logging.info("Fetched %g tiles/s from the disk cache", len(pos) / dur)
+
+        tstart = time.time()
+        das.getTiles(pos, 0, depth=1)
+        dur = time.time() - tstart
+        logging.info("Fetched %g tiles/s from the memory cache", len(pos) / dur)
+
+
+
+class TestTileDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _get_total_size(self):
+        size = 0
+        for root, _, files in os.walk(self.path):
+            size += sum(os.path.getsize(os.path.join(root, fn)) for fn in files)
+        return size
+
+    def test_size_all_stacks(self):
+        """
+        Check the size limit applies to all the stacks together
+        """
+        cache = catmaid.TileDiskCache(self.path, 10000)
+        content = b"a" * 1000
+        for i in range(8):
+            cache.put("stack1", (0, 0, 0, i), content)
+        for i in range(8):
+            cache.put("stack2", (0, 0, 0, i), content)
+        self.assertEqual(sorted(os.listdir(self.path)), ["stack1", "stack2"])
+        self.assertLessEqual(self._get_total_size(), 10000)
+
+        # The least recently used tiles are deleted first
+        self.assertIsNone(cache.get("stack1", (0, 0, 0, 0)))
+        self.assertEqual(cache.get("stack2", (0, 0, 0, 7)), content)
+
+        # Reopening the cache takes into account all the stacks
+        cache = catmaid.TileDiskCache(self.path, 5000)
+        self.assertEqual(cache.get("stack2", (0, 0, 0, 6)), content)
+        cache.put("stack3", (0, 0, 0, 0), content)
+        self.assertLessEqual(self._get_total_size(), 5000)
+        self.assertEqual(cache.get("stack3", (0, 0, 0, 0)), content)
+
+    def test_shared(self):
+        """
+        Check the same cache is used for all the stacks
+        """
+        orig_cache_path = catmaid.CACHE_PATH
+        catmaid.CACHE_PATH = self.path
+        try:
+            self.assertIs(catmaid.get_disk_cache(), catmaid.get_disk_cache())
+        finally:
+            catmaid.CACHE_PATH = orig_cache_path
+
+
 if __name__ == '__main__':
     unittest.main()
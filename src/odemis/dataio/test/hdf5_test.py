@@ -258,6 +258,139 @@ class TestHDF5IO(unittest.TestCase):
         subim = im[0, 0, 0] # just one channel
         self.assertEqual(subim.shape, size[-1::-1])
 
+    def testExportCompression(self):
+        """
+        Check the data is read back identically, with all the compressions,
+        and chunks are adapted to the data
+        """
+        shape = (200, 1, 1, 75, 130)  # CTZYX
+        for dtype in (numpy.uint16, numpy.float32, ">i4"):
+            data = numpy.random.randint(0, 4000, shape).astype(dtype)
+            data = model.DataArray(data, {model.MD_DIMS: "CTZYX",
+                                          model.MD_WL_LIST: list(numpy.linspace(400e-9, 600e-9, shape[0]))})
+            for compression in (None, "gzip", "lzf"):
+                hdf5.export(FILENAME, data, compression=compression, compression_level=1)
+
+                f = h5py.File(FILENAME, "r")
+                im = f["Acquisition0/ImageData/Image"]
+                self.assertEqual(im.compression, compression)
+                if compression:
+                    self.assertTrue(im.shuffle)
+                    self.assertLessEqual(numpy.prod(im.chunks) * im.dtype.itemsize, hdf5.CHUNK_SIZE)
+                    # Not too elongated in any dimension
+                    self.assertGreater(min(im.chunks[0], im.chunks[3], im.chunks[4]), 10)
+                numpy.testing.assert_array_equal(im[()], data)
+                f.close()
+
+                rdata = hdf5.read_data(FILENAME)
+                numpy.testing.assert_array_equal(rdata[0], data)
+
+        self.assertRaises(ValueError, hdf5.export, FILENAME, data, compression="szip")
+
+    def testAppend(self):
+        """
+        Check that data appended along T or Z is read back as a cube
+        """
+        # 2 fluorescence streams (which will be grouped) + 1 SEM stream
+        fluo_md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6), model.MD_POS: (1e-3, -2e-3),
+                   model.MD_HW_NAME: "fake ccd", model.MD_EXP_TIME: 0.1}
+        sem_md = {model.MD_PIXEL_SIZE: (2e-7, 2e-7), model.MD_POS: (1e-3, -2e-3),
+                  model.MD_HW_NAME: "fake sem", model.MD_DWELL_TIME: 1e-6}
+        wls = (((400e-9, 420e-9), (500e-9, 520e-9)), ((600e-9, 620e-9), (700e-9, 720e-9)))
+        nframes = 4
+        frames = []  # for each frame, the data of each stream
+        tstart = time.time()
+        for i in range(nframes):
+            das = []
+            for inwl, outwl in wls:
+                md = dict(fluo_md)
+                md.update({model.MD_IN_WL: inwl, model.MD_OUT_WL: outwl,
+                           model.MD_ACQ_DATE: tstart + 2 * i})
+                das.append(model.DataArray(numpy.random.randint(0, 4000, (100, 120)).astype(numpy.uint16), md))
+            md = dict(sem_md, **{model.MD_ACQ_DATE: tstart + 2 * i})
+            das.append(model.DataArray(numpy.random.randint(0, 255, (50, 30)).astype(numpy.uint8), md))
+            frames.append(das)
+
+        for compression in ("gzip", "lzf", None):
+            with hdf5.open_appendable(FILENAME, "T", compression=compression) as appender:
+                for das in frames:
+                    appender.append(das)
+
+            # The fluorescence streams are stored together, but read back separately
+            rdata = hdf5.read_data(FILENAME)
+            self.assertEqual(len(rdata), 3)
+            for j, rd in enumerate(rdata):
+                exp = numpy.array([das[j] for das in frames])
+                self.assertEqual(rd.shape[-4:], (nframes, 1) + exp.shape[1:])
+                numpy.testing.assert_array_equal(rd.reshape(exp.shape), exp)
+                numpy.testing.assert_allclose(rd.metadata[model.MD_TIME_LIST], [0, 2, 4, 6])
+
+        # Along Z
+        md = {model.MD_PIXEL_SIZE: (1e-6, 2e-6, 3e-6), model.MD_POS: (1e-3, -2e-3, 5e-6),
+              model.MD_DIMS: "ZYX"}
+        zframes = [model.DataArray(numpy.random.randint(0, 4000, (1, 100, 120)).astype(numpy.uint16), md)
+                   for i in range(5)]
+        with hdf5.open_appendable(FILENAME, "Z") as appender:
+            self.assertEqual(appender.filenames, [])
+            for da in zframes:
+                appender.append(da)
+            self.assertEqual(appender.filenames, [FILENAME])
+            # Frames must all have the same shape
+            self.assertRaises(ValueError, appender.append, frames[0][2])
+
+        rd = hdf5.read_data(FILENAME)[0]
+        self.assertEqual(rd.shape, (1, 1, 5, 100, 120))
+        numpy.testing.assert_array_equal(rd[0, 0], numpy.concatenate(zframes))
+        numpy.testing.assert_allclose(rd.metadata[model.MD_PIXEL_SIZE], md[model.MD_PIXEL_SIZE])
+        numpy.testing.assert_allclose(rd.metadata[model.MD_POS], md[model.MD_POS])
+
+    def test_speed(self):
+        """
+        Compare the export of a spectrum cube, and the random access to a spectrum
+        or an image, with the h5py default chunks, and with the adapted chunks
+        """
+        shape = (1024, 1, 1, 256, 256)  # CTZYX
+        c = numpy.arange(shape[0]).reshape(shape[0], 1, 1, 1, 1)
+        y, x = numpy.mgrid[0:shape[-2], 0:shape[-1]]
+        data = 1000 + 800 * numpy.exp(-((c - 300 - y) / 40) ** 2) * (1 + numpy.sin(x / 9))
+        data += numpy.random.poisson(30, data.shape)
+        data = model.DataArray(data.astype(numpy.uint16), {model.MD_DIMS: "CTZYX"})
+
+        def read_random(im):
+            tstart = time.time()
+            for i in range(20):
+                y, x = numpy.random.randint(0, shape[-2]), numpy.random.randint(0, shape[-1])
+                im[:, 0, 0, y, x]
+            dur_spec = (time.time() - tstart) / 20
+            tstart = time.time()
+            for i in range(20):
+                im[numpy.random.randint(0, shape[0]), 0, 0]
+            dur_img = (time.time() - tstart) / 20
+            return dur_spec, dur_img
+
+        # Default h5py behaviour (as the previous export)
+        tstart = time.time()
+        with h5py.File(FILENAME, "w") as f:
+            f.create_dataset("Image", data=data, compression="gzip")
+        dur_write = time.time() - tstart
+        fsize = os.stat(FILENAME).st_size
+        with h5py.File(FILENAME, "r") as f:
+            dur_spec, dur_img = read_random(f["Image"])
+        logging.info("Default chunks: write %g s, %d MB, read spectrum %g s, read image %g s",
+                     dur_write, fsize / 2 ** 20, dur_spec, dur_img)
+
+        for level in (1, hdf5.COMPRESSION_LEVEL):
+            tstart = time.time()
+            hdf5.export(FILENAME, data, compression_level=level)
+            dur_write = time.time() - tstart
+            fsize = os.stat(FILENAME).st_size
+            with h5py.File(FILENAME, "r") as f:
+                im = f["Acquisition0/ImageData/Image"]
+                dur_spec, dur_img = read_random(im)
+                numpy.testing.assert_array_equal(im[()], data)
+            logging.info("Adapted chunks (level %d): write %g s, %d MB, read spectrum %g s, read image %g s",
+                         level, dur_write, fsize / 2 ** 20, dur_spec, dur_img)
+
     def testExportSpatialCube(self):
         """
         Check it's possible to export 3D spatial data
@@ -136,6 +136,45 @@ class TestTiffIO(unittest.TestCase):
             # No thumbnail handling for now, so assert that is empty
             self.assertEqual(rthumbnail, [])
 
+    def testAppend(self):
+        """
+        Check that data appended along T is written in multiple files
+        """
+        # 2 fluorescence streams (which will be grouped) + 1 SEM stream
+        fluo_md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6), model.MD_POS: (1e-3, -2e-3),
+                   model.MD_HW_NAME: "fake ccd", model.MD_EXP_TIME: 0.1}
+        sem_md = {model.MD_PIXEL_SIZE: (2e-7, 2e-7), model.MD_POS: (1e-3, -2e-3),
+                  model.MD_HW_NAME: "fake sem", model.MD_DWELL_TIME: 1e-6}
+        wls = (((400e-9, 420e-9), (500e-9, 520e-9)), ((600e-9, 620e-9), (700e-9, 720e-9)))
+        nframes = 4
+        frames = []  # for each frame, the data of each stream
+        tstart = time.time()
+        for i in range(nframes):
+            das = []
+            for inwl, outwl in wls:
+                md = dict(fluo_md)
+                md.update({model.MD_IN_WL: inwl, model.MD_OUT_WL: outwl,
+                           model.MD_ACQ_DATE: tstart + 2 * i})
+                das.append(model.DataArray(numpy.random.randint(0, 4000, (100, 120)).astype(numpy.uint16), md))
+            md = dict(sem_md, **{model.MD_ACQ_DATE: tstart + 2 * i})
+            das.append(model.DataArray(numpy.random.randint(0, 255, (50, 30)).astype(numpy.uint8), md))
+            frames.append(das)
+
+        with stiff.open_appendable(FILENAME, "T") as appender:
+            for das in frames:
+                appender.append(das)
+            self.assertEqual(len(appender.filenames), 2)
+            self.assertEqual(appender.filenames[0], FILENAME)
+        self.no_of_images = 2  # The fluorescence streams are in the same file
+
+        rdata = tiff.read_data(FILENAME)
+        self.assertEqual(len(rdata), 3)
+        for j, rd in enumerate(rdata):
+            exp = numpy.array([das[j] for das in frames])
+            self.assertEqual(rd.shape, (1, nframes, 1) + exp.shape[1:])
+            numpy.testing.assert_array_equal(rd[0, :, 0], exp)
+            numpy.testing.assert_allclose(rd.metadata[model.MD_TIME_LIST], [0, 2, 4, 6])
+
     def testRename(self):
         """
         Check it's at least possible to open one DataArray, when the files are
@@ -1665,6 +1665,144 @@ class TestTiffIO(unittest.TestCase):
             self.assertEqual(rmd[model.MD_DESCRIPTION], emd[model.MD_DESCRIPTION])
             self.assertEqual(rmd[model.MD_DIMS], emd[model.MD_DIMS])
 
+    def testExportCompressedLZW(self):
+        """
+        Checks the images are compressed by default as LZW, in a single strip
+        """
+        shape = (1000, 1300)
+        arr = numpy.random.randint(0, 5000, shape).astype(numpy.uint16)
+        tiff.export(FILENAME, model.DataArray(arr, {model.MD_DIMS: "YX"}))
+
+        im = libtiff.TIFF.open(FILENAME)
+        self.assertEqual(im.GetField("Compression"), T.COMPRESSION_LZW)
+        self.assertEqual(im.NumberOfStrips(), 1)
+        im.close()
+
+        rdata = tiff.read_data(FILENAME)
+        numpy.testing.assert_array_equal(rdata[0], arr)
+
+        self.assertRaises(ValueError, tiff.export, FILENAME, model.DataArray(arr),
+                          compression="foo")
+
+    def testExportCompressedStrips(self):
+        """
+        Checks the Deflate compressed images are split in strips, and can be
+        read back identically, whatever the dtype and byte order
+        """
+        shape = (1000, 1300)
+        for dtype in (numpy.uint16, ">u2", numpy.int32, numpy.float32):
+            arr = numpy.random.randint(-100, 5000, shape).astype(dtype)
+            data = model.DataArray(arr, {model.MD_DIMS: "YX"})
+            tiff.export(FILENAME, data, compression="deflate")
+
+            im = libtiff.TIFF.open(FILENAME)
+            self.assertEqual(im.GetField("Compression"), T.COMPRESSION_ADOBE_DEFLATE)
+            if numpy.dtype(dtype).kind in "iu":
+                self.assertEqual(im.GetField("Predictor"), T.PREDICTOR_HORIZONTAL)
+            self.assertGreater(im.NumberOfStrips(), 1)
+            im.close()
+
+            rdata = tiff.read_data(FILENAME)
+            numpy.testing.assert_array_equal(rdata[0], arr)
+
+    def testAppendTimelapse(self):
+        """
+        Check that data appended along T is read back as a T cube
+        """
+        # 2 fluorescence streams (which will be grouped) + 1 SEM stream
+        fluo_md = {model.MD_PIXEL_SIZE: (1e-6, 1e-6), model.MD_POS: (1e-3, -2e-3),
+                   model.MD_HW_NAME: "fake ccd", model.MD_EXP_TIME: 0.1}
+        sem_md = {model.MD_PIXEL_SIZE: (2e-7, 2e-7), model.MD_POS: (1e-3, -2e-3),
+                  model.MD_HW_NAME: "fake sem", model.MD_DWELL_TIME: 1e-6}
+        wls = (((400e-9, 420e-9), (500e-9, 520e-9)), ((600e-9, 620e-9), (700e-9, 720e-9)))
+        nframes = 4
+        frames = []  # for each frame, the data of each stream
+        tstart = time.time()
+        for i in range(nframes):
+            das = []
+            for inwl, outwl in wls:
+                md = dict(fluo_md)
+                md.update({model.MD_IN_WL: inwl, model.MD_OUT_WL: outwl,
+                           model.MD_ACQ_DATE: tstart + 2 * i})
+                das.append(model.DataArray(numpy.random.randint(0, 4000, (100, 120)).astype(numpy.uint16), md))
+            md = dict(sem_md, **{model.MD_ACQ_DATE: tstart + 2 * i})
+            das.append(model.DataArray(numpy.random.randint(0, 255, (50, 30)).astype(numpy.uint8), md))
+            frames.append(das)
+
+        with tiff.open_appendable(FILENAME, "T") as appender:
+            for das in frames:
+                appender.append(das)
+
+        rdata = tiff.read_data(FILENAME)
+        self.assertEqual(len(rdata), 3)
+        for j, rd in enumerate(rdata):
+            exp = numpy.array([das[j] for das in frames])
+            self.assertEqual(rd.shape, (1, nframes, 1) + exp.shape[1:])
+            numpy.testing.assert_array_equal(rd[0, :, 0], exp)
+            numpy.testing.assert_allclose(rd.metadata[model.MD_TIME_LIST], [0, 2, 4, 6])
+            self.assertEqual(rd.metadata[model.MD_PIXEL_SIZE][:2], frames[0][j].metadata[model.MD_PIXEL_SIZE])
+
+        # Frames must all have the same shape
+        appender = tiff.open_appendable(FILENAME, "T", compressed=False, bigtiff=False)
+        appender.append(frames[0][2])
+        self.assertRaises(ValueError, appender.append, frames[0][0])
+        appender.close()
+        numpy.testing.assert_array_equal(tiff.read_data(FILENAME)[0], frames[0][2])
+
+    def testAppendZStack(self):
+        """
+        Check that data appended along Z is read back as a Z cube
+        """
+        md = {model.MD_PIXEL_SIZE: (1e-6, 2e-6, 3e-6), model.MD_POS: (1e-3, -2e-3, 5e-6),
+              model.MD_DIMS: "ZYX"}
+        frames = [model.DataArray(numpy.random.randint(0, 4000, (1, 100, 120)).astype(numpy.uint16), md)
+                  for i in range(5)]
+        with tiff.open_appendable(FILENAME, "Z") as appender:
+            self.assertEqual(appender.filenames, [])
+            for da in frames:
+                appender.append(da)
+            self.assertEqual(appender.filenames, [FILENAME])
+
+        rdata = tiff.read_data(FILENAME)
+        self.assertEqual(len(rdata), 1)
+        rd = rdata[0]
+        self.assertEqual(rd.shape, (1, 1, 5, 100, 120))
+        numpy.testing.assert_array_equal(rd[0, 0], numpy.concatenate(frames))
+        numpy.testing.assert_allclose(rd.metadata[model.MD_PIXEL_SIZE], md[model.MD_PIXEL_SIZE])
+        numpy.testing.assert_allclose(rd.metadata[model.MD_POS], md[model.MD_POS])
+
+    def test_speed(self):
+        """
+        Compare the export duration of a 4k x 4k x N channels uint16 image,
+        uncompressed, and compressed as LZW and Deflate
+        """
+        shape = (4096, 4096)
+        ldata = []
+        for c in range(3):
+            y, x = numpy.mgrid[0:shape[0], 0:shape[1]]
+            arr = 1000 + 500 * numpy.sin(x / (50 + c)) * numpy.cos(y / 70)
+            arr += numpy.random.poisson(20, shape)
+            md = {model.MD_DESCRIPTION: "channel %d" % (c,),
+                  model.MD_IN_WL: (400e-9 + c * 100e-9, 450e-9 + c * 100e-9),
+                  model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+                  model.MD_DIMS: "YX"}
+            ldata.append(model.DataArray(arr.astype(numpy.uint16), md))
+
+        for pyramid in (False, True):
+            for compressed, compression in ((False, "lzw"), (True, "lzw"), (True, "deflate")):
+                tstart = time.time()
+                tiff.export(FILENAME, ldata, compressed=compressed, pyramid=pyramid,
+                            compression=compression)
+                dur = time.time() - tstart
+                fsize = os.stat(FILENAME).st_size
+                logging.info("Export of %d x %s (pyramid=%s, compressed=%s, compression=%s) took %g s, "
+                             "file size = %d MB",
+                             len(ldata), shape, pyramid, compressed, compression, dur, fsize / 2 ** 20)
+
+                rdata = tiff.read_data(FILENAME)
+                for d, rd in zip(ldata, rdata):
+                    numpy.testing.assert_array_equal(d, rd)
+
     def testReadAndSaveTemporal(self):
         """
         Checks that can both write and read back an time-correlator data
@@ -1926,6 +2064,63 @@ class TestTiffIO(unittest.TestCase):
         self.assertEqual(full_image[-1][0], 4096)
         self.assertEqual(full_image[-1][-1], 4097)
 
+    def testExportTiled(self):
+        """
+        Checks that an image generated tile by tile can be read back, with its
+        lower resolutions
+        """
+        size = (1000, 1300)  # X, Y
+        arr = numpy.random.randint(0, 5000, size[::-1]).astype(numpy.uint16)
+        md = {model.MD_PIXEL_SIZE: (1e-6, 2e-6), model.MD_POS: (1e-3, -2e-3)}
+        requested = []
+
+        def get_tile(x, y):
+            requested.append((x, y))
+            return arr[y * tiff.TILE_SIZE:(y + 1) * tiff.TILE_SIZE,
+                       x * tiff.TILE_SIZE:(x + 1) * tiff.TILE_SIZE]
+
+        # The lower resolutions are the average of each 2x2 pixels of the level above
+        levels = [arr]
+        for z in range(2):
+            im = levels[-1].astype(numpy.int64)
+            h, w = im.shape[0] // 2, im.shape[1] // 2
+            s = im[0:h * 2:2, 0:w * 2:2] + im[1:h * 2:2, 0:w * 2:2] + im[0:h * 2:2, 1:w * 2:2] + im[1:h * 2:2, 1:w * 2:2]
+            levels.append(((s + 2) // 4).astype(arr.dtype))
+
+        for compressed in (True, False):
+            requested = []
+            tiff.export_tiled(FILENAME, size[::-1], numpy.uint16, get_tile, md, compressed=compressed)
+            # Each tile of the full resolution is requested once: 4x6
+            self.assertEqual(len(requested), 24)
+            self.assertEqual(len(set(requested)), 24)
+
+            acd = tiff.open_data(FILENAME)
+            das = acd.content[0]
+            self.assertEqual(das.shape, size[::-1])
+            self.assertEqual(das.maxzoom, 2)
+            self.assertEqual(das.metadata[model.MD_PIXEL_SIZE], md[model.MD_PIXEL_SIZE])
+            numpy.testing.assert_allclose(das.metadata[model.MD_POS], md[model.MD_POS])
+            numpy.testing.assert_array_equal(das.getData(), arr)
+            for z in range(3):
+                exp = levels[z][tiff.TILE_SIZE:2 * tiff.TILE_SIZE, 0:tiff.TILE_SIZE]
+                numpy.testing.assert_array_equal(das.getTile(0, 1, z), exp)
+            # A partial tile, on the border
+            exp = levels[1][tiff.TILE_SIZE:2 * tiff.TILE_SIZE, tiff.TILE_SIZE:]
+            numpy.testing.assert_array_equal(das.getTile(1, 1, 1), exp)
+
+        # RGB
+        arr = numpy.random.randint(0, 255, (300, 400, 3)).astype(numpy.uint8)
+        tiff.export_tiled(FILENAME, arr.shape, numpy.uint8,
+                          lambda x, y: arr[y * 256:(y + 1) * 256, x * 256:(x + 1) * 256],
+                          pyramid=False)
+        rdata = tiff.read_data(FILENAME)
+        numpy.testing.assert_array_equal(rdata[0], arr)
+
+        # Wrong tile shape
+        with self.assertRaises(ValueError):
+            tiff.export_tiled(FILENAME, (300, 400), numpy.uint8,
+                              lambda x, y: numpy.zeros((256, 256), numpy.uint8))
+
     def testExportMultiArrayPyramid(self):
         """
         Checks that we can export and read back the metadata and data of 1 SEM image,
@@ -25,11 +25,15 @@ from past.builtins import basestring
 from builtins import range
 
 import calendar
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 import json
 from libtiff import TIFF
 import logging
 import math
+import multiprocessing
 import numpy
 from odemis import model, util
 import odemis
@@ -40,9 +44,11 @@ import operator
 import os
 import re
 import sys
+import tempfile
 import threading
 import time
 import uuid
+import zlib
 
 import libtiff.libtiff_ctypes as T  # for the constant names
 import xml.etree.ElementTree as ET
@@ -71,6 +77,31 @@ CAN_SAVE_PYRAMID = True # indicates the support for pyramidal export
 TILE_SIZE = 256 # Tile size of pyramidal images
 LOSSY = False
 
+# Compression used when exporting with compressed=True:
+# * "lzw": each image is compressed by libtiff, as a single strip (or by tiles
+#   in pyramid mode). According to this page:
+#   http://www.openmicroscopy.org/site/support/file-formats/ome-tiff/ome-tiff-data
+#   LZW is a good trade-off between compatibility and small size (reduces file
+#   size by about 2). => that's why we use it by default
+# * "deflate": Deflate with the horizontal predictor (for integers). It is
+#   compressed via zlib, which releases the GIL, so the strips (or tiles) of an
+#   image are compressed in parallel, on a thread pool, and only the
+#   compressed buffers are written in order in the file. The images are split
+#   in strips of about STRIP_SIZE bytes. At level 1, it's about as fast as LZW
+#   on one core, and compresses a little bit better.
+COMPRESSION = "lzw"
+DEFLATE_LEVEL = 1  # 1 (fastest) -> 9 (smallest)
+STRIP_SIZE = 2 ** 18  # bytes, approximate (uncompressed) size of each strip
+
+# compression name -> libtiff compression name
+_LIBTIFF_COMPRESSIONS = {"lzw": "lzw", "deflate": "adobe_deflate"}
+
+# Thread pool to compress (or generate) the strips and tiles in parallel.
+# Created when first needed, and shared by all the exports.
+_MAX_WORKERS = multiprocessing.cpu_count()
+_executor = None
+_executor_lock = threading.Lock()
+
 # We try to make it as much as possible looking like a normal (multi-page) TIFF,
 # with as much metadata as possible saved in the known TIFF tags. In addition,
 # we ensure it's compatible with OME-TIFF, which support much more metadata, and
@@ -617,7 +648,7 @@ def _updateMDFromOME(root, das):
             pass
 
         hd_2_ifd, hdims = _getIFDsFromOME(pxe, offset=ifd_offset)
-        ifd_offset += len(hd_2_ifd)
+        ifd_offset += hd_2_ifd.size
 
         # Channels are a bit tricky, because apparently they are associated to
         # each C only by the order they are specified.
@@ -1650,20 +1681,48 @@ def _mergeCorrectionMetadata(da):
     return model.DataArray(da, md) # create a view
 
 
-def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_files=False,
-                       file_index=None, uuid_list=None, pyramid=False):
+def _getExecutor():
+    """
+    return (ThreadPoolExecutor): the thread pool shared by all the exports
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_MAX_WORKERS)
+        return _executor
+
+
+def _getLibtiffCompression(compressed, compression):
+    """
+    compressed (boolean): whether the file is compressed or not
+    compression (str): the compression to use, if compressed ("lzw" or "deflate")
+    return (None or str): the compression name for libtiff
+    raise ValueError: if the compression is not supported
+    """
+    if not compressed:
+        return None
+    try:
+        return _LIBTIFF_COMPRESSIONS[compression]
+    except KeyError:
+        raise ValueError("Compression %s not supported" % (compression,))
+
+
+def _saveAsMultiTiffLT(filename, ldata, thumbnail, compression="lzw", multiple_files=False,
+                       file_index=None, uuid_list=None, pyramid=False, executor=None):
     """
     Saves a list of DataArray as a multiple-page TIFF file.
     filename (string): name of the file to save
     ldata (list of DataArray): list of 2D data of int or float. Should have at least one array
     thumbnail (None or DataArray): see export
-    compressed (boolean): whether the file is LZW compressed or not.
+    compression (None or str): libtiff compression of the images, or None for
+      no compression.
     multiple_files (boolean): whether the data is distributed across multiple
       files or not.
     file_index (int): index of this particular file.
     uuid_list (list of str): list that contains all the file uuids
     pyramid (boolean): whether the file should be saved in the pyramid format or not.
       In this format, each image is saved along with different zoom levels
+    executor (None or Executor): to compress the images in parallel
     """
     if multiple_files:
         # Add index
@@ -1675,14 +1734,6 @@ def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_fil
     else:
         f = TIFF.open(filename, mode='w')
 
-    # According to this page: http://www.openmicroscopy.org/site/support/file-formats/ome-tiff/ome-tiff-data
-    # LZW is a good trade-off between compatibility and small size (reduces file
-    # size by about 2). => that's why we use it by default
-    if compressed:
-        compression = "lzw"
-    else:
-        compression = None
-
     # merge correction metadata (as we cannot save them separatly in OME-TIFF)
     ldata = [_mergeCorrectionMetadata(da) for da in ldata]
 
@@ -1723,7 +1774,7 @@ def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_fil
         # Our version is fixed
 
         # write_rgb makes it clever to detect RGB vs. Greyscale
-        f.write_image(thumbnail, compression=compression, write_rgb=True)
+        write_image(f, thumbnail, compression=compression, write_rgb=True, executor=executor)
 
 
         # TODO also save it as thumbnail of the image (in limited size)
@@ -1775,42 +1826,56 @@ def _saveAsMultiTiffLT(filename, ldata, thumbnail, compressed=True, multiple_fil
         # Only get the corresponding data for this file
         ldata = sorted_x[file_index][1]
 
+    for data in ldata:
+        _writeDataArray(f, data, compression, pyramid, executor, ometxt)
+        ometxt = None  # OME tags are only saved on the first image
+
+
+def _writeDataArray(f, data, compression=None, pyramid=False, executor=None, ometxt=None):
+    """
+    Write all the planes of a DataArray, as consecutive TIFF pages
+    f (libtiff file handle): Handle of a TIFF file
+    data (DataArray): the data to write, see export() for the dimensions
+    compression (None or str): see write_image()
+    pyramid (boolean): see write_image()
+    executor (None or Executor): to compress the images in parallel
+    ometxt (None or bytes): the OME-XML to store in the first page
+    """
     # TODO: to keep the code simple, we should just first convert the DAs into
     # 2D or 3D DAs and put it in an dict original DA -> DAs
-    for data in ldata:
-        # TODO: see if we need to set FILETYPE_PAGE + Page number for each image? data?
-        tags = _convertToTiffTag(data.metadata)
-        if ometxt: # save OME tags if not yet done
-            f.SetField(T.TIFFTAG_IMAGEDESCRIPTION, ometxt)
-            ometxt = None
-
-        # if metadata indicates YXC format just handle it as RGB
-        if data.metadata.get(model.MD_DIMS) == 'YXC' and data.shape[-1] in (3, 4):
-            write_rgb = True
-            hdim = data.shape[:-3]
-        # TODO: handle RGB for C at any position before and after XY, but iif TZ=11
-        # for data > 2D: write as a sequence of 2D images or RGB images
-        elif data.ndim == 5 and data.shape[0] == 3:  # RGB
-            # Write an RGB image, instead of 3 images along C
-            write_rgb = True
-            hdim = data.shape[1:3]
-            data = numpy.rollaxis(data, 0, -2) # move C axis near YX
-        else:
-            write_rgb = False
-            hdim = data.shape[:-2]
+    # TODO: see if we need to set FILETYPE_PAGE + Page number for each image? data?
+    tags = _convertToTiffTag(data.metadata)
+    if ometxt:  # save OME tags if not yet done
+        f.SetField(T.TIFFTAG_IMAGEDESCRIPTION, ometxt)
 
-        for i in numpy.ndindex(*hdim):
-            # Save metadata (before the image)
-            for key, val in tags.items():
-                try:
-                    f.SetField(key, val)
-                except Exception:
-                    logging.exception("Failed to store tag %s with value '%s'", key, val)
-            if data[i].dtype in [numpy.int64, numpy.uint64]:
-                c = None # libtiff doesn't support compression on these types
-            else:
-                c = compression
-            write_image(f, data[i], write_rgb=write_rgb, compression=c, pyramid=pyramid)
+    # if metadata indicates YXC format just handle it as RGB
+    if data.metadata.get(model.MD_DIMS) == 'YXC' and data.shape[-1] in (3, 4):
+        write_rgb = True
+        hdim = data.shape[:-3]
+    # TODO: handle RGB for C at any position before and after XY, but iif TZ=11
+    # for data > 2D: write as a sequence of 2D images or RGB images
+    elif data.ndim == 5 and data.shape[0] == 3:  # RGB
+        # Write an RGB image, instead of 3 images along C
+        write_rgb = True
+        hdim = data.shape[1:3]
+        data = numpy.rollaxis(data, 0, -2) # move C axis near YX
+    else:
+        write_rgb = False
+        hdim = data.shape[:-2]
+
+    for i in numpy.ndindex(*hdim):
+        # Save metadata (before the image)
+        for key, val in tags.items():
+            try:
+                f.SetField(key, val)
+            except Exception:
+                logging.exception("Failed to store tag %s with value '%s'", key, val)
+        if data[i].dtype in [numpy.int64, numpy.uint64]:
+            c = None # libtiff doesn't support compression on these types
+        else:
+            c = compression
+        write_image(f, data[i], write_rgb=write_rgb, compression=c, pyramid=pyramid,
+                    executor=executor)
 
 
 def _genResizedShapes(data):
@@ -1835,18 +1900,363 @@ def _genResizedShapes(data):
     return resized_shapes
 
 
-def write_image(f, arr, compression=None, write_rgb=False, pyramid=False):
+def _getSampleFormat(dtype):
+    """
+    dtype (numpy.dtype): type of the data
+    return (int): the corresponding TIFF SampleFormat
+    """
+    if numpy.issubdtype(dtype, numpy.floating):
+        return T.SAMPLEFORMAT_IEEEFP
+    elif numpy.issubdtype(dtype, numpy.unsignedinteger) or numpy.issubdtype(dtype, numpy.bool_):
+        return T.SAMPLEFORMAT_UINT
+    elif numpy.issubdtype(dtype, numpy.signedinteger):
+        return T.SAMPLEFORMAT_INT
+    elif numpy.issubdtype(dtype, numpy.complexfloating):
+        return T.SAMPLEFORMAT_COMPLEXIEEEFP
+    else:
+        raise NotImplementedError("Unsupported dtype %s" % (dtype,))
+
+
+def _compressBlock(block, predictor, shape=None):
+    """
+    Compress one strip or tile, as Deflate.
+    Note: it is thread-safe, and mostly runs without the GIL.
+    block (ndarray): the pixels of the strip or tile (Y, X and optionally samples)
+    predictor (bool): if True, apply the horizontal predictor before compressing
+    shape (None or tuple of int): if not None, the block is first padded with 0's
+      to this shape (for the tiles on the edges).
+    return (bytes): the compressed data
+    """
+    h, w = block.shape[:2]
+    if shape is not None and block.shape != shape:
+        out = numpy.zeros(shape, dtype=block.dtype)
+    elif predictor:
+        out = numpy.empty_like(block, order="C")
+    else:
+        out = numpy.ascontiguousarray(block)
+
+    if predictor:
+        # Difference with the previous pixel of the same row (and same sample),
+        # with wrap-around, as specified by the TIFF horizontal predictor.
+        # Note: the padding (if any) is left to 0, which doesn't correspond to
+        # 0's once decoded, but these pixels are outside of the image anyway.
+        out[:h, 0] = block[:, 0]
+        numpy.subtract(block[:, 1:], block[:, :-1], out=out[:h, 1:w])
+    elif out is not block:
+        out[:h, :w] = block
+
+    return zlib.compress(out.data, DEFLATE_LEVEL)
+
+
+def _writeRawBlocks(write_raw, blocks, predictor, shape=None, executor=None):
+    """
+    Compresses the blocks (strips or tiles) and writes them in order.
+    write_raw (callable (int, bytes, int)): function to write a raw (precompressed)
+      block, taking the block index, the data, and its size.
+    blocks (list of ndarray): the blocks, in order
+    predictor (bool): if True, use the horizontal predictor
+    shape (None or tuple of int): shape of all the blocks, after padding
+    executor (None or Executor): to compress the blocks in parallel. If None,
+      they are compressed in the current thread.
+    """
+    jobs = ((_compressBlock, (b, predictor, shape)) for b in blocks)
+    _writeRawJobs(write_raw, jobs, executor)
+
+
+def _writeRawJobs(write_raw, jobs, executor=None, max_workers=_MAX_WORKERS):
+    """
+    Runs the functions generating the raw blocks (strips or tiles), and writes
+    the blocks in order.
+    write_raw (callable (int, bytes, int)): function to write a raw (precompressed)
+      block, taking the block index, the data, and its size.
+    jobs (iterable of (callable, tuple)): for each block, in order, the function
+      and its arguments, which returns the raw data of the block (as bytes).
+    executor (None or Executor): to run the jobs in parallel. If None, they are
+      run in the current thread.
+    max_workers (int): number of workers of the executor
+    """
+    if executor is None:
+        for i, (fn, args) in enumerate(jobs):
+            buf = fn(*args)
+            write_raw(i, buf, len(buf))
+        return
+
+    # Keep a limited number of blocks computed in advance, to limit the
+    # memory usage, but enough to keep all the workers busy.
+    max_queued = 2 * max_workers
+    queued = deque()
+    jobs = iter(jobs)
+    for fn, args in jobs:
+        queued.append(executor.submit(fn, *args))
+        if len(queued) >= max_queued:
+            break
+
+    i = 0
+    while queued:
+        buf = queued.popleft().result()
+        write_raw(i, buf, len(buf))
+        i += 1
+        for fn, args in jobs:  # Add a block in the queue, if there is any left
+            queued.append(executor.submit(fn, *args))
+            break
+
+
+def _setImageFields(f, arr, write_rgb):
+    """
+    Set the TIFF fields describing the image layout, as libtiff.write_image()
+    would do (for the compression, the caller is responsible).
+    f (libtiff file handle): Handle of a TIFF file
+    arr (ndarray): the image, 2D, or 3D if RGB
+    write_rgb (boolean): True if the image is RGB, False if the image is grayscale
+    return (list of ndarrays): each plane of the image (YX or YXS)
+    raise NotImplementedError: if the array shape is not supported
+    """
+    if not arr.dtype.isnative:
+        # The data is written as-is, so it must be in the same byte order as the file
+        arr = arr.astype(arr.dtype.newbyteorder("="))
+
+    f.SetField(T.TIFFTAG_BITSPERSAMPLE, arr.itemsize * 8)
+    f.SetField(T.TIFFTAG_SAMPLEFORMAT, _getSampleFormat(arr.dtype))
+    f.SetField(T.TIFFTAG_ORIENTATION, T.ORIENTATION_TOPLEFT)
+
+    if arr.ndim == 2:
+        height, width = arr.shape
+        f.SetField(T.TIFFTAG_IMAGEWIDTH, width)
+        f.SetField(T.TIFFTAG_IMAGELENGTH, height)
+        f.SetField(T.TIFFTAG_PHOTOMETRIC, T.PHOTOMETRIC_MINISBLACK)
+        f.SetField(T.TIFFTAG_PLANARCONFIG, T.PLANARCONFIG_CONTIG)
+        return [arr]
+    elif arr.ndim == 3 and write_rgb:
+        # Guess the planar config, with preference for separate planes
+        if arr.shape[2] in (3, 4):
+            planar_config = T.PLANARCONFIG_CONTIG
+            height, width, depth = arr.shape
+            planes = [arr]
+        else:
+            planar_config = T.PLANARCONFIG_SEPARATE
+            depth, height, width = arr.shape
+            planes = list(arr)
+
+        f.SetField(T.TIFFTAG_PHOTOMETRIC, T.PHOTOMETRIC_RGB)
+        f.SetField(T.TIFFTAG_IMAGEWIDTH, width)
+        f.SetField(T.TIFFTAG_IMAGELENGTH, height)
+        f.SetField(T.TIFFTAG_SAMPLESPERPIXEL, depth)
+        f.SetField(T.TIFFTAG_PLANARCONFIG, planar_config)
+        if depth == 4:  # RGBA
+            f.SetField(T.TIFFTAG_EXTRASAMPLES, [T.EXTRASAMPLE_UNASSALPHA], count=1)
+        elif depth > 4:  # No idea...
+            f.SetField(T.TIFFTAG_EXTRASAMPLES, [T.EXTRASAMPLE_UNSPECIFIED] * (depth - 3),
+                       count=(depth - 3))
+        return planes
+    else:
+        raise NotImplementedError("Cannot write image of shape %s" % (arr.shape,))
+
+
+def _setCompressionFields(f, arr):
+    """
+    Set the TIFF fields for the Deflate compression (and predictor if useful)
+    return (bool): True if the horizontal predictor should be used
+    """
+    f.SetField(T.TIFFTAG_COMPRESSION, T.COMPRESSION_ADOBE_DEFLATE)
+    # As with LZW in libtiff, only use the predictor on integers
+    predictor = _getSampleFormat(arr.dtype) in (T.SAMPLEFORMAT_INT, T.SAMPLEFORMAT_UINT)
+    if predictor:
+        f.SetField(T.TIFFTAG_PREDICTOR, T.PREDICTOR_HORIZONTAL)
+    return predictor
+
+
+def _writeStripsCompressed(f, arr, write_rgb=False, executor=None):
+    """
+    Write the image as Deflate compressed strips, compressed in parallel.
+    Same as libtiff.write_image(), with a compression, but the image is split
+    in multiple strips of about STRIP_SIZE bytes.
+    f (libtiff file handle): Handle of a TIFF file
+    arr (ndarray): the image, 2D, or 3D if RGB
+    write_rgb (boolean): True if the image is RGB, False if the image is grayscale
+    executor (None or Executor): to compress the strips in parallel
+    """
+    planes = _setImageFields(f, arr, write_rgb)
+    predictor = _setCompressionFields(f, arr)
+
+    height = planes[0].shape[0]
+    row_size = planes[0][0].nbytes
+    rps = max(1, min(height, STRIP_SIZE // row_size))  # rows per strip
+    f.SetField(T.TIFFTAG_ROWSPERSTRIP, rps)
+
+    # Strips are ordered per plane, and then from top to bottom
+    strips = [p[y:y + rps] for p in planes for y in range(0, height, rps)]
+    _writeRawBlocks(f.WriteRawStrip, strips, predictor, executor=executor)
+    f.WriteDirectory()
+
+
+def _writeTilesCompressed(f, arr, write_rgb=False, executor=None):
+    """
+    Write the image as Deflate compressed tiles of TILE_SIZE, compressed in parallel.
+    Same as libtiff.write_tiles(), with a compression.
+    f (libtiff file handle): Handle of a TIFF file
+    arr (ndarray): the image, 2D, or 3D if RGB
+    write_rgb (boolean): True if the image is RGB, False if the image is grayscale
+    executor (None or Executor): to compress the tiles in parallel
+    """
+    planes = _setImageFields(f, arr, write_rgb)
+    predictor = _setCompressionFields(f, arr)
+    f.SetField(T.TIFFTAG_TILEWIDTH, TILE_SIZE)
+    f.SetField(T.TIFFTAG_TILELENGTH, TILE_SIZE)
+
+    # Tiles are ordered per plane, and then row by row
+    height, width = planes[0].shape[:2]
+    tiles = [p[y:y + TILE_SIZE, x:x + TILE_SIZE]
+             for p in planes
+             for y in range(0, height, TILE_SIZE)
+             for x in range(0, width, TILE_SIZE)]
+    tshape = (TILE_SIZE, TILE_SIZE) + planes[0].shape[2:]
+    _writeRawBlocks(partial(_writeRawTile, f), tiles, predictor, tshape, executor)
+    f.WriteDirectory()
+
+
+def _writeRawTile(f, i, buf, size):
+    """
+    Write a raw (precompressed) tile
+    f (libtiff file handle): Handle of a TIFF file
+    i (int): index of the tile
+    buf (bytes): the data of the tile
+    size (int): the number of bytes in buf
+    raise IOError: if the tile couldn't be written
+    """
+    r = T.libtiff.TIFFWriteRawTile(f, i, buf, size)
+    if r.value != size:
+        raise IOError("Failed to write tile %d (%s != %d bytes)" % (i, r.value, size))
+
+
+def _generateTile(get_tile, x, y, shape, dtype, compressed, predictor, reduced=None):
+    """
+    Get one tile, and convert it to the raw data to store in the file.
+    Note: it is thread-safe, if get_tile is.
+    get_tile (callable (int, int) -> ndarray): returns the data of the tile X, Y
+    x (int), y (int): the tile indices
+    shape (tuple of int): the shape of the whole image at this zoom level
+    dtype (numpy.dtype): the type of the data stored
+    compressed (bool): if True, the tile is compressed as Deflate
+    predictor (bool): if True, apply the horizontal predictor before compressing
+    reduced (None or ndarray): if not None, the whole image at the next zoom
+      level, where the tile, downsampled by 2, is stored.
+    return (bytes): the raw data of the tile, padded to TILE_SIZE
+    raise ValueError: if the tile doesn't have the expected shape
+    """
+    tile = numpy.asarray(get_tile(x, y), dtype=dtype)
+    exp_shape = (min(TILE_SIZE, shape[0] - y * TILE_SIZE),
+                 min(TILE_SIZE, shape[1] - x * TILE_SIZE)) + shape[2:]
+    if tile.shape != exp_shape:
+        raise ValueError("Tile %d,%d has shape %s, while expected %s" %
+                         (x, y, tile.shape, exp_shape))
+
+    if reduced is not None:
+        # TILE_SIZE is even, so the tile is exactly on the pixels of the next level
+        rtile = _halveImage(tile)
+        ry, rx = y * TILE_SIZE // 2, x * TILE_SIZE // 2
+        reduced[ry:ry + rtile.shape[0], rx:rx + rtile.shape[1]] = rtile
+
+    tshape = (TILE_SIZE, TILE_SIZE) + shape[2:]
+    if compressed:
+        return _compressBlock(tile, predictor, tshape)
+    else:
+        out = numpy.zeros(tshape, dtype=dtype)
+        out[:exp_shape[0], :exp_shape[1]] = tile
+        return out.tobytes()
+
+
+def _halveImage(im):
+    """
+    Downsample an image by 2 in X and Y, by averaging each block of 2x2 pixels.
+    If the size is odd, the last row (or column) is dropped, as in the pyramid
+    levels (whose shape is always the shape of the previous level // 2).
+    im (ndarray of shape YX or YXC): the image
+    return (ndarray of shape Y//2, X//2(, C)): the downsampled image, with the same dtype
+    """
+    h, w = im.shape[0] // 2, im.shape[1] // 2
+    blocks = im[:h * 2, :w * 2].reshape((h, 2, w, 2) + im.shape[2:])
+    if numpy.issubdtype(im.dtype, numpy.integer) and im.dtype.itemsize <= 4:
+        # Sum on 64 bits, to avoid overflows, and round to the closest integer
+        s = blocks.sum(axis=(1, 3), dtype=numpy.int64)
+        return ((s + 2) // 4).astype(im.dtype)
+    else:
+        m = blocks.mean(axis=(1, 3))
+        if numpy.issubdtype(im.dtype, numpy.integer):
+            m = numpy.round(m)
+        return m.astype(im.dtype)
+
+
+def _writeTilesGenerated(f, shape, dtype, get_tile, write_rgb=False,
+                         compressed=True, executor=None, reduced=None):
+    """
+    Write an image as tiles of TILE_SIZE, each tile being generated (and
+    compressed) on demand, so that the whole image is never in memory.
+    f (libtiff file handle): Handle of a TIFF file
+    shape (tuple of int): shape of the image, YX, or YXC if RGB
+    dtype (numpy.dtype): the type of the data (in native byte order)
+    get_tile (callable (int, int) -> ndarray): returns the data of the tile X, Y
+    write_rgb (boolean): True if the image is RGB, False if the image is grayscale
+    compressed (boolean): if True, the tiles are Deflate compressed
+    executor (None or Executor): to generate the tiles in parallel
+    reduced (None or ndarray): if not None, where to store the image downsampled
+      by 2, which is the next zoom level.
+    """
+    placeholder = numpy.broadcast_to(numpy.zeros((), dtype), shape)
+    _setImageFields(f, placeholder, write_rgb)
+    if compressed:
+        predictor = _setCompressionFields(f, placeholder)
+    else:
+        f.SetField(T.TIFFTAG_COMPRESSION, T.COMPRESSION_NONE)
+        predictor = False
+    f.SetField(T.TIFFTAG_TILEWIDTH, TILE_SIZE)
+    f.SetField(T.TIFFTAG_TILELENGTH, TILE_SIZE)
+
+    # Tiles are ordered row by row
+    jobs = ((_generateTile, (get_tile, x, y, shape, dtype, compressed, predictor, reduced))
+            for y in range(int(math.ceil(shape[0] / TILE_SIZE)))
+            for x in range(int(math.ceil(shape[1] / TILE_SIZE))))
+    _writeRawJobs(partial(_writeRawTile, f), jobs, executor)
+    f.WriteDirectory()
+
+
+def _getArrayTile(arr, x, y):
+    """
+    return (ndarray): the tile X, Y of the image (a view)
+    """
+    return arr[y * TILE_SIZE:(y + 1) * TILE_SIZE, x * TILE_SIZE:(x + 1) * TILE_SIZE]
+
+
+def _canWriteCompressed(arr, write_rgb):
+    """
+    return (bool): True if the array can be written with _writeStripsCompressed()
+      or _writeTilesCompressed()
+    """
+    return arr.ndim == 2 or (arr.ndim == 3 and write_rgb)
+
+
+def write_image(f, arr, compression=None, write_rgb=False, pyramid=False, executor=None):
     """
     f (libtiff file handle): Handle of a TIFF file
     arr (DataArray): DataArray to be written to the file
-    compression (boolean): Compression type to be used on the TIFF file
+    compression (None or str): Compression type to be used on the TIFF file.
+      If it's "adobe_deflate" and the image is 2D (or RGB), it is compressed
+      by strips (or tiles) in parallel.
     write_rgb (boolean): True if the image is RGB, False if the image is grayscale
     pyramid (boolean): whether the file should be saved in the pyramid format or not.
       In this format, each image is saved along with different zoom levels
+    executor (None or Executor): to compress the strips (or tiles) in parallel
     """
+    if compression == "adobe_deflate" and _canWriteCompressed(arr, write_rgb):
+        write_strips = partial(_writeStripsCompressed, f, executor=executor)
+        write_tiles = partial(_writeTilesCompressed, f, executor=executor)
+    else:
+        write_strips = partial(f.write_image, compression=compression)
+        write_tiles = partial(f.write_tiles, tile_width=TILE_SIZE, tile_height=TILE_SIZE,
+                              compression=compression)
+
     # if not pyramid, just save the image in the TIFF file, and return
     if not pyramid:
-        f.write_image(arr, compression=compression, write_rgb=write_rgb)
+        write_strips(arr, write_rgb=write_rgb)
         return
 
     # TODO: for pyramidal images, we should follow the OME-TIFF 6 format
@@ -1863,7 +2273,7 @@ def write_image(f, arr, compression=None, write_rgb=False, pyramid=False):
         f.SetField(T.TIFFTAG_SUBIFD, [0] * len(resized_shapes))
 
     # write the original image
-    f.write_tiles(arr, TILE_SIZE, TILE_SIZE, compression, write_rgb)
+    write_tiles(arr, write_rgb=write_rgb)
     # generate the rescaled images and write the tiled image
     for resized_shape in resized_shapes:
         # rescale the image
@@ -1872,10 +2282,11 @@ def write_image(f, arr, compression=None, write_rgb=False, pyramid=False):
         # Before writting the actual data, we set the special metadata
         f.SetField(T.TIFFTAG_SUBFILETYPE, T.FILETYPE_REDUCEDIMAGE)
         # write the tiled image to the TIFF file
-        f.write_tiles(subim, TILE_SIZE, TILE_SIZE, compression, write_rgb)
+        write_tiles(subim, write_rgb=write_rgb)
 
 
-def export(filename, data, thumbnail=None, compressed=True, multiple_files=False, pyramid=False):
+def export(filename, data, thumbnail=None, compressed=True, multiple_files=False, pyramid=False,
+           compression=COMPRESSION):
     '''
     Write a TIFF file with the given image and metadata
     filename (unicode): filename of the file to create (including path)
@@ -1892,7 +2303,16 @@ def export(filename, data, thumbnail=None, compressed=True, multiple_files=False
     compressed (boolean): whether the file is compressed or not.
     multiple_files (boolean): whether the data is distributed across multiple
       files or not.
+    compression (str): the compression used if compressed, "lzw" or "deflate".
+      See COMPRESSION for the differences.
     '''
+    compression = _getLibtiffCompression(compressed, compression)
+    # With Deflate, the compression is done in parallel, while writing the file
+    if compression == "adobe_deflate":
+        executor = _getExecutor()
+    else:
+        executor = None
+
     if isinstance(data, list):
         if multiple_files:
             if thumbnail is not None:
@@ -1905,14 +2325,321 @@ def export(filename, data, thumbnail=None, compressed=True, multiple_files=False
                 uuid_list.append(uuid.uuid4().urn)
             for i in range(nfiles):
                 # TODO: Take care of thumbnails
-                _saveAsMultiTiffLT(filename, data, None, compressed,
-                                   multiple_files, i, uuid_list, pyramid)
+                _saveAsMultiTiffLT(filename, data, None, compression,
+                                   multiple_files, i, uuid_list, pyramid, executor)
         else:
-            _saveAsMultiTiffLT(filename, data, thumbnail, compressed, pyramid=pyramid)
+            _saveAsMultiTiffLT(filename, data, thumbnail, compression, pyramid=pyramid,
+                               executor=executor)
     else:
         # TODO should probably not enforce it: respect duck typing
         assert(isinstance(data, model.DataArray))
-        _saveAsMultiTiffLT(filename, [data], thumbnail, compressed, pyramid=pyramid)
+        _saveAsMultiTiffLT(filename, [data], thumbnail, compression, pyramid=pyramid,
+                           executor=executor)
+
+
+def export_tiled(filename, shape, dtype, get_tile, metadata=None, compressed=True, pyramid=True):
+    """
+    Write a TIFF file with one (very large) image, generated tile by tile, so
+    that the whole image never has to be in memory. The tiles are generated
+    in parallel, and written as soon as they are available (in order).
+    The file is always stored as BigTIFF, as it can be larger than 4 GB.
+    filename (unicode): filename of the file to create (including path)
+    shape (tuple of int): shape of the full resolution image, either YX, or
+      YXC for RGB(A) images (with C = 3 or 4).
+    dtype (numpy.dtype): the type of the data
+    get_tile (callable (int, int) -> ndarray): returns the data of the
+      tile X, Y of the full resolution image. Each tile is TILE_SIZE x TILE_SIZE
+      pixels, except on the right and bottom borders, where it's only the
+      remaining part of the image. It is called from multiple threads
+      simultaneously, and only once per tile.
+    metadata (None or dict str->value): metadata of the (full resolution) image
+    compressed (boolean): whether the file is compressed or not.
+    pyramid (boolean): if True, the lower resolution images are also stored
+      (as sub-images). Each level is downsampled from the tiles of the level
+      above, so get_tile() is only called for the full resolution.
+    raise ValueError: if the shape is not supported, or a tile returned has
+      the wrong shape
+    """
+    shape = tuple(shape)
+    dtype = numpy.dtype(dtype).newbyteorder("=")
+    md = dict(metadata or {})
+    if len(shape) == 3 and shape[2] in (3, 4):
+        md[model.MD_DIMS] = "YXC"
+        write_rgb = True
+    elif len(shape) == 2:
+        md[model.MD_DIMS] = "YX"
+        write_rgb = False
+    else:
+        raise ValueError("Shape %s is not supported, it should be YX or YXC" % (shape,))
+
+    # A DataArray with the metadata but no actual data, to generate the tags
+    header = model.DataArray(numpy.broadcast_to(numpy.zeros((), dtype), shape), md)
+    header = _mergeCorrectionMetadata(header)
+    ometxt = _convertToOMEMD([header])
+    tags = _convertToTiffTag(header.metadata)
+
+    shapes = [shape]
+    if pyramid:
+        shapes += _genResizedShapes(header)
+
+    # The tiles are generated (and compressed) in parallel, even if not
+    # compressed, as their generation may be slow too.
+    executor = _getExecutor()
+    tmpdir = os.path.dirname(filename) or None
+    tmpfiles = []
+    f = TIFF.open(filename, mode="w8")
+    try:
+        f.SetField(T.TIFFTAG_IMAGEDESCRIPTION, ometxt)
+        for key, val in tags.items():
+            try:
+                f.SetField(key, val)
+            except Exception:
+                logging.exception("Failed to store tag %s with value '%s'", key, val)
+
+        if len(shapes) > 1:
+            # The next directories are written as sub-directories
+            f.SetField(T.TIFFTAG_SUBIFD, [0] * (len(shapes) - 1))
+
+        for z, s in enumerate(shapes):
+            if z > 0:
+                f.SetField(T.TIFFTAG_SUBFILETYPE, T.FILETYPE_REDUCEDIMAGE)
+
+            # While writing a level, its tiles are downsampled into the next
+            # level. As it can be too large to fit in memory, it's stored in
+            # a temporary file.
+            if z + 1 < len(shapes):
+                tmpf = tempfile.TemporaryFile(dir=tmpdir)
+                tmpfiles.append(tmpf)
+                reduced = numpy.memmap(tmpf, dtype=dtype, mode="w+", shape=shapes[z + 1])
+            else:
+                reduced = None
+
+            _writeTilesGenerated(f, s, dtype, get_tile, write_rgb, compressed, executor, reduced)
+            if reduced is not None:
+                get_tile = partial(_getArrayTile, reduced)
+    finally:
+        f.close()
+        for tmpf in tmpfiles:
+            tmpf.close()
+
+
+def _expandFrame(da, dim):
+    """
+    Prepare a DataArray to be appended along a dimension
+    da (DataArray): the frame. The dimensions must be ordered CTZYX, but the
+      first dimensions of size 1 can be omitted.
+    dim (str): the dimension along which the frames are appended ("T" or "Z")
+    return (DataArray of 5 dims): the same data, with the correction metadata
+      merged.
+    raise ValueError: if the frame cannot be appended along dim
+    """
+    dims = da.metadata.get(model.MD_DIMS, "CTZYX"[-da.ndim:])
+    if dims != "CTZYX"[-da.ndim:]:
+        raise ValueError("Data with dimensions %s cannot be appended" % (dims,))
+    da = _mergeCorrectionMetadata(da)
+    da = da.reshape((1,) * (5 - da.ndim) + da.shape)
+    if da.shape["CTZ".index(dim)] != 1:
+        raise ValueError("Data of shape %s cannot be appended along %s" % (da.shape, dim))
+    da.metadata[model.MD_DIMS] = "CTZYX"
+    return da
+
+
+class TIFFAppender(object):
+    """
+    Writes an OME-TIFF file (or several, in case of "multiple files"), in which
+    the data can be added progressively along the T or Z dimension, for
+    instance after each acquisition of a time-lapse or a Z-stack.
+    Only the data of one frame is kept in memory. In order to have the data of
+    each stream contiguous in the file, only the first stream of each file is
+    directly written. The other ones are written to a temporary file, and copied
+    at the end.
+    """
+
+    def __init__(self, filename, dim="T", compressed=True, multiple_files=False, bigtiff=True,
+                 compression=COMPRESSION):
+        """
+        filename (unicode): filename of the file to create (including path). If
+          multiple_files is True, it must contain ".0.", which will be replaced
+          by the index of each file.
+        dim (str): the dimension along which the data is appended ("T" or "Z")
+        compressed (boolean): whether the file is compressed or not.
+        compression (str): the compression used if compressed, see export().
+        multiple_files (boolean): whether the data of each stream (or group of
+          streams) is stored in a separate file.
+        bigtiff (boolean): if True, the file is stored as BigTIFF, which allows
+          files larger than 4 GB.
+        """
+        if dim not in ("T", "Z"):
+            raise ValueError("dim must be T or Z, but got %s" % (dim,))
+        if multiple_files and STIFF_SPLIT not in filename:
+            raise ValueError("The filename '%s' doesn't contain '%s'." % (filename, STIFF_SPLIT))
+        self._filename = filename
+        self._dim = dim
+        self._compression = _getLibtiffCompression(compressed, compression)
+        self._multiple_files = multiple_files
+        self._mode = "w8" if bigtiff else "w"
+        if self._compression == "adobe_deflate":
+            self._executor = _getExecutor()
+        else:
+            self._executor = None
+
+        self._headers = None  # list of DataArrays: the first frame of each stream
+        self._outputs = []  # list of (str, list of int): filename -> streams stored in it
+        self._writers = []  # for each stream: TIFF file or temporary file object
+        self._nframes = 0
+        self._acq_dates = []  # MD_ACQ_DATE of each frame (of the first stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def filenames(self):
+        """
+        (list of str): the files created so far (none before the first append)
+        """
+        return [fn for fn, _ in self._outputs]
+
+    def _open(self, data):
+        """
+        Create the files, based on the first frame of each stream
+        data (list of DataArrays of 5 dims)
+        """
+        self._headers = data
+        groups = _findImageGroups(data)
+        sorted_groups = [g for _, g in sorted(groups.items(), key=operator.itemgetter(0))]
+        if self._multiple_files:
+            tokens = self._filename.rsplit(STIFF_SPLIT, 1)
+            for i, g in enumerate(sorted_groups):
+                fn = tokens[0] + "." + str(i) + "." + tokens[1]
+                streams = [j for j, da in enumerate(data) if any(da is gda for gda in g)]
+                self._outputs.append((fn, streams))
+        else:
+            self._outputs.append((self._filename, list(range(len(data)))))
+
+        self._writers = [None] * len(data)
+        tmpdir = os.path.dirname(self._filename) or None
+        for fn, streams in self._outputs:
+            self._writers[streams[0]] = TIFF.open(fn, mode=self._mode)
+            for i in streams[1:]:
+                self._writers[i] = tempfile.TemporaryFile(dir=tmpdir)
+
+    def append(self, data):
+        """
+        Add a frame to the file.
+        data (list of model.DataArray, or model.DataArray): one frame for each
+          stream. All the frames must have the same shape as the first ones,
+          and have the dimension along which data is appended of size 1.
+        """
+        if not isinstance(data, (list, tuple)):
+            data = [data]
+        data = [_expandFrame(da, self._dim) for da in data]
+        if self._headers is None:
+            self._open(data)
+        elif (len(data) != len(self._headers) or
+              any(da.shape != h.shape or da.dtype != h.dtype for da, h in zip(data, self._headers))):
+            raise ValueError("Data must be identical to the first frames, but got %s" %
+                             ([(da.shape, da.dtype) for da in data],))
+
+        for da, w in zip(data, self._writers):
+            if isinstance(w, TIFF):
+                _writeDataArray(w, da, self._compression, executor=self._executor)
+            else:
+                w.write(numpy.ascontiguousarray(da).data)
+
+        self._acq_dates.append(data[0].metadata.get(model.MD_ACQ_DATE))
+        self._nframes += 1
+
+    def _getFullDataArrays(self):
+        """
+        return (list of DataArrays): one per stream, representing all the data
+          written, with the metadata (but not the actual data).
+        """
+        das = []
+        dimi = "CTZ".index(self._dim)
+        for h in self._headers:
+            md = h.metadata.copy()
+            if self._dim == "T" and None not in self._acq_dates:
+                md[model.MD_TIME_LIST] = [d - self._acq_dates[0] for d in self._acq_dates]
+            shape = list(h.shape)
+            shape[dimi] = self._nframes
+            das.append(model.DataArray(numpy.broadcast_to(h, shape), md))
+        return das
+
+    def close(self):
+        """
+        Finish writing the file(s). Must be called after all the data has been
+        appended.
+        """
+        try:
+            if self._headers is None:
+                logging.warning("No data appended, so no file %s created", self._filename)
+                return
+
+            for w in self._writers:
+                if isinstance(w, TIFF):
+                    w.close()
+
+            das = self._getFullDataArrays()
+            dimi = "CTZ".index(self._dim)
+            uuid_list = [uuid.uuid4().urn for _ in self._outputs]
+            for findex, (fn, streams) in enumerate(self._outputs):
+                # Copy the data of the other streams
+                if len(streams) > 1:
+                    f = TIFF.open(fn, mode="a")
+                    try:
+                        for i in streams[1:]:
+                            h = self._headers[i]
+                            tmpf = self._writers[i]
+                            tmpf.flush()
+                            frames = numpy.memmap(tmpf, dtype=h.dtype, mode="r",
+                                                  shape=(self._nframes,) + h.shape)
+                            for frame in frames:
+                                da = model.DataArray(frame, h.metadata)
+                                _writeDataArray(f, da, self._compression, executor=self._executor)
+                            del frames
+                    finally:
+                        f.close()
+
+                # Store the OME-XML in the first page
+                if self._multiple_files:
+                    ometxt = _convertToOMEMD(das, True, findex=findex, fname=self._filename,
+                                             uuids=uuid_list)
+                else:
+                    ometxt = _convertToOMEMD(das)
+                f = TIFF.open(fn, mode="r+")
+                try:
+                    f.SetDirectory(0)
+                    f.SetField(T.TIFFTAG_IMAGEDESCRIPTION, ometxt)
+                    if T.libtiff.TIFFRewriteDirectory(f) != 1:
+                        raise IOError("Failed to write the metadata to %s" % (fn,))
+                finally:
+                    f.close()
+        finally:
+            for w in self._writers:
+                if not isinstance(w, TIFF):
+                    w.close()
+            self._writers = []
+
+
+def open_appendable(filename, dim="T", compressed=True, multiple_files=False, bigtiff=True,
+                    compression=COMPRESSION):
+    """
+    Open a file to write data progressively, one frame at a time.
+    filename (unicode): filename of the file to create (including path)
+    dim (str): the dimension along which the data is appended ("T" or "Z")
+    compressed (boolean): whether the file is compressed or not.
+    compression (str): the compression used if compressed, see export().
+    multiple_files (boolean): whether the data is distributed across multiple
+      files or not.
+    bigtiff (boolean): whether to use the BigTIFF format, to support files
+      larger than 4 GB.
+    return (TIFFAppender): call .append() for each new frame, and .close()
+      at the end.
+    """
+    return TIFFAppender(filename, dim, compressed, multiple_files, bigtiff, compression)
 
 
 def read_data(filename):
@@ -2426,7 +3153,7 @@ class AcquisitionDataTIFF(AcquisitionData):
     #        spp = int(pxe.get("Channel/SamplesPerPixel", "1"))
 
             imsetn, hdims = _getIFDsFromOME(pxe, offset=ifd_offset)
-            ifd_offset += len(imsetn)
+            ifd_offset += imsetn.size
             # For now we expect RGB as (SPP=3,) SizeC=3, PlaneCount=1, and 1 3D IFD,
             # or as (SPP=3,) SizeC=3, PlaneCount=3 and 3 2D IFDs.
 
@@ -29,7 +29,7 @@ import logging
 import math
 import numpy
 from odemis import model, util
-from odemis.model import HwError
+from odemis.model import HwError, oneway
 from odemis.util import TimeoutError
 import queue
 import random
@@ -403,6 +403,12 @@ class HHDLL(CDLL):
 GEN_START = "S"  # Start acquisition
 GEN_STOP = "E"  # Don't acquire image anymore
 GEN_TERM = "T"  # Stop the generator
+GEN_UNSYNC = "U"  # Synchronisation stopped
+# Note: a trigger is a float (the time it was received)
+
+# Maximum number of histograms which can be passed per DataArray (X dimension of
+# the resolution). Used to send a whole line of a scan at once.
+MAX_HIST_LINE = 256
 
 
 class TerminationRequested(Exception):
@@ -559,11 +565,13 @@ class PH300(model.Detector):
         dt_rng = (PH_ACQTMIN * 1e-3, PH_ACQTMAX * 1e-3)  # s
         self.dwellTime = model.FloatContinuous(1, dt_rng, unit="s")
 
-        # Indicate first dim is time and second dim is (useless) X (in reversed order)
+        # Indicate first dim is time and second dim is X (in reversed order).
+        # X is normally 1, but can be increased to receive multiple histograms
+        # at once (typically, a whole line of a synchronized acquisition).
         self._metadata[model.MD_DIMS] = "XT"
         self._shape = (
             PH_HISTCHAN,
-            1,
+            MAX_HIST_LINE,
             2 ** 16,
         )  # Histogram is 32 bits, but only return 16 bits info
 
@@ -578,8 +586,9 @@ class PH300(model.Detector):
             tres * 1e-12, pxd_ch, unit="s", setter=self._setPixelDuration
         )
 
-        res = self._shape[:2]
-        self.resolution = model.ResolutionVA(res, (res, res), readonly=True)
+        res = (self._shape[0], 1)
+        self.resolution = model.ResolutionVA(res, (res, self._shape[:2]),
+                                             setter=self._setResolution)
 
         self.syncDiv = model.IntEnumerated(
             1, choices={1, 2, 4, 8}, unit="", setter=self._setSyncDiv
@@ -597,7 +606,7 @@ class PH300(model.Detector):
         self._setSyncOffset(self.syncOffset.value)
 
         # Wrapper for the dataflow
-        self.data = BasicDataFlow(self)
+        self.data = HistogramDataFlow(self)
         # Note: Apparently, the hardware supports reading the data, while it's
         # still accumulating (ie, the acquisition is still running).
         # We don't support this feature for now, and if the user needs to see
@@ -607,8 +616,12 @@ class PH300(model.Detector):
         # Alternatively, we could provide a second dataflow that sends the data
         # while it's building up.
 
+        # Event to trigger the acquisition of one histogram, when synchronized
+        self.softwareTrigger = model.Event()
+
         # Queue to control the acquisition thread:
         self._genmsg = queue.Queue()
+        self._old_triggers = []  # triggers received while busy acquiring
         self._generator = threading.Thread(
             target=self._acquire, name="PicoHarp300 acquisition thread"
         )
@@ -818,12 +831,19 @@ class PH300(model.Detector):
         return ctcstatus.value > 0
 
     @autoretry
-    def GetHistogram(self, block=0):
+    def GetHistogram(self, block=0, buf=None):
         """
         block (0<=int): only useful if routing
-        return numpy.array of shape (1, res): the histogram
+        buf (None or numpy.array of uint32): C-contiguous array of at least
+          PH_HISTCHAN elements where to write the histogram. If None, a new
+          array is allocated.
+        return numpy.array of shape (1, res): the histogram (buf, if provided)
         """
-        buf = numpy.empty((1, PH_HISTCHAN), dtype=numpy.uint32)
+        if buf is None:
+            buf = numpy.empty((1, PH_HISTCHAN), dtype=numpy.uint32)
+        else:
+            assert buf.dtype == numpy.uint32 and buf.size >= PH_HISTCHAN
+            assert buf.flags.c_contiguous
 
         buf_ct = buf.ctypes.data_as(POINTER(c_uint32))
         self._dll.PH_GetHistogram(self._idx, buf_ct, block)
@@ -897,6 +917,10 @@ class PH300(model.Detector):
         self._metadata[model.MD_TIME_LIST] = tl
         return offset
 
+    def _setResolution(self, value):
+        # Only the number of histograms (X) can be changed
+        return self._shape[0], value[1]
+
     # Acquisition methods
     def start_generate(self):
         self._genmsg.put(GEN_START)
@@ -910,17 +934,36 @@ class PH300(model.Detector):
     def stop_generate(self):
         self._genmsg.put(GEN_STOP)
 
+    def set_trigger(self, sync):
+        """
+        sync (bool): True if should be triggered
+        """
+        if sync:
+            logging.debug("Now set to software trigger")
+        else:
+            # Just to make sure to not wait forever for it
+            logging.debug("Sending unsynchronisation event")
+            self._genmsg.put(GEN_UNSYNC)
+
+    @oneway
+    def onEvent(self):
+        """
+        Called by the Event when it is triggered
+        """
+        self._genmsg.put(time.time())
+
     def _get_acq_msg(self, **kwargs):
         """
         Read one message from the acquisition queue
-        return (str): message
+        return (str or float): message
         raises queue.Empty: if no message on the queue
         """
         msg = self._genmsg.get(**kwargs)
-        if msg not in (GEN_START, GEN_STOP, GEN_TERM):
-            logging.warning("Acq received unexpected message %s", msg)
-        else:
+        if (msg in (GEN_START, GEN_STOP, GEN_TERM, GEN_UNSYNC) or
+              isinstance(msg, float)):
             logging.debug("Acq received message %s", msg)
+        else:
+            logging.warning("Acq received unexpected message %s", msg)
         return msg
 
     def _acq_wait_start(self):
@@ -936,9 +979,13 @@ class PH300(model.Detector):
 
             # Check if there are already more messages on the queue
             try:
-                msg = self._get_acq_msg(block=False)
-                if msg == GEN_TERM:
+                nmsg = self._get_acq_msg(block=False)
+                if nmsg == GEN_TERM:
                     raise TerminationRequested()
+                elif isinstance(nmsg, float):  # trigger, just after the start
+                    self._old_triggers.insert(0, nmsg)
+                else:
+                    msg = nmsg
             except queue.Empty:
                 pass
 
@@ -965,10 +1012,49 @@ class PH300(model.Detector):
                 return True
             elif msg == GEN_TERM:
                 raise TerminationRequested()
+            elif isinstance(msg, float):  # trigger
+                # received trigger too early => store it for later
+                self._old_triggers.insert(0, msg)
         except queue.Empty:
             pass
         return False
 
+    def _acq_wait_trigger(self):
+        """
+        Block until a trigger is received, or a stop message.
+        Note: it expects that the acquisition is running.
+        If the acquisition is not synchronised, it will immediately return
+        return (bool): True if needs to stop, False if a trigger is received
+        raise TerminationRequested: if a terminate message was received
+        """
+        if not self.data._sync_event:
+            # No synchronisation -> just check it shouldn't stop
+            return self._acq_should_stop()
+
+        try:
+            # Already some trigger received before?
+            trigger = self._old_triggers.pop()
+            logging.debug("Using late trigger")
+        except IndexError:
+            # Let's really wait
+            while True:
+                msg = self._get_acq_msg(block=True)
+                if msg == GEN_TERM:
+                    raise TerminationRequested()
+                elif msg == GEN_STOP:
+                    return True
+                elif msg == GEN_UNSYNC or isinstance(msg, float):  # trigger
+                    trigger = msg
+                    break
+                else:  # Anything else shouldn't really happen
+                    logging.warning("Skipped message %s as acquisition is waiting for trigger", msg)
+
+        if trigger == GEN_UNSYNC:
+            logging.debug("End of synchronisation")
+        else:
+            logging.debug("Received trigger after %s s", time.time() - trigger)
+        return False
+
     def _acq_wait_data(self, exp_tend, timeout=0):
         """
         Block until a data is received, or a stop message.
@@ -1017,17 +1103,74 @@ class PH300(model.Detector):
         for f in fs:
             f.result()
 
+    def _acq_histograms(self, tacq, data, md):
+        """
+        Acquire one histogram per row of the data, each of them after a trigger
+        (if synchronized).
+        Note: it expects that the acquisition is running.
+        tacq (float): measurement duration in s
+        data (numpy.array of uint32 of shape XT): where to write the histograms
+        md (dict): metadata, updated with the acquisition date
+        return (bool): True if needs to stop, False if the data is complete
+        raise TerminationRequested: if a terminate message was received
+        """
+        for i, buf in enumerate(data):
+            # Wait for trigger (if synchronized), and check if any message
+            # received before starting again
+            if self._acq_wait_trigger():
+                return True
+            if i == 0:
+                md[model.MD_ACQ_DATE] = time.time()
+
+            logging.debug("Starting new acquisition")
+            if self._acq_measure(tacq, buf):
+                return True
+
+        return False
+
+    def _acq_measure(self, tacq, buf):
+        """
+        Run one measurement and read its histogram.
+        Note: it expects that the acquisition is running.
+        tacq (float): measurement duration in s
+        buf (numpy.array of uint32): where to write the histogram
+        return (bool): True if needs to stop, False if the histogram is in buf
+        raise TerminationRequested: if a terminate message was received
+        """
+        while True:
+            tstart = time.time()
+            self.ClearHistMem()
+            self.StartMeas(int(tacq * 1e3))
+
+            # Wait for the acquisition to be done or until a stop or
+            # terminate message comes
+            try:
+                if self._acq_wait_data(tstart + tacq, timeout=tacq * 3 + 1):
+                    # Stop message received
+                    return True
+                logging.debug("Acq complete")
+            except TimeoutError as ex:
+                logging.error(ex)
+                # TODO: try to reset the hardware?
+                continue
+            finally:
+                # Must always be called, whether the measurement finished or not
+                self.StopMeas()
+
+            self.GetHistogram(buf=buf)
+            return False
+
     def _acquire(self):
         """
         Acquisition thread
         Managed via the .genmsg Queue
+        When the dataflow is synchronized, one histogram is acquired per trigger,
+        and the shutters stay open in-between, until the acquisition is stopped.
         """
-        # TODO: support synchronized acquisition, so that it's possible to acquire
-        #   one image at a time, without opening/closing the shutters in-between.
-        #   See avantes for an example.
         try:
             while True:
                 # Wait until we have a start (or terminate) message
+                self._old_triggers = []  # discard all old triggers
                 self._acq_wait_start()
 
                 # Open protection shutters
@@ -1035,39 +1178,18 @@ class PH300(model.Detector):
 
                 # Keep acquiring
                 while True:
-                    tacq = self.dwellTime.value
-                    tstart = time.time()
-
                     # TODO: only allow to update the setting here (not during acq)
+                    tacq = self.dwellTime.value
+                    nx = self.resolution.value[1]
                     md = self._metadata.copy()
-                    md[model.MD_ACQ_DATE] = tstart
                     md[model.MD_DWELL_TIME] = tacq
 
-                    # check if any message received before starting again
-                    if self._acq_should_stop():
-                        break
-
-                    logging.debug("Starting new acquisition")
-                    self.ClearHistMem()
-                    self.StartMeas(int(tacq * 1e3))
-
-                    # Wait for the acquisition to be done or until a stop or
-                    # terminate message comes
-                    try:
-                        if self._acq_wait_data(tstart + tacq, timeout=tacq * 3 + 1):
-                            # Stop message received
-                            break
-                        logging.debug("Acq complete")
-                    except TimeoutError as ex:
-                        logging.error(ex)
-                        # TODO: try to reset the hardware?
-                        continue
-                    finally:
-                        # Must always be called, whether the measurement finished or not
-                        self.StopMeas()
-
-                    # Read data and pass it
-                    data = self.GetHistogram()
+                    # Each histogram is directly read into its row of the array
+                    data = numpy.empty((nx, self._shape[0]), dtype=numpy.uint32)
+                    if self._acq_histograms(tacq, data, md):
+                        break  # Stop requested
+
+                    # Pass the data
                     da = model.DataArray(data, md)
                     self.data.notify(da)
 
@@ -1245,11 +1367,13 @@ class HH400(model.Detector):
         dt_rng = (HH_ACQTMIN * 1e-3, HH_ACQTMAX * 1e-3)  # s
         self.dwellTime = model.FloatContinuous(1, dt_rng, unit="s")
 
-        # Indicate first dim is time and second dim is (useless) X (in reversed order)
+        # Indicate first dim is time and second dim is X (in reversed order).
+        # X is normally 1, but can be increased to receive multiple histograms
+        # at once (typically, a whole line of a synchronized acquisition).
         self._metadata[model.MD_DIMS] = "XT"
         self._shape = (
             HH_MAXHISTLEN,
-            1,
+            MAX_HIST_LINE,
             2 ** 16,
         )  # Histogram is 32 bits, but only return 16 bits info
 
@@ -1286,8 +1410,9 @@ class HH400(model.Detector):
 
         self._actuallen = self.SetHistoLen(HH_MAXLENCODE)
 
-        res = self._shape[:2]
-        self.resolution = model.ResolutionVA(res, (res, res), readonly=True)
+        res = (self._shape[0], 1)
+        self.resolution = model.ResolutionVA(res, (res, self._shape[:2]),
+                                             setter=self._setResolution)
 
         # Sync signal settings
         self.syncDiv = model.IntEnumerated(
@@ -1315,7 +1440,7 @@ class HH400(model.Detector):
         # Make sure the device is synchronised and metadata is updated
 
         # Wrapper for the dataflow
-        self.data = BasicDataFlow(self)
+        self.data = HistogramDataFlow(self)
         # Note: Apparently, the hardware supports reading the data, while it's
         # still accumulating (ie, the acquisition is still running).
         # We don't support this feature for now, and if the user needs to see
@@ -1325,8 +1450,12 @@ class HH400(model.Detector):
         # Alternatively, we could provide a second dataflow that sends the data
         # while it's building up.
 
+        # Event to trigger the acquisition of one histogram, when synchronized
+        self.softwareTrigger = model.Event()
+
         # Queue to control the acquisition thread:
         self._genmsg = queue.Queue()
+        self._old_triggers = []  # triggers received while busy acquiring
         self._generator = threading.Thread(
             target=self._acquire, name="HydraHarp 400 acquisition thread"
         )
@@ -1690,7 +1819,7 @@ class HH400(model.Detector):
         return ctcstatus.value > 0
 
     @autoretry
-    def GetHistogram(self, channel, clear=False):
+    def GetHistogram(self, channel, clear=False, buf=None):
         """
         The histogram buffer size actuallen must correspond to the value obtained through HH_SetHistoLen().
         The maximum input channel index must correspond to nchannels-1 as obtained through HH_GetNumOfInputChannels().
@@ -1699,12 +1828,18 @@ class HH400(model.Detector):
         clear (bool): denotes the action upon completing the reading process
             False (0) = keeps the histogram in the acquisition buffer
             True (1) = clears the acquisition buffer
+        buf (None or numpy.array of uint32): C-contiguous array of at least
+          actuallen elements where to write the histogram. If None, a new
+          array is allocated.
         return:
-            chcount (unsigned int): pointer to an array of at least actuallen double words (32bit)
-            where the histogram data can be stored
+            chcount (numpy.array of shape (1, actuallen)): the histogram (buf, if provided)
         """
         clear_int = 1 if clear else 0
-        buf = numpy.empty((1, self._actuallen), dtype=numpy.uint32)
+        if buf is None:
+            buf = numpy.empty((1, self._actuallen), dtype=numpy.uint32)
+        else:
+            assert buf.dtype == numpy.uint32 and buf.size >= self._actuallen
+            assert buf.flags.c_contiguous
         buf_ct = buf.ctypes.data_as(POINTER(c_uint32))
         self._dll.HH_GetHistogram(self._idx, buf_ct, channel, clear_int)
         return buf
@@ -1940,6 +2075,10 @@ class HH400(model.Detector):
         offset = offset_ns * 1e-9  # convert the round-down in ps back to s
         return offset
 
+    def _setResolution(self, value):
+        # Only the number of histograms (X) can be changed
+        return self._shape[0], value[1]
+
     # Acquisition methods
     def start_generate(self):
         self._genmsg.put(GEN_START)
@@ -1953,17 +2092,36 @@ class HH400(model.Detector):
     def stop_generate(self):
         self._genmsg.put(GEN_STOP)
 
+    def set_trigger(self, sync):
+        """
+        sync (bool): True if should be triggered
+        """
+        if sync:
+            logging.debug("Now set to software trigger")
+        else:
+            # Just to make sure to not wait forever for it
+            logging.debug("Sending unsynchronisation event")
+            self._genmsg.put(GEN_UNSYNC)
+
+    @oneway
+    def onEvent(self):
+        """
+        Called by the Event when it is triggered
+        """
+        self._genmsg.put(time.time())
+
     def _get_acq_msg(self, **kwargs):
         """
         Read one message from the acquisition queue
-        return (str): message
+        return (str or float): message
         raises queue.Empty: if no message on the queue
         """
         msg = self._genmsg.get(**kwargs)
-        if msg not in (GEN_START, GEN_STOP, GEN_TERM):
-            logging.warning("Acq received unexpected message %s", msg)
-        else:
+        if (msg in (GEN_START, GEN_STOP, GEN_TERM, GEN_UNSYNC) or
+              isinstance(msg, float)):
             logging.debug("Acq received message %s", msg)
+        else:
+            logging.warning("Acq received unexpected message %s", msg)
         return msg
 
     def _acq_wait_start(self):
@@ -1979,9 +2137,13 @@ class HH400(model.Detector):
 
             # Check if there are already more messages on the queue
             try:
-                msg = self._get_acq_msg(block=False)
-                if msg == GEN_TERM:
+                nmsg = self._get_acq_msg(block=False)
+                if nmsg == GEN_TERM:
                     raise TerminationRequested()
+                elif isinstance(nmsg, float):  # trigger, just after the start
+                    self._old_triggers.insert(0, nmsg)
+                else:
+                    msg = nmsg
             except queue.Empty:
                 pass
 
@@ -2008,10 +2170,49 @@ class HH400(model.Detector):
                 return True
             elif msg == GEN_TERM:
                 raise TerminationRequested()
+            elif isinstance(msg, float):  # trigger
+                # received trigger too early => store it for later
+                self._old_triggers.insert(0, msg)
         except queue.Empty:
             pass
         return False
 
+    def _acq_wait_trigger(self):
+        """
+        Block until a trigger is received, or a stop message.
+        Note: it expects that the acquisition is running.
+        If the acquisition is not synchronised, it will immediately return
+        return (bool): True if needs to stop, False if a trigger is received
+        raise TerminationRequested: if a terminate message was received
+        """
+        if not self.data._sync_event:
+            # No synchronisation -> just check it shouldn't stop
+            return self._acq_should_stop()
+
+        try:
+            # Already some trigger received before?
+            trigger = self._old_triggers.pop()
+            logging.debug("Using late trigger")
+        except IndexError:
+            # Let's really wait
+            while True:
+                msg = self._get_acq_msg(block=True)
+                if msg == GEN_TERM:
+                    raise TerminationRequested()
+                elif msg == GEN_STOP:
+                    return True
+                elif msg == GEN_UNSYNC or isinstance(msg, float):  # trigger
+                    trigger = msg
+                    break
+                else:  # Anything else shouldn't really happen
+                    logging.warning("Skipped message %s as acquisition is waiting for trigger", msg)
+
+        if trigger == GEN_UNSYNC:
+            logging.debug("End of synchronisation")
+        else:
+            logging.debug("Received trigger after %s s", time.time() - trigger)
+        return False
+
     def _acq_wait_data(self, exp_tend, timeout=0):
         """
         Block until a data is received, or a stop message.
@@ -2060,17 +2261,81 @@ class HH400(model.Detector):
         for f in fs:
             f.result()
 
+    def _acq_histograms(self, tacq, data, md):
+        """
+        Acquire one histogram per row of the data, each of them after a trigger
+        (if synchronized).
+        Note: it expects that the acquisition is running.
+        tacq (float): measurement duration in s
+        data (numpy.array of uint32 of shape XT): where to write the histograms
+        md (dict): metadata, updated with the acquisition date
+        return (bool): True if needs to stop, False if the data is complete
+        raise TerminationRequested: if a terminate message was received
+        """
+        for i, buf in enumerate(data):
+            # Wait for trigger (if synchronized), and check if any message
+            # received before starting again
+            if self._acq_wait_trigger():
+                return True
+            if i == 0:
+                md[model.MD_ACQ_DATE] = time.time()
+
+            logging.debug("Starting new acquisition")
+            if self._acq_measure(tacq, buf):
+                return True
+
+        return False
+
+    def _acq_measure(self, tacq, buf):
+        """
+        Run one measurement and read its histogram.
+        The histogram memory is cleared when reading it, so that the next
+        measurement can immediately start.
+        Note: it expects that the acquisition is running, and the histogram
+        memory is empty.
+        tacq (float): measurement duration in s
+        buf (numpy.array of uint32): where to write the histogram
+        return (bool): True if needs to stop, False if the histogram is in buf
+        raise TerminationRequested: if a terminate message was received
+        """
+        failed = False
+        while True:
+            if failed:  # Drop the partial histogram of the failed measurement
+                self.ClearHistMem(0)
+            tstart = time.time()
+            self.StartMeas(int(tacq * 1e3))
+
+            # Wait for the acquisition to be done or until a stop or
+            # terminate message comes
+            try:
+                if self._acq_wait_data(tstart + tacq, timeout=tacq * 3 + 1):
+                    # Stop message received
+                    return True
+                logging.debug("Acq complete")
+            except TimeoutError as ex:
+                logging.error(ex)
+                # TODO: try to reset the hardware?
+                failed = True
+                continue
+            finally:
+                # Must always be called, whether the measurement finished or not
+                self.StopMeas()
+
+            # Read data, and reset the memory for the next measurement
+            self.GetHistogram(0, clear=True, buf=buf)
+            return False
+
     def _acquire(self):
         """
         Acquisition thread
         Managed via the .genmsg Queue
+        When the dataflow is synchronized, one histogram is acquired per trigger,
+        and the shutters stay open in-between, until the acquisition is stopped.
         """
-        # TODO: support synchronized acquisition, so that it's possible to acquire
-        #   one image at a time, without opening/closing the shutters in-between.
-        #   See avantes for an example.
         try:
             while True:
                 # Wait until we have a start (or terminate) message
+                self._old_triggers = []  # discard all old triggers
                 self._acq_wait_start()
 
                 # Open protection shutters
@@ -2092,41 +2357,23 @@ class HH400(model.Detector):
                 # Odemis waits a while to keep acquiring even after overflow
                 # Check for overflow at the end and log warning message
 
+                # Only needed once, as the memory is cleared when reading each histogram
+                self.ClearHistMem(0)
+
                 # Keep acquiring
                 while True:
-                    tacq = self.dwellTime.value
-                    tstart = time.time()
-
                     # TODO: only allow to update the setting here (not during acq)
+                    tacq = self.dwellTime.value
+                    nx = self.resolution.value[1]
                     md = self._metadata.copy()
-                    md[model.MD_ACQ_DATE] = tstart
                     md[model.MD_DWELL_TIME] = tacq
 
-                    # check if any message received before starting again
-                    if self._acq_should_stop():
-                        break
-
-                    logging.debug("Starting new acquisition")
-                    self.ClearHistMem(0)
-                    self.StartMeas(int(tacq * 1e3))
-
-                    # Wait for the acquisition to be done or until a stop or
-                    # terminate message comes
-                    try:
-                        if self._acq_wait_data(tstart + tacq, timeout=tacq * 3 + 1):
-                            # Stop message received
-                            break
-                        logging.debug("Acq complete")
-                    except TimeoutError as ex:
-                        logging.error(ex)
-                        # TODO: try to reset the hardware?
-                        continue
-                    finally:
-                        # Must always be called, whether the measurement finished or not
-                        self.StopMeas()
-
-                    # Read data and pass it
-                    data = self.GetHistogram(0)
+                    # Each histogram is directly read into its row of the array
+                    data = numpy.empty((nx, self._actuallen), dtype=numpy.uint32)
+                    if self._acq_histograms(tacq, data, md):
+                        break  # Stop requested
+
+                    # Pass the data
                     da = model.DataArray(data, md)
                     self.data.notify(da)
                     # TODO: support multiple channels
@@ -2332,6 +2579,44 @@ class BasicDataFlow(model.DataFlow):
         self._detector.stop_generate()
 
 
+# Same as avantes.AvantesDataFlow
+class HistogramDataFlow(BasicDataFlow):
+    def __init__(self, detector):
+        """
+        detector (PH300 or HH400): the detector that the dataflow corresponds to
+        """
+        BasicDataFlow.__init__(self, detector)
+        self._sync_event = None  # synchronization Event
+        self._prev_max_discard = self._max_discard
+
+    def synchronizedOn(self, event):
+        """
+        Synchronize the acquisition on the given event. Every time the event is
+          triggered, the DataFlow will acquire a new histogram. The shutters
+          are kept open between the histograms.
+        event (model.Event or None): event to synchronize with. Use None to
+          disable synchronization.
+        The DataFlow can be synchronized only with one Event at a time.
+        """
+        if self._sync_event == event:
+            return
+
+        if self._sync_event:
+            self._sync_event.unsubscribe(self._detector)
+            self.max_discard = self._prev_max_discard
+
+        self._sync_event = event
+        if self._sync_event:
+            # if the df is synchronized, the subscribers probably don't want to
+            # skip some data
+            self._prev_max_discard = self._max_discard
+            self.max_discard = 0
+            self._detector.set_trigger(True)
+            self._sync_event.subscribe(self._detector)
+        else:
+            self._detector.set_trigger(False)
+
+
 # Only for testing/simulation purpose
 # Very rough version that is just enough so that if the wrapper behaves correctly,
 # it returns the expected values.
@@ -2454,7 +2739,9 @@ class FakePHDLL(object):
 
     def PH_StopMeas(self, i):
         if self._acq_start is not None:
-            self._last_acq_dur = self._acq_end - self._acq_start
+            # Histograms accumulate until the memory is cleared
+            dur = min(self._acq_end, time.time()) - self._acq_start
+            self._last_acq_dur = (self._last_acq_dur or 0) + dur
         self._acq_start = None
         self._acq_end = None
 
@@ -2638,7 +2925,9 @@ class FakeHHDLL(object):
 
     def HH_StopMeas(self, i):
         if self._acq_start is not None:
-            self._last_acq_dur = self._acq_end - self._acq_start
+            # Histograms accumulate until the memory is cleared
+            dur = min(self._acq_end, time.time()) - self._acq_start
+            self._last_acq_dur = (self._last_acq_dur or 0) + dur
         self._acq_start = None
         self._acq_end = None
 
@@ -2669,6 +2958,9 @@ class FakeHHDLL(object):
             numpy.uint32
         )
 
+        if _val(clear):
+            self._last_acq_dur = None
+
     def HH_GetResolution(self, i, p_resolution):
         resolution = _deref(p_resolution, c_double)
         resolution.value = self._base_res * (2 ** self._bincode)
@@ -1543,6 +1543,38 @@ class Controller(object):
         # takes more characters and for CL, we need a more clever code anyway
         return not axes.isdisjoint(self.GetMotionStatus())
 
+    def getMotionState(self, axes):
+        """
+        Report which of the given axes are still moving, and the error state of
+        the controller, in as few round trips as possible.
+        axes (set of str): axes to check
+        return (set of str, int): the axes still moving, and the number of the
+          last error (0 if no error)
+        """
+        # The motion status reports all the axes at once, and can be merged
+        # with the error check => always a single round trip
+        errs, answer = self._sendQueryCommand(["ERR?\n", "\x05"])
+        bitmap = int(answer, 16)
+        mv_axes = set(c for i, c in enumerate(self._channels) if bitmap & (1 << i))
+        return mv_axes & set(axes), int(errs)
+
+    def _parseAxesValues(self, com, lresp):
+        """
+        Decode the answers to a series of queries, one per axis (ex: "ONT? 1").
+        com (list of str): the commands sent
+        lresp (list of str): the answers received, one per command
+        return (dict str -> str): axis name -> value reported
+        raise ValueError: if an answer cannot be parsed
+        """
+        values = {}
+        for r in lresp:
+            ss = r.split("=")
+            if len(ss) != 2:
+                raise ValueError("Failed to parse answer from %s: %r" %
+                                 (com, lresp))
+            values[ss[0]] = ss[1]
+        return values
+
     def stopMotion(self):
         """
         Stop the motion on all axes immediately
@@ -1796,6 +1828,19 @@ class CLAbsController(Controller):
 
         return False
 
+    def getMotionState(self, axes):
+        """
+        See Controller.getMotionState
+        """
+        # All the "ONT?" are sent together with the error check, so that it
+        # takes a single round trip whatever the number of axes.
+        axes = sorted(axes)
+        com = ["ERR?\n"] + ["ONT? %s\n" % (a,) for a in axes]
+        lresp = self._sendQueryCommand(com)
+        ont = self._parseAxesValues(com, lresp[1:])
+        mv_axes = set(a for a in axes if ont.get(a) != "1")
+        return mv_axes, int(lresp[0])
+
     # TODO allow to reference, but need to get multiple axes, and to check the
     # status, isMoving() cannot be used, but just GetMotionStatus()
     # def startReferencing(self, axis):
@@ -2381,6 +2426,28 @@ class CLRelController(Controller):
         #  POS? 1  # Should be very close
         #  ONT? 1 # Should be true at worst a little after the settle time window
 
+    def getMotionState(self, axes):
+        """
+        See Controller.getMotionState
+        """
+        axes = sorted(axes)
+        # The "ONT?" of all the axes are sent at once, but without the error
+        # check, as this causes a long delay in the answer. The error is only
+        # checked when an axis is done.
+        com = ["ONT? %s\n" % (a,) for a in axes]
+        ont = self._parseAxesValues(com, self._sendQueryCommand(com))
+        mv_axes = set(a for a in axes if ont.get(a) != "1")
+
+        if len(mv_axes) == len(axes):
+            return mv_axes, 0
+
+        # Some axes are done => turn off their encoder (in a few seconds)
+        if self._auto_suspend:
+            for a in axes:
+                if a not in mv_axes:
+                    self._releaseAxis(a, self._auto_suspend)
+        return mv_axes, self.GetErrorNum()
+
     def stopMotion(self):
         super(CLRelController, self).stopMotion()
         for c in self._channels:
@@ -2790,6 +2857,18 @@ class SMOController(Controller):
                 return True
         return False
 
+    def getMotionState(self, axes):
+        """
+        See Controller.getMotionState
+        """
+        # Same as _isAxisMovingOLViaPID(), but for all the axes at once
+        axes = sorted(axes)
+        com = ["ERR?\n"] + ["SMO? %s\n" % (a,) for a in axes]
+        lresp = self._sendQueryCommand(com)
+        smo = self._parseAxesValues(com, lresp[1:])
+        mv_axes = set(a for a in axes if smo.get(a) != "0")
+        return mv_axes, int(lresp[0])
+
     def stopMotion(self):
         """
         Stop the motion on all axes immediately
@@ -3252,16 +3331,23 @@ class Bus(model.Actuator):
                     logging.debug("Ending move control early as next move is an update containing %s", moving_axes)
                     return
 
-                for an in moving_axes.copy():  # need copy to remove during iteration
+                # Query each controller only once for all its axes
+                ctrl_axes = {}  # controller -> dict channel -> axis name
+                for an in moving_axes:
                     controller, channel = self._axis_to_cc[an]
-                    # TODO: change isMoving to report separate info on multiple channels
-                    if not controller.isMoving({channel}):
-                        moving_axes.discard(an)
-                        try:
-                            controller.checkError()
-                        except PIGCSError as ex:
-                            raise_exp = ex  # Keep it for the end, while waiting for other axes
-                            logging.error("Move on axis %s has failed: %s", an, ex)
+                    ctrl_axes.setdefault(controller, {})[channel] = an
+                for controller, chan_axes in ctrl_axes.items():
+                    mv_channels, err = controller.getMotionState(set(chan_axes.keys()))
+                    if err:
+                        # The error is for the whole controller => consider
+                        # all its axes as failed.
+                        raise_exp = PIGCSError(err)  # Keep it for the end, while waiting for other axes
+                        logging.error("Move on axes %s has failed: %s",
+                                      ", ".join(chan_axes.values()), raise_exp)
+                        mv_channels = set()
+                    for c, an in chan_axes.items():
+                        if c not in mv_channels:
+                            moving_axes.discard(an)
                 if not moving_axes:
                     # no more axes to wait for
                     break
@@ -3282,9 +3368,15 @@ class Bus(model.Actuator):
                     last_upd = now
                     last_axes = moving_axes.copy()
 
-                # Wait half of the time left (maximum 0.1 s)
+                # Before the expected end, wait half of the time left. After, the
+                # axes are probably settling, so poll quickly at first, and less
+                # and less often if it takes long.
                 left = end - time.time()
-                sleept = max(0.001, min(left / 2, 0.1))
+                if left > 0:
+                    sleept = left / 2
+                else:
+                    sleept = -left / 4
+                sleept = max(0.005, min(sleept, 0.1))
                 future._must_stop.wait(sleept)
             else:
                 logging.debug("Move of axes %s cancelled before the end", axes)
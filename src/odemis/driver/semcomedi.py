@@ -110,6 +110,10 @@ NI_AO_TRIG_AI_START1 = 19  # Trigger number for AI Start1 (= beginning of a comm
 ACQ_CMD_UPD = 1
 ACQ_CMD_TERM = 2
 
+# Maximum memory used by the scan arrays kept for reuse (the latest one is
+# always kept, even if it's bigger).
+MAX_SCAN_CACHE_SIZE = 128 * 2 ** 20  # bytes
+
 
 class CancelledError(Exception):
     """
@@ -2800,8 +2804,18 @@ class Scanner(model.Emitter):
         # the beam settling time or when put to rest.
         self.newPosition = model.Event()
 
-        self._prev_settings = [None, None, None, None] # resolution, scale, translation, margin
-        self._scan_array = None # last scan array computed
+        # (list of (float, float)) in px => if not empty, the e-beam scans each
+        # of these positions (relative to the center, like .translation, and
+        # independent of scale), in order, instead of the area defined by
+        # .resolution, .scale and .translation. The data is then of shape 1 x N.
+        self.scanPath = model.ListVA([], unit="px", setter=self._setScanPath)
+
+        self._prev_settings = None  # resolution, scale, translation, margin
+        self._scan_array = None  # last scan array computed
+        # Scan arrays recently computed, to quickly switch back to a previous
+        # scan area (eg, when the drift correction alternates with the main scan)
+        # (shape, scale, translation, margin) -> (array, ranges), in LRU order
+        self._scan_cache = collections.OrderedDict()
 
     def terminate(self):
         if self._scanning_mng:
@@ -2926,6 +2940,18 @@ class Scanner(model.Emitter):
                 max(min(value[1], max_tran[1]), -max_tran[1]))
         return tran
 
+    def _setScanPath(self, value):
+        """
+        value (list of (float, float)): positions to scan, in px from the center
+        returns actual path accepted
+        """
+        path = [tuple(p) for p in value]
+        hshape = (self._shape[0] / 2, self._shape[1] / 2)
+        for p in path:
+            if len(p) != 2 or not all(-h <= c <= h for c, h in zip(p, hshape)):
+                raise ValueError("Position %s is outside of the scanning area" % (p,))
+        return path
+
     # we share metadata with our parent
     def getMetadata(self):
         return self.parent.getMetadata()
@@ -3115,6 +3141,20 @@ class Scanner(model.Emitter):
             self.dwellTime.value = self.dwellTime.value
             assert nrchans == self._nrchans
         dwell_time, osr, dpr = self.dwellTime.value, self._osr, self._dpr
+        path = self.scanPath.value
+        if path:
+            # The beam jumps between arbitrary positions, so give the full
+            # settling time before the first one. Between the other positions,
+            # the dwell time is expected to be much longer than the settle time.
+            margin = int(math.ceil(self._settle_time / dwell_time - 0.01))
+            new_settings = (tuple(path), margin)
+            if self._prev_settings != new_settings:
+                self._scan_array, self._ranges = self._get_path_scan_array(path, margin)
+                self._prev_settings = new_settings
+
+            return (self._scan_array, dwell_time, (1, len(path)),
+                    margin, self._channels, self._ranges, osr, dpr)
+
         resolution = self.resolution.value
         scale = self.scale.value
         translation = self.translation.value
@@ -3127,18 +3167,107 @@ class Scanner(model.Emitter):
         # being exposed twice more than the others.
         margin = int(math.ceil(st / dwell_time - 0.01))
 
-        new_settings = [resolution, scale, translation, margin]
+        new_settings = (tuple(resolution), tuple(scale), tuple(translation), margin)
         if self._prev_settings != new_settings:
-            # TODO: if only margin changes, just duplicate the margin columns
-            # need to recompute the scanning array
-            self._update_raw_scan_array(resolution[::-1], scale[::-1],
-                                        translation[::-1], margin)
-
+            self._scan_array, self._ranges = self._get_raw_scan_array(
+                      tuple(resolution[::-1]), tuple(scale[::-1]),
+                      tuple(translation[::-1]), margin)
             self._prev_settings = new_settings
 
         return (self._scan_array, dwell_time, resolution[::-1],
                 margin, self._channels, self._ranges, osr, dpr)
 
+    def _get_raw_scan_array(self, shape, scale, translation, margin):
+        """
+        Find the raw array of values to send to scan the 2D area, either from
+        the cache, or by computing it.
+        shape (tuple of 2 int): H/W=Y/X of the scanning area (slow, fast axis)
+        scale (tuple of 2 float): scaling of the pixels
+        translation (tuple of 2 float): shift from the center
+        margin (0<=int): number of additional pixels to add at the beginning of
+            each scanned line
+        returns:
+            array (3D numpy.ndarray): the scan array (should not be modified)
+            ranges (list of int): the range index of each output channel
+        """
+        key = (shape, scale, translation, margin)
+        try:
+            scan_data = self._scan_cache.pop(key)
+            logging.debug("Reusing scan array for shape %s + margin %d", shape, margin)
+        except KeyError:
+            # If only the margin is different, the array can be derived
+            for (cshape, cscale, ctrans, cmargin), (carray, cranges) in reversed(self._scan_cache.items()):
+                if (cshape, cscale, ctrans) == (shape, scale, translation):
+                    logging.debug("Deriving scan array from the one with margin %d to margin %d",
+                                  cmargin, margin)
+                    scan_data = self._change_scan_margin(carray, cmargin, margin), cranges
+                    break
+            else:
+                self._update_raw_scan_array(shape, scale, translation, margin)
+                scan_data = self._scan_array, self._ranges
+
+        # (Re)insert as most recently used, and drop the oldest ones if too big
+        self._scan_cache[key] = scan_data
+        cache_size = sum(a.nbytes for a, r in self._scan_cache.values())
+        while cache_size > MAX_SCAN_CACHE_SIZE and len(self._scan_cache) > 1:
+            _, (a, r) = self._scan_cache.popitem(last=False)
+            cache_size -= a.nbytes
+
+        return scan_data
+
+    def _get_path_scan_array(self, path, margin):
+        """
+        Compute the raw array of values to send to scan a list of positions.
+        path (list of (float, float)): X/Y positions in px, from the center
+        margin (0<=int): number of additional pixels to add at the beginning
+        returns:
+            array (3D numpy.ndarray of shape 1 x (N + margin) x 2): the scan array
+            ranges (list of int): the range index of each output channel
+        """
+        area_shape = self._shape[::-1]
+        pos = numpy.array(path, dtype=numpy.double)[:, ::-1]  # Y/X
+        scan_phys = numpy.empty(pos.shape, dtype=numpy.double)
+        for i, lim in enumerate(self._limits):
+            center = (lim[0] + lim[1]) / 2
+            pxv = (lim[1] - lim[0]) / area_shape[i]  # V/px
+            scan_phys[:, i] = center + pos[:, i] * pxv
+
+        # Compute the best ranges for each channel
+        ranges = []
+        for i, channel in enumerate(self._channels):
+            data_lim = (scan_phys[:, i].min(), scan_phys[:, i].max())
+            best_range = comedi.find_range(self.parent._device,
+                                           self.parent._ao_subdevice,
+                              channel, comedi.UNIT_volt, data_lim[0], data_lim[1])
+            ranges.append(best_range)
+
+        scan_raw = self.parent._array_from_phys(self.parent._ao_subdevice,
+                                                self._channels, ranges, scan_phys)
+        scan = numpy.empty((1, len(path) + margin, 2), dtype=scan_raw.dtype)
+        scan[0, margin:] = scan_raw
+        # fill the margin with the first position
+        scan[0, :margin] = scan_raw[0]
+        logging.debug("Scan path of %d positions + margin %d", len(path), margin)
+        return scan, ranges
+
+    @staticmethod
+    def _change_scan_margin(scan, margin, new_margin):
+        """
+        Derive a scan array with a different margin from an existing one.
+        scan (3D ndarray of shape H x (W + margin) x 2): the scan array, as
+          generated by _generate_scan_array()
+        margin (0<=int): the margin of the scan array
+        new_margin (0<=int): the margin of the new array
+        returns (3D ndarray of shape H x (W + new_margin) x 2): the new scan array
+        """
+        width = scan.shape[1] - margin
+        nscan = numpy.empty((scan.shape[0], width + new_margin, scan.shape[2]),
+                            dtype=scan.dtype)
+        nscan[:, new_margin:] = scan[:, margin:]
+        # The margin is just a copy of the first pixel of each line
+        nscan[:, :new_margin] = scan[:, margin:margin + 1]
+        return nscan
+
     def _update_raw_scan_array(self, shape, scale, translation, margin):
         """
         Update the raw array of values to send to scan the 2D area.
@@ -202,6 +202,16 @@ class Scanner(model.Emitter):
 
         self.dwellTime = model.FloatContinuous(1e-06, (1e-06, 1000), unit="s")
 
+        # (list of (float, float)) in px => if not empty, the e-beam scans each
+        # of these positions (relative to the center, like .translation, and
+        # independent of scale), in order, instead of the area defined by
+        # .resolution, .scale and .translation. The data is then of shape 1 x N.
+        self.scanPath = model.ListVA([], unit="px", setter=self._setScanPath)
+
+        # event to allow another component to synchronize on the beginning of
+        # a pixel position. Only sent when scanning a .scanPath.
+        self.newPosition = model.Event()
+
         # VAs to control the ebeam, purely fake
         self.probeCurrent = model.FloatEnumerated(1.3e-9,
                           {0.1e-9, 1.3e-9, 2.6e-9, 3.4e-9, 11.564e-9, 23e-9},
@@ -309,6 +319,18 @@ class Scanner(model.Emitter):
                 max(min(value[1], max_tran[1]), -max_tran[1]))
         return tran
 
+    def _setScanPath(self, value):
+        """
+        value (list of (float, float)): positions to scan, in px from the center
+        returns actual path accepted
+        """
+        path = [tuple(p) for p in value]
+        hshape = (self._shape[0] / 2, self._shape[1] / 2)
+        for p in path:
+            if len(p) != 2 or not all(-h <= c <= h for c, h in zip(p, hshape)):
+                raise ValueError("Position %s is outside of the scanning area" % (p,))
+        return path
+
     def pixelToPhy(self, px_pos):
         """
         Converts a position in pixels to physical (at the current magnification)
@@ -477,18 +499,7 @@ class Detector(model.Detector):
                      [int(round(ltrb[1] + i * scale[1])) for i in range(res[1])])
             sim_img = self.fake_img[numpy.ix_(coord[1], coord[0])] # copy
 
-            # reduce image depth if requested
-            bpp = self.bpp.value
-            if bpp < 16:
-                mind, maxd = sim_img.min(), sim_img.max()
-                maxf = 2 ** bpp - 1
-                b = maxf / max(1, (maxd - mind))
-                # Multiply by a float and drop to the original dtype
-                numpy.multiply(sim_img - mind, b, out=sim_img, casting="unsafe")
-                if bpp <= 8:
-                    sim_img = sim_img.astype(numpy.uint8)
-
-            metadata[model.MD_BPP] = bpp
+            sim_img = self._reduce_depth(sim_img, metadata)
 
             if self.parent._focus:
                 # apply the defocus
@@ -506,6 +517,73 @@ class Detector(model.Detector):
             metadata[model.MD_EBEAM_VOLTAGE] = scanner.accelVoltage.value
             return model.DataArray(sim_img, metadata)
 
+    def _reduce_depth(self, sim_img, metadata):
+        """
+        Reduce the image depth, if requested by the .bpp
+        sim_img (ndarray): the image, it might be modified
+        metadata (dict): the metadata, updated with the BPP
+        return (ndarray): the image, with the depth reduced
+        """
+        bpp = self.bpp.value
+        if bpp < 16:
+            mind, maxd = sim_img.min(), sim_img.max()
+            maxf = 2 ** bpp - 1
+            b = maxf / max(1, (maxd - mind))
+            # Multiply by a float and drop to the original dtype
+            numpy.multiply(sim_img - mind, b, out=sim_img, casting="unsafe")
+            if bpp <= 8:
+                sim_img = sim_img.astype(numpy.uint8)
+
+        metadata[model.MD_BPP] = bpp
+        return sim_img
+
+    def _simulate_path_image(self, path):
+        """
+        Generates the fake output when scanning a list of positions, based on
+        the current drift.
+        path (list of (float, float)): positions in px, from the center
+        return (DataArray of shape 1xN): the value at each position
+        """
+        metadata = self.parent._metadata.copy()
+        scanner = self.parent._scanner
+        metadata.update(scanner._metadata)
+        metadata.update(self._metadata)
+
+        with self._acquisition_init_lock:
+            pxs = scanner.pixelSize.value  # m/px
+            shi = scanner.shift.value
+
+            shape = self.fake_img.shape
+            # Simulate shift and drift
+            center = (shape[1] / 2 - shi[0] / pxs[0] - self.current_drift,
+                      shape[0] / 2 - shi[1] / pxs[1] + self.current_drift)
+
+            pos = numpy.array(path, dtype=numpy.float64)
+            xs = numpy.clip(numpy.round(center[0] + pos[:, 0]), 0, shape[1] - 1).astype(int)
+            ys = numpy.clip(numpy.round(center[1] + pos[:, 1]), 0, shape[0] - 1).astype(int)
+            sim_img = self.fake_img[ys, xs].reshape(1, len(path))  # copy
+
+            sim_img = self._reduce_depth(sim_img, metadata)
+
+            metadata[model.MD_ACQ_DATE] = time.time()
+            metadata[model.MD_DWELL_TIME] = scanner.dwellTime.value
+            metadata[model.MD_EBEAM_CURRENT] = scanner.probeCurrent.value
+            metadata[model.MD_EBEAM_VOLTAGE] = scanner.accelVoltage.value
+            return model.DataArray(sim_img, metadata)
+
+    def _scan_path(self, path, dwelltime):
+        """
+        Simulates the scan of each position of the path, and notifies the
+        .newPosition event of the scanner at the beginning of each of them.
+        return (bool): False if the acquisition has been requested to stop
+        """
+        scanner = self.parent._scanner
+        for p in path:
+            scanner.newPosition.notify()
+            if self._acquisition_must_stop.wait(dwelltime):
+                return False
+        return True
+
     def _acquire_thread(self, callback):
         """
         Thread that simulates the SEM acquisition. It calculates and updates the
@@ -516,6 +594,14 @@ class Detector(model.Detector):
         try:
             while not self._acquisition_must_stop.is_set():
                 dwelltime = self.parent._scanner.dwellTime.value
+                path = self.parent._scanner.scanPath.value
+                if path:
+                    self.data._waitSync()
+                    if not self._scan_path(path, dwelltime):
+                        break
+                    callback(self._simulate_path_image(path))
+                    continue
+
                 resolution = self.parent._scanner.resolution.value
                 duration = numpy.prod(resolution) * dwelltime
                 if self._acquisition_must_stop.wait(duration):
@@ -133,7 +133,7 @@ class TestPH300(unittest.TestCase):
     def test_acquire_get(self):
         dt = self.dev.dwellTime.range[0]
         self.dev.dwellTime.value = dt
-        exp_shape = self.dev.shape[-2::-1]
+        exp_shape = self.dev.resolution.value[::-1]
         df = self.dev.data
         for i in range(3):
             data = df.get()
@@ -147,7 +147,7 @@ class TestPH300(unittest.TestCase):
         dt = 1  # 1s
         df = self.dev.data
         self.dev.dwellTime.value = dt
-        exp_shape = self.dev.shape[-2::-1]
+        exp_shape = self.dev.resolution.value[::-1]
 
         self._cnt = 0
         self._lastdata = None
@@ -161,6 +161,83 @@ class TestPH300(unittest.TestCase):
         self._cnt += 1
         self._lastdata = data
 
+    def _wait_cnt(self, n, timeout):
+        """
+        Wait until at least n data has been received, or the timeout is over
+        """
+        tend = time.time() + timeout
+        while self._cnt < n and time.time() < tend:
+            time.sleep(0.01)
+
+    def test_acquire_sync(self):
+        """Test the synchronized acquisition: one histogram per trigger"""
+        dt = 0.01  # s
+        df = self.dev.data
+        self.dev.dwellTime.value = dt
+        exp_shape = self.dev.resolution.value[::-1]
+
+        self._cnt = 0
+        self._lastdata = None
+        df.synchronizedOn(self.dev.softwareTrigger)
+        df.subscribe(self._on_det)
+        try:
+            time.sleep(0.5)
+            self.assertEqual(self._cnt, 0)  # Not triggered yet => no data
+
+            for i in range(1, 6):
+                self.dev.softwareTrigger.notify()
+                self._wait_cnt(i, timeout=dt + 10)  # Opening the shutters can take time
+                self.assertEqual(self._cnt, i)
+                self.assertEqual(self._lastdata.shape, exp_shape)
+                self.assertEqual(self._lastdata.metadata[model.MD_DWELL_TIME], dt)
+
+            # Triggers arriving faster than the acquisition are not lost
+            for i in range(3):
+                self.dev.softwareTrigger.notify()
+            self._wait_cnt(8, timeout=3 * dt + 2)
+            time.sleep(0.5)  # No more data should come
+            self.assertEqual(self._cnt, 8)
+        finally:
+            df.unsubscribe(self._on_det)
+            df.synchronizedOn(None)
+
+        # Back to non-synchronized acquisition
+        data = df.get()
+        self.assertEqual(data.shape, exp_shape)
+
+    def test_acquire_line(self):
+        """Test acquiring multiple histograms per data"""
+        dt = 0.01  # s
+        df = self.dev.data
+        self.dev.dwellTime.value = dt
+        nt = self.dev.resolution.value[0]
+        self.dev.resolution.value = (nt, 4)
+        try:
+            self.assertEqual(self.dev.resolution.value, (nt, 4))
+            self._cnt = 0
+            self._lastdata = None
+            df.synchronizedOn(self.dev.softwareTrigger)
+            df.subscribe(self._on_det)
+            try:
+                for i in range(7):
+                    self.dev.softwareTrigger.notify()
+                self._wait_cnt(1, timeout=7 * dt + 10)
+                time.sleep(0.5)
+                self.assertEqual(self._cnt, 1)  # 8th histogram not yet triggered
+                self.assertEqual(self._lastdata.shape, (4, nt))
+                self.dev.softwareTrigger.notify()
+                self._wait_cnt(2, timeout=dt + 2)
+                self.assertEqual(self._cnt, 2)
+            finally:
+                df.unsubscribe(self._on_det)
+                df.synchronizedOn(None)
+
+            # Not synchronized: the histograms are acquired one after another
+            data = df.get()
+            self.assertEqual(data.shape, (4, nt))
+        finally:
+            self.dev.resolution.value = (nt, 1)
+
     def test_va(self):
         """Test changing VA"""
         dt = self.dev.dwellTime.range[0]
@@ -233,7 +310,7 @@ class TestHH400(unittest.TestCase):
     def test_acquire_get(self):
         dt = self.dev.dwellTime.range[0]
         self.dev.dwellTime.value = dt
-        exp_shape = self.dev.shape[-2::-1]
+        exp_shape = self.dev.resolution.value[::-1]
         df = self.dev.data
         for i in range(3):
             data = df.get()
@@ -247,7 +324,7 @@ class TestHH400(unittest.TestCase):
         dt = 1  # 1s
         df = self.dev.data
         self.dev.dwellTime.value = dt
-        exp_shape = self.dev.shape[-2::-1]
+        exp_shape = self.dev.resolution.value[::-1]
 
         self._cnt = 0
         self._lastdata = None
@@ -261,6 +338,83 @@ class TestHH400(unittest.TestCase):
         self._cnt += 1
         self._lastdata = data
 
+    def _wait_cnt(self, n, timeout):
+        """
+        Wait until at least n data has been received, or the timeout is over
+        """
+        tend = time.time() + timeout
+        while self._cnt < n and time.time() < tend:
+            time.sleep(0.01)
+
+    def test_acquire_sync(self):
+        """Test the synchronized acquisition: one histogram per trigger"""
+        dt = 0.01  # s
+        df = self.dev.data
+        self.dev.dwellTime.value = dt
+        exp_shape = self.dev.resolution.value[::-1]
+
+        self._cnt = 0
+        self._lastdata = None
+        df.synchronizedOn(self.dev.softwareTrigger)
+        df.subscribe(self._on_det)
+        try:
+            time.sleep(0.5)
+            self.assertEqual(self._cnt, 0)  # Not triggered yet => no data
+
+            for i in range(1, 6):
+                self.dev.softwareTrigger.notify()
+                self._wait_cnt(i, timeout=dt + 10)  # Opening the shutters can take time
+                self.assertEqual(self._cnt, i)
+                self.assertEqual(self._lastdata.shape, exp_shape)
+                self.assertEqual(self._lastdata.metadata[model.MD_DWELL_TIME], dt)
+
+            # Triggers arriving faster than the acquisition are not lost
+            for i in range(3):
+                self.dev.softwareTrigger.notify()
+            self._wait_cnt(8, timeout=3 * dt + 2)
+            time.sleep(0.5)  # No more data should come
+            self.assertEqual(self._cnt, 8)
+        finally:
+            df.unsubscribe(self._on_det)
+            df.synchronizedOn(None)
+
+        # Back to non-synchronized acquisition
+        data = df.get()
+        self.assertEqual(data.shape, exp_shape)
+
+    def test_acquire_line(self):
+        """Test acquiring multiple histograms per data"""
+        dt = 0.01  # s
+        df = self.dev.data
+        self.dev.dwellTime.value = dt
+        nt = self.dev.resolution.value[0]
+        self.dev.resolution.value = (nt, 4)
+        try:
+            self.assertEqual(self.dev.resolution.value, (nt, 4))
+            self._cnt = 0
+            self._lastdata = None
+            df.synchronizedOn(self.dev.softwareTrigger)
+            df.subscribe(self._on_det)
+            try:
+                for i in range(7):
+                    self.dev.softwareTrigger.notify()
+                self._wait_cnt(1, timeout=7 * dt + 10)
+                time.sleep(0.5)
+                self.assertEqual(self._cnt, 1)  # 8th histogram not yet triggered
+                self.assertEqual(self._lastdata.shape, (4, nt))
+                self.dev.softwareTrigger.notify()
+                self._wait_cnt(2, timeout=dt + 2)
+                self.assertEqual(self._cnt, 2)
+            finally:
+                df.unsubscribe(self._on_det)
+                df.synchronizedOn(None)
+
+            # Not synchronized: the histograms are acquired one after another
+            data = df.get()
+            self.assertEqual(data.shape, (4, nt))
+        finally:
+            self.dev.resolution.value = (nt, 1)
+
     def test_va(self):
         """Test changing VA"""
         dt = self.dev.dwellTime.range[0]
@@ -402,6 +556,41 @@ class TestPH300_Shutters(TestPH300):
         self.assertEqual(self.tc_act.position.value["shutter0"], 0)
         self.assertEqual(self.tc_act.position.value["shutter1"], 0)
 
+    def test_shutters_sync(self):
+        # When synchronized, the shutters should stay open between the triggers
+        self.tc_act.speed.value = {
+            "shutter0": 10,
+            "shutter1": 10,
+        }  # shutters are much faster than a stage
+        self.dev.dwellTime.value = 0.01
+        self._cnt = 0
+        self._lastdata = None
+        self._positions = []
+        self.tc_act.position.subscribe(self._on_position)
+        self.dev.data.synchronizedOn(self.dev.softwareTrigger)
+        self.dev.data.subscribe(self._on_det)
+        try:
+            time.sleep(1)
+            self.assertEqual(self.tc_act.position.value["shutter0"], 1)
+            self.assertEqual(self.tc_act.position.value["shutter1"], 1)
+            nmoves = len(self._positions)
+            for i in range(5):
+                self.dev.softwareTrigger.notify()
+                time.sleep(0.2)
+            self.assertEqual(self._cnt, 5)
+            # No more shutter moves
+            self.assertEqual(len(self._positions), nmoves)
+        finally:
+            self.dev.data.unsubscribe(self._on_det)
+            self.dev.data.synchronizedOn(None)
+            self.tc_act.position.unsubscribe(self._on_position)
+        time.sleep(1)
+        self.assertEqual(self.tc_act.position.value["shutter0"], 0)
+        self.assertEqual(self.tc_act.position.value["shutter1"], 0)
+
+    def _on_position(self, pos):
+        self._positions.append(pos)
+
 
 class TestHH400_Shutters(TestHH400):
     """
@@ -475,6 +664,41 @@ class TestHH400_Shutters(TestHH400):
         self.assertEqual(self.tc_act.position.value["shutter0"], 0)
         self.assertEqual(self.tc_act.position.value["shutter1"], 0)
 
+    def test_shutters_sync(self):
+        # When synchronized, the shutters should stay open between the triggers
+        self.tc_act.speed.value = {
+            "shutter0": 10,
+            "shutter1": 10,
+        }  # shutters are much faster than a stage
+        self.dev.dwellTime.value = 0.01
+        self._cnt = 0
+        self._lastdata = None
+        self._positions = []
+        self.tc_act.position.subscribe(self._on_position)
+        self.dev.data.synchronizedOn(self.dev.softwareTrigger)
+        self.dev.data.subscribe(self._on_det)
+        try:
+            time.sleep(1)
+            self.assertEqual(self.tc_act.position.value["shutter0"], 1)
+            self.assertEqual(self.tc_act.position.value["shutter1"], 1)
+            nmoves = len(self._positions)
+            for i in range(5):
+                self.dev.softwareTrigger.notify()
+                time.sleep(0.2)
+            self.assertEqual(self._cnt, 5)
+            # No more shutter moves
+            self.assertEqual(len(self._positions), nmoves)
+        finally:
+            self.dev.data.unsubscribe(self._on_det)
+            self.dev.data.synchronizedOn(None)
+            self.tc_act.position.unsubscribe(self._on_position)
+        time.sleep(1)
+        self.assertEqual(self.tc_act.position.value["shutter0"], 0)
+        self.assertEqual(self.tc_act.position.value["shutter1"], 0)
+
+    def _on_position(self, pos):
+        self._positions.append(pos)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -142,6 +142,45 @@ class TestController(unittest.TestCase):
         self.assertEqual(0, ctrl.GetErrorNum())
         ctrl.terminate()
 
+    def test_motion_state(self):
+        """
+        Check the motion state (and error) is reported with a single round trip
+        while moving
+        """
+        ctrl = pigcs.Controller(self.accesser, *self.config_ctrl)
+        queries = []
+        orig_query = self.accesser.sendQueryCommand
+
+        def counting_query(addr, com):
+            queries.append(com)
+            return orig_query(addr, com)
+
+        self.accesser.sendQueryCommand = counting_query
+        try:
+            speed_rng = ctrl.speed_rng['1']
+            speed = max(speed_rng[0], speed_rng[1] / 10)
+            ctrl.setSpeed('1', speed)
+            ctrl.moveRel('1', speed / 2)  # should take 0.5s
+            queries[:] = []
+            mv_axes, err = ctrl.getMotionState({'1'})
+            self.assertEqual(mv_axes, {'1'})
+            self.assertEqual(err, 0)
+            self.assertEqual(len(queries), 1)
+
+            timeout = time.time() + 1.5
+            while mv_axes:
+                self.assertLess(time.time(), timeout, "Move still not done")
+                time.sleep(0.01)
+                queries[:] = []
+                mv_axes, err = ctrl.getMotionState({'1'})
+                self.assertEqual(err, 0)
+            # The last query might need a separate error check
+            self.assertLessEqual(len(queries), 2)
+            self.assertFalse(ctrl.isMoving({'1'}))
+        finally:
+            self.accesser.sendQueryCommand = orig_query
+        ctrl.terminate()
+
 #@skip("faster")
 class TestFake(TestController):
     """
@@ -163,6 +202,76 @@ class TestFakeCL(TestController):
         self.config_ctrl = CONFIG_CTRL_CL
 
 
+class TestMotionState(unittest.TestCase):
+    """
+    Test the parsing of the motion state of multi-axis controllers, which is
+    queried for all the axes at once (without hardware).
+    """
+
+    def _createController(self, cls, answers):
+        """
+        Create a controller, without connecting to it, which has 3 channels
+        cls (class): Controller class
+        answers (dict str -> str): command -> answer line
+        return (Controller): the controller, with .queries the list of queries sent
+        """
+        ctrl = object.__new__(cls)  # Controller.__new__() would connect
+        ctrl._channels = ("1", "2", "3")
+        ctrl._auto_suspend = None
+        ctrl.queries = []
+
+        def sendQueryCommand(com):
+            ctrl.queries.append(com)
+            return [answers[c] for c in com]
+
+        ctrl._sendQueryCommand = sendQueryCommand
+        return ctrl
+
+    def test_parse_axes_values(self):
+        ctrl = self._createController(pigcs.Controller, {})
+        com = ["ONT? 1\n", "ONT? 3\n"]
+        self.assertEqual(ctrl._parseAxesValues(com, ["1=0", "3=1"]), {"1": "0", "3": "1"})
+        with self.assertRaises(ValueError):
+            ctrl._parseAxesValues(com, ["1=0", "3"])
+
+    def test_cl_abs(self):
+        ctrl = self._createController(pigcs.CLAbsController,
+                                      {"ERR?\n": "0", "ONT? 1\n": "1=0",
+                                       "ONT? 2\n": "2=1", "ONT? 3\n": "3=0"})
+        mv_axes, err = ctrl.getMotionState({"1", "2", "3"})
+        self.assertEqual(mv_axes, {"1", "3"})
+        self.assertEqual(err, 0)
+        # All the axes (and the error) in a single query
+        self.assertEqual(ctrl.queries, [["ERR?\n", "ONT? 1\n", "ONT? 2\n", "ONT? 3\n"]])
+
+        # Only the axes requested are reported
+        mv_axes, err = ctrl.getMotionState({"2", "3"})
+        self.assertEqual(mv_axes, {"3"})
+
+    def test_cl_abs_error(self):
+        ctrl = self._createController(pigcs.CLAbsController,
+                                      {"ERR?\n": "7", "ONT? 1\n": "1=1", "ONT? 2\n": "2=1"})
+        mv_axes, err = ctrl.getMotionState({"1", "2"})
+        self.assertEqual(mv_axes, set())
+        self.assertEqual(err, 7)
+
+    def test_smo(self):
+        ctrl = self._createController(pigcs.SMOController,
+                                      {"ERR?\n": "0", "SMO? 1\n": "1=0",
+                                       "SMO? 2\n": "2=-12", "SMO? 3\n": "3=0"})
+        mv_axes, err = ctrl.getMotionState({"1", "2", "3"})
+        self.assertEqual(mv_axes, {"2"})
+        self.assertEqual(err, 0)
+        self.assertEqual(len(ctrl.queries), 1)
+
+    def test_bitmap(self):
+        # Axes 1 and 3 moving
+        ctrl = self._createController(pigcs.Controller, {"ERR?\n": "0", "\x05": "5"})
+        mv_axes, err = ctrl.getMotionState({"2", "3"})
+        self.assertEqual(mv_axes, {"3"})
+        self.assertEqual(err, 0)
+
+
 #@skip("faster")
 class TestActuator(unittest.TestCase):
 
@@ -374,6 +483,38 @@ class TestActuator(unittest.TestCase):
         self.assertGreaterEqual(dur, expected_time)
         stage.terminate()
 
+    def test_move_round_trips(self):
+        """
+        Check the number of queries to the controllers during a multi-axis move
+        stays low
+        """
+        stage = CLASS(**self.kwargs_two)
+        queries = []
+        orig_query = stage.accesser.sendQueryCommand
+
+        def counting_query(addr, com):
+            queries.append(com)
+            return orig_query(addr, com)
+
+        stage.accesser.sendQueryCommand = counting_query
+        try:
+            speed = max(stage.axes["x"].speed[0], 0.001)  # try as slow as reasonable
+            stage.speed.value = {"x": speed, "y": speed}
+            move = {'x': speed / 2, 'y': -speed / 2}  # should take 0.5s
+            queries[:] = []
+            start = time.time()
+            stage.moveRel(move).result()
+            dur = time.time() - start
+            nqueries = len(queries)
+        finally:
+            stage.accesser.sendQueryCommand = orig_query
+
+        logging.info("Move took %g s, with %d queries", dur, nqueries)
+        # Per axis: polling of the motion status (~20 Hz), and position update (10 Hz)
+        naxes = len(move)
+        self.assertLessEqual(nqueries, naxes * (30 * dur + 10))
+        stage.terminate()
+
     def test_moveAbs(self):
         stage = CLASS(**self.kwargs)
 
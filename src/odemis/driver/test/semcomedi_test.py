@@ -159,6 +159,19 @@ class TestSEMStatic(unittest.TestCase):
             comp = diffx >= 0 # must be decreasing
         self.assertTrue(comp.all())
 
+    def test_change_scan_margin(self):
+        """
+        Test deriving a scan array with a different margin gives the same
+        result as generating it
+        """
+        limits = numpy.array([[30320, 35215], [40943, 24592]], dtype="uint16")
+        shape = (256, 512)
+        scan_m3 = semcomedi.Scanner._generate_scan_array(shape, limits, 3)
+        for margin in (0, 1, 3, 10):
+            exp_scan = semcomedi.Scanner._generate_scan_array(shape, limits, margin)
+            scan = semcomedi.Scanner._change_scan_margin(scan_m3, 3, margin)
+            numpy.testing.assert_array_equal(scan, exp_scan)
+
 #@unittest.skip("simple")
 class TestSEM(unittest.TestCase):
     """
@@ -289,6 +302,90 @@ class TestSEM(unittest.TestCase):
         test.assert_tuple_almost_equal(im.metadata[model.MD_POS], exp_pos)
 
 
+    def test_scan_cache(self):
+        """
+        Check the scan arrays are not regenerated when alternating between two
+        scan areas, as done by the drift correction
+        """
+        max_res = self.scanner.resolution.range[1]
+        main_settings = ((1, 1), max_res, (0, 0))
+        anchor_settings = ((4, 4), (max_res[0] // 16, max_res[1] // 16), (-30.5, 20))
+
+        self.scanner._scan_cache.clear()
+        self.scanner._prev_settings = None
+        orig_update = self.scanner._update_raw_scan_array
+        nb_updates = [0]
+        def count_update(*args, **kwargs):
+            nb_updates[0] += 1
+            return orig_update(*args, **kwargs)
+        self.scanner._update_raw_scan_array = count_update
+
+        try:
+            # Simulate a drift-corrected acquisition, with a drift correction
+            # every 10 lines
+            for i in range(10):
+                for scale, res, trans in (main_settings, anchor_settings):
+                    self.scanner.scale.value = scale
+                    self.scanner.resolution.value = res
+                    self.scanner.translation.value = trans
+                    exp_shape = res[::-1]
+                    scan = self.scanner.get_scan_data(1)[0]
+                    margin = self.scanner.get_scan_data(1)[3]
+                    self.assertEqual(scan.shape, (exp_shape[0], exp_shape[1] + margin, 2))
+
+            self.assertEqual(nb_updates[0], 2)
+
+            # Changing the margin only (via the dwell time) just derives the array
+            self.scanner.scale.value, self.scanner.resolution.value, self.scanner.translation.value = main_settings
+            self.scanner.dwellTime.value = 1e-3  # long enough to have no margin
+            scan, period, shape, margin = self.scanner.get_scan_data(1)[:4]
+            self.assertEqual(margin, 0)
+            self.assertEqual(nb_updates[0], 2)
+
+            # Check it's the same as if it was generated
+            self.scanner._scan_cache.clear()
+            self.scanner._prev_settings = None
+            exp_scan = self.scanner.get_scan_data(1)[0]
+            self.assertEqual(nb_updates[0], 3)
+            numpy.testing.assert_array_equal(scan, exp_scan)
+        finally:
+            del self.scanner._update_raw_scan_array
+
+    def test_scan_path(self):
+        """
+        Check the scan array generated for a path, and its acquisition
+        """
+        path = [(0, 0), (-100, 50.5), (2000, -1000), (0, 0)]
+        self.scanner.dwellTime.value = 1e-3
+        self.scanner.scanPath.value = path
+        try:
+            scan, period, shape, margin = self.scanner.get_scan_data(1)[:4]
+            self.assertEqual(shape, (1, len(path)))
+            self.assertEqual(scan.shape, (1, len(path) + margin, 2))
+            # Same position => same values
+            numpy.testing.assert_array_equal(scan[0, margin], scan[0, -1])
+
+            # The center is the same as when scanning just the center pixel
+            self.scanner.scanPath.value = [(0, 0)]
+            center_path = self.scanner.get_scan_data(1)[0]
+            self.scanner.scanPath.value = []
+            self.scanner.scale.value = (1, 1)
+            self.scanner.resolution.value = (1, 1)
+            self.scanner.translation.value = (0, 0)
+            center_scan = self.scanner.get_scan_data(1)[0]
+            numpy.testing.assert_array_equal(center_path[0, -1], center_scan[0, -1])
+
+            # Acquisition returns one value per position
+            self.scanner.scanPath.value = path
+            im = self.sed.data.get()
+            self.assertEqual(im.shape, (1, len(path)))
+        finally:
+            self.scanner.scanPath.value = []
+
+        # Positions outside of the scanning area are refused
+        with self.assertRaises(ValueError):
+            self.scanner.scanPath.value = [(self.scanner.shape[0], 0)]
+
 #     @unittest.skip("simple")
     def test_osr(self):
         """
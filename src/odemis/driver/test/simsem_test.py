@@ -281,6 +281,47 @@ class TestSEM(unittest.TestCase):
         im_big_shift = self.sed.data.get()
         test.assert_array_not_equal(im_no_shift, im_big_shift)
 
+    def test_scan_path(self):
+        """
+        check that .scanPath scans each position, and sends .newPosition for each of them
+        """
+        hshape = (self.scanner.shape[0] / 2, self.scanner.shape[1] / 2)
+        path = [(-10, -10), (0, 0), (10.5, -20), (hshape[0], hshape[1])]
+        self.scanner.dwellTime.value = 0.01  # s
+        self.scanner.scanPath.value = path
+        self.assertEqual(self.scanner.scanPath.value, path)
+
+        self.events = 0
+        self.scanner.newPosition.subscribe(self)
+        try:
+            start = time.time()
+            im = self.sed.data.get()
+            duration = time.time() - start
+        finally:
+            self.scanner.newPosition.unsubscribe(self)
+            self.scanner.scanPath.value = []
+
+        self.assertEqual(im.shape, (1, len(path)))
+        self.assertGreaterEqual(duration, len(path) * 0.01)
+        self.assertIn(model.MD_DWELL_TIME, im.metadata)
+        # There could be more events if the next scan has already started
+        self.assertGreaterEqual(self.events, len(path))
+
+        # Back to standard scanning
+        self.scanner.dwellTime.value = self.scanner.dwellTime.range[0]
+        im = self.sed.data.get()
+        self.assertEqual(im.shape, self.size[::-1])
+
+        # Positions outside of the scanning area are refused
+        with self.assertRaises(ValueError):
+            self.scanner.scanPath.value = [(0, 0), (hshape[0] + 1, 0)]
+
+    def onEvent(self):
+        """
+        Called by the scanner when a new position happens
+        """
+        self.events += 1
+
     @skip("faster")
     def test_acquire_high_osr(self):
         """
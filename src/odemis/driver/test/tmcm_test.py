@@ -156,6 +156,115 @@ class TestStatic(unittest.TestCase):
         os.remove(PARAM_FILE)
 
 
+# @skip("faster")
+class TestInstructions(unittest.TestCase):
+    """
+    Tests of sending multiple instructions at once, with the simulator
+    """
+    def setUp(self):
+        self.dev = CLASS(**KWARGS_SIM)
+        self.ser = self.dev._serial  # The TMCMSimulator
+
+    def tearDown(self):
+        self.dev.terminate()
+
+    def test_order(self):
+        """
+        Check the replies are matched to the right instruction
+        """
+        for a in range(6):
+            self.dev.SetAxisParam(a, 4, 100 + a)
+        aparams = [(a, 4) for a in range(6)] + [(a, 1) for a in range(6)]
+        exp_vals = [self.dev.GetAxisParam(a, p) for a, p in aparams]
+
+        # More than the maximum instructions per batch, so it takes 2 writes
+        self.assertGreater(len(aparams), tmcm.MAX_BATCH_INSTRUCTIONS)
+        nwrites = [0]
+        orig_write = self.ser.write
+
+        def counting_write(data):
+            nwrites[0] += 1
+            return orig_write(data)
+
+        self.ser.write = counting_write
+        vals = self.dev.GetAxisParams(aparams)
+        self.assertEqual(vals, exp_vals)
+        self.assertEqual(nwrites[0], 2)
+
+        # Mix of different instructions
+        vals = self.dev.GetGlobalParams([(2, 0), (2, 1), (2, 2)])
+        self.assertEqual(vals, [self.dev.GetGlobalParam(2, i) for i in range(3)])
+        replies = self.dev.SendInstructions([(6, 4, 2), (10, 1, 2), (15, 8, 1)])
+        self.assertEqual(replies, [102, self.dev.GetGlobalParam(2, 1), self.dev.GetIO(1, 8)])
+
+    def test_partial_failure(self):
+        """
+        Check an instruction failing doesn't affect the others
+        """
+        replies = self.dev.SendInstructions([(6, 4, 1), (6, 4, 10), (6, 4, 2)])  # axis 10 doesn't exist
+        self.assertEqual(replies[0], 1024)
+        self.assertIsInstance(replies[1], tmcm.TMCLError)
+        self.assertEqual(replies[1].errno, 4)  # Invalid value
+        self.assertEqual(replies[2], 1024)
+
+        with self.assertRaises(tmcm.TMCLError):
+            self.dev.GetAxisParams([(1, 4), (10, 4)])
+
+        # Still all fine afterwards
+        self.assertEqual(self.dev.GetAxisParams([(1, 4), (2, 4)]), [1024, 1024])
+
+    def test_timeout(self):
+        """
+        Check that if replies are late, the communication is resynchronised
+        """
+        for a in range(3):
+            self.dev.SetAxisParam(a, 4, 100 + a)
+
+        # Replies arrive after the (0.1 s) timeout
+        self.ser.delayed_replies = 3
+        self.ser.reply_delay = 0.15  # s
+        with self.assertRaises(IOError):
+            self.dev.GetAxisParams([(0, 6), (1, 6), (2, 6)])
+
+        # The late replies should not be confused with the new ones
+        self.assertEqual(self.dev.GetAxisParams([(a, 4) for a in range(3)]), [100, 101, 102])
+        self.assertEqual(self.dev.GetAxisParam(1, 4), 101)
+
+    def test_poll_move(self):
+        """
+        Check the status of all the moving axes is read in one go
+        """
+        nwrites = [0]
+        orig_write = self.ser.write
+
+        def counting_write(data):
+            nwrites[0] += 1
+            return orig_write(data)
+
+        self.ser.write = counting_write
+        f = self.dev.moveRel({"x": 100e-6, "y": 100e-6})
+        f.result()
+        nwrites_batch = nwrites[0]
+        logging.info("Move took %d writes", nwrites_batch)
+
+        # Same move, but with one instruction at a time
+        def send_one_by_one(instructions):
+            replies = []
+            for inst in instructions:
+                try:
+                    replies.append(self.dev.SendInstruction(*inst))
+                except tmcm.TMCLError as ex:
+                    replies.append(ex)
+            return replies
+
+        self.dev.SendInstructions = send_one_by_one
+        nwrites[0] = 0
+        f = self.dev.moveRel({"x": -100e-6, "y": -100e-6})
+        f.result()
+        logging.info("Move with one instruction at a time took %d writes", nwrites[0])
+        self.assertLess(nwrites_batch, nwrites[0])
+
+
 # @skip("faster")
 class TestActuator(unittest.TestCase):
 
@@ -93,6 +93,10 @@ TMCL_ERR_STATUS = {
     6: "Command not available",
 }
 
+# Maximum number of instructions sent at once, before reading the replies, to
+# be sure it fits in the input buffer of the controller.
+MAX_BATCH_INSTRUCTIONS = 8
+
 REFPROC_2XFF = "2xFinalForward" # fast then slow, always finishing by forward move
 REFPROC_STD = "Standard"  # Use the standard reference search built in the controller (depends on the axis parameters)
 REFPROC_FAKE = "FakeReferencing"  # was used for simulator when it didn't support referencing
@@ -786,11 +790,9 @@ class TMCLController(model.Actuator):
         if not 2 <= l <= 55:
             raise TypeError("Impossible length of %d" % l)
 
-        # Read the rest of the data
-        s = b""
-        for i in range(l):
-            d = self.GetGlobalParam(2, i + 1)
-            s += struct.pack(">i", d)
+        # Read the rest of the data (all at once)
+        data = self.GetGlobalParams([(2, i + 1) for i in range(l)])
+        s = struct.pack(">%di" % (l,), *data)
 
         logging.debug("Read user config as '%s%s'", to_str_escape(sh), to_str_escape(s))
 
@@ -885,6 +887,66 @@ class TMCLController(model.Actuator):
 
             self._resynchonise()
 
+    def _buildInstruction(self, n, typ=0, mot=0, val=0):
+        """
+        Encode one instruction into a message
+        n, typ, mot, val: see SendInstruction()
+        return (numpy.array of 9 uint8): the message to send
+        """
+        msg = numpy.empty(9, dtype=numpy.uint8)
+        struct.pack_into('>BBBBiB', msg, 0, self._target, n, typ, mot, val, 0)
+        # compute the checksum (just the sum of all the bytes)
+        msg[-1] = numpy.sum(msg[:-1], dtype=numpy.uint8)
+        return msg
+
+    def _readReply(self, msg, n):
+        """
+        Read the reply to an instruction which has already been sent.
+        Must be called with _ser_access acquired.
+        msg (numpy.array of 9 uint8): the message sent
+        n (0<=int<=255): instruction ID of the message sent
+        return (-2**31<=int<2**31-1): value of the reply (if status is good)
+        raises:
+            IOError: if problem with receiving data over the serial port
+            TMCLError: if status if bad
+        """
+        while True:
+            try:
+                res = self._serial.read(9)
+            except IOError:
+                logging.warn("Failed to read from TMCM, trying to reconnect.")
+                self._tryRecover()
+                # We already sent the instruction before, so don't send it again
+                # here. Instead, raise an error and let the user decide what to do next
+                raise IOError("Failed to read from TMCM, restarted serial connection.")
+            if len(res) < 9:  # TODO: TimeoutError?
+                logging.warning("Received only %d bytes after %s, will fail the instruction",
+                                len(res), self._instr_to_str(msg))
+                raise IOError("Received only %d bytes after %s" %
+                              (len(res), self._instr_to_str(msg)))
+            logging.debug("Received %s", self._reply_to_str(res))
+            ra, rt, status, rn, rval, chk = struct.unpack('>BBBBiB', res)
+
+            # Check it's a valid message
+            npres = numpy.frombuffer(res, dtype=numpy.uint8)
+            good_chk = numpy.sum(npres[:-1], dtype=numpy.uint8)
+            if chk == good_chk:
+                if self._target != 0 and self._target != rt:  # 0 means 'any device'
+                    logging.warning("Received a message from %d while expected %d",
+                                    rt, self._target)
+                if rn != n:
+                    logging.info("Skipping a message about instruction %d (waiting for %d)",
+                                 rn, n)
+                    continue
+                if status not in TMCL_OK_STATUS:
+                    raise TMCLError(status, rval, self._instr_to_str(msg))
+            else:
+                # TODO: investigate more why once in a while (~1/1000 msg)
+                # the message is garbled
+                logging.warning("Message checksum incorrect (%d), will assume it's all fine", chk)
+
+            return rval
+
     def SendInstruction(self, n, typ=0, mot=0, val=0):
         """
         Sends one instruction, and return the reply.
@@ -897,10 +959,7 @@ class TMCLController(model.Actuator):
             IOError: if problem with sending/receiving data over the serial port
             TMCLError: if status if bad
         """
-        msg = numpy.empty(9, dtype=numpy.uint8)
-        struct.pack_into('>BBBBiB', msg, 0, self._target, n, typ, mot, val, 0)
-        # compute the checksum (just the sum of all the bytes)
-        msg[-1] = numpy.sum(msg[:-1], dtype=numpy.uint8)
+        msg = self._buildInstruction(n, typ, mot, val)
         with self._ser_access:
             logging.debug("Sending %s", self._instr_to_str(msg))
             try:
@@ -912,42 +971,56 @@ class TMCLController(model.Actuator):
                 # instruction, so it's safe to send the command again.
                 return self.SendInstruction(n, typ, mot, val)
             self._serial.flush()
-            while True:
+            return self._readReply(msg, n)
+
+    def SendInstructions(self, instructions):
+        """
+        Sends multiple instructions, and return their replies. The instructions
+        are sent back to back (by groups of MAX_BATCH_INSTRUCTIONS), before reading
+        the replies, which avoids waiting for a round trip per instruction.
+        instructions (list of tuples of 4 ints): the arguments for SendInstruction
+          (n, typ, mot, val) of each instruction. typ, mot and val are optional.
+        return (list of int or TMCLError): for each instruction, in the same
+          order, the value of the reply, or the error if the status was bad.
+        raises:
+            IOError: if problem with sending/receiving data over the serial port.
+              The communication is resynchronised before raising the error.
+        """
+        replies = []
+        for i in range(0, len(instructions), MAX_BATCH_INSTRUCTIONS):
+            batch = instructions[i:i + MAX_BATCH_INSTRUCTIONS]
+            msgs = [(inst[0], self._buildInstruction(*inst)) for inst in batch]
+            with self._ser_access:
+                for n, msg in msgs:
+                    logging.debug("Sending %s", self._instr_to_str(msg))
                 try:
-                    res = self._serial.read(9)
+                    self._serial.write(numpy.concatenate([msg for n, msg in msgs]))
                 except IOError:
-                    logging.warn("Failed to read from TMCM, trying to reconnect.")
+                    logging.warn("Failed to send command to TMCM, trying to reconnect.")
                     self._tryRecover()
-                    # We already sent the instruction before, so don't send it again
-                    # here. Instead, raise an error and let the user decide what to do next
-                    raise IOError("Failed to read from TMCM, restarted serial connection.")
-                if len(res) < 9:  # TODO: TimeoutError?
-                    logging.warning("Received only %d bytes after %s, will fail the instruction",
-                                    len(res), self._instr_to_str(msg))
-                    raise IOError("Received only %d bytes after %s" %
-                                  (len(res), self._instr_to_str(msg)))
-                logging.debug("Received %s", self._reply_to_str(res))
-                ra, rt, status, rn, rval, chk = struct.unpack('>BBBBiB', res)
+                    # Same as in SendInstruction(): the device didn't get the
+                    # (complete) instructions, so it's safe to send them again.
+                    return replies + self.SendInstructions(instructions[i:])
+                self._serial.flush()
 
-                # Check it's a valid message
-                npres = numpy.frombuffer(res, dtype=numpy.uint8)
-                good_chk = numpy.sum(npres[:-1], dtype=numpy.uint8)
-                if chk == good_chk:
-                    if self._target != 0 and self._target != rt:  # 0 means 'any device'
-                        logging.warning("Received a message from %d while expected %d",
-                                        rt, self._target)
-                    if rn != n:
-                        logging.info("Skipping a message about instruction %d (waiting for %d)",
-                                     rn, n)
-                        continue
-                    if status not in TMCL_OK_STATUS:
-                        raise TMCLError(status, rval, self._instr_to_str(msg))
-                else:
-                    # TODO: investigate more why once in a while (~1/1000 msg)
-                    # the message is garbled
-                    logging.warning("Message checksum incorrect (%d), will assume it's all fine", chk)
-
-                return rval
+                for n, msg in msgs:
+                    try:
+                        replies.append(self._readReply(msg, n))
+                    except TMCLError as ex:
+                        # Just this instruction failed, the following ones are fine
+                        logging.debug("Instruction %s failed: %s", self._instr_to_str(msg), ex)
+                        replies.append(ex)
+                    except IOError:
+                        # The replies to the rest of the instructions might
+                        # arrive later, and be confused with the next replies.
+                        # So get rid of them.
+                        try:
+                            self._resynchonise()
+                        except IOError:
+                            logging.warning("Failed to resynchronise after missing reply")
+                        raise
+
+        return replies
 
     def _tryRecover(self):
         self.state._set_value(HwError("USB connection lost"), force_write=True)
@@ -1000,6 +1073,30 @@ class TMCLController(model.Actuator):
         val = self.SendInstruction(6, param, axis)
         return val
 
+    def GetAxisParams(self, axes_params):
+        """
+        Read multiple axis/parameter settings from the RAM, at once
+        axes_params (list of (0<=int<=5, 0<=int<=255)): axis number/parameter number
+        return (list of int): the value stored for each axis/parameter
+        raises:
+            TMCLError: if one of the parameters couldn't be read
+        """
+        replies = self.SendInstructions([(6, p, a) for a, p in axes_params])
+        return self._checkReplies(replies)
+
+    @staticmethod
+    def _checkReplies(replies):
+        """
+        replies (list of int or TMCLError): as returned by SendInstructions()
+        return (list of int): the values of the replies
+        raises:
+            TMCLError: the first error in the replies, if any
+        """
+        for r in replies:
+            if isinstance(r, TMCLError):
+                raise r
+        return replies
+
     def SetAxisParam(self, axis, param, val):
         """
         Write the axis/parameter setting from the RAM
@@ -1035,6 +1132,17 @@ class TMCLController(model.Actuator):
         val = self.SendInstruction(10, param, bank)
         return val
 
+    def GetGlobalParams(self, banks_params):
+        """
+        Read multiple parameter settings from the RAM, at once
+        banks_params (list of (0<=int<=2, 0<=int<=255)): bank number/parameter number
+        return (list of int): the value stored for each bank/parameter
+        raises:
+            TMCLError: if one of the parameters couldn't be read
+        """
+        replies = self.SendInstructions([(10, p, b) for b, p in banks_params])
+        return self._checkReplies(replies)
+
     def SetGlobalParam(self, bank, param, val):
         """
         Write the parameter setting from the RAM
@@ -1240,6 +1348,13 @@ class TMCLController(model.Actuator):
         """
         # Extended Error Flag: automatically reset after reading it
         xef = self.GetAxisParam(axis, 207)
+        self._checkErrorFlagValue(axis, xef)
+
+    def _checkErrorFlagValue(self, axis, xef):
+        """
+        Raises an HWError if the axis error flag value reports an issue
+        xef (int): value of the extended error flag (axis param 207)
+        """
         if xef & 1:
             raise HwError("Stall detected on axis %d" % (axis,))
         elif xef & 2:  # only on TMCM-3214
@@ -1621,25 +1736,35 @@ class TMCLController(model.Actuator):
           updated
         """
         # uses the current values (converted to internal representation)
-        pos = {}
+        # All the values are read at once, to save round trips
+        names = []
+        instructions = []
         for n, i in self._name_to_axis.items():
             if axes is None or n in axes:
                 if self._abs_encoder[i] is None:
                     # param 1 = current position
-                    pos[n] = self.GetAxisParam(i, 1) * self._ustepsize[i]
+                    instructions.append((6, 1, i))
                 else:
                     # param 209 = encoder position
                     # Note: it's almost like param 215 * 512 / param 210, but
                     # as long as the controller is turned on, it will remember
                     # multiple rotations.
-                    pos[n] = self.GetAxisParam(i, 209) * self._ustepsize[i]
+                    instructions.append((6, 209, i))
+                names.append(n)
 
         for i, (n, hpos, lpos, _) in self._do_axes.items():
             if do_axes is None or n in do_axes:
-                if self.GetIO(2, i):
-                    pos[n] = hpos
-                else:
-                    pos[n] = lpos
+                instructions.append((15, i, 2))  # GetIO(2, i)
+                names.append(n)
+
+        values = self._checkReplies(self.SendInstructions(instructions))
+        pos = {}
+        for n, v in zip(names, values):
+            if n in self._name_to_axis:
+                pos[n] = v * self._ustepsize[self._name_to_axis[n]]
+            else:
+                _, hpos, lpos, _ = self._do_axes[self._name_to_do_axis[n]]
+                pos[n] = hpos if v else lpos
 
         pos = self._applyInversion(pos)
 
@@ -2007,11 +2132,16 @@ class TMCLController(model.Actuator):
         last_axes = moving_axes.copy()
         try:
             while not future._must_stop.is_set():
-                for aid in moving_axes.copy(): # need copy to remove during iteration
-                    if self._isOnTarget(aid):
+                # Read at once the target reached flag (param 8) and the error
+                # flag (param 207) of all the moving axes
+                maxes = sorted(moving_axes)
+                aparams = [(aid, p) for aid in maxes for p in (8, 207)]
+                values = self.GetAxisParams(aparams)
+                for aid, reached, xef in zip(maxes, values[::2], values[1::2]):
+                    if reached != 0:
                         moving_axes.discard(aid)
                     # Check whether the move has stopped due to an error
-                    self._checkErrorFlag(aid)
+                    self._checkErrorFlagValue(aid, xef)
 
                 now = time.time()
                 for ch in moving_do_axes.copy():
@@ -2330,6 +2460,12 @@ class TMCMSimulator(object):
         # time at which the referencing ends
         self._ref_move = [0] * self._naxes
 
+        # To simulate communication issues: the next replies can be delayed,
+        # as if they were sent late by the device
+        self.delayed_replies = 0  # number of the next replies to delay
+        self.reply_delay = 0  # s
+        self._pending_replies = []  # list of (float, bytes): time to send, reply
+
     def _getCurrentPos(self, axis):
         """
         return (int): position in microsteps
@@ -2365,20 +2501,35 @@ class TMCMSimulator(object):
             self._parseMessage(msg) # will update _output_buf
 
     def read(self, size=1):
+        self._releaseReplies()
         ret = self._output_buf[:size]
         self._output_buf = self._output_buf[len(ret):]
 
         if len(ret) < size:
             # simulate timeout
             time.sleep(self.timeout)
+            # The delayed replies might have arrived in the mean time
+            self._releaseReplies()
+            more = self._output_buf[:size - len(ret)]
+            self._output_buf = self._output_buf[len(more):]
+            ret += more
         return ret
 
     def flush(self):
         pass
 
     def flushInput(self):
+        self._releaseReplies()
         self._output_buf = b""
 
+    def _releaseReplies(self):
+        """
+        Put the delayed replies which are due into the output buffer
+        """
+        now = time.time()
+        while self._pending_replies and self._pending_replies[0][0] <= now:
+            self._output_buf += self._pending_replies.pop(0)[1]
+
     def close(self):
         # using read or write will fail after that
         del self._output_buf
@@ -2390,7 +2541,14 @@ class TMCMSimulator(object):
         # compute the checksum (just the sum of all the bytes)
         msg[-1] = numpy.sum(msg[:-1], dtype=numpy.uint8)
 
-        self._output_buf += msg.tostring()
+        if self.delayed_replies > 0:
+            self.delayed_replies -= 1
+            self._pending_replies.append((time.time() + self.reply_delay, msg.tostring()))
+        elif self._pending_replies:
+            # Replies are always received in order => after the delayed ones
+            self._pending_replies.append((self._pending_replies[-1][0], msg.tostring()))
+        else:
+            self._output_buf += msg.tostring()
 
     def _parseMessage(self, msg):
         """
@@ -138,7 +138,9 @@ from abc import abstractmethod
 import cairo
 from decorator import decorator
 import logging
-from odemis import util, gui
+import math
+import numpy
+from odemis import model, util, gui
 from odemis.gui import BLEND_DEFAULT, BLEND_SCREEN, BufferSizeEvent
 from odemis.gui import img
 from odemis.gui.comp.overlay.base import WorldOverlay, ViewOverlay
@@ -146,12 +148,18 @@ from odemis.gui.evt import EVT_KNOB_ROTATE, EVT_KNOB_PRESS
 from odemis.gui.util import call_in_wx_main, capture_mouse_on_drag, \
     release_mouse_on_drag
 from odemis.gui.util.conversion import wxcol_to_frgb
-from odemis.gui.util.img import add_alpha_byte, apply_rotation, apply_shear, apply_flip, get_sub_img
+from odemis.gui.util.img import add_alpha_byte, apply_rotation, apply_shear, apply_flip, get_sub_img, \
+    downscale_by_2
 from odemis.util import intersect
 import os
 import wx
 from wx.lib import wxcairo
 
+# Minimum number of pixels of a non-interpolated image to use mipmaps when
+# zooming out. Smaller images (eg, live streams) are drawn directly, as cairo
+# only samples the output pixels, and the mipmaps would be recomputed for
+# every new frame.
+MIPMAP_MIN_PIXELS = 4096 * 4096
 
 # Special abilities that a canvas might possess
 CAN_DRAG = 1    # Content can be dragged
@@ -778,6 +786,11 @@ class BitmapCanvas(BufferedCanvas):
         # List of odemis.model.DataArray images to draw. Should always have at least 1 element,
         # to allow the direct addition of a 2nd image.
         self.images = [None]
+        # Mipmaps of the (non-tiled) images, computed when the image is drawn
+        # smaller than its actual size: id(im) -> (im, list of DataArray).
+        # The first level is the image itself, and each level is half the
+        # size of the previous one.
+        self._mipmaps = {}
         # Merge ratio for combining the images
         self.merge_ratio = 0.3
         self.scale = 1.0  # px/m
@@ -786,6 +799,7 @@ class BitmapCanvas(BufferedCanvas):
     def clear(self):
         """ Remove the images and clear the canvas """
         self.images = [None]
+        self._mipmaps = {}
         BufferedCanvas.clear(self)
 
     def set_images(self, im_args):
@@ -860,6 +874,46 @@ class BitmapCanvas(BufferedCanvas):
                 images.append(im)
 
         self.images = images
+        # Forget the mipmaps of the images not displayed anymore
+        self._mipmaps = {i: m for i, m in self._mipmaps.items()
+                         if any(m[0] is im for im in images)}
+
+    def _get_mipmap_level(self, im_data, scale, interpolate_data=False):
+        """ Return the version of the image the most adapted to the given scale
+
+        The mipmaps are only computed if the image is interpolated, or if it is
+        big (>= MIPMAP_MIN_PIXELS). Otherwise, the original image is returned.
+
+        :param im_data: (DataArray of shape YXC) The image
+        :param scale: (0 < float) The scale at which the image will be drawn
+          (1 = 1 image pixel per buffer pixel)
+        :param interpolate_data: (boolean) True if the image is drawn with
+          interpolation
+
+        :return: (DataArray, int): the image data, and how many times it is
+          smaller than the original image (a power of 2).
+
+        """
+        if scale >= 0.75:
+            return im_data, 1
+        if not interpolate_data and im_data.shape[0] * im_data.shape[1] < MIPMAP_MIN_PIXELS:
+            return im_data, 1
+
+        # The level closest to the scale
+        n = int(round(math.log(1 / scale, 2)))
+        try:
+            im, levels = self._mipmaps[id(im_data)]
+            if im is not im_data:
+                raise KeyError("Different image")
+        except KeyError:
+            levels = [im_data]
+            self._mipmaps[id(im_data)] = (im_data, levels)
+
+        while len(levels) <= n and min(levels[-1].shape[:2]) >= 2:
+            levels.append(model.DataArray(downscale_by_2(levels[-1]), im_data.metadata))
+
+        n = min(n, len(levels) - 1)
+        return levels[n], 2 ** n
 
     def draw(self, interpolate_data=False):
         """ Draw the images and overlays into the buffer
@@ -1170,6 +1224,21 @@ class BitmapCanvas(BufferedCanvas):
             if b_im_rect[2] > intersection[2] * 1.1 or b_im_rect[3] > intersection[3] * 1.1:
                 im_data, tl = get_sub_img(intersection, b_im_rect, im_data, total_scale)
                 b_im_rect = (tl[0], tl[1], b_im_rect[2], b_im_rect[3], )
+        else:
+            # Down scaling: draw a smaller version of the image, so that cairo
+            # doesn't have to go through all the pixels of the original image.
+            im_data, lvl_ratio = self._get_mipmap_level(im_data, max(total_scale_x, total_scale_y),
+                                                         interpolate_data)
+            if lvl_ratio > 1:
+                total_scale = total_scale_x, total_scale_y = (total_scale_x * lvl_ratio,
+                                                              total_scale_y * lvl_ratio)
+
+            # Only pass the visible part (when the image is not transformed, as
+            # the intersection is computed without the transformations)
+            if (not (rotation or shear or flip) and
+                (b_im_rect[2] > intersection[2] * 1.1 or b_im_rect[3] > intersection[3] * 1.1)):
+                im_data, tl = get_sub_img(intersection, b_im_rect, im_data, total_scale)
+                b_im_rect = (tl[0], tl[1], b_im_rect[2], b_im_rect[3], )
 
         # Render the image data to the context
 
@@ -1729,14 +1798,52 @@ PLOT_MODE_LINE = 2
 PLOT_MODE_BAR = 3
 
 
+def find_plot_columns(pos_x, width):
+    """
+    Groups the points which fall into the same pixel column
+    pos_x (ndarray of float): the (sorted) horizontal position of each point in px
+    width (int): the number of columns
+    return (ndarray of int): index of the first point of each group. If there
+      are less than 2 points per column, each point is its own group.
+    """
+    if len(pos_x) <= 2 * width:
+        return numpy.arange(len(pos_x))
+
+    cols = numpy.clip(pos_x.astype(numpy.int64), 0, width - 1)
+    # As the data is ordered, a new column starts at every change
+    return numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(cols)) + 1))
+
+
+def minmax_envelope(pos_x, pos_y, starts):
+    """
+    Reduces the points to the envelope (min and max) of each group
+    pos_x (ndarray of float): the horizontal position of each point
+    pos_y (ndarray of float): the vertical position of each point
+    starts (ndarray of int): index of the first point of each group, as returned
+      by find_plot_columns()
+    return (ndarray of float, ndarray of float): the horizontal and vertical
+      positions of the envelope, 2 points per group (or 1 if groups have just
+      one point)
+    """
+    if len(starts) == len(pos_x):  # No reduction
+        return pos_x, pos_y
+
+    env_x = numpy.repeat(pos_x[starts], 2)
+    env_y = numpy.empty(len(env_x), dtype=numpy.float64)
+    env_y[0::2] = numpy.minimum.reduceat(pos_y, starts)
+    env_y[1::2] = numpy.maximum.reduceat(pos_y, starts)
+    return env_x, env_y
+
+
 class PlotCanvas(BufferedCanvas):
     """ This is a general canvas for plotting numerical data in various ways """
 
     def __init__(self, *args, **kwargs):
         BufferedCanvas.__init__(self, *args, **kwargs)
 
-        # The data to be plotted: list of 2-tuples (x, y, for each point)
-        self._data = None
+        # The data to be plotted: the X and Y value of each point, as 2 1D arrays
+        self._data_x = None
+        self._data_y = None
 
         self.range_x = None
         self.range_y = None
@@ -1758,12 +1865,18 @@ class PlotCanvas(BufferedCanvas):
     # Getters and Setters
 
     def set_1d_data(self, xs, ys, unit_x=None, unit_y=None, range_x=None, range_y=None):
-        """ Construct the data by zipping the two provided 1D iterables """
+        """ Set the data to be plotted, from the two provided 1D iterables
 
+        xs (iterable of numbers): the X values, ordered and not duplicated.
+        ys (iterable of numbers): the Y values, same length as xs.
+        See set_data() for the other arguments.
+        """
         if len(xs) != len(ys):
             msg = "X and Y list are of unequal length. X: %s, Y: %s, Xs: %s..."
             raise ValueError(msg % (len(xs), len(ys), str(xs)[:30]))
-        self.set_data(list(zip(xs, ys)), unit_x, unit_y, range_x, range_y)
+        self._set_data(numpy.asarray(xs, dtype=numpy.float64),
+                       numpy.asarray(ys, dtype=numpy.float64),
+                       unit_x, unit_y, range_x, range_y)
 
     def set_data(self, data, unit_x=None, unit_y=None, range_x=None, range_y=None):
         """ Set the data to be plotted
@@ -1778,49 +1891,49 @@ class PlotCanvas(BufferedCanvas):
            If None, it's automatically computed.
         """
         if data is not None:
-            if len(data[0]) != 2:
+            data = numpy.asarray(data, dtype=numpy.float64)
+            if data.ndim != 2 or data.shape[1] != 2:
                 raise ValueError("The data should be 2D!")
-
-            self._data = data
-
-            if range_x is None:
-                # It's easy, as the data is ordered
-                range_x = (data[0][0], data[-1][0])
-
-            # If a range is not given, we calculate it from the data
-            if range_y is None:
-                min_y = min(d[1] for d in data)
-                max_y = max(d[1] for d in data)
-                range_y = (min_y, max_y)
-
-#             # Check if sorted
-#             s = all(data[i][0] < data[i + 1][0] for i in xrange(len(data) - 1))
-#             try:
-#                 if not s:
-#                     if any(data[i][0] == data[i + 1][0] for i in xrange(len(data) - 1)):
-#                         raise ValueError("The horizontal data points should be unique.")
-#                     else:
-#                         raise ValueError("The horizontal data should be sorted.")
-#             except ValueError:
-#                 # Try to display the data any way
-#                 logging.exception("Horizontal data is incorrect, will drop it. Was: %s",
-#                                   [d[0] for d in data])
-#                 data = [(i, d[1]) for i, d in enumerate(data)]
-#                 unit_x = None
-
-            self.range_x = range_x
-            self.range_y = range_y
-
-            self.unit_x = unit_x
-            self.unit_y = unit_y
+            self._set_data(data[:, 0], data[:, 1], unit_x, unit_y, range_x, range_y)
         else:
-            logging.warn("Trying to fill PlotCanvas with empty data!")
+            logging.warning("Trying to fill PlotCanvas with empty data!")
             self.clear()
+            wx.CallAfter(self.request_drawing_update)
+
+    def _set_data(self, xs, ys, unit_x, unit_y, range_x, range_y):
+        """ Set the data to be plotted
+
+        xs (ndarray of float): The X values, ordered
+        ys (ndarray of float): The Y values, same length as xs
+        """
+        if len(xs) == 0:
+            logging.warning("Trying to fill PlotCanvas with empty data!")
+            self.clear()
+            wx.CallAfter(self.request_drawing_update)
+            return
+
+        if range_x is None:
+            # It's easy, as the data is ordered
+            range_x = (float(xs[0]), float(xs[-1]))
+
+        # If a range is not given, we calculate it from the data
+        if range_y is None:
+            range_y = (float(ys.min()), float(ys.max()))
+
+        # Set X & Y together, as drawing can happen in another thread
+        self._data_x, self._data_y = xs, ys
+
+        self.range_x = range_x
+        self.range_y = range_y
+
+        self.unit_x = unit_x
+        self.unit_y = unit_y
 
         wx.CallAfter(self.request_drawing_update)
 
     def clear(self):
-        self._data = None
+        self._data_x = None
+        self._data_y = None
         self.unit_y = None
         self.unit_x = None
         self.range_x = None
@@ -1828,7 +1941,7 @@ class PlotCanvas(BufferedCanvas):
         BufferedCanvas.clear(self)
 
     def has_data(self):
-        return self._data is not None and len(self._data) > 2
+        return self._data_x is not None and len(self._data_x) > 2
 
     # Value calculation methods
 
@@ -1880,11 +1993,50 @@ class PlotCanvas(BufferedCanvas):
         else:
             return 0
 
+    def _val_to_pos_arrays(self, xs, ys, range_x, range_y):
+        """ Translate the values to pixel positions, like val_to_pos(), but
+        on all the points at once.
+        :param xs, ys: (ndarray of float) The X and Y values
+        :return: (ndarray of float, ndarray of float) The X and Y positions
+        """
+        width, height = self.ClientSize
+        data_width = range_x[1] - range_x[0]
+        if data_width:
+            pos_x = numpy.clip(xs, range_x[0], range_x[1])
+            pos_x -= range_x[0]
+            pos_x *= width / data_width
+        else:
+            pos_x = numpy.zeros(len(xs))
+
+        data_height = range_y[1] - range_y[0]
+        if data_height:
+            pos_y = numpy.clip(ys, range_y[0], range_y[1])
+            pos_y = range_y[1] - pos_y
+            pos_y *= height / data_height
+        else:
+            pos_y = numpy.zeros(len(ys))
+
+        return pos_x, pos_y
+
+    def _index_closest_x(self, val_x):
+        """
+        Find the index of the point with the X value closest to the given one
+        val_x (float): the value in X
+        return (int): the index in the data
+        """
+        xs = self._data_x
+        i = numpy.searchsorted(xs, val_x)
+        if i >= len(xs):
+            return len(xs) - 1
+        elif i > 0 and (val_x - xs[i - 1]) <= (xs[i] - val_x):
+            return i - 1
+        return i
+
     def pos_x_to_val_x(self, pos_x, snap=False):
         """ Map the given pixel position to an x value from the data
 
-        If snap is True, the closest snap from `self._data` will be returned, otherwise
-        interpolation will occur.
+        If snap is True, the closest value from `self._data_x` will be returned,
+        otherwise interpolation will occur.
         """
         perc_x = pos_x / self.ClientSize.x
         data_width = self.range_x[1] - self.range_x[0]
@@ -1892,7 +2044,7 @@ class PlotCanvas(BufferedCanvas):
 
         if snap:
             # Return the value closest to val_x
-            return util.find_closest(val_x, [x for x, _ in self._data])
+            return float(self._data_x[self._index_closest_x(val_x)])
         else:
             # Clip the value
             min_val, max_val = min(self.range_x), max(self.range_x)
@@ -1903,16 +2055,17 @@ class PlotCanvas(BufferedCanvas):
     def pos_y_to_val_y(self, pos_y, snap=False):
         """ Map the given pixel position to a y value from the data
 
-        If snap is True, the closest snap from `self._data` will be returned, otherwise
-        interpolation will occur.
+        If snap is True, the closest value from `self._data_y` will be returned,
+        otherwise interpolation will occur.
         """
         perc_y = pos_y / self.ClientSize.y
         data_height = self.range_y[1] - self.range_y[0]
         val_y = self.range_y[1] - (perc_y * data_height)
 
         if snap:
-            # Return the value closest to val_x
-            return util.find_closest(val_y, [y for _, y in self._data])
+            # Return the value closest to val_y (Y is not ordered)
+            ys = self._data_y
+            return float(ys[numpy.argmin(numpy.abs(ys - val_y))])
         else:
             # Clip the value
             min_val, max_val = min(self.range_y), max(self.range_y)
@@ -1926,9 +2079,8 @@ class PlotCanvas(BufferedCanvas):
         val_x (number): the value in X
         return (tuple of data): X, Y value
         """
-        # TODO: as _data is sorted over X, it would be much faster to use
-        # dichotomy search, cf bisect.bisect() or numpy.searchsorted()
-        return min(self._data, key=lambda v: abs(v[0] - val_x))
+        i = self._index_closest_x(val_x)
+        return float(self._data_x[i]), float(self._data_y[i])
 
     def SetForegroundColour(self, *args, **kwargs):
         BufferedCanvas.SetForegroundColour(self, *args, **kwargs)
@@ -1960,82 +2112,74 @@ class PlotCanvas(BufferedCanvas):
         ctx = wxcairo.ContextFromDC(self._dc_buffer)
         self._draw_background(ctx)
 
-        if self._data is not None:
-            data = self._data
-            ctx = wxcairo.ContextFromDC(self._dc_buffer)
-            self._plot_data(ctx, data, self.range_x, self.range_y)
+        xs, ys = self._data_x, self._data_y
+        if xs is not None:
+            self._plot_data(ctx, xs, ys, self.range_x, self.range_y)
 
-    def _plot_data(self, ctx, data, range_x, range_y):
-        """ Plot the current `_data` to the given context """
+    def _plot_data(self, ctx, xs, ys, range_x, range_y):
+        """ Plot the given data to the given context """
+        if self.plot_mode == PLOT_MODE_LINE:
+            self._line_plot(ctx, xs, ys, range_x, range_y)
+        elif self.plot_mode == PLOT_MODE_BAR:
+            self._bar_plot(ctx, xs, ys, range_x, range_y)
+        elif self.plot_mode == PLOT_MODE_POINT:
+            self._point_plot(ctx, xs, ys, range_x, range_y)
 
-        if self._data is not None:
-            if self.plot_mode == PLOT_MODE_LINE:
-                self._line_plot(ctx, data, range_x, range_y)
-            elif self.plot_mode == PLOT_MODE_BAR:
-                self._bar_plot(ctx, data, range_x, range_y)
-            elif self.plot_mode == PLOT_MODE_POINT:
-                self._point_plot(ctx, data, range_x, range_y)
+    # The drawing methods reduce the data to at most 2 points per pixel column,
+    # so that the number of cairo calls is independent of the size of the data.
 
-    def _bar_plot(self, ctx, data, range_x, range_y):
-        """ Do a bar plot of the current `_data` """
+    def _bar_plot(self, ctx, xs, ys, range_x, range_y):
+        """ Do a bar plot of the data """
 
-        if len(data) < 2:
+        if len(xs) < 2:
             return
 
-        vx_to_px = self._val_x_to_pos_x
-        vy_to_py = self._val_y_to_pos_y
+        # Each bar goes half-way to the next/previous point
+        edges = numpy.empty(len(xs) + 1)
+        edges[1:-1] = (xs[:-1] + xs[1:]) / 2
+        edges[0] = xs[0] - (xs[1] - xs[0]) / 2
+        edges[-1] = xs[-1] + (xs[-1] - xs[-2]) / 2
+        pos_edges, pos_y = self._val_to_pos_arrays(edges, ys, range_x, range_y)
+        py0 = self._val_y_to_pos_y(0, range_y)
+
+        # For each pixel column, show the bar the furthest away from 0
+        starts = find_plot_columns(pos_edges[:-1], self.ClientSize.x)
+        if len(starts) < len(xs):
+            pmin = numpy.minimum.reduceat(pos_y, starts)
+            pmax = numpy.maximum.reduceat(pos_y, starts)
+            pos_y = numpy.where(py0 - pmin >= pmax - py0, pmin, pmax)
+            pos_edges = numpy.append(pos_edges[starts], pos_edges[-1])
+
+        # Steps: left edge -> right edge at the height of each bar
+        step_x = numpy.repeat(pos_edges, 2)[1:-1]
+        step_y = numpy.repeat(pos_y, 2)
 
         line_to = ctx.line_to
         ctx.set_source_rgb(*self.fill_colour)
-
-        diff = (data[1][0] - data[0][0]) / 2.0
-        px = vx_to_px(data[0][0] - diff, range_x)
-        py = vy_to_py(0, range_y)
-
-        ctx.move_to(px, py)
-        # print "-", px, py
-
-        for i, (vx, vy) in enumerate(data[:-1]):
-            py = vy_to_py(vy, range_y)
-            # print "-", px, py
-            line_to(px, py)
-            px = vx_to_px((data[i + 1][0] + vx) / 2, range_x)
-            # print "-", px, py
+        ctx.move_to(pos_edges[0], py0)
+        for px, py in zip(step_x.tolist(), step_y.tolist()):
             line_to(px, py)
-
-        py = vy_to_py(data[-1][1], range_y)
-        # print "-", px, py
-        line_to(px, py)
-
-        diff = (data[-1][0] - data[-2][0]) / 2
-        px = vx_to_px(data[-1][0] + diff, range_x)
-        # print "-", px, py
-        line_to(px, py)
-
-        py = vy_to_py(0, range_y)
-        # print "-", px, py
-        line_to(px, py)
+        line_to(pos_edges[-1], py0)
 
         ctx.close_path()
         ctx.fill()
 
-    def _line_plot(self, ctx, data, range_x, range_y):
-        """ Do a line plot of the current `_data` """
+    def _line_plot(self, ctx, xs, ys, range_x, range_y):
+        """ Do a line plot of the data """
 
-        ctx.move_to(*self.val_to_pos(data[0], range_x, range_y))
+        pos_x, pos_y = self._val_to_pos_arrays(xs, ys, range_x, range_y)
+        starts = find_plot_columns(pos_x, self.ClientSize.x)
+        pos_x, pos_y = minmax_envelope(pos_x, pos_y, starts)
 
-        value_to_position = self.val_to_pos
+        ctx.move_to(pos_x[0], pos_y[0])
         line_to = ctx.line_to
-
-        for p in data[1:]:
-            x, y = value_to_position(p, range_x, range_y)
-            # logging.debug("drawing to %s", (x, y))
-            line_to(x, y)
+        for px, py in zip(pos_x[1:].tolist(), pos_y[1:].tolist()):
+            line_to(px, py)
 
         if self.plot_closed == PLOT_CLOSE_BOTTOM:
-            x, y = value_to_position((range_x[1], 0), range_x, range_y)
+            x, y = self.val_to_pos((range_x[1], 0), range_x, range_y)
             ctx.line_to(x, y)
-            x, y = value_to_position((0, 0), range_x, range_y)
+            x, y = self.val_to_pos((0, 0), range_x, range_y)
             ctx.line_to(x, y)
         else:
             ctx.close_path()
@@ -2044,17 +2188,23 @@ class PlotCanvas(BufferedCanvas):
         ctx.set_source_rgb(*self.fill_colour)
         ctx.fill()
 
-    def _point_plot(self, ctx, data, range_x, range_y):
-        """ Do a line plot of the current `_data` """
+    def _point_plot(self, ctx, xs, ys, range_x, range_y):
+        """ Do a point plot of the data, as vertical lines from the bottom """
+
+        pos_x, pos_y = self._val_to_pos_arrays(xs, ys, range_x, range_y)
+        starts = find_plot_columns(pos_x, self.ClientSize.x)
+        if len(starts) < len(pos_x):
+            # Only the highest point of each column is visible
+            pos_x = pos_x[starts]
+            pos_y = numpy.minimum.reduceat(pos_y, starts)
 
         move_to = ctx.move_to
         line_to = ctx.line_to
         bottom_y = self.ClientSize.y
 
-        for p in data:
-            x, y = self.val_to_pos(p, range_x, range_y)
-            move_to(x, bottom_y)
-            line_to(x, y)
+        for px, py in zip(pos_x.tolist(), pos_y.tolist()):
+            move_to(px, bottom_y)
+            line_to(px, py)
 
         ctx.set_line_width(self.line_width)
         ctx.set_source_rgb(*self.fill_colour)
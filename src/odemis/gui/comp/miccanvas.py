@@ -1199,7 +1199,7 @@ class BarPlotCanvas(canvas.PlotCanvas):
     @wxlimit_invocation(2)  # max 1/2 Hz
     def update_thumbnail(self):
         if self and self.IsEnabled():
-            if self._data is None:
+            if self._data_x is None:
                 self.view.thumbnail.value = None
             else:
                 img = self._get_img_from_buffer()
@@ -1221,7 +1221,7 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
     with the mouse wheel.The plot can be panned with a middle mouse button drag.
     Therefore, the data range and display range are different.
 
-    The plot also re-samples large data sets to speed up their display.
+    Large data sets are reduced to the visible part before being displayed.
 
     API:
     Read only values
@@ -1236,8 +1236,7 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
             are range tuples.
         .reset_ranges(): Resets the display ranges to the data ranges
         .refresh_plot(): Redraws the plot with the newest parameters.
-            This function takes a window of the data set based on the current display range
-            and resamples large data sets so that they can be displayed quickly without lag.
+            This function takes a window of the data set based on the current display range.
 
     Note: fit_view_to_content does not function in the same way as the parent. Because the plot ranges
         are usually controlled by VA's in the viewport, this method now posts
@@ -1275,9 +1274,7 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
 
         # If a range is not given, we calculate it from the data
         if range_y is None:
-            min_y = float(min(self._data_buffer[1]))
-            max_y = float(max(self._data_buffer[1]))
-            range_y = (min_y, max_y)
+            range_y = (float(self._data_buffer[1].min()), float(self._data_buffer[1].max()))
 
         self.data_xrange = range_x
         self.data_yrange = range_y
@@ -1304,46 +1301,6 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
 
         self.set_ranges(self.data_xrange, self.data_yrange)
 
-    def _resample_plot(self, xs, ys, threshold):
-        """
-        Re-sample the data if there are more points than the threshold
-        xs, ys: two 1-D arrays with data
-        threshold: the minimum number of points for a re-sampling to occur
-        """
-        # Re-sample data based on window size
-        if len(xs) > threshold:
-            rs_factor = len(xs) // (threshold // 2)
-            logging.debug("Re-sampling data with factor %d", rs_factor)
-
-            """
-            # TODO: One we support Scipy 1.2.1, we can use this function
-            xr = xs[::rs_factor]
-            # Add the peaks back into the data set so that features are displayed
-            # peaks, _ = scipy.signal.find_peaks(ys, height=0)
-            xr = numpy.append(xr, peaks)
-            xr = numpy.unique(xr)
-            xr.sort()
-            """
-            n = len(xs)
-            rem = n % rs_factor
-            new_shape = (n // rs_factor, rs_factor)
-
-            # Reshape the array into bins and take the max of each bin
-            xr = numpy.reshape(xs[:(n - rem)], new_shape)
-            xr = numpy.amax(xr, axis=1)
-
-            # in case there are remaining items left at the end (could not fit into
-            # an equally sized bin) add these to the end of the re-sampled dataset
-            rem_items = xs[(n - rem):n]
-            if len(rem_items) > 0:
-                xr = numpy.append(xr, max(rem_items))
-
-            yr = numpy.interp(xr, xs, ys)
-
-            return xr, yr
-        else:
-            return xs, ys
-
     @limit_invocation(0.05)  # Max 20 Hz
     def refresh_plot(self):
         """
@@ -1382,8 +1339,8 @@ class NavigableBarPlotCanvas(BarPlotCanvas):
             xs = numpy.append(xs, xst[hix])
             ys = numpy.append(ys, yst[hix])
 
-        # Resample the plot (if necessary) for the view, and restack the data
-        xs, ys = self._resample_plot(xs, ys, self.ClientSize.x * 10)
+        # No need to resample the data, as PlotCanvas only draws the envelope
+        # of the points which fall in the same pixel column.
         temp_data = numpy.column_stack((xs, ys))
 
         if temp_data.size == 0:
@@ -1596,8 +1553,8 @@ class TwoDPlotCanvas(BitmapCanvas):
     def pos_to_val(self, pos, snap=False):
         """ Map the given pixel position to a value in the data range
 
-        If snap is True, the closest snap from `self._data` will be returned, otherwise
-        interpolation will occur.
+        If snap is True, the closest values from `self._data_x` and `self._data_y`
+        would be returned (not supported yet), otherwise interpolation will occur.
         """
         size = self.ClientSize
         perc_x = pos[0] / size[0]
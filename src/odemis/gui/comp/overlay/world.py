@@ -27,6 +27,7 @@ from __future__ import division
 import cairo
 import logging
 import math
+import numpy
 from odemis import model, util
 from odemis.acq.stream import UNDEFINED_ROI
 from odemis.gui import img
@@ -41,6 +42,7 @@ from future.utils import with_metaclass
 import odemis.gui as gui
 from odemis.util.comp import compute_scanner_fov, get_fov_rect
 import odemis.util.conversion as conversion
+from scipy.spatial import cKDTree
 import odemis.util.units as units
 
 
@@ -2308,6 +2310,11 @@ class PointsOverlay(WorldOverlay):
         self.point = None
         # The possible choices for point as a physical coordinates
         self.choices = set()
+        # Same choices, as a list, and as an array (N x 2) with a spatial index,
+        # to quickly find the points close to a position
+        self._choices_list = []
+        self._choices_pos = numpy.empty((0, 2))
+        self._choices_tree = None
 
         self.min_dist = None
 
@@ -2380,16 +2387,18 @@ class PointsOverlay(WorldOverlay):
 
                 b_hover_box = None
 
-                for p_pos in self.choices:
-                    b_box_x, b_box_y = self.cnvs.phys_to_buffer(p_pos, offset)
-
-                    if abs(b_box_x - b_x) <= self.dot_size and abs(b_box_y - b_y) <= self.dot_size:
-                        # Calculate box in buffer coordinates
-                        b_hover_box = (b_box_x - self.dot_size,
-                                       b_box_y - self.dot_size,
-                                       b_box_x + self.dot_size,
-                                       b_box_y + self.dot_size)
-                        break
+                # Look for the closest point, within the (square) dot
+                p_pos = self.cnvs.buffer_to_phys((b_x, b_y), offset)
+                p_dot_size = self.dot_size / self.cnvs.scale
+                dist, i = self._choices_tree.query(p_pos, p=numpy.inf,
+                                                   distance_upper_bound=p_dot_size * 1.000001)
+                if i < len(self._choices_list):  # Found
+                    b_box_x, b_box_y = self.cnvs.phys_to_buffer(self._choices_list[i], offset)
+                    # Calculate box in buffer coordinates
+                    b_hover_box = (b_box_x - self.dot_size,
+                                   b_box_y - self.dot_size,
+                                   b_box_x + self.dot_size,
+                                   b_box_y + self.dot_size)
 
                 if self.b_hover_box != b_hover_box:
                     self.b_hover_box = b_hover_box
@@ -2406,21 +2415,21 @@ class PointsOverlay(WorldOverlay):
         """ Prepares the choices and compute the minimum physical distance
          between points
         """
-        choices = [c for c in self.point.choices if None not in c]
-        if len(choices) > 1:
-            # normally all the points are uniformly distributed, so just need to
-            # look at the distance from the first point
-            p0 = choices[0]
-
-            def distance(p):
-                return math.hypot(p[0] - p0[0], p[1] - p0[1])
-
-            min_dist = min(distance(p) for p in choices[1:])
+        self.choices = frozenset(c for c in self.point.choices if None not in c)
+        self._choices_list = list(self.choices)
+        self._choices_pos = numpy.array(self._choices_list, dtype=numpy.float64).reshape(-1, 2)
+        self._choices_tree = cKDTree(self._choices_pos)
+
+        if len(self._choices_list) > 1:
+            # Distance of every point to its nearest neighbour (the first one is itself)
+            dists, _ = self._choices_tree.query(self._choices_pos, k=2)
+            min_dist = dists[:, 1].min()
         else:
+            min_dist = 0
+        if min_dist <= 0:
             # can't compute the distance => pick something typical
             min_dist = 100e-9  # m
 
-        self.choices = frozenset(choices)
         self.min_dist = min_dist / 2  # radius
 
     def draw(self, ctx, shift=(0, 0), scale=1.0):
@@ -2434,7 +2443,16 @@ class PointsOverlay(WorldOverlay):
         p_cursor_over = None
         offset = self.cnvs.get_half_buffer_size()
 
-        for p_pos in self.choices:
+        # Only draw the points within the buffer (with a margin for the dot)
+        p_margin = self.dot_size / self.cnvs.scale
+        p_l, p_t = self.cnvs.buffer_to_phys((0, 0), offset)
+        p_r, p_b = self.cnvs.buffer_to_phys((offset[0] * 2, offset[1] * 2), offset)
+        pos = self._choices_pos
+        visible = numpy.flatnonzero((pos[:, 0] >= p_l - p_margin) & (pos[:, 0] <= p_r + p_margin) &
+                                    (pos[:, 1] >= p_b - p_margin) & (pos[:, 1] <= p_t + p_margin))
+
+        for i in visible:
+            p_pos = self._choices_list[i]
             b_x, b_y = self.cnvs.phys_to_buffer(p_pos, offset)
 
             ctx.new_sub_path()
@@ -224,7 +224,8 @@ class SnapshotController(object):
                     raw_images.append(d)
 
             # record everything to a file
-            exporter.export(filepath, raw_images, thumbnail)
+            exporter.export(filepath, raw_images, thumbnail,
+                            **conf.get_acqui_conf().get_export_options(exporter))
             popup.show_message(self._main_frame,
                                "Snapshot saved as %s" % (os.path.basename(filepath),),
                                message="In %s" % (os.path.dirname(filepath),),
@@ -846,7 +847,7 @@ class SparcAcquiController(object):
         filename = self.filename.value
         if data:
             exporter = dataio.get_converter(self.conf.last_format)
-            exporter.export(filename, data, thumb)
+            exporter.export(filename, data, thumb, **self.conf.get_export_options(exporter))
             logging.info(u"Acquisition saved as file '%s'.", filename)
         else:
             logging.debug("Not saving into file '%s' as there is no data", filename)
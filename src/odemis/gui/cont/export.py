@@ -23,15 +23,17 @@ This file is part of Odemis.
 from __future__ import division
 
 from collections import OrderedDict
+from concurrent.futures import CancelledError
 import logging
 from odemis.util import dataio as udataio
-from odemis.dataio import get_converter
+from odemis.dataio import get_converter, tiff
 from odemis.gui.comp import popup
 from odemis.gui.conf import get_acqui_conf
 from odemis.gui.util import call_in_wx_main, formats_to_wildcards
 from odemis.gui.util.img import ar_to_export_data, spectrum_to_export_data, \
     images_to_export_data, line_to_export_data, temporal_spectrum_to_export_data, \
-    chronogram_to_export_data
+    chronogram_to_export_data, images_to_tiled_export_async, get_tiled_export_size, \
+    MAX_RES_FACTOR, CROP_RES_LIMIT
 from odemis.util.dataio import splitext
 import os
 import time
@@ -182,6 +184,14 @@ class ExportController(object):
             self._conf.export_raw = raw
             self._conf.last_export_path = os.path.dirname(filepath)
 
+            # Spatial views too large for a print-ready image in memory are
+            # exported tile by tile, at full resolution, in the background.
+            if export_type == 'spatial' and export_format == tiff.FORMAT and not raw:
+                f = self.export_tiled(filepath)
+                if f is not None:
+                    self._show_tiled_export_progress(f, filepath)
+                    return
+
             exported_data = self.export(export_type, raw)
 
             # batch export
@@ -216,7 +226,8 @@ class ExportController(object):
 
                 # record everything to a file
                 for key, data in exported_data.items():
-                    exporter.export(filename_dict[key], data)
+                    exporter.export(filename_dict[key], data,
+                                    **self._conf.get_export_options(exporter))
 
                 # TODO need to be adapted for batch export as now redundant
                 popup.show_message(self._main_frame,
@@ -230,7 +241,8 @@ class ExportController(object):
                              export_type, os.path.join(dir_name, base_name + "_" + "mode" + file_extension))
 
             else:  # single file export
-                exporter.export(filepath, exported_data)
+                exporter.export(filepath, exported_data,
+                                **self._conf.get_export_options(exporter))
 
                 popup.show_message(self._main_frame,
                                    "Image exported",
@@ -301,10 +313,7 @@ class ExportController(object):
         elif export_type == 'spectrum-time':
             exported_data = chronogram_to_export_data(streams[0], raw, vp)
         else:
-            view_px = tuple(vp.canvas.ClientSize)
-            view_mpp = fview.mpp.value
-            view_hfw = (view_mpp * view_px[0], view_mpp * view_px[1])
-            view_pos = fview.view_pos.value
+            view_hfw, view_pos = self._get_view_area(fview, vp)
             draw_merge_ratio = fview.stream_tree.kwargs.get("merge", 0.5)
             interpolate_data = fview.interpolate_content.value
             exported_data = images_to_export_data(streams,
@@ -315,6 +324,101 @@ class ExportController(object):
 
         return exported_data
 
+    def export_tiled(self, filepath):
+        """
+        Exports the print-ready image of the focused (spatial) view as a tiled
+        TIFF file at full resolution, if it is larger than what export() can
+        generate.
+        :param filepath: (str) full path to the destination file
+        returns (None or ProgressiveFuture): None if the image is small enough
+          for export(), in which case nothing is written. Otherwise, the export
+          running in the background, which returns the size (X, Y) of the image.
+        raises:
+            LookupError: if no data found to export
+        """
+        fview = self._data_model.focussedView.value
+        vp = self.get_viewport_by_view(fview)
+        streams = fview.stream_tree.getProjections()
+        view_hfw, view_pos = self._get_view_area(fview, vp)
+
+        # Same limit as in images_to_export_data()
+        size = get_tiled_export_size(streams, view_hfw, view_pos)
+        if size[0] * size[1] <= (MAX_RES_FACTOR * CROP_RES_LIMIT) ** 2:
+            return None
+
+        draw_merge_ratio = fview.stream_tree.kwargs.get("merge", 0.5)
+        interpolate_data = fview.interpolate_content.value
+        return images_to_tiled_export_async(filepath, streams, view_hfw, view_pos, draw_merge_ratio,
+                                            interpolate_data=interpolate_data)
+
+    def _show_tiled_export_progress(self, future, filepath):
+        """
+        Show the progress of a tiled export in a dialog, which allows to cancel
+        it, and report the result when it's over.
+        :param future: (ProgressiveFuture) the export, which returns the size of the image
+        :param filepath: (str) full path to the file being written
+        """
+        dlg = wx.ProgressDialog("Exporting image",
+                                "Exporting the view at full resolution to %s" % (os.path.basename(filepath),),
+                                maximum=100,
+                                parent=self._main_frame,
+                                style=wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME | wx.PD_REMAINING_TIME)
+
+        def update_progress():
+            start, end = future.get_progress()
+            now = time.time()
+            if end > start:
+                ratio = min(0.99, max(0, (now - start) / (end - start)))
+            else:
+                ratio = 0
+            keep_going, _ = dlg.Update(int(ratio * 100))
+            if not keep_going:
+                logging.info("Cancelling the export to %s", filepath)
+                future.cancel()
+
+        # a repeating timer, always called in the GUI thread
+        timer = wx.PyTimer(update_progress)
+        timer.Start(250)  # 4 Hz
+
+        @call_in_wx_main
+        def on_done(f):
+            timer.Stop()
+            dlg.Destroy()
+            try:
+                size = f.result()
+            except CancelledError:
+                return
+            except Exception as ex:
+                logging.exception("Failed to export the view to %s", filepath)
+                edlg = wx.MessageDialog(self._main_frame,
+                                        "Failed to export: %s" % (ex,),
+                                        "Export failed",
+                                        wx.OK | wx.ICON_WARNING)
+                edlg.ShowModal()
+                edlg.Destroy()
+                return
+
+            popup.show_message(self._main_frame,
+                               "Image exported",
+                               "Stored in %s" % (filepath,),
+                               timeout=3
+                               )
+            logging.info("Exported a spatial view into file '%s' as a %dx%d px tiled image.",
+                         filepath, size[0], size[1])
+
+        future.add_done_callback(on_done)
+
+    def _get_view_area(self, view, vp):
+        """
+        Return the area shown by the view
+        returns (float, float), (float, float): the horizontal field width
+          (X, Y) in m, and the center position (X, Y) in m
+        """
+        view_px = tuple(vp.canvas.ClientSize)
+        view_mpp = view.mpp.value
+        view_hfw = (view_mpp * view_px[0], view_mpp * view_px[1])
+        return view_hfw, view.view_pos.value
+
     def get_viewport_by_view(self, view):
         """ Return the ViewPort associated with the given view """
 
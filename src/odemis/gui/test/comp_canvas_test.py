@@ -26,10 +26,12 @@ from __future__ import division
 import logging
 import numpy
 from odemis import model
+from odemis.gui import BLEND_DEFAULT
 from odemis.acq.stream import RGBStream
 from odemis.dataio import tiff
 from odemis.gui import test
 from odemis.gui.comp.canvas import BufferedCanvas
+import time
 import unittest
 import wx
 
@@ -444,6 +446,46 @@ class TestDblMicroscopeCanvas(test.GuiTestCase):
             self.assertTrue(all(isinstance(v, (int, float)) for v in vp))
             self.assertEqual(view_point, vp)
 
+    def test_mipmap_draw(self):
+        """
+        Check the mipmaps are used when zooming out, and measure the redraw time
+        """
+        self.canvas.fit_view_to_next_image = False
+        im = model.DataArray(numpy.zeros((4096, 4096, 4), dtype=numpy.uint8))
+        im[:, :, 2] = 255  # red (BGRA)
+        im[:, :, 3] = 255
+        self.canvas.set_images([(im, (0, 0), (1e-6, 1e-6), True, None, None, None,
+                                 BLEND_DEFAULT, "big")])
+        test.gui_loop()
+
+        for scale in (2e6, 1e6, 0.5e6, 0.1e6, 0.02e6):  # px/m => 2x ... 1/50x
+            self.canvas.scale = scale
+            tstart = time.time()
+            for i in range(5):
+                self.canvas.draw()
+            dur = (time.time() - tstart) / 5
+            logging.info("Redrawing at zoom %g took %g s", scale * 1e-6, dur)
+
+            # The mipmap closest to the zoom level is computed, at most
+            nlevels = len(self.canvas._mipmaps[id(im)][1]) if self.canvas._mipmaps else 1
+            self.assertLessEqual(2 ** (nlevels - 1), max(1, round(1e6 / scale) * 1.5))
+
+        # The image is still displayed the same
+        result_im = get_image_from_buffer(self.canvas)
+        px = get_rgb(result_im, result_im.Width // 2, result_im.Height // 2)
+        self.assertEqual(px, (255, 0, 0))
+
+        # New image => mipmaps are dropped
+        im2 = model.DataArray(numpy.zeros((100, 100, 4), dtype=numpy.uint8))
+        self.canvas.set_images([(im2, (0, 0), (1e-6, 1e-6), True, None, None, None,
+                                 BLEND_DEFAULT, "small")])
+        self.assertNotIn(id(im), self.canvas._mipmaps)
+
+        # Small, non-interpolated, image (eg, live stream) => no mipmaps
+        self.canvas.scale = 0.1e6
+        self.canvas.draw()
+        self.assertNotIn(id(im2), self.canvas._mipmaps)
+
     def test_pyramidal_one_tile(self):
         """
         Draws a view with two streams, one pyramidal stream square completely green,
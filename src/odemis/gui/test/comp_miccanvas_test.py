@@ -34,6 +34,7 @@ import unittest
 import math
 import logging
 
+import numpy
 import wx
 import time
 
@@ -336,6 +337,63 @@ class PlotCanvasTestCase(test.GuiTestCase):
 
         test.gui_loop()
 
+    def test_plot_canvas_snap(self):
+        cnvs = canvas.PlotCanvas(self.panel)
+        self.add_control(cnvs, wx.EXPAND, proportion=1)
+
+        cnvs.set_1d_data([0, 1, 2, 4], [1, 3, -2, 5])
+        test.gui_loop(0.1)
+        self.assertEqual(cnvs.range_x, (0, 4))
+        self.assertEqual(cnvs.range_y, (-2, 5))
+        self.assertEqual(cnvs.val_x_to_val(2.9), (2, -2))
+        self.assertEqual(cnvs.val_x_to_val(3.1), (4, 5))
+        self.assertEqual(cnvs.val_x_to_val(-1), (0, 1))
+        self.assertEqual(cnvs.val_x_to_val(10), (4, 5))
+        self.assertEqual(cnvs.pos_x_to_val_x(cnvs.ClientSize.x, snap=True), 4)
+        self.assertEqual(cnvs.pos_y_to_val_y(0, snap=True), 5)
+
+    def test_plot_canvas_envelope(self):
+        pos_x = numpy.linspace(0, 100, 10000, endpoint=False)
+        pos_y = numpy.random.random(pos_x.shape)
+        pos_y[5050] = 2  # in column 50
+        starts = canvas.find_plot_columns(pos_x, 100)
+        self.assertEqual(len(starts), 100)
+        env_x, env_y = canvas.minmax_envelope(pos_x, pos_y, starts)
+        self.assertEqual(len(env_x), 200)
+        self.assertEqual(env_y[101], 2)
+
+        # Not enough points => no reduction
+        starts = canvas.find_plot_columns(pos_x[:150], 100)
+        self.assertEqual(len(starts), 150)
+
+    def test_plot_speed(self):
+        """
+        Measure the time to draw a large spectrum
+        """
+        cnvs = canvas.PlotCanvas(self.panel)
+        self.add_control(cnvs, wx.EXPAND, proportion=1)
+        test.gui_loop(0.1)
+
+        n = 1000000
+        xs = numpy.linspace(400e-9, 900e-9, n)
+        ys = numpy.sin(xs * 1e8) + numpy.random.random(n)
+        cnvs.set_1d_data(xs, ys, unit_x="m")
+        test.gui_loop(0.1)
+
+        for mode in (canvas.PLOT_MODE_LINE, canvas.PLOT_MODE_BAR, canvas.PLOT_MODE_POINT):
+            cnvs.set_plot_mode(mode)
+            tstart = time.time()
+            for i in range(10):
+                cnvs.draw()
+            dur = (time.time() - tstart) / 10
+            logging.info("Drawing %d points in mode %d took %g s", n, mode, dur)
+            self.assertLess(dur, 1)
+
+        tstart = time.time()
+        for i in range(1000):
+            cnvs.pos_x_to_val_x(i % cnvs.ClientSize.x, snap=True)
+        logging.info("Snapping took %g s", (time.time() - tstart) / 1000)
+
     def test_navigable_plot_canvas(self):
         # Create and add a test plot canvas
         # cnvs = canvas.PlotCanvas(self.panel)
@@ -24,9 +24,11 @@
 from __future__ import division, print_function
 
 from builtins import range
+import cairo
 import logging
 import math
 import numpy
+import time
 from odemis import model
 from odemis.acq.stream import UNDEFINED_ROI
 from odemis.driver import simsem
@@ -998,6 +1000,50 @@ class OverlayTestCase(test.GuiTestCase):
         # point = model.VAEnumerated(phys_points[0], choices=frozenset([(50 / 1.0e5, 50 / 1.0e5)]))
         # pol.set_point(point)
 
+    def test_points_overlay_speed(self):
+        """
+        Measure the time to handle a dense grid of 100k points
+        """
+        cnvs = miccanvas.DblMicroscopeCanvas(self.panel)
+        self.add_control(cnvs, wx.EXPAND, proportion=1, clear=True)
+
+        tab_mod = self.create_simple_tab_model()
+        view = tab_mod.focussedView.value
+        view.mpp.value = 1e-7
+        cnvs.setView(view, tab_mod)
+
+        pol = wol.PointsOverlay(cnvs)
+        cnvs.add_world_overlay(pol)
+        cnvs.current_mode = guimodel.TOOL_POINT
+        pol.activate()
+        test.gui_loop()
+
+        # 316 x 316 points, 1 µm apart
+        phys_points = [(x * 1e-6, y * 1e-6) for x in range(-158, 158) for y in range(-158, 158)]
+        point = model.VAEnumerated(phys_points[0], choices=frozenset(phys_points))
+
+        tstart = time.time()
+        pol.set_point(point)
+        logging.info("Preparing %d points took %g s", len(phys_points), time.time() - tstart)
+        self.assertAlmostEqual(pol.min_dist, 0.5e-6)
+
+        ctx = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, *cnvs.ClientSize))
+        tstart = time.time()
+        pol.draw(ctx)
+        logging.info("Drawing took %g s", time.time() - tstart)
+
+        # Move the mouse over the center of the canvas, which is on a point
+        evt = wx.MouseEvent(wx.wxEVT_MOTION)
+        tstart = time.time()
+        for i in range(100):
+            evt.SetPosition(wx.Point(cnvs.ClientSize.x // 2 + i % 3, cnvs.ClientSize.y // 2))
+            pol.on_motion(evt)
+        logging.info("Mouse motion took %g s", (time.time() - tstart) / 100)
+        self.assertIsNotNone(pol.b_hover_box)
+
+        cnvs.update_drawing()
+        test.gui_loop(0.5)
+
     def test_mirror_arc_overlay(self):
         cnvs = miccanvas.SparcARCanvas(self.panel)
         cnvs.scale = 20000
@@ -25,15 +25,19 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 from __future__ import division
 
 from past.builtins import basestring
+from collections import OrderedDict
+from concurrent.futures import CancelledError
 import threading
 import cairo
 import logging
 import math
 import numpy
 from odemis import model
+from odemis.dataio import tiff
 from odemis.gui import BLEND_SCREEN, BLEND_DEFAULT
 from odemis.gui.comp.overlay.base import Label
-from odemis.util import intersect, fluo, img, units
+from odemis.util import intersect, rect_intersect, fluo, img, units, executeAsyncTask
+import os
 import time
 import wx
 import odemis.acq.stream as acqstream
@@ -2119,6 +2123,36 @@ def get_sub_img(b_intersect, b_im_rect, im_data, total_scale):
     return im_data, b_new
 
 
+def downscale_by_2(im_data):
+    """ Compute the next level of a mipmap: an image half the size, where each
+    pixel is the mean of 2x2 pixels (box filter).
+
+    :param im_data: (numpy.ndarray of uint8, shape YXC) The image, typically
+      BGRA as returned by format_rgba_darray(). If the size is odd, the last
+      row/column is dropped.
+
+    :return: (numpy.ndarray of uint8, shape Y//2, X//2, C) The smaller image
+
+    """
+    h, w = im_data.shape[0] // 2, im_data.shape[1] // 2
+    out = numpy.empty((h, w) + im_data.shape[2:], dtype=numpy.uint8)
+
+    # Compute by blocks of rows, to limit the size of the temporary array
+    step = max(1, 2 ** 22 // max(1, im_data[0].size))
+    for y in range(0, h, step):
+        ye = min(y + step, h)
+        sub = im_data[y * 2:ye * 2, :w * 2]
+        acc = sub[0::2, 0::2].astype(numpy.uint16)
+        acc += sub[1::2, 0::2]
+        acc += sub[0::2, 1::2]
+        acc += sub[1::2, 1::2]
+        acc += 2  # round to the nearest value
+        acc >>= 2
+        out[y:ye] = acc
+
+    return out
+
+
 class FakeCanvas(object):
     """Fake canvas for drawing purposes. It is currently used to export images with printed rulers
     in print-ready export. We ask the overlay to draw on this fake canvas"""
@@ -2340,6 +2374,425 @@ def images_to_export_data(streams, view_hfw, view_pos,
     return data_to_export
 
 
+class ExportTileSource(object):
+    """
+    Provides the (BGRA) images of a stream needed to draw any area of the
+    export, at any scale, without projecting the whole data at once.
+    For pyramidal data, only the raw tiles covering the area are read, at the
+    zoom level the closest to the scale requested, and projected. Otherwise,
+    the projected image is cropped to the area.
+    A source is meant to be used for a single export: the projected tiles are
+    cached, as each of them is typically needed by several tiles of the export.
+    """
+
+    def __init__(self, projection, blend_mode):
+        """
+        projection (Stream or DataProjection): the stream to draw
+        blend_mode (int): blend mode to draw the images
+        raise LookupError: if the stream has no image to draw
+        """
+        self.blend_mode = blend_mode
+        self.stream = projection.stream if isinstance(projection, DataProjection) else projection
+        self._projection = projection
+        self._tile_cache = OrderedDict()  # (int, int, int) -> DataArray: projected tile per x, y, z
+        self._tile_cache_lock = threading.Lock()
+        raw = self.stream.raw
+        if (raw and isinstance(raw[0], DataArrayShadow) and getattr(raw[0], "maxzoom", None) is not None
+            and hasattr(projection, "projectTile")):
+            self._das = raw[0]
+            self._image = None
+            md = self._das.metadata.copy()
+            img.mergeMetadata(md)
+            self._md = md
+            dims = md.get(model.MD_DIMS, "CTZYX"[-self._das.ndim:])
+            self.shape = self._das.shape[dims.index("Y")], self._das.shape[dims.index("X")]
+            self.pixel_size = md[model.MD_PIXEL_SIZE][:2]
+            self.bbox = img.getBoundingBox(self._das)
+        else:
+            if not hasattr(projection, "image") or projection.image.value is None:
+                raise LookupError("Stream %s has no image" % (self.stream.name.value,))
+            im = projection.image.value
+            if isinstance(im, tuple):  # 2D tuple = tiles
+                im = img.mergeTiles(im)
+            self._das = None
+            self._image = self._to_bgra(im)
+            self.shape = im.shape[:2]
+            self.pixel_size = im.metadata[model.MD_PIXEL_SIZE][:2]
+            self.bbox = img.getBoundingBox(im)
+
+    def _to_bgra(self, im):
+        """
+        im (DataArray of shape YXC): projected RGB(A) image
+        return (DataArray of shape YX4): BGRA image, with the metadata for draw_image()
+        """
+        md = im.metadata
+        rgba_im = format_rgba_darray(im)
+        return set_images([(rgba_im, md[model.MD_POS], md[model.MD_PIXEL_SIZE], False,
+                            md.get(model.MD_ROTATION, 0), md.get(model.MD_SHEAR, 0),
+                            md.get(model.MD_FLIP, 0), self.blend_mode, self.stream.name.value,
+                            md.get(model.MD_ACQ_DATE, None), self.stream, md)])[0]
+
+    def get_images(self, rect, scale, interpolate_data=False):
+        """
+        Get the images needed to draw the given area. Can be called from any thread.
+        rect (float, float, float, float): area to draw, as left, bottom, right, top (m)
+        scale (float, float): size of a pixel of the drawing (m)
+        interpolate_data (boolean): if True, the images also contain the pixels
+          just around the area, so that the interpolation is continuous.
+        return (list of DataArray): BGRA images (possibly empty)
+        """
+        if self._das is None:
+            im = self._crop(self._image, rect)
+            return [] if im is None else [im]
+
+        das = self._das
+        z = int(math.floor(math.log(scale[0] / self.pixel_size[0], 2) + 1e-6))
+        z = max(0, min(z, das.maxzoom))
+
+        # Area in pixels (at full resolution) from the top-left of the image
+        pos = self._md.get(model.MD_POS, (0, 0))
+        h, w = self.shape
+        l = (rect[0] - pos[0]) / self.pixel_size[0] + w / 2
+        r = (rect[2] - pos[0]) / self.pixel_size[0] + w / 2
+        t = (pos[1] - rect[3]) / self.pixel_size[1] + h / 2
+        b = (pos[1] - rect[1]) / self.pixel_size[1] + h / 2
+        # Only the tiles really inside the area, or with one more pixel around
+        # to interpolate
+        margin = 2 ** z if interpolate_data else -1e-3
+
+        # Convert to tile indices at the zoom level
+        tw, th = das.tile_shape[0] * 2 ** z, das.tile_shape[1] * 2 ** z
+        n_tiles = (int(math.ceil((w // 2 ** z) / das.tile_shape[0])),
+                   int(math.ceil((h // 2 ** z) / das.tile_shape[1])))
+        x1 = max(0, int(math.floor((l - margin) / tw)))
+        x2 = min(n_tiles[0] - 1, int(math.floor((r + margin) / tw)))
+        y1 = max(0, int(math.floor((t - margin) / th)))
+        y2 = min(n_tiles[1] - 1, int(math.floor((b + margin) / th)))
+        if x1 > x2 or y1 > y2:
+            return []
+
+        # Merge the tiles, so that the interpolation is continuous between them
+        tiles = tuple(tuple(self._get_tile(x, y, z, n_tiles[0]) for y in range(y1, y2 + 1))
+                      for x in range(x1, x2 + 1))
+        im = self._to_bgra(img.mergeTiles(tiles))
+        return [im]
+
+    def _get_tile(self, x, y, z, n_tiles_x):
+        """
+        Get a projected tile, from the cache if it was already projected.
+        x, y, z (int): tile indices and zoom level
+        n_tiles_x (int): number of tiles horizontally, at the zoom level
+        return (DataArray): the projected tile
+        """
+        key = (x, y, z)
+        with self._tile_cache_lock:
+            tile = self._tile_cache.pop(key, None)
+            if tile is not None:
+                self._tile_cache[key] = tile  # Now the most recently used
+                return tile
+
+        tile = self._projection.projectTile(x, y, z)
+        with self._tile_cache_lock:
+            self._tile_cache[key] = tile
+            # The export is drawn row by row, and each row needs (at most) the
+            # tiles of three rows, to interpolate. Keep one more row, as the
+            # tiles are drawn in parallel, so not exactly in order.
+            while len(self._tile_cache) > 4 * n_tiles_x:
+                self._tile_cache.popitem(last=False)
+        return tile
+
+    @staticmethod
+    def _crop(im, rect):
+        """
+        Crop an image to the given area (with a one pixel margin)
+        im (DataArray of shape YX4): BGRA image, with the draw_image() metadata
+        rect (float, float, float, float): area, as left, bottom, right, top (m)
+        return (None or DataArray): the (sub-)image, or None if outside of the area
+        """
+        md = im.metadata
+        if md['dc_rotation'] or md['dc_shear'] or md['dc_flip']:
+            # The transformations are around the center of the image => keep it all
+            return im
+
+        h, w = im.shape[:2]
+        ps = md['dc_scale']
+        left = md['dc_center'][0] - w * ps[0] / 2
+        top = md['dc_center'][1] + h * ps[1] / 2
+        x0 = max(0, int(math.floor((rect[0] - left) / ps[0])) - 1)
+        x1 = min(w, int(math.ceil((rect[2] - left) / ps[0])) + 1)
+        y0 = max(0, int(math.floor((top - rect[3]) / ps[1])) - 1)
+        y1 = min(h, int(math.ceil((top - rect[1]) / ps[1])) + 1)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        elif (x0, y0, x1, y1) == (0, 0, w, h):
+            return im
+
+        # Copy, as cairo needs contiguous data
+        sub_im = model.DataArray(im[y0:y1, x0:x1].copy(), md.copy())
+        sub_im.metadata['dc_center'] = (left + (x0 + x1) / 2 * ps[0],
+                                        top - (y0 + y1) / 2 * ps[1])
+        return sub_im
+
+
+def get_ordered_export_sources(streams):
+    """ Return the sources of the images to draw for a tiled export, ordered
+    bottom to top (=last to draw), in the same order as get_ordered_images().
+
+    streams (list of Streams or DataProjections)
+    return (list of ExportTileSource)
+    """
+    sources_opt = []
+    sources_spc = []
+    sources_std = []
+
+    for s in streams:
+        if not s:
+            # should not happen, but let's not completely fail on this
+            logging.error("StreamTree has a None stream")
+            continue
+
+        ostream = s.stream if isinstance(s, DataProjection) else s
+        # FluoStreams are merged using the "Screen" method
+        if isinstance(ostream, acqstream.OpticalStream):
+            sources, blend_mode = sources_opt, BLEND_SCREEN
+        elif isinstance(ostream, (acqstream.SpectrumStream, acqstream.CLStream)):
+            sources, blend_mode = sources_spc, BLEND_DEFAULT
+        else:
+            sources, blend_mode = sources_std, BLEND_DEFAULT
+
+        try:
+            sources.append(ExportTileSource(s, blend_mode))
+        except LookupError:
+            logging.info("Skipping %s which has no image", ostream.name.value)
+
+    # Sort by size, so that the biggest picture is first drawn (no opacity)
+    def get_area(src):
+        return numpy.prod(src.shape) * src.pixel_size[0]
+
+    sources_opt.sort(key=get_area, reverse=True)
+    sources_spc.sort(key=get_area, reverse=True)
+    sources_std.sort(key=get_area, reverse=True)
+
+    # Reset the first image to be drawn to the default blend operator to be
+    # drawn full opacity
+    if sources_opt:
+        sources_opt[0].blend_mode = BLEND_DEFAULT
+
+    return sources_opt + sources_std + sources_spc
+
+
+def _get_tiled_export_geometry(sources, view_hfw, view_pos, pxs=None):
+    """
+    Compute the area of a tiled export, which only contains the part of the
+    view with data.
+    sources (list of ExportTileSource): the sources of the images to draw
+    view_hfw (tuple of float): X (width), Y (height) in m
+    view_pos (tuple of float): center position X, Y in m
+    pxs (None or float): size of a pixel of the exported image (in m). If None,
+      the smallest pixel size of the sources is used.
+    return:
+      size (int, int): size of the exported image (X, Y) in px
+      pxs (float, float): pixel size of the exported image (X, Y) in m
+      left, top (float, float): position of the top-left corner of the exported image in m
+    raise LookupError: if no data visible in the selected FoV
+    """
+    # Only export the part of the view which contains data
+    view_rect = (view_pos[0] - view_hfw[0] / 2, view_pos[1] - view_hfw[1] / 2,
+                 view_pos[0] + view_hfw[0] / 2, view_pos[1] + view_hfw[1] / 2)
+    data_rect = None
+    for src in sources:
+        r = rect_intersect(src.bbox, view_rect)
+        if r is None:
+            continue
+        elif data_rect is None:
+            data_rect = r
+        else:
+            data_rect = (min(data_rect[0], r[0]), min(data_rect[1], r[1]),
+                         max(data_rect[2], r[2]), max(data_rect[3], r[3]))
+
+    if data_rect is None:
+        raise LookupError("There is no visible stream data to be exported")
+
+    if pxs is None:
+        pxs = min(src.pixel_size for src in sources)
+    else:
+        pxs = (pxs, pxs)
+    size = (max(1, int(round((data_rect[2] - data_rect[0]) / pxs[0]))),
+            max(1, int(round((data_rect[3] - data_rect[1]) / pxs[1]))))
+    return size, pxs, (data_rect[0], data_rect[3])
+
+
+def get_tiled_export_size(streams, view_hfw, view_pos, pxs=None):
+    """
+    Compute the size of the image which images_to_tiled_export() would export.
+    It can be used to check whether the full resolution image would be larger
+    than what images_to_export_data() accepts.
+    See images_to_tiled_export() for the parameters.
+    return (int, int): size of the exported image (X, Y) in px
+    raise LookupError: if no data visible in the selected FoV
+    """
+    sources = get_ordered_export_sources(streams)
+    if not sources:
+        raise LookupError("There is no stream data to be exported")
+    return _get_tiled_export_geometry(sources, view_hfw, view_pos, pxs)[0]
+
+
+def images_to_tiled_export(filename, streams, view_hfw, view_pos, draw_merge_ratio,
+                           interpolate_data=False, pxs=None, compressed=True, pyramid=True):
+    """
+    Export the print-ready image of the streams as a tiled (and pyramidal) TIFF
+    file, at full resolution.
+    Contrarily to images_to_export_data(), the resolution is not limited, as
+    the image is never entirely in memory: each tile is drawn independently
+    (in parallel), and written to the file as soon as it's ready. The lower
+    resolutions of the pyramid are downsampled from the tiles already drawn.
+    There is no legend.
+    filename (str): path of the TIFF file to create
+    streams (Streams or DataProjection): the data to be exported
+    view_hfw (tuple of float): X (width), Y (height) in m
+    view_pos (tuple of float): center position X, Y in m
+    draw_merge_ratio (0<=float<=1): opacity of the last stream drawn
+    interpolate_data (boolean): apply interpolation on data if True
+    pxs (None or float): size of a pixel of the exported image (in m). If None,
+      the smallest pixel size of the streams is used.
+    compressed (boolean): whether the file is compressed or not.
+    pyramid (boolean): if True, the lower resolutions are also stored in the file.
+    return (int, int): size of the exported image (X, Y) in px
+    raise LookupError: if no data visible in the selected FoV
+    """
+    return _doTiledExport(None, filename, streams, view_hfw, view_pos, draw_merge_ratio,
+                          interpolate_data, pxs, compressed, pyramid)
+
+
+def images_to_tiled_export_async(filename, streams, view_hfw, view_pos, draw_merge_ratio,
+                                 interpolate_data=False, pxs=None, compressed=True, pyramid=True):
+    """
+    Same as images_to_tiled_export(), but runs in a separate thread.
+    The parameters are the same as images_to_tiled_export().
+    return (ProgressiveFuture): the export. Its result is the size of the
+      exported image (X, Y) in px. If it's cancelled, the file is deleted.
+    """
+    f = model.ProgressiveFuture()
+    f._export_must_stop = threading.Event()
+    f.task_canceller = _cancelTiledExport
+    executeAsyncTask(f, _doTiledExport,
+                     args=(f, filename, streams, view_hfw, view_pos, draw_merge_ratio,
+                           interpolate_data, pxs, compressed, pyramid))
+    return f
+
+
+def _cancelTiledExport(future):
+    """
+    Canceller of the tiled export task
+    """
+    future._export_must_stop.set()
+    return True
+
+
+def _doTiledExport(future, filename, streams, view_hfw, view_pos, draw_merge_ratio,
+                   interpolate_data, pxs, compressed, pyramid):
+    """
+    Export the view as a tiled TIFF file. See images_to_tiled_export() for the
+    parameters.
+    future (None or ProgressiveFuture): if not None, its progress is updated
+      while the tiles are drawn, and the export stops when it's cancelled.
+    return (int, int): size of the exported image (X, Y) in px
+    raise:
+        LookupError: if no data visible in the selected FoV
+        CancelledError: if the future was cancelled
+    """
+    sources = get_ordered_export_sources(streams)
+    if not sources:
+        raise LookupError("There is no stream data to be exported")
+
+    size, pxs, (left, top) = _get_tiled_export_geometry(sources, view_hfw, view_pos, pxs)
+
+    n = len(sources)
+    merge_ratios = []
+    for i, src in enumerate(sources):
+        if src.blend_mode == BLEND_SCREEN:
+            merge_ratios.append(1.0)
+        elif i == n - 1:  # last image
+            merge_ratios.append(1.0 if n == 1 else draw_merge_ratio)
+        else:
+            merge_ratios.append(1 - i / n)
+
+    ts = tiff.TILE_SIZE
+    n_tiles = int(math.ceil(size[0] / ts)) * int(math.ceil(size[1] / ts))
+    tiles_done = [0]  # number of tiles drawn so far
+    progress_lock = threading.Lock()
+    start = time.time()
+
+    def draw_tile(x, y):
+        """
+        Draw one tile of the export, at full resolution
+        return (ndarray of shape YX4): RGBA image
+        """
+        if future is not None and future._export_must_stop.is_set():
+            raise CancelledError()
+
+        buffer_scale = pxs
+        buffer_size = (min(ts, size[0] - x * ts), min(ts, size[1] - y * ts))
+        buffer_center = (left + (x * ts + buffer_size[0] / 2) * buffer_scale[0],
+                         top - (y * ts + buffer_size[1] / 2) * buffer_scale[1])
+        rect = (buffer_center[0] - buffer_size[0] / 2 * buffer_scale[0],
+                buffer_center[1] - buffer_size[1] / 2 * buffer_scale[1],
+                buffer_center[0] + buffer_size[0] / 2 * buffer_scale[0],
+                buffer_center[1] + buffer_size[1] / 2 * buffer_scale[1])
+
+        data_to_draw = numpy.zeros((buffer_size[1], buffer_size[0], 4), dtype=numpy.uint8)
+        surface = cairo.ImageSurface.create_for_data(
+            data_to_draw, cairo.FORMAT_ARGB32, buffer_size[0], buffer_size[1])
+        ctx = cairo.Context(surface)
+        for src, merge_ratio in zip(sources, merge_ratios):
+            for im in src.get_images(rect, buffer_scale, interpolate_data):
+                draw_image(
+                    ctx,
+                    im,
+                    im.metadata['dc_center'],
+                    buffer_center,
+                    buffer_scale,
+                    buffer_size,
+                    merge_ratio,
+                    im_scale=im.metadata['dc_scale'],
+                    rotation=im.metadata['dc_rotation'],
+                    shear=im.metadata['dc_shear'],
+                    flip=im.metadata['dc_flip'],
+                    blend_mode=src.blend_mode,
+                    interpolate_data=interpolate_data
+                )
+
+        data_to_draw[:, :, [2, 0]] = data_to_draw[:, :, [0, 2]]
+
+        if future is not None:
+            # Estimate the end based on the average time per tile so far
+            with progress_lock:
+                tiles_done[0] += 1
+                dur = time.time() - start
+                future.set_progress(end=time.time() + dur * (n_tiles - tiles_done[0]) / tiles_done[0])
+        return data_to_draw
+
+    md = {model.MD_PIXEL_SIZE: pxs,
+          model.MD_POS: (left + size[0] * pxs[0] / 2, top - size[1] * pxs[1] / 2)}
+    logging.info("Exporting %d streams as a %dx%d px image", n, size[0], size[1])
+    try:
+        tiff.export_tiled(filename, (size[1], size[0], 4), numpy.uint8, draw_tile, md,
+                          compressed=compressed, pyramid=pyramid)
+        # Cancelled after all the tiles were drawn => the file is not wanted anyway
+        if future is not None and future._export_must_stop.is_set():
+            raise CancelledError()
+    except CancelledError:
+        logging.info("Export of %s cancelled", filename)
+        try:
+            os.remove(filename)
+        except OSError:
+            logging.warning("Failed to delete partial file %s", filename, exc_info=True)
+        raise
+    logging.info("Exported %s in %g s", filename, time.time() - start)
+
+    return size
+
+
 def _adapt_rgb_to_raw(imrgb, data_raw):
     """
     Converts a RGB(A) image to greyscale.
@@ -23,6 +23,7 @@ from __future__ import division
 
 from builtins import range
 import cairo
+from concurrent.futures import CancelledError
 import logging
 import numpy
 from odemis import model, dataio
@@ -116,6 +117,25 @@ class TestRGBA(unittest.TestCase):
         self.assertTrue((bgraim[2, 2] == [200, 100, 1, 0]).all())
 
 
+class TestDownscale(unittest.TestCase):
+
+    def test_simple(self):
+        im = numpy.zeros((5, 7, 4), dtype=numpy.uint8)
+        im[0:2, 0:2] = [0, 100, 201, 255]
+        im[0, 0] = [4, 100, 200, 255]
+        im[4, :] = 255  # Odd => dropped
+        small = img.downscale_by_2(im)
+        self.assertEqual(small.shape, (2, 3, 4))
+        numpy.testing.assert_array_equal(small[0, 0], [1, 100, 201, 255])
+        numpy.testing.assert_array_equal(small[1], 0)
+
+    def test_big(self):
+        im = numpy.random.randint(0, 256, (2001, 1500, 4)).astype(numpy.uint8)
+        small = img.downscale_by_2(im)
+        exp = im[:2000].reshape(1000, 2, 750, 2, 4).mean(axis=(1, 3))
+        numpy.testing.assert_array_equal(small, numpy.floor(exp + 0.5))
+
+
 class TestCalculateTicks(unittest.TestCase):
 
     def test_simple(self):
@@ -1327,6 +1347,171 @@ class TestSpatialExportPyramidal(unittest.TestCase):
             self.assertLess(abs(new_image_ratio - ratio) / ratio, 1.5)
 
 
+class TestTiledExport(unittest.TestCase):
+    """
+    Tests the export of the view as a tiled (pyramidal) TIFF file
+    """
+    FILENAME = u"test-tiled" + tiff.EXTENSIONS[0]
+    FILENAME_PYRAMID = u"test-tiled-src" + tiff.EXTENSIONS[0]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = wx.App()
+
+    def setUp(self):
+        # Pixel sizes and positions which are exactly represented as float,
+        # to get exactly the same pixels as the standard export
+        self.pxs = 2 ** -20  # m
+        self.pos = (2 ** -10, -2 ** -11)  # m
+        self.fluo_md = {model.MD_DESCRIPTION: "fluo", model.MD_BPP: 12,
+                        model.MD_PIXEL_SIZE: (4 * self.pxs, 4 * self.pxs),
+                        model.MD_POS: self.pos, model.MD_EXP_TIME: 1,
+                        model.MD_IN_WL: (600e-9, 620e-9), model.MD_OUT_WL: (620e-9, 650e-9),
+                        model.MD_USER_TINT: (0, 255, 0)}
+        self.sem_md = {model.MD_DESCRIPTION: "sem", model.MD_BPP: 12,
+                       model.MD_PIXEL_SIZE: (self.pxs, self.pxs),
+                       model.MD_POS: self.pos, model.MD_DWELL_TIME: 1e-6}
+        rng = numpy.random.RandomState(0)
+        self.fluo_data = model.DataArray(rng.randint(0, 4096, (250, 300)).astype(numpy.uint16),
+                                         self.fluo_md)
+        self.sem_data = model.DataArray(rng.randint(0, 4096, (1000, 1200)).astype(numpy.uint16),
+                                        self.sem_md)
+
+    def tearDown(self):
+        for fn in (self.FILENAME, self.FILENAME_PYRAMID):
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+
+    def _create_projections(self, sem_data):
+        fluo_stream = stream.StaticFluoStream("fluo", self.fluo_data)
+        sem_stream = stream.StaticSEMStream("sem", sem_data)
+        projs = [RGBSpatialProjection(fluo_stream), RGBSpatialProjection(sem_stream)]
+        # Wait for all the streams to get an RGB image
+        for i in range(100):
+            if all(p.image.value is not None for p in projs):
+                break
+            time.sleep(0.1)
+        return projs
+
+    def _check_same_as_export(self, projs):
+        """
+        Check the tiled export is identical to the standard print-ready export
+        """
+        view_hfw = (1200 * self.pxs, 1000 * self.pxs)
+        exp_data = img.images_to_export_data(projs, view_hfw, self.pos, 0.3, False)
+        # Drop the legend
+        exp_im = exp_data[0][:1000]
+        self.assertEqual(exp_im.shape, (1000, 1200, 4))
+
+        self.assertEqual(img.get_tiled_export_size(projs, view_hfw, self.pos), (1200, 1000))
+        size = img.images_to_tiled_export(self.FILENAME, projs, view_hfw, self.pos, 0.3)
+        self.assertEqual(size, (1200, 1000))
+
+        rdata = tiff.read_data(self.FILENAME)
+        self.assertEqual(len(rdata), 1)
+        tiled_im = rdata[0]
+        self.assertEqual(tiled_im.shape, (1000, 1200, 4))
+        numpy.testing.assert_array_equal(tiled_im, exp_im)
+        numpy.testing.assert_allclose(tiled_im.metadata[model.MD_POS], self.pos)
+        numpy.testing.assert_allclose(tiled_im.metadata[model.MD_PIXEL_SIZE], (self.pxs, self.pxs))
+
+        # The lower resolutions are stored too
+        acd = tiff.open_data(self.FILENAME)
+        das = acd.content[0]
+        self.assertEqual(das.maxzoom, 2)
+        tile = das.getTile(0, 0, 1)
+        self.assertEqual(tile.shape, (256, 256, 4))
+        # Each pixel is the average of the 2x2 pixels at full resolution
+        blocks = tiled_im[:512, :512].reshape(256, 2, 256, 2, 4).astype(numpy.int64)
+        numpy.testing.assert_array_equal(tile, (blocks.sum(axis=(1, 3)) + 2) // 4)
+
+    def test_same_as_export(self):
+        """
+        Compare with the standard export, with data in memory
+        """
+        projs = self._create_projections(self.sem_data)
+        self._check_same_as_export(projs)
+
+    def test_same_as_export_pyramidal(self):
+        """
+        Compare with the standard export, with data read from a pyramidal file
+        """
+        tiff.export(self.FILENAME_PYRAMID, self.sem_data, pyramid=True)
+        acd = tiff.open_data(self.FILENAME_PYRAMID)
+        projs = self._create_projections(acd.content[0])
+        self._check_same_as_export(projs)
+
+    def test_tile_cache(self):
+        """
+        Each tile of pyramidal data is only projected once
+        """
+        tiff.export(self.FILENAME_PYRAMID, self.sem_data, pyramid=True)
+        acd = tiff.open_data(self.FILENAME_PYRAMID)
+        projs = self._create_projections(acd.content[0])
+
+        projected = []
+        orig_project_tile = projs[1].projectTile
+
+        def project_tile(x, y, z):
+            projected.append((x, y, z))
+            return orig_project_tile(x, y, z)
+
+        projs[1].projectTile = project_tile
+        view_hfw = (1200 * self.pxs, 1000 * self.pxs)
+        # With interpolation, each tile of the export also needs the neighbouring tiles
+        img.images_to_tiled_export(self.FILENAME, projs, view_hfw, self.pos, 0.3,
+                                   interpolate_data=True)
+        self.assertTrue(projected)
+        self.assertEqual(len(projected), len(set(projected)))
+
+    def test_async(self):
+        """
+        Export in the background, and cancel it
+        """
+        projs = self._create_projections(self.sem_data)
+        view_hfw = (1200 * self.pxs, 1000 * self.pxs)
+        f = img.images_to_tiled_export_async(self.FILENAME, projs, view_hfw, self.pos, 0.3)
+        self.assertEqual(f.result(), (1200, 1000))
+        self.assertEqual(tiff.read_data(self.FILENAME)[0].shape, (1000, 1200, 4))
+        os.remove(self.FILENAME)
+
+        f = img.images_to_tiled_export_async(self.FILENAME, projs, view_hfw, self.pos, 0.3)
+        self.assertTrue(f.cancel())
+        with self.assertRaises(CancelledError):
+            f.result()
+        # The partial file is deleted (after the export thread stops)
+        for i in range(50):
+            if not os.path.exists(self.FILENAME):
+                break
+            time.sleep(0.1)
+        self.assertFalse(os.path.exists(self.FILENAME))
+
+    def test_lower_resolution(self):
+        """
+        Export with a bigger pixel size than the data
+        """
+        projs = self._create_projections(self.sem_data)
+        view_hfw = (1200 * self.pxs, 1000 * self.pxs)
+        size = img.images_to_tiled_export(self.FILENAME, projs, view_hfw, self.pos, 0.3,
+                                          pxs=4 * self.pxs, pyramid=False)
+        self.assertEqual(size, (300, 250))
+        rdata = tiff.read_data(self.FILENAME)
+        self.assertEqual(rdata[0].shape, (250, 300, 4))
+
+    def test_no_intersection(self):
+        """
+        Data has no intersection with the view
+        """
+        projs = self._create_projections(self.sem_data)
+        view_pos = (self.pos[0] + 2000 * self.pxs, self.pos[1])
+        with self.assertRaises(LookupError):
+            img.images_to_tiled_export(self.FILENAME, projs, (100 * self.pxs, 100 * self.pxs),
+                                       view_pos, 0.3)
+        self.assertFalse(os.path.exists(self.FILENAME))
+
+
 class TestOverviewFunctions(unittest.TestCase):
     """ Tests the util functions used in building up the overview image """
 
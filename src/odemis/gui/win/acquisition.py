@@ -588,7 +588,7 @@ class AcquisitionDialog(xrcfr_acq):
             thumb = acqmng.computeThumbnail(self._view.stream_tree, future)
             filename = self.filename.value
             exporter = dataio.get_converter(self.conf.last_format)
-            exporter.export(filename, data, thumb)
+            exporter.export(filename, data, thumb, **self.conf.get_export_options(exporter))
             logging.info("Acquisition saved as file '%s'.", filename)
             # Allow to see the acquisition
             self.btn_secom_acquire.SetLabel("VIEW")
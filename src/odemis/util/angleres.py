@@ -21,17 +21,23 @@ If not, see http://www.gnu.org/licenses/.
 
 from __future__ import division
 
+import collections
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from concurrent.futures._base import CANCELLED, FINISHED, RUNNING
+import logging
 import math
 import matplotlib
-matplotlib.use("Agg")  # use non-GUI backend
-import matplotlib.pyplot as plt
+import matplotlib.cm
+import matplotlib.colors
+import multiprocessing
 import numpy
-from numpy import ma
-from scipy.interpolate import LinearNDInterpolator
+from scipy.sparse import csr_matrix
 from scipy.spatial import Delaunay as DelaunayTriangulation
+import threading
+import time
 
 from odemis import model
-from odemis.util import img
+from odemis.util import img, executeAsyncTask
 from odemis.model import MD_POL_UP, MD_POL_DOP, MD_POL_DOCP, MD_POL_DOLP, \
     MD_POL_S1N, MD_POL_DS1N, MD_POL_S2N, MD_POL_DS2N, MD_POL_S3N, MD_POL_DS3N, \
     MD_POL_S1, MD_POL_S2, MD_POL_S3, MD_POL_DS1, MD_POL_DS2, MD_POL_DS3, \
@@ -51,6 +57,16 @@ AR_HOLE_DIAMETER = 0.6e-3  # m, diameter of the hole in the mirror
 AR_FOCUS_DISTANCE = 0.5e-3  # m, the vertical mirror cutoff, iow the min distance between the mirror and the sample
 AR_PARABOLA_F = 2.5e-3  # m, parabola_parameter=1/(4f): f: focal point of mirror (place of sample)
 
+# The interpolation from the raw data to the projections only depends on the
+# geometry of the mirror and of the image, so it's computed once and reused for
+# all the images with the same geometry (eg, all the ebeam positions of an AR acquisition).
+MAX_PLANS_CACHED = 4  # Each plan takes ~ 12 bytes * 3 * number of output pixels
+_plans_cache = collections.OrderedDict()  # geometry key -> csr_matrix
+_plans_lock = threading.Lock()
+# Same for the rectangular to polar rendering: (data shape, output size, mirror
+# parameters) -> (lookup table, mirror mask)
+_polar_plans_cache = collections.OrderedDict()
+
 
 def _ExtractAngleInformation(data, hole):
     """
@@ -204,20 +220,34 @@ def AngleResolved2Polar(data, output_size, hole=True):
     """
 
     data = _flipDataIfMirrorFlipped(data)
+    plan = _getInterpolationPlan(_ComputePolarPlan, data, output_size, hole)
+    qz = _ApplyPolarPlan(plan, data, output_size)
+
+    return model.DataArray(qz, data.metadata)
+
 
+def _ComputePolarPlan(data, output_size, hole):
+    """
+    Computes the interpolation from the raw data to the polar projection.
+    :param data: (model.DataArray) The image that was projected on the detector, with
+      the standard mirror orientation. Only its shape and metadata are used.
+    :param output_size: (int) The size of the output (assumed to be square).
+    :param hole: (boolean) Crop the pole if True.
+    :returns: (csr_matrix of shape (output_size², Y*X)) Weights of each input pixel
+      for each output pixel (before rotation).
+    """
     # calculate the corresponding theta and phi angles based on the geometrical properties
-    # of the mirror for each px on the raw data
-    # TODO the angles are all the same for a given mirror shape
-    # TODO runtime could be improved by calc mirror shape with pole pos at center and always move data to center
-    # TODO implement: if not theta, phi, intensity -> calc angles
-    theta_data, phi_data, intensity_data, circle_mask_dilated = _ExtractAngleInformation(data, hole)
+    # of the mirror for each px on the raw data.
+    # The intensity factor (mask & solid angle) is computed by passing an image of 1's.
+    ones = model.DataArray(numpy.ones(data.shape), data.metadata)
+    theta_data, phi_data, intensity_factor, circle_mask_dilated = _ExtractAngleInformation(ones, hole)
 
     # Crop the raw input data based on the mirror mask (circle_mask) to save memory and improve runtime.
     # We use a dilated mask for cropping to avoid edge effects during triangulation and interpolation.
     # The additional data points (due to dilation) will be set to zero during the interpolation step by intensity_data.
     theta_data_masked = theta_data[circle_mask_dilated]  # list of values for theta within mask
     phi_data_masked = phi_data[circle_mask_dilated]  # list of values for phi within mask
-    intensity_data_masked = intensity_data[circle_mask_dilated]  # list of values for intensity within mask
+    src_idx = numpy.flatnonzero(circle_mask_dilated)  # position of each of these values in the raw data
 
     # Convert the spherical coordinates theta and phi into polar coordinates for display in GUI
     # theta equals radial distance r to center of whole (0 - 90 degree)
@@ -232,45 +262,38 @@ def AngleResolved2Polar(data, output_size, hole=True):
     # Therefore, not all px in the output image are populated.
     # Moreover, the data is masked with the mirror shape (mask_circle).
     # Therefore, we perform a delaunay triangulation of the given data points.
-    # The delaunay object is passed to the interpolator with the corresponding intensity values (intensity_data).
-    # The interpolator also receives a meshgrid (set of coordinates) of the size specified for the output image.
-    # The input data points (theta and phi) are mapped on the meshgrid. As the meshgrid contains much more positions
-    # compared to the input data points, the interpolator fills up the empty grid positions with intensity values.
-    # These intensity values are interpolated from the intensity values of the positions spanning the triangle they
+    # Each position of a meshgrid (set of coordinates) of the size specified for the output image
+    # is then interpolated from the intensity values of the positions spanning the triangle they
     # are contained in (triangle from delaunay triangulation).
-    # Grid positions located outside of any delaunay triangle are set to NaN.
+    # Grid positions located outside of any delaunay triangle are set to 0.
 
     # Note: delaunay triangulation input points: ndarray of floats, shape (numpyoints, ndim) -> transpose data for input
     data_transposed = numpy.array([x_data_polar, y_data_polar]).T  # transpose moves angle orientation from CCW to CW
-    triang = DelaunayTriangulation(data_transposed)
-    # create interpolation object
-    interp = LinearNDInterpolator(triang, intensity_data_masked.flat)
     # create grid of positions for interpolation: neg to pos as x/y data polar
     # contain now values from -output_size/2 to +output_size/2
     xi, yi = numpy.meshgrid(numpy.linspace(-output_size / 2, output_size / 2, output_size),
                             numpy.linspace(-output_size / 2, output_size / 2, output_size))
 
-    # interpolate
-    qz = interp(xi, yi)
+    return _ComputeTriangulationWeights(data_transposed, src_idx, intensity_factor.ravel(), xi, yi)
+
+
+def _ApplyPolarPlan(plan, data, output_size):
+    """
+    Converts a raw angle resolved image to polar projection.
+    :param plan: (csr_matrix) as returned by _ComputePolarPlan()
+    :param data: (ndarray of shape YX) The raw image, with the standard mirror orientation.
+    :param output_size: (int) The size of the output (assumed to be square).
+    :returns: (ndarray of shape (output_size, output_size)) The polar projection.
+    """
+    # Note: sparse matrix * vector is faster than sparse matrix * dense matrix,
+    # so even for multiple images, it's best to convert them one at a time.
+    qz = plan.dot(data.ravel()).reshape(output_size, output_size)
     # polar coordinate transformation starts with 0 at horizontal axis by definition
     qz = numpy.rot90(qz)  # rotate by 90 degrees CCW so we start 0 at top (angles will be CW orientated)
-    qz[numpy.isnan(qz)] = 0  # remove NaNs created during interpolation
+    qz[numpy.isnan(qz)] = 0  # remove NaNs from the input data
     assert numpy.all(qz > -1)  # there should be no negative values, some very small due to interpolation are possible
     qz[qz < 0] = 0  # all negative values (due to interpolation or wrong background subtraction) set to zero
-
-    # plot the data
-    # plt.figure()
-    # plt.plot(theta_data_polar, phi_data_polar)
-    #
-    # plt.figure()
-    # plt.plot(triang.points[:, 0], triang.points[:, 1])
-    #
-    # plt.figure()
-    # plt.plot(triang.points[:, 0], triang.points[:, 1], 'o')
-    # plt.triplot(triang.points[:, 0], triang.points[:, 1], triang.simplices.copy())
-    # plt.title("delaunay tesselation (triangulation)")
-
-    return model.DataArray(qz, data.metadata)
+    return qz
 
 
 def AngleResolved2Rectangular(data, output_size, hole=True):
@@ -290,10 +313,27 @@ def AngleResolved2Rectangular(data, output_size, hole=True):
     """
 
     data = _flipDataIfMirrorFlipped(data)
+    plan = _getInterpolationPlan(_ComputeRectangularPlan, data, output_size, hole)
+    qz = _ApplyRectangularPlan(plan, data, output_size)
 
+    return model.DataArray(qz, data.metadata)
+
+
+def _ComputeRectangularPlan(data, output_size, hole):
+    """
+    Computes the interpolation from the raw data to the equirectangular projection.
+    :param data: (model.DataArray) The image that was projected on the detector, with
+      the standard mirror orientation. Only its shape and metadata are used.
+    :param output_size: (int, int) The size of the output (theta, phi).
+    :param hole: (boolean) Crop the pole if True.
+    :returns: (csr_matrix of shape (theta*phi, Y*X)) Weights of each input pixel
+      for each output pixel.
+    """
     # calculate the corresponding theta and phi angles based on the geometrical properties
-    # of the mirror for each px on the raw data
-    theta_data, phi_data, intensity_data, circle_mask_dilated = _ExtractAngleInformation(data, hole)
+    # of the mirror for each px on the raw data.
+    # The intensity factor (mask & solid angle) is computed by passing an image of 1's.
+    ones = model.DataArray(numpy.ones(data.shape), data.metadata)
+    theta_data, phi_data, intensity_factor, circle_mask_dilated = _ExtractAngleInformation(ones, hole)
 
     # extend the data range to take care of edge effects during interpolation step
     # extend the range of phi from 0 - 2pi to -2pi to 2pi to take care of periodicity of phi
@@ -318,42 +358,288 @@ def AngleResolved2Rectangular(data, output_size, hole=True):
         numpy.append(phi_data - 2 * math.pi, phi_data, axis=1),
         phi_data + 2 * math.pi, axis=1)[:, low_border: high_border]  # -pi to +3pi
     theta_data_doubled = numpy.tile(theta_data, (1, 3))[:, low_border: high_border]
-    intensity_data_doubled = numpy.tile(intensity_data, (1, 3))[:, low_border: high_border]
     circle_mask_dilated_doubled = numpy.tile(circle_mask_dilated, (1, 3))[:, low_border: high_border]
+    # position of each value in the raw data
+    src_idx_doubled = numpy.tile(numpy.arange(data.size).reshape(data.shape), (1, 3))[:, low_border: high_border]
 
     # Crop the raw input data based on the mirror mask (circle_mask) to save memory and improve runtime.
     # We use a dilated mask for cropping to avoid edge effects during triangulation.
     # The additional data points (due to dilation) will be set to zero during the interpolation step by intensity_data.
     theta_data_masked = theta_data_doubled[circle_mask_dilated_doubled]  # list containing values from 0 to +pi/2
     phi_data_masked = phi_data_doubled[circle_mask_dilated_doubled]  # list containing values from -pi to + 3pi
-    intensity_data_masked = intensity_data_doubled[circle_mask_dilated_doubled]
+    src_idx = src_idx_doubled[circle_mask_dilated_doubled]
 
     # Multiple theta-phi combinations will be mapped to the same px in the output image after polar-transformation.
     # Therefore, not all px in the output image are populated.
     # Moreover, the data is masked with the mirror shape (mask_circle).
     # Therefore, we perform a delaunay triangulation of the given data points.
-    # The delaunay object is passed to the interpolator with the corresponding intensity values (intensity_data).
-    # The interpolator also receives a meshgrid (set of coordinates) of the size specified for the output image.
-    # The input data points (theta and phi) are mapped on the meshgrid. As the meshgrid contains much more positions
-    # compared to the input data points, the interpolator fills up the empty grid positions with intensity values.
-    # These intensity values are interpolated from the intensity values of the positions spanning the triangle they
+    # Each position of a meshgrid (set of coordinates) of the size specified for the output image
+    # is then interpolated from the intensity values of the positions spanning the triangle they
     # are contained in (triangle from delaunay triangulation).
-    # Grid positions located outside of any delaunay triangle are set to NaN.
+    # Grid positions located outside of any delaunay triangle are set to 0.
 
     # Note: delaunay triangulation input points: ndarray of floats, shape (numpoints, ndim) -> transpose data for input
     data_transposed = numpy.array([phi_data_masked, theta_data_masked]).T
-    triang = DelaunayTriangulation(data_transposed)
-    # create interpolation object
-    interp = LinearNDInterpolator(triang, intensity_data_masked.flat)
     # create grid of positions for interpolation
     xi, yi = numpy.meshgrid(numpy.linspace(0, 2 * numpy.pi, output_size[1]),
                             numpy.linspace(0, numpy.pi / 2, output_size[0]))
 
-    # interpolate
-    qz = interp(xi, yi)
-    qz[numpy.isnan(qz)] = 0  # remove NaNs created during interpolation but keep negative values
+    return _ComputeTriangulationWeights(data_transposed, src_idx, intensity_factor.ravel(), xi, yi)
 
-    return model.DataArray(qz, data.metadata)
+
+def _ApplyRectangularPlan(plan, data, output_size):
+    """
+    Converts a raw angle resolved image to equirectangular projection.
+    :param plan: (csr_matrix) as returned by _ComputeRectangularPlan()
+    :param data: (ndarray of shape YX) The raw image, with the standard mirror orientation.
+    :param output_size: (int, int) The size of the output (theta, phi).
+    :returns: (ndarray of shape (theta, phi)) The equirectangular projection.
+    """
+    qz = plan.dot(data.ravel()).reshape(output_size)
+    qz[numpy.isnan(qz)] = 0  # remove NaNs from the input data but keep negative values
+    return qz
+
+
+def _ComputeTriangulationWeights(points, src_idx, intensity_factor, xi, yi):
+    """
+    Computes the linear interpolation over a Delaunay triangulation of scattered
+    points, as a sparse matrix. It's equivalent to scipy's LinearNDInterpolator,
+    but the weights can be reused for any values of the points.
+    :param points: (ndarray of shape (N, 2)) Coordinates of the scattered points
+    :param src_idx: (ndarray of int of shape N) For each point, the index of the
+      corresponding value in the (flattened) raw data
+    :param intensity_factor: (ndarray of float) For each value of the (flattened)
+      raw data, the factor to apply before interpolation
+    :param xi, yi: (ndarrays of same shape) Coordinates of the output positions
+    :returns: (csr_matrix of shape (xi.size, intensity_factor.size)) Weights of
+      each raw value for each output position. The output positions outside of
+      the triangulation have no weight (so they are 0).
+    """
+    triang = DelaunayTriangulation(points)
+    out_pos = numpy.column_stack((xi.ravel(), yi.ravel()))
+    simplex = triang.find_simplex(out_pos)
+    inside = numpy.flatnonzero(simplex >= 0)
+    simplex = simplex[inside]
+
+    # barycentric coordinates of each output position in its triangle
+    trans = triang.transform[simplex]
+    bary = numpy.einsum("ijk,ik->ij", trans[:, :2, :], out_pos[inside] - trans[:, 2, :])
+    weights = numpy.column_stack((bary, 1 - bary.sum(axis=1)))
+
+    cols = src_idx[triang.simplices[simplex]]
+    rows = numpy.repeat(inside, 3)
+    return csr_matrix(((weights * intensity_factor[cols]).ravel(), (rows, cols.ravel())),
+                      shape=(xi.size, intensity_factor.size))
+
+
+def _getGeometryKey(data):
+    """
+    Returns the metadata which define the geometry of an angle resolved image
+    :param data: (model.DataArray) The image that was projected on the detector.
+    :returns: (tuple) hashable, and identical for all images with the same geometry.
+    """
+    md = data.metadata
+    try:
+        return (data.shape,
+                tuple(md[model.MD_PIXEL_SIZE]),
+                tuple(md[model.MD_AR_POLE]),
+                md.get(model.MD_AR_PARABOLA_F, AR_PARABOLA_F),
+                md.get(model.MD_AR_XMAX, AR_XMAX),
+                md.get(model.MD_AR_HOLE_DIAMETER, AR_HOLE_DIAMETER),
+                md.get(model.MD_AR_FOCUS_DISTANCE, AR_FOCUS_DISTANCE),
+                )
+    except KeyError:
+        raise ValueError("Metadata required: MD_PIXEL_SIZE, MD_AR_POLE, MD_AR_PARABOLA_F.")
+
+
+def _getInterpolationPlan(compute_plan, data, output_size, hole):
+    """
+    Returns the interpolation plan for the given geometry, from the cache if
+    it was already computed.
+    :param compute_plan: (callable) _ComputePolarPlan or _ComputeRectangularPlan
+    :param data: (model.DataArray) The image that was projected on the detector, with
+      the standard mirror orientation.
+    :param output_size: passed to compute_plan
+    :param hole: (boolean) passed to compute_plan
+    :returns: (csr_matrix) the plan
+    """
+    if isinstance(output_size, list):
+        output_size = tuple(output_size)
+    key = (compute_plan, _getGeometryKey(data), output_size, hole)
+    with _plans_lock:
+        try:
+            plan = _plans_cache.pop(key)
+            _plans_cache[key] = plan  # put it as most recently used
+            return plan
+        except KeyError:
+            pass
+
+    plan = compute_plan(data, output_size, hole)
+
+    with _plans_lock:
+        _plans_cache[key] = plan
+        while len(_plans_cache) > MAX_PLANS_CACHED:
+            _plans_cache.popitem(last=False)
+    return plan
+
+
+def AngleResolved2PolarBatch(data, output_size, hole=True, out=None, chunk_size=16, max_workers=None):
+    """
+    Converts a series of angle resolved images, which all have the same geometry
+    (eg, all the ebeam positions of an AR acquisition), to polar projections.
+    The images are processed by chunks in parallel.
+    :param data: (model.DataArray of shape ...YX, or list of model.DataArrays of shape YX)
+      The images, as accepted by AngleResolved2Polar(). The geometry is read from
+      the metadata of the (first) DataArray.
+    :param output_size: (int) The size of each output image (assumed to be square).
+    :param hole: (boolean) Crop the pole if True.
+    :param out: (None or ndarray of shape ...(output_size, output_size)) C-contiguous
+      array of float, where to store the result. If None, a new one is allocated.
+    :param chunk_size: (int) Number of images converted at once by a worker.
+    :param max_workers: (None or int) Number of workers. If None, the number of CPUs is used.
+    :returns: (model.ProgressiveFuture) Progress of the conversion, whose result() returns
+      the output array (out, if it was provided).
+    """
+    return _ConvertBatch(_ComputePolarPlan, _ApplyPolarPlan, data, output_size, (output_size, output_size),
+                         hole, out, chunk_size, max_workers)
+
+
+def AngleResolved2RectangularBatch(data, output_size, hole=True, out=None, chunk_size=16, max_workers=None):
+    """
+    Converts a series of angle resolved images, which all have the same geometry
+    (eg, all the ebeam positions of an AR acquisition), to equirectangular projections.
+    The images are processed by chunks in parallel.
+    :param data: (model.DataArray of shape ...YX, or list of model.DataArrays of shape YX)
+      The images, as accepted by AngleResolved2Rectangular(). The geometry is read from
+      the metadata of the (first) DataArray.
+    :param output_size: (int, int) The size of each output image (theta, phi).
+    :param hole: (boolean) Crop the pole if True.
+    :param out: (None or ndarray of shape ...(theta, phi)) C-contiguous array of float,
+      where to store the result. If None, a new one is allocated.
+    :param chunk_size: (int) Number of images converted at once by a worker.
+    :param max_workers: (None or int) Number of workers. If None, the number of CPUs is used.
+    :returns: (model.ProgressiveFuture) Progress of the conversion, whose result() returns
+      the output array (out, if it was provided).
+    """
+    return _ConvertBatch(_ComputeRectangularPlan, _ApplyRectangularPlan, data, output_size, tuple(output_size),
+                         hole, out, chunk_size, max_workers)
+
+
+def _ConvertBatch(compute_plan, apply_plan, data, output_size, out_shape, hole, out, chunk_size, max_workers):
+    """
+    Prepares the conversion of a series of images, and starts it in a separate thread.
+    See AngleResolved2PolarBatch() for the parameters.
+    :param compute_plan: (callable) the function to compute the interpolation plan
+    :param apply_plan: (callable) the function to apply the interpolation plan
+    :param out_shape: (tuple of ints) the shape of one output image
+    :returns: (model.ProgressiveFuture) Progress of the conversion
+    """
+    if isinstance(data, numpy.ndarray):
+        ref = data
+        lead_shape = data.shape[:-2]
+        # Show each frame as a DataArray of shape YX, without copying the data
+        frames = data.reshape((-1,) + data.shape[-2:])
+    else:
+        ref = data[0]
+        lead_shape = (len(data),)
+        frames = data
+        key = _getGeometryKey(ref)
+        for d in data[1:]:
+            if _getGeometryKey(d) != key:
+                raise ValueError("All the images must have the same geometry")
+
+    ref = model.DataArray(ref[(0,) * (ref.ndim - 2)], ref.metadata)
+    # If the mirror is flipped, each frame will be flipped in the same way
+    flip = ref.metadata.get(model.MD_AR_FOCUS_DISTANCE, AR_FOCUS_DISTANCE) < 0
+    ref = _flipDataIfMirrorFlipped(ref)
+
+    if out is None:
+        out = numpy.empty(lead_shape + out_shape)
+    elif out.shape != lead_shape + out_shape or not out.flags.c_contiguous:
+        raise ValueError("out must be C-contiguous of shape %s, but got %s" %
+                         (lead_shape + out_shape, out.shape))
+
+    n = len(frames)
+    est_start = time.time() + 0.1
+    # Very rough estimation, it will be updated after the first chunk
+    f = model.ProgressiveFuture(start=est_start, end=est_start + 1 + n * 0.01)
+    f._conversion_state = RUNNING
+    f._conversion_lock = threading.Lock()
+    f.task_canceller = _CancelConvertBatch
+
+    executeAsyncTask(f, _DoConvertBatch,
+                     args=(f, compute_plan, apply_plan, ref, frames, flip, output_size, hole,
+                           out, chunk_size, max_workers))
+    return f
+
+
+def _DoConvertBatch(future, compute_plan, apply_plan, ref, frames, flip, output_size, hole,
+                    out, chunk_size, max_workers):
+    """
+    Converts a series of images, by chunks, in parallel.
+    See _ConvertBatch() for the parameters.
+    :param ref: (model.DataArray) An image with the geometry of all the frames,
+      with the standard mirror orientation.
+    :param frames: (sequence of ndarrays of shape YX) The raw images
+    :param flip: (bool) If True, the frames are inverted vertically before conversion
+    :param out: (ndarray) where to store the output images
+    :returns: out
+    :raises: CancelledError if cancelled
+    """
+    start = time.time()
+    plan = _getInterpolationPlan(compute_plan, ref, output_size, hole)
+    n = len(frames)
+    out_flat = out.reshape((n,) + out.shape[-2:])  # view, as out is C-contiguous
+    chunks = [(i, min(i + chunk_size, n)) for i in range(0, n, chunk_size)]
+
+    def convert_chunk(b, e):
+        for i in range(b, e):
+            if future._conversion_state == CANCELLED:
+                return
+            fr = frames[i]
+            if flip:
+                fr = fr[::-1, :]
+            out_flat[i] = apply_plan(plan, fr, output_size)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or multiprocessing.cpu_count())
+    fs = []
+    try:
+        fs = [executor.submit(convert_chunk, b, e) for b, e in chunks]
+        for cf, (b, e) in zip(fs, chunks):
+            cf.result()
+            with future._conversion_lock:
+                if future._conversion_state == CANCELLED:
+                    raise CancelledError()
+            # Update the estimated end time based on the average time per frame so far
+            dur = time.time() - start
+            future.set_progress(end=time.time() + dur * (n - e) / e)
+    finally:
+        executor.shutdown(wait=False)
+        for cf in fs:
+            cf.cancel()
+
+    with future._conversion_lock:
+        if future._conversion_state == CANCELLED:
+            raise CancelledError()
+        future._conversion_state = FINISHED
+
+    logging.debug("Converted %d AR images in %g s", n, time.time() - start)
+    return out
+
+
+def _CancelConvertBatch(future):
+    """
+    Canceller of _DoConvertBatch task.
+    """
+    logging.debug("Cancelling AR batch conversion...")
+
+    with future._conversion_lock:
+        if future._conversion_state == FINISHED:
+            return False
+        future._conversion_state = CANCELLED
+        logging.debug("AR batch conversion cancellation requested.")
+
+    return True
 
 
 def ARBackgroundSubtract(data):
@@ -518,27 +804,105 @@ def _CreateMirrorMaskRectangular(data, hole=True):
     return mask
 
 
+def _ComputeRectangular2PolarPlan(data, output_size):
+    """
+    Computes the lookup table to convert a rectangular representation to a polar
+    representation.
+    :param data: (model.DataArray) The data array in rectangular representation. Shape is (theta, phi).
+    :param output_size: (int) The size of the output image (same in X and Y).
+    :returns:
+        (ndarray of int, shape output_size x output_size): for each output pixel,
+          the index of the input pixel in the flattened data. -1 for pixels
+          outside of the mirror.
+        (boolean ndarray) Mask of the mirror, in rectangular representation.
+    """
+    n_theta, n_phi = data.shape
+    mask = _CreateMirrorMaskRectangular(data, hole=True)
+
+    # Each input pixel is drawn at the nearest output pixels (like pcolormesh
+    # with "nearest" shading), so the image goes half a step beyond pi/2.
+    theta_step = (numpy.pi / 2) / max(n_theta - 1, 1)
+    phi_step = (2 * numpy.pi) / max(n_phi - 1, 1)
+    radius = numpy.pi / 2 + theta_step / 2
+
+    # Position of the center of each output pixel, with Y going up
+    coords = (numpy.arange(output_size) + 0.5) * (2 * radius / output_size) - radius
+    x, y = numpy.meshgrid(coords, coords[::-1])
+    theta = numpy.hypot(x, y)
+    phi = numpy.arctan2(x, y) % (2 * numpy.pi)
+
+    theta_idx = numpy.rint(theta / theta_step).astype(numpy.intp)
+    phi_idx = numpy.rint(phi / phi_step).astype(numpy.intp)
+    inside = theta_idx < n_theta
+    lut = numpy.full((output_size, output_size), -1, dtype=numpy.intp)
+    src_idx = theta_idx[inside] * n_phi + phi_idx[inside]
+    # Only keep the pixels which are on the mirror
+    src_idx[~mask.ravel()[src_idx]] = -1
+    lut[inside] = src_idx
+
+    return lut, mask
+
+
+def _getRectangular2PolarPlan(data, output_size):
+    """
+    Returns the lookup table for Rectangular2Polar, from the cache if it was
+    already computed.
+    :param data: (model.DataArray) The data array in rectangular representation. Shape is (theta, phi).
+    :param output_size: (int) The size of the output image.
+    :returns: same as _ComputeRectangular2PolarPlan
+    """
+    md = data.metadata
+    key = (data.shape, output_size,
+           md.get(model.MD_AR_PARABOLA_F, AR_PARABOLA_F),
+           md.get(model.MD_AR_XMAX, AR_XMAX),
+           md.get(model.MD_AR_HOLE_DIAMETER, AR_HOLE_DIAMETER),
+           md.get(model.MD_AR_FOCUS_DISTANCE, AR_FOCUS_DISTANCE),
+           )
+    with _plans_lock:
+        try:
+            plan = _polar_plans_cache.pop(key)
+            _polar_plans_cache[key] = plan  # put it as most recently used
+            return plan
+        except KeyError:
+            pass
+
+    plan = _ComputeRectangular2PolarPlan(data, output_size)
+
+    with _plans_lock:
+        _polar_plans_cache[key] = plan
+        while len(_polar_plans_cache) > MAX_PLANS_CACHED:
+            _polar_plans_cache.popitem(last=False)
+    return plan
+
+
+def _getColormap(colormap):
+    """
+    :param colormap: (matplotlib.colors.Colormap or str or None) The colormap object, or its name.
+      If None, the default colormap of matplotlib is used (rcParams["image.cmap"]).
+    :returns: (matplotlib.colors.Colormap) The colormap object.
+    """
+    if isinstance(colormap, matplotlib.colors.Colormap):
+        return colormap
+    if colormap is None:
+        colormap = matplotlib.rcParams["image.cmap"]
+    try:
+        return matplotlib.colormaps[colormap]
+    except AttributeError:  # matplotlib < 3.5
+        return matplotlib.cm.get_cmap(colormap)
+
+
 def Rectangular2Polar(data, output_size, colormap=None):
     """
     Calculates the polar representation (angle: phi, radius: theta) from the rectangular
     representation (theta, phi) of the raw data.
     :param data: (model.DataArray) The data array containing the image. Shape is (theta, phi).
-    :param output_size: (tuple of 1 int) Size for the output figure.
-    :param colormap: (matplotlib.colors.LinearSegmentedColormap or None) The colormap object.
-                     If None, default colormap of pcolormesh method is used (rcParams["image.cmap"]).
-    :returns: (model.DataArray) Shape is (y, x, c). Also, if colormap = None.
+    :param output_size: (int) Size for the output figure.
+    :param colormap: (matplotlib.colors.Colormap or str or None) The colormap object, or its name.
+                     If None, default colormap of matplotlib is used (rcParams["image.cmap"]).
+    :returns: (model.DataArray) Shape is (y, x, c). The pixels outside of the mirror are black.
     """
-
-    # For each pixel of the input ndarray, calculate the corresponding theta, phi values.
-    phi_indices = numpy.linspace(0, 2 * numpy.pi, data.shape[1])  # list of px indices (1D array)
-    theta_indices = numpy.linspace(0, numpy.pi / 2, data.shape[0])  # list of px indices (1D array)
-    phi, theta = numpy.meshgrid(phi_indices, theta_indices)
-    y_data_polar = numpy.cos(phi) * theta
-    x_data_polar = numpy.sin(phi) * theta
-
-    # Calculate the mirror mask in rectangular phi/theta representation
-    # Note: Everything outside of mask is 0
-    mask = _CreateMirrorMaskRectangular(data, hole=True)
+    output_size = int(output_size)
+    lut, mask = _getRectangular2PolarPlan(data, output_size)
 
     # define the limits for plotting
     if data.metadata[MD_POL_MODE] in [MD_POL_UP, MD_POL_DOP, MD_POL_DOLP]:
@@ -560,51 +924,26 @@ def Rectangular2Polar(data, output_size, colormap=None):
             lim = max(abs(lim1), abs(lim2))
             lim1, lim2 = -lim, lim
 
-    # Mask data (everything outside of mask is invalid) to reduce calculation time
-    # Note: Pass inverted mask as masked array labels invalid values as True.
-    data_masked = ma.masked_array(data, ~mask)
-    dpi = 1  # Trick to avoid rounding of the output_size
-    # Size of the figure for plotting. Values are in inch.
-    sizefig = (output_size/dpi, output_size/dpi)  # match figure size with output_size and dpi
-    # plot the data
-    fig = plt.figure(figsize=sizefig, dpi=dpi)
-
-    plt.pcolormesh(x_data_polar, y_data_polar, data_masked, cmap=colormap, vmin=lim1, vmax=lim2)
-    plt.axis("square")
-
-    # get the data from the figure canvas as numpy array
-    result = _figure2data(fig)
-    plt.close(fig)  # to prevent memory leakage
+    # Gather the value of each output pixel (pixels outside get any value, and
+    # are reset afterwards)
+    values = numpy.asarray(data, dtype=numpy.float64).ravel().take(lut)
+    outside = (lut < 0) | numpy.isnan(values)
+
+    # Convert to colours, the same way as matplotlib: the values below/above
+    # the limits get the first/last colour.
+    cmap = _getColormap(colormap)
+    if lim2 > lim1:
+        values -= lim1
+        values *= cmap.N / (lim2 - lim1)
+    else:
+        values[:] = 0
+    values[outside] = 0
+    cidx = numpy.clip(values, 0, cmap.N - 1).astype(numpy.intp)
+    colours = cmap(numpy.arange(cmap.N), bytes=True)[:, :3]
+    result = colours.take(cidx, axis=0)
+    result[outside] = 0  # black background
 
     md = data.metadata.copy()
     md[model.MD_DIMS] = "YXC"
 
     return model.DataArray(result, md)
-
-
-def _figure2data(figure):
-    """
-    Extracts the data from the figure canvas and stores it in an numpy array.
-    :param figure: (matplotlib figure) Figure to extract the data from.
-    :returns: (ndarray) Array containing the image from the plotted figure.
-    Note: This method needs special dependencies to be loaded. Use an backend without
-          front end (without GUI interface), to not plot the figures.
-          import matplotlib
-          matplotlib.use("Agg")  # use non-GUI backend
-          import matplotlib.pyplot as plt
-    """
-
-    figure.set_facecolor((0, 0, 0))
-    figure.gca().axis("tight")
-    figure.gca().set_xticks([])
-    figure.gca().set_yticks([])
-    figure.gca().axis('off')
-    figure.tight_layout(pad=0)
-    figure.canvas.draw()
-
-    w, h = figure.canvas.get_width_height()
-    image = numpy.fromstring(figure.canvas.tostring_rgb(), dtype=numpy.uint8)
-    image.shape = (h, w, 3)
-
-    return image
-
@@ -925,14 +925,19 @@ class ImageIntegrator(object):
     Integrate the images one after another. Once the first image is acquired, calculate the best type for fitting
     the image to avoid saturation and overflow. At the end of acquisition, take the average of integrated data if
     the detector is DT_NORMAL and subtract the baseline from the final integrated image.
+    The images are accumulated in place, in a buffer allocated only once per integration.
     """
-    def __init__(self, steps):
+    def __init__(self, steps, det_type=None):
         """
         steps: (int) the total number of images that need to be integrated
+        det_type (MD_DT_* or None): the type of detector, which defines whether the
+          images are averaged or summed. If None, it's read from the metadata of the
+          images, and by default they are summed (ie, MD_DT_INTEGRATING).
         """
         self.steps = steps  # can be changed by the caller, on the fly
+        self._det_type = det_type
         self._step = 0
-        self._img = None
+        self._img = None  # DataArray: the accumulated image
         self._best_dtype = None
 
     def append(self, img):
@@ -940,6 +945,8 @@ class ImageIntegrator(object):
         Integrate two images (the new acquired image with the previous integrated one if exists) and return the
         new integrated image. It will reset the ._img after reaching the number of integration counts, notifying
         that the integration of the acquired images is completed.
+        Note: to avoid copying data, the intermediary integrated images share the same memory, which is updated
+        at the next call. Only the final integrated image is independent.
         Args:
             img(model.DataArray): the image that should be integrated with the previous (integrated) one, if exists
         Returns:
@@ -950,35 +957,24 @@ class ImageIntegrator(object):
             orig_dtype = img.dtype
             self._best_dtype = get_best_dtype_for_acc(orig_dtype, self.steps)
             integ_img = img
-            self._img = integ_img
-
+            if self._step < self.steps:
+                # Allocate the accumulator (also avoid modifying the original image)
+                self._img = model.DataArray(img.astype(self._best_dtype), img.metadata)
+            else:
+                self._img = img
         else:
-            mda = img.metadata  # metadata of the new acquired image
+            mda = img.metadata.copy()  # metadata of the new acquired image
             mdb = self._img.metadata  # metadata of the previous acquired image or the previous integrated one
-            data = numpy.add(self._img, img, dtype=self._best_dtype)
+            numpy.add(self._img, img, out=self._img)
             # update the metadata of the integrated image in every integration step
             md = self.add_integration_metadata(mda, mdb)
+            # Same data, but with new metadata (no copy)
+            integ_img = model.DataArray(self._img, md)
+            self._img = integ_img
 
-            # At the end of the acquisition, check if the detector type is DT_NORMAL and then take the average by
-            # dividing with the number of acquired images (integration count) for every pixel position and restoring
-            # the original dtype.
+            # At the end of the acquisition, average and subtract the baseline, if needed
             if self._step == self.steps:
-                det_type = md.get(model.MD_DET_TYPE, model.MD_DT_INTEGRATING)
-                if det_type == model.MD_DT_NORMAL:  # SEM
-                    orig_dtype = img.dtype
-                    if orig_dtype.kind in "biu":
-                        data = numpy.floor_divide(data, self._step, dtype=orig_dtype, casting='unsafe')
-                    else:
-                        data = numpy.true_divide(data, self._step, dtype=orig_dtype, casting='unsafe')
-                elif det_type != model.MD_DT_INTEGRATING:  # optical
-                    logging.warning("Unknown detector type %s for image integration.", det_type)
-                # The baseline, if exists, should also be subtracted from the integrated image.
-                if model.MD_BASELINE in md:
-                    data, md = self.subtract_baseline(data, md)
-                logging.debug("Image integration is completed.")
-
-            integ_img = model.DataArray(data, md)
-            self._img = integ_img
+                integ_img = self._finalize(integ_img, img.dtype)
 
         # reset the ._img and ._step once you reach the integration count
         if self._step >= self.steps:
@@ -987,6 +983,32 @@ class ImageIntegrator(object):
 
         return integ_img
 
+    def _finalize(self, integ_img, orig_dtype):
+        """
+        Convert the accumulated image into the final integrated image.
+        If the detector type is DT_NORMAL, take the average by dividing with the number of acquired images
+        (integration count) for every pixel position and restoring the original dtype.
+        integ_img (DataArray): the accumulated image. It might be modified.
+        orig_dtype (numpy.dtype): the dtype of the images acquired
+        return (DataArray): the final integrated image
+        """
+        data = integ_img
+        md = integ_img.metadata
+        det_type = self._det_type or md.get(model.MD_DET_TYPE, model.MD_DT_INTEGRATING)
+        if det_type == model.MD_DT_NORMAL:  # SEM
+            if orig_dtype.kind in "biu":
+                data = numpy.floor_divide(data, self._step, dtype=orig_dtype, casting='unsafe')
+            else:
+                data = numpy.true_divide(data, self._step, dtype=orig_dtype, casting='unsafe')
+        elif det_type != model.MD_DT_INTEGRATING:  # optical
+            logging.warning("Unknown detector type %s for image integration.", det_type)
+        # The baseline, if exists, should also be subtracted from the integrated image.
+        if model.MD_BASELINE in md:
+            data, md = self.subtract_baseline(data, md)
+        logging.debug("Image integration is completed.")
+
+        return model.DataArray(data, md)
+
     def add_integration_metadata(self, mda, mdb):
         """
         add mdb to mda, and update mda with the result
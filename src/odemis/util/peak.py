@@ -16,10 +16,13 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 from __future__ import division
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from concurrent.futures._base import CancelledError, CANCELLED, FINISHED, RUNNING
 import logging
+import multiprocessing
 import numpy
 from odemis import model
+from odemis.util import executeAsyncTask
 from scipy.optimize import curve_fit, OptimizeWarning
 import threading
 import time
@@ -203,6 +206,187 @@ def Detect(y_vector, x_vector=None, lookahead=5, delta=0):
     return maxtab, mintab
 
 
+def _FitSpectrum(spectrum, wavelength, type='gaussian_space', peaks=None, is_cancelled=None):
+    """
+    Smooths the spectrum signal, detects the peaks and applies the type of peak
+    fitting required. This is the actual work of PeakFitter.Fit() (and FitMap()),
+    so it must be possible to run it in a separate thread.
+    spectrum (1d array of floats): The data representing the spectrum.
+    wavelength (1d array of floats): The wavelength values corresponding to the
+    spectrum given.
+    type (str): Type of fitting to be applied (see PEAK_FUNCTIONS).
+    peaks (None or list of 2-tuple of floats): position and amplitude of the
+      peaks to use as initial guess, instead of detecting them. If fitting with
+      them fails, the peaks are detected on the spectrum, as normally.
+    is_cancelled (None or callable): if provided, called regularly, and if it
+      returns True, the fitting is stopped.
+    returns:
+         params (list of 3-tuple): Each peak parameters as (pos, width, amplitude)
+         offset (float): global offset to add
+    raises:
+            KeyError if given type not available
+            ValueError if fitting cannot be applied
+            CancelledError if is_cancelled() returned True
+    """
+    if type not in PEAK_FUNCTIONS:
+        raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
+
+    params = None
+    if peaks:
+        try:
+            params = _FitPeaks(spectrum, wavelength, type, peaks)
+        except Exception as ex:
+            logging.debug("Failed to fit with the given peaks, will detect them: %s", ex)
+
+    if params is None:
+        # Increase window size until peak detection finds enough peaks to fit
+        # the spectrum curve
+        for peaks in _DetectPeaks(spectrum, wavelength, is_cancelled):
+            if is_cancelled and is_cancelled():
+                raise CancelledError()
+
+            try:
+                params = _FitPeaks(spectrum, wavelength, type, peaks)
+                break
+            except Exception as ex:
+                logging.debug("Retrying to fit peak with a larger window due to error %s", ex)
+                continue
+        else:
+            raise ValueError("Could not apply peak fitting of type %s." % type)
+
+    # reformat parameters to (list of 3 tuples, offset)
+    peaks_params = []
+    for pos, width, amplitude in _Grouped(params[:-1], 3):
+        if type in {'gaussian_energy', 'lorentzian_energy'}:
+            peaks_params.append(peak_to_wavelength(pos, width, amplitude))
+        else:
+            peaks_params.append((pos, width, amplitude))
+
+    return peaks_params, params[-1]
+
+
+def _InitWindowSize(length):
+    """
+    length (int): number of points in the spectrum
+    returns (int): the initial smoothing window size for peak detection
+    """
+    # values based on experimental datasets
+    if length >= 2000:
+        divider = 20
+    elif length >= 1000:
+        divider = 25
+    else:
+        divider = 30
+    return max(3, length // divider)
+
+
+def _DetectPeaks(spectrum, wavelength, is_cancelled=None):
+    """
+    Detects the peaks, with a smoothing window increasing at each step (5 steps
+    at most), and reports the peaks of every step which finds some.
+    spectrum (1d array of floats): The data representing the spectrum.
+    wavelength (1d array of floats): The wavelength values
+    is_cancelled (None or callable): if provided, called before each step,
+      and if it returns True, the detection is stopped.
+    yields (list of 2-tuple of floats): position and amplitude of each peak
+    raises:
+            CancelledError if is_cancelled() returned True
+    """
+    window_size = _InitWindowSize(len(wavelength))
+    logging.debug("Starting peak detection on data (len = %d) with window = %d",
+                  len(wavelength), window_size)
+    for step in range(5):
+        if step > 0:
+            window_size = int(round(window_size * 1.2))
+            logging.debug("Retrying to detect peaks with window = %d", window_size)
+        if is_cancelled and is_cancelled():
+            raise CancelledError()
+        smoothed = Smooth(spectrum, window_len=window_size)
+        peaks = Detect(smoothed, wavelength, lookahead=window_size, delta=5)[0]
+        if peaks:
+            yield peaks
+
+
+def _FitSpectra(spectra, wavelength, type, max_peaks, peaks):
+    """
+    Fits multiple spectra. Used by PeakFitter.FitMap() in the worker threads.
+    spectra (2d array of shape N, C): the spectra
+    wavelength (1d array of floats): The wavelength values
+    type (str): Type of fitting to be applied (see PEAK_FUNCTIONS).
+    max_peaks (int): maximum number of peaks reported
+    peaks (list of N (None or list of 2-tuple of floats)): initial guess of
+      the peaks for each spectrum, or None to detect them.
+    returns:
+      params (array of shape N, max_peaks, 3): pos, width, amplitude of each
+        peak, sorted by decreasing amplitude (NaN if no such peak)
+      offsets (array of shape N): offset of each spectrum (NaN if fitting failed)
+    """
+    params = numpy.full((len(spectra), max_peaks, 3), numpy.nan)
+    offsets = numpy.full((len(spectra),), numpy.nan)
+    for i, (spec, hint) in enumerate(zip(spectra, peaks)):
+        try:
+            peaks_params, offsets[i] = _FitSpectrum(spec, wavelength, type, peaks=hint)
+        except ValueError as ex:
+            logging.debug("Failed to fit spectrum %d: %s", i, ex)
+            continue
+        peaks_params = sorted(peaks_params, key=lambda p: p[2], reverse=True)[:max_peaks]
+        params[i, :len(peaks_params)] = peaks_params
+    return params, offsets
+
+
+def _FitPeaks(spectrum, wavelength, type, peaks):
+    """
+    Fits the spectrum with the given type of peak function, starting from the
+    given peaks.
+    spectrum (1d array of floats): The data representing the spectrum.
+    wavelength (1d array of floats): The wavelength values corresponding to the
+    spectrum given.
+    type (str): Type of fitting to be applied (see PEAK_FUNCTIONS).
+    peaks (list of 2-tuple of floats): position and amplitude of each peak
+    returns (array of floats): the optimized parameters, as passed to the
+      fitting function (ie, in energy domain for the *_energy types).
+    raises: Exception if the fitting failed
+    """
+    FitFunction = PEAK_FUNCTIONS[type]
+    wl_rng = wavelength[-1] - wavelength[0]
+    width = wl_rng * WIDTH_RATIO  # initial peak width estimation
+
+    fit_list = []
+    lower_bounds = []
+    upper_bounds = []
+    for (pos, amplitude) in peaks:
+        if type in {'gaussian_energy', 'lorentzian_energy'}:
+            energy = apply_jacobian_x(wavelength)
+            spectra_energy = apply_jacobian_y(wavelength, spectrum)
+            fit_list.extend(peak_to_energy(pos, width, amplitude))
+            # lower & upper bounds for center position, width, amplitude in energy domain
+            en_rng = energy[0] - energy[-1]
+            lower_bounds.extend([energy[-1] - en_rng / 2, en_rng / 1e4, 0])
+            upper_bounds.extend([energy[0] + en_rng / 2, en_rng * 10, numpy.inf])
+        else:
+            # lower & upper bounds for center position, width, amplitude in space domain
+            fit_list.extend([pos, width, amplitude])
+            lower_bounds.extend([wavelength[0] - wl_rng / 2, wl_rng / 1e3, 0])
+            upper_bounds.extend([wavelength[-1] + wl_rng / 2, wl_rng * 10, numpy.inf])
+
+    # Initialize the offset with the minimum possible value
+    offset = 0
+    fit_list.append(offset)
+    # Set the lower & upper bounds for the offset
+    lower_bounds.extend([0])
+    upper_bounds.extend([min(spectrum)])
+    param_bounds = (lower_bounds, upper_bounds)
+
+    with warnings.catch_warnings():
+        # Hide scipy/optimize/minpack.py:690: OptimizeWarning: Covariance of the parameters could not be estimated
+        warnings.filterwarnings("ignore", "", OptimizeWarning)
+        if type in {'gaussian_energy', 'lorentzian_energy'}:
+            params, _ = curve_fit(FitFunction, energy, spectra_energy, p0=fit_list, bounds=param_bounds)
+        else:
+            params, _ = curve_fit(FitFunction, wavelength, spectrum, p0=fit_list, bounds=param_bounds)
+    return params
+
+
 class PeakFitter(object):
     def __init__(self):
         # will take care of executing peak fitting asynchronously
@@ -255,94 +439,9 @@ class PeakFitter(object):
                 ValueError if fitting cannot be applied
         """
         try:
-            # values based on experimental datasets
-            if len(wavelength) >= 2000:
-                divider = 20
-            elif len(wavelength) >= 1000:
-                divider = 25
-            else:
-                divider = 30
-            init_window_size = max(3, len(wavelength) // divider)
-            window_size = init_window_size
-            logging.debug("Starting peak detection on data (len = %d) with window = %d",
-                          len(wavelength), window_size)
-            try:
-                wl_rng = wavelength[-1] - wavelength[0]
-                width = wl_rng * WIDTH_RATIO  # initial peak width estimation
-                FitFunction = PEAK_FUNCTIONS[type]
-            except KeyError:
-                raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
-            for step in range(5):
-                if future._fit_state == CANCELLED:
-                    raise CancelledError()
-                smoothed = Smooth(spectrum, window_len=window_size)
-                # Increase window size until peak detection finds enough peaks to fit
-                # the spectrum curve
-                peaks = Detect(smoothed, wavelength, lookahead=window_size, delta=5)[0]
-                if not peaks:
-                    window_size = int(round(window_size * 1.2))
-                    logging.debug("Retrying to fit peak with window = %d", window_size)
-                    continue
-
-                fit_list = []
-                lower_bounds = []
-                upper_bounds = []
-                for (pos, amplitude) in peaks:
-                    if type in {'gaussian_energy', 'lorentzian_energy'}:
-                        energy = apply_jacobian_x(wavelength)
-                        spectra_energy = apply_jacobian_y(wavelength, spectrum)
-                        fit_list.extend(peak_to_energy(pos, width, amplitude))
-                        # lower & upper bounds for center position, width, amplitude in energy domain
-                        en_rng = energy[0] - energy[-1]
-                        lower_bounds.extend([energy[-1] - en_rng / 2, en_rng / 1e4, 0])
-                        upper_bounds.extend([energy[0] + en_rng / 2, en_rng * 10, numpy.inf])
-                    else:
-                        # lower & upper bounds for center position, width, amplitude in space domain
-                        fit_list.extend([pos, width, amplitude])
-                        lower_bounds.extend([wavelength[0] - wl_rng / 2, wl_rng / 1e3, 0])
-                        upper_bounds.extend([wavelength[-1] + wl_rng / 2, wl_rng * 10, numpy.inf])
-
-                # Initialize the offset with the minimum possible value
-                offset = 0
-                fit_list.append(offset)
-                # Set the lower & upper bounds for the offset
-                lower_bounds.extend([0])
-                upper_bounds.extend([min(spectrum)])
-                param_bounds = (lower_bounds, upper_bounds)
-
-                if future._fit_state == CANCELLED:
-                    raise CancelledError()
-
-                try:
-                    with warnings.catch_warnings():
-                        # Hide scipy/optimize/minpack.py:690: OptimizeWarning: Covariance of the parameters could not be estimated
-                        warnings.filterwarnings("ignore", "", OptimizeWarning)
-                        # TODO, from scipy 0.17, curve_fit() supports the 'bounds' parameter.
-                        # It could be used to ensure the peaks params are positives.
-                        # (Once we don't support Ubuntu 12.04)
-                        if type in {'gaussian_energy', 'lorentzian_energy'}:
-                            params, _ = curve_fit(FitFunction, energy, spectra_energy, p0=fit_list, bounds=param_bounds)
-                        else:
-                            params, _ = curve_fit(FitFunction, wavelength, spectrum, p0=fit_list, bounds=param_bounds)
-                    break
-                except Exception as ex:
-                    window_size = int(round(window_size * 1.2))
-                    logging.debug("Retrying to fit peak with window = %d due to error %s", window_size, ex)
-                    continue
-            else:
-                raise ValueError("Could not apply peak fitting of type %s." % type)
-            # reformat parameters to (list of 3 tuples, offset)
-            peaks_params = []
-            for pos, width, amplitude in _Grouped(params[:-1], 3):
-                # Note: to avoid negative peaks, the fit functions only take the
-                # absolute of the amplitude/width. So now amplitude and width
-                # have 50% chances to be negative => Force positive now.
-                if type in {'gaussian_energy', 'lorentzian_energy'}:
-                    peaks_params.append(peak_to_wavelength(pos, width, amplitude))
-                else:
-                    peaks_params.append((pos, width, amplitude))
-
-            return peaks_params, params[-1], type
+            peaks_params, offset = _FitSpectrum(spectrum, wavelength, type,
+                                                is_cancelled=lambda: future._fit_state == CANCELLED)
+            return peaks_params, offset, type
         except CancelledError:
             logging.debug("Fitting of type %s was cancelled.", type)
         finally:
@@ -372,6 +471,148 @@ class PeakFitter(object):
         # really rough estimation
         return len(data) * 10e-3  # s
 
+    def FitMap(self, spectra, wavelength, type='gaussian_space', max_peaks=4,
+               neighbourhood=1, max_workers=None):
+        """
+        Fits every spectrum of a spectrum cube. The spectra are fitted in parallel,
+        in separate threads.
+        spectra (DataArray of shape C...): The spectrum cube, with the wavelength
+          as first dimension (eg, CYX).
+        wavelength (1d array of floats): The wavelength values corresponding to the
+        spectra given.
+        type (str): Type of fitting to be applied ('gaussian_space', 'lorentzian_space',
+        'gaussian_energy' or 'lorentzian_energy')
+        max_peaks (int > 0): Maximum number of peaks reported for each spectrum.
+          If more peaks were fitted, only the ones with the largest amplitude are kept.
+        neighbourhood (int > 0): If > 1, the peaks are detected only once, on
+          the mean spectrum of each square of neighbourhood x neighbourhood pixels,
+          and used as initial guess to fit each of these spectra. It's faster,
+          but the result might differ from Fit(). If 1, each spectrum is fitted
+          exactly as with Fit().
+        max_workers (None or int > 0): Number of threads. If None, the number
+          of CPUs is used.
+        returns (model.ProgressiveFuture): Progress of the fitting, whose result is:
+          pos, width, amplitude (DataArrays of shape ...P, with P = max_peaks):
+            the parameters of each peak, sorted by decreasing amplitude. If a
+            spectrum has less peaks, the remaining values are NaN.
+          offset (DataArray of shape ...): the global offset of each spectrum.
+            If the fitting failed, it's NaN (as are all its peak parameters).
+        raises:
+                KeyError if given type not available
+        """
+        if type not in PEAK_FUNCTIONS:
+            raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
+        if spectra.shape[0] != len(wavelength):
+            raise ValueError("Spectra have %d wavelengths, but got %d wavelength values" %
+                             (spectra.shape[0], len(wavelength)))
+        if neighbourhood > 1 and spectra.ndim < 3:
+            raise ValueError("Spectra must have at least 2 spatial dimensions to use neighbourhood")
+
+        nspec = int(numpy.prod(spectra.shape[1:]))
+        nworkers = max_workers or multiprocessing.cpu_count()
+        est_start = time.time() + 0.1
+        f = model.ProgressiveFuture(start=est_start,
+                                    end=est_start + nspec * self.estimateFitTime(wavelength) / nworkers)
+        f._fit_state = RUNNING
+        f._fit_lock = threading.Lock()
+        f.task_canceller = self._CancelFit
+
+        # Not using the executor, as it's only one fit at a time, and it could
+        # block a simple Fit() for a long time.
+        executeAsyncTask(f, self._DoFitMap,
+                         args=(f, spectra, wavelength, type, max_peaks, neighbourhood, nworkers))
+        return f
+
+    def _DoFitMap(self, future, spectra, wavelength, type, max_peaks, neighbourhood, nworkers):
+        """
+        Fits every spectrum of a spectrum cube. See FitMap() for the parameters.
+        returns (4 DataArrays): pos, width, amplitude, offset
+        raises:
+                CancelledError if cancelled
+        """
+        start = time.time()
+        spatial_shape = spectra.shape[1:]
+        # One spectrum per row
+        flat = numpy.asarray(spectra).reshape(spectra.shape[0], -1).T
+        nspec = flat.shape[0]
+
+        if neighbourhood > 1:
+            hints = self._DetectNeighbourhoodPeaks(spectra, wavelength, neighbourhood)
+        else:
+            hints = [None] * nspec
+
+        params = numpy.full((nspec, max_peaks, 3), numpy.nan)
+        offsets = numpy.full((nspec,), numpy.nan)
+        # Big enough to keep the overhead of scheduling low, but small enough
+        # to have all the workers busy and to update the progress.
+        chunk_size = max(1, min(64, nspec // (nworkers * 4)))
+
+        # Threads, and not processes, as forking this (multi-threaded) process is
+        # not safe. As bounds are always passed, curve_fit() uses least_squares(),
+        # which is thread-safe, and most of the computation is done in numpy,
+        # which releases the GIL.
+        executor = ThreadPoolExecutor(max_workers=nworkers)
+        try:
+            fs = {}
+            for i in range(0, nspec, chunk_size):
+                j = min(i + chunk_size, nspec)
+                cf = executor.submit(_FitSpectra, flat[i:j], wavelength, type, max_peaks, hints[i:j])
+                fs[cf] = (i, j)
+
+            ndone = 0
+            for cf in as_completed(fs):
+                if future._fit_state == CANCELLED:
+                    raise CancelledError()
+                i, j = fs[cf]
+                params[i:j], offsets[i:j] = cf.result()
+                ndone += j - i
+                dur = time.time() - start
+                future.set_progress(end=time.time() + dur * (nspec - ndone) / ndone)
+        except CancelledError:
+            logging.debug("Fitting map of type %s was cancelled.", type)
+        finally:
+            for cf in fs:
+                cf.cancel()
+            executor.shutdown(wait=False)
+            with future._fit_lock:
+                if future._fit_state == CANCELLED:
+                    raise CancelledError()
+                future._fit_state = FINISHED
+
+        logging.debug("Fitted %d spectra in %g s", nspec, time.time() - start)
+        md = dict(getattr(spectra, "metadata", {}))
+        for k in (model.MD_WL_LIST, model.MD_DIMS):
+            md.pop(k, None)
+        params.shape = spatial_shape + (max_peaks, 3)
+        return (model.DataArray(params[..., 0].copy(), md),
+                model.DataArray(params[..., 1].copy(), md),
+                model.DataArray(params[..., 2].copy(), md),
+                model.DataArray(offsets.reshape(spatial_shape), md))
+
+    def _DetectNeighbourhoodPeaks(self, spectra, wavelength, neighbourhood):
+        """
+        Detects the peaks on the mean spectrum of each square of neighbouring pixels.
+        spectra (array of shape C, ..., Y, X): the spectrum cube
+        wavelength (1d array of floats): The wavelength values
+        neighbourhood (int): the size of the side of each square
+        returns (list of (None or list of 2-tuple of floats)): for each spectrum
+          (in flattened order), the peaks detected on its neighbourhood.
+        """
+        spectra = numpy.asarray(spectra)
+        shape = spectra.shape
+        spectra = spectra.reshape((shape[0], -1) + shape[-2:])  # C, N, Y, X
+        hints = numpy.empty(spectra.shape[1:], dtype=object)
+        for y in range(0, shape[-2], neighbourhood):
+            for x in range(0, shape[-1], neighbourhood):
+                block = spectra[:, :, y:y + neighbourhood, x:x + neighbourhood]
+                for k in range(block.shape[1]):
+                    mean_spec = block[:, k].reshape(shape[0], -1).mean(axis=1)
+                    # The peaks with the smallest smoothing window which finds some
+                    peaks = next(_DetectPeaks(mean_spec, wavelength), None)
+                    for h in numpy.ndindex(block.shape[2:]):
+                        hints[k, y + h[0], x + h[1]] = peaks
+        return list(hints.ravel())
+
 
 def peak_to_energy(pos, width, amplitude):
     """
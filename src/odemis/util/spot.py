@@ -148,7 +148,7 @@ def FindCenterCoordinates(image, smoothing=True):
     -------
     pos : tuple
         Position of the radial symmetry center in px from the center of the
-        image.
+        image. If the image is flat, (0, 0) is returned.
 
     Examples
     --------
@@ -178,6 +178,9 @@ def FindCenterCoordinates(image, smoothing=True):
     # Discard entries where the intensity gradient magnitude is zero, flatten
     # the array in the same go.
     idx = numpy.flatnonzero(dI2)
+    if idx.size == 0:
+        # Flat image (eg, saturated): no way to find the center
+        return 0.0, 0.0
     ik = numpy.take(ik, idx)
     jk = numpy.take(jk, idx)
     dIdi = numpy.take(dIdi, idx)
@@ -213,6 +216,124 @@ def FindCenterCoordinates(image, smoothing=True):
     return xc, yc
 
 
+def FindCenterCoordinatesBatch(images, smoothing=True):
+    """
+    Returns the radial symmetry center of each image of a stack of images with
+    sub-pixel resolution. It gives the same result as calling
+    FindCenterCoordinates() on every image, but all the images are processed
+    at once, which is much faster when there are many small images.
+    When the center cannot be determined, because the image is flat or all
+    its intensity gradients are parallel (eg, a straight edge), the center of
+    the image, (0, 0), is returned.
+
+    Parameters
+    ----------
+    images : array_like
+        Stack of images of shape (N, n, m), of which to determine the radial
+        symmetry centers.
+    smoothing : boolean
+        Apply a smoothing kernel to the intensity gradient.
+
+    Returns
+    -------
+    pos : array like
+        A 2D array of shape (N, 2) containing the position (x, y) of the radial
+        symmetry center of each image in px from the center of the image.
+
+    Examples
+    --------
+    >>> imgs = numpy.zeros((2, 7, 7))
+    >>> imgs[0, 3, 3] = 1
+    >>> imgs[1, 2, 4] = 1
+    >>> numpy.round(FindCenterCoordinatesBatch(imgs), 3)
+    array([[ 0.,  0.],
+           [ 1., -1.]])
+
+    """
+    images = numpy.asarray(images, dtype=numpy.float64)
+    if images.ndim != 3:
+        raise ValueError("Expected a stack of images of shape (N, n, m), got %s" % (images.shape,))
+
+    # Compute lattice midpoints (ik, jk), the same for all the images.
+    _, n, m = images.shape
+    jk, ik = numpy.meshgrid(numpy.arange(m - 1) + 0.5, numpy.arange(n - 1) + 0.5)
+
+    # Calculate the intensity gradient, as the 2x2 convolutions of
+    # FindCenterCoordinates(), but on all the images at once.
+    tl = images[:, :-1, :-1]
+    tr = images[:, :-1, 1:]
+    bl = images[:, 1:, :-1]
+    br = images[:, 1:, 1:]
+    dIdi = bl + br - tl - tr
+    dIdj = tr + br - tl - bl
+    if smoothing:
+        dIdi = _SmoothStack(dIdi)
+        dIdj = _SmoothStack(dIdj)
+    dI2 = numpy.square(dIdi) + numpy.square(dIdj)
+
+    # Entries where the intensity gradient magnitude is zero are discarded, by
+    # giving them a null weight.
+    valid = dI2 != 0
+    dI = numpy.sqrt(dI2)
+    dI[~valid] = 1
+
+    # Lines passing through the midpoint (ik, jk), parallel to the gradient
+    # intensity, in implicit form: `a*i + b*j + c = 0`, with `a^2 + b^2 = 1`.
+    a = -dIdj / dI
+    b = dIdi / dI
+    c = a * ik + b * jk
+
+    # Weighting (squared): square of the gradient magnitude and inverse
+    # distance to the centroid of the square of the gradient intensity
+    # magnitude.
+    sdI2 = numpy.sum(dI2, axis=(1, 2))
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        i0 = numpy.sum(dI2 * ik, axis=(1, 2)) / sdI2
+        j0 = numpy.sum(dI2 * jk, axis=(1, 2)) / sdI2
+        w2 = dI2 / numpy.hypot(ik - i0[:, None, None], jk - j0[:, None, None])
+    w2[~valid] = 0
+
+    # Solve the N linear sets of equations in a least-squares sense. As there
+    # are only 2 unknowns, the normal equations are solved directly.
+    saa = numpy.sum(w2 * a * a, axis=(1, 2))
+    sab = numpy.sum(w2 * a * b, axis=(1, 2))
+    sbb = numpy.sum(w2 * b * b, axis=(1, 2))
+    sac = numpy.sum(w2 * a * c, axis=(1, 2))
+    sbc = numpy.sum(w2 * b * c, axis=(1, 2))
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        det = saa * sbb - sab * sab
+        ic = (sbb * sac - sab * sbc) / det
+        jc = (saa * sbc - sab * sac) / det
+
+    # Convert from index (top-left) to (center) position information.
+    xc = jc - 0.5 * float(m) + 0.5
+    yc = ic - 0.5 * float(n) + 0.5
+
+    # No solution (the equations are not independent) => center of the image
+    undetermined = det == 0
+    xc[undetermined] = 0
+    yc[undetermined] = 0
+
+    return numpy.column_stack((xc, yc))
+
+
+def _SmoothStack(images):
+    """
+    Apply a 3x3 mean filter on each image of a stack, with symmetrical
+    boundaries (same as scipy.signal.convolve2d(boundary='symm', mode='same')).
+    images (ndarray of shape (N, n, m)): the stack of images
+    returns (ndarray of shape (N, n, m)): the smoothed images
+    """
+    _, n, m = images.shape
+    padded = numpy.pad(images, ((0, 0), (1, 1), (1, 1)), mode="symmetric")
+    smoothed = numpy.zeros_like(images)
+    for i in range(3):
+        for j in range(3):
+            smoothed += padded[:, i:i + n, j:j + m]
+    smoothed /= 9.
+    return smoothed
+
+
 def _CreateSEDisk(r=3):
     """
     Create a flat disk-shaped structuring element with the specified radius r. The structuring element can be used
@@ -284,6 +405,9 @@ def MaximaFind(image, qty, len_object=18):
     refined_center = numpy.zeros_like(pos)
     pos = numpy.rint(pos).astype(numpy.int16)
     y_max, x_max = image.shape
+    # The sub-images are grouped by shape (typically, they all have the same
+    # shape), so that the centers can be computed in a single batch.
+    spots = {}  # shape -> list of (index, sub-image)
     for idx, xy in enumerate(pos):
         x_start, y_start = xy - w + 1
         x_end, y_end = xy + w
@@ -303,7 +427,11 @@ def MaximaFind(image, qty, len_object=18):
             y_start += y_end - y_max
             y_end = y_max
         spot = filtered[y_start:y_end, x_start:x_end]
-        refined_center[idx] = numpy.array(FindCenterCoordinates(spot))
+        spots.setdefault(spot.shape, []).append((idx, spot))
+
+    for sspots in spots.values():
+        indices, subimages = zip(*sspots)
+        refined_center[list(indices)] = FindCenterCoordinatesBatch(subimages)
     refined_position = pos + refined_center
     return refined_position
 
@@ -21,7 +21,9 @@ If not, see http://www.gnu.org/licenses/.
 
 from __future__ import division
 
+import logging
 import numpy
+import time
 
 from odemis.model import MD_POL_MODE, MD_POL_S1
 
@@ -29,11 +31,48 @@ from odemis.util.img import ensure2DImage
 
 from odemis import model
 from odemis.dataio import hdf5
-from odemis.util import angleres
+from odemis.util import angleres, img
 import unittest
 
 from odemis.util.img import RGB2Greyscale
 
+import matplotlib
+matplotlib.use("Agg")  # use non-GUI backend
+import matplotlib.pyplot as plt
+
+
+def Rectangular2PolarMatplotlib(data, output_size, colormap=None):
+    """
+    Reference implementation of Rectangular2Polar, which draws the data with matplotlib.
+    """
+    phi_indices = numpy.linspace(0, 2 * numpy.pi, data.shape[1])
+    theta_indices = numpy.linspace(0, numpy.pi / 2, data.shape[0])
+    phi, theta = numpy.meshgrid(phi_indices, theta_indices)
+    y_data_polar = numpy.cos(phi) * theta
+    x_data_polar = numpy.sin(phi) * theta
+
+    mask = angleres._CreateMirrorMaskRectangular(data, hole=True)
+    mask_outliers = mask & ~numpy.isnan(data)
+    lim1, lim2 = img.getOutliers(data[mask_outliers], outliers=1/256)
+    lim = max(abs(lim1), abs(lim2))
+    lim1, lim2 = -lim, lim  # Only MD_POL_S1 supported
+
+    data_masked = numpy.ma.masked_array(data, ~mask)
+    fig = plt.figure(figsize=(output_size, output_size), dpi=1)
+    plt.pcolormesh(x_data_polar, y_data_polar, data_masked, cmap=colormap, vmin=lim1, vmax=lim2)
+    plt.axis("square")
+
+    fig.set_facecolor((0, 0, 0))
+    fig.gca().axis("tight")
+    fig.gca().set_xticks([])
+    fig.gca().set_yticks([])
+    fig.gca().axis('off')
+    fig.tight_layout(pad=0)
+    fig.canvas.draw()
+    result = numpy.array(fig.canvas.buffer_rgba())[:, :, :3]
+    plt.close(fig)
+    return result
+
 
 class TestAngleResolvedDataConversion(unittest.TestCase):
     """
@@ -442,6 +481,124 @@ class TestAngleResolvedDataConversion(unittest.TestCase):
         self.assertEqual(result.shape, (201, 201, 3))
         self.assertEqual(result_polar_2.shape, result_polar_1.shape)
 
+    def test_rect2polar_matplotlib(self):
+        """
+        Tests the output of Rectangular2Polar is the same as drawing the data with matplotlib.
+        """
+        data = ensure2DImage(self.data[0])
+        data.metadata[MD_POL_MODE] = MD_POL_S1
+        data_rect = angleres.AngleResolved2Rectangular(data, (90, 360))
+
+        for colormap in ("seismic", "viridis"):
+            result = angleres.Rectangular2Polar(data_rect, 201, colormap=colormap)
+            expected = Rectangular2PolarMatplotlib(data_rect, 201, colormap=colormap)
+            self.assertEqual(result.shape, expected.shape)
+            self.assertEqual(result.metadata[model.MD_DIMS], "YXC")
+
+            # Only the borders (antialiasing, mirror edges) may differ
+            diff = numpy.abs(result.astype(numpy.int16) - expected).max(axis=2)
+            logging.debug("Differing pixels: %d", numpy.count_nonzero(diff > 16))
+            self.assertLess(numpy.count_nonzero(diff > 16), 0.01 * diff.size)
+            self.assertLess(numpy.mean(diff), 4)
+
+        # Second call uses the cache, and gives the same result
+        result2 = angleres.Rectangular2Polar(data_rect, 201, colormap="viridis")
+        numpy.testing.assert_array_equal(result, result2)
+
+    def test_batch_polar(self):
+        """
+        Tests the conversion of a series of images is the same as one at a time.
+        """
+        data = ensure2DImage(self.data[0])
+        cube = numpy.array([data * (i + 1) for i in range(7)], dtype=numpy.float64)
+        cube = model.DataArray(cube.reshape((7, 1) + data.shape), data.metadata)
+        f = angleres.AngleResolved2PolarBatch(cube, 201, chunk_size=3)
+        result = f.result()
+        self.assertEqual(result.shape, (7, 1, 201, 201))
+        for i in range(7):
+            expected = angleres.AngleResolved2Polar(model.DataArray(cube[i, 0], data.metadata), 201)
+            numpy.testing.assert_allclose(result[i, 0], expected, rtol=1e-6)
+
+        # with a pre-allocated output
+        out = numpy.empty((7, 1, 201, 201))
+        f = angleres.AngleResolved2PolarBatch(cube, 201, out=out, max_workers=2)
+        self.assertIs(f.result(), out)
+        numpy.testing.assert_array_equal(out, result)
+
+        # wrong output shape
+        with self.assertRaises(ValueError):
+            angleres.AngleResolved2PolarBatch(cube, 201, out=numpy.empty((7, 201, 201)))
+
+    def test_batch_rectangular_inverted_mirror(self):
+        """
+        Tests the conversion of a list of images from a flipped mirror is the same
+        as one at a time.
+        """
+        data = ensure2DImage(self.data_invMir[0])
+        images = [model.DataArray(data * (i + 1), data.metadata) for i in range(5)]
+        result = angleres.AngleResolved2RectangularBatch(images, (90, 360), chunk_size=2).result()
+        self.assertEqual(result.shape, (5, 90, 360))
+        for im, r in zip(images, result):
+            expected = angleres.AngleResolved2Rectangular(im, (90, 360))
+            numpy.testing.assert_allclose(r, expected, rtol=1e-6, atol=1e-7)
+
+        # All the images must have the same geometry
+        md = data.metadata.copy()
+        md[model.MD_AR_POLE] = (100, 100)
+        images.append(model.DataArray(data, md))
+        with self.assertRaises(ValueError):
+            angleres.AngleResolved2RectangularBatch(images, (90, 360))
+
+    def test_speed(self):
+        """
+        Compares the speed of converting a series of images at once vs one at a
+        time, recomputing the interpolation for each image (as without the cache).
+        """
+        data = self.white_data_512
+        n = 8
+        cube = model.DataArray(numpy.repeat(data[numpy.newaxis], n, axis=0), data.metadata)
+
+        tstart = time.time()
+        for im in cube:
+            angleres._plans_cache.clear()
+            angleres.AngleResolved2Polar(model.DataArray(im, data.metadata), 201)
+        dur_single = time.time() - tstart
+
+        angleres._plans_cache.clear()
+        tstart = time.time()
+        angleres.AngleResolved2PolarBatch(cube, 201).result()
+        dur_batch = time.time() - tstart
+        logging.info("Converting %d images took %g s one at a time, and %g s as a batch",
+                     n, dur_single, dur_batch)
+        self.assertLess(dur_batch, dur_single)
+
+    def test_speed_rect2polar(self):
+        """
+        Compares the speed of Rectangular2Polar with the matplotlib rendering
+        """
+        data = ensure2DImage(self.data[0])
+        data.metadata[MD_POL_MODE] = MD_POL_S1
+        data_rect = angleres.AngleResolved2Rectangular(data, (90, 360))
+        n = 10
+
+        tstart = time.time()
+        for i in range(n):
+            Rectangular2PolarMatplotlib(data_rect, 400, colormap="seismic")
+        dur_mpl = (time.time() - tstart) / n
+
+        angleres._polar_plans_cache.clear()
+        tstart = time.time()
+        angleres.Rectangular2Polar(data_rect, 400, colormap="seismic")
+        dur_first = time.time() - tstart
+
+        tstart = time.time()
+        for i in range(n):
+            angleres.Rectangular2Polar(data_rect, 400, colormap="seismic")
+        dur_cached = (time.time() - tstart) / n
+        logging.info("Rendering in polar took %g s with matplotlib, %g s the first time, "
+                     "and %g s with the cached plan", dur_mpl, dur_first, dur_cached)
+        self.assertLess(dur_cached, dur_mpl)
+
 
 if __name__ == "__main__":
     # for debug:
@@ -945,6 +945,41 @@ class TestImageIntegrator(unittest.TestCase):
 
         numpy.testing.assert_equal(self.integrated_data, (numpy.array([1, 1, 1, 1, 1])))
 
+    def test_det_type(self):
+        """
+        Test forcing the detector type
+        """
+        self.img_intor = img.ImageIntegrator(self.integrationCounts, det_type=model.MD_DT_NORMAL)
+        for i in range(self.integrationCounts):
+            self.integrated_data = self.img_intor.append(self.data)
+
+        numpy.testing.assert_equal(self.integrated_data, numpy.ones((5, 5)))
+        self.assertEqual(self.integrated_data.dtype, self.data.dtype)
+
+    def test_in_place(self):
+        """
+        Test the accumulation reuses the same buffer, and the final image is independent
+        """
+        self.integrationCounts = 5
+        self.img_intor = img.ImageIntegrator(self.integrationCounts)
+        inter_imgs = []
+        for i in range(self.integrationCounts):
+            self.integrated_data = self.img_intor.append(self.data)
+            inter_imgs.append(self.integrated_data)
+
+        # The input data is not modified
+        numpy.testing.assert_equal(self.data, numpy.ones((5, 5)))
+        # All the intermediary images share the same buffer
+        for im in inter_imgs[2:]:
+            self.assertTrue(numpy.shares_memory(inter_imgs[1], im))
+        numpy.testing.assert_equal(self.integrated_data, 5 * numpy.ones((5, 5)))
+        self.assertEqual(self.integrated_data.metadata[model.MD_INTEGRATION_COUNT], 5)
+
+        # The next integration doesn't modify the previous result
+        for i in range(self.integrationCounts):
+            self.img_intor.append(self.data)
+        numpy.testing.assert_equal(self.integrated_data, 5 * numpy.ones((5, 5)))
+
 
 class TestMergeTiles(unittest.TestCase):
 
@@ -16,11 +16,13 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 from __future__ import division
 
+from concurrent.futures._base import CancelledError
 import logging
 import numpy
 from odemis.dataio import hdf5
 from odemis.util import peak
 import os
+import time
 import unittest
 import matplotlib.pyplot as plt
 
@@ -132,6 +134,48 @@ class TestPeak(unittest.TestCase):
         # Assert wrong fitting type
         self.assertRaises(KeyError, peak.Curve, wl, params, offset, type='wrongType')
 
+    def test_fit_map(self):
+        """
+        Fitting a whole map should give the same result as fitting each spectrum
+        """
+        wl = self.wl_in_meters
+        spectra = self.data[:, 18:21, 18:22]
+        for fit_type in ('gaussian_space', 'lorentzian_energy'):
+            f = self._peak_fitter.FitMap(spectra, wl, type=fit_type, max_peaks=20, max_workers=2)
+            pos, width, amplitude, offset = f.result()
+            self.assertEqual(pos.shape, (3, 4, 20))
+            self.assertEqual(offset.shape, (3, 4))
+
+            for y, x in numpy.ndindex(offset.shape):
+                params, exp_offset, _ = self._peak_fitter.Fit(spectra[:, y, x], wl, type=fit_type).result()
+                # Map peaks are sorted by amplitude
+                params = numpy.array(sorted(params, key=lambda p: p[2], reverse=True))
+                n = len(params)
+                numpy.testing.assert_allclose(pos[y, x, :n], params[:, 0])
+                numpy.testing.assert_allclose(width[y, x, :n], params[:, 1])
+                numpy.testing.assert_allclose(amplitude[y, x, :n], params[:, 2])
+                self.assertTrue(numpy.all(numpy.isnan(pos[y, x, n:])))
+                self.assertAlmostEqual(offset[y, x], exp_offset)
+
+        # With peak detection shared by neighbours, the fit might be different,
+        # but every spectrum should still be fitted
+        f = self._peak_fitter.FitMap(spectra, wl, max_peaks=1, neighbourhood=2)
+        pos, width, amplitude, offset = f.result()
+        self.assertEqual(pos.shape, (3, 4, 1))
+        self.assertTrue(numpy.all(numpy.isfinite(offset)))
+        self.assertTrue(numpy.all(pos > wl[0] / 2))
+        self.assertTrue(numpy.all(width > 0))
+
+        self.assertRaises(KeyError, self._peak_fitter.FitMap, spectra, wl, type='wrongType')
+
+    def test_fit_map_cancel(self):
+        f = self._peak_fitter.FitMap(self.data, self.wl_in_meters)
+        time.sleep(0.5)
+        self.assertTrue(f.cancel())
+        self.assertTrue(f.cancelled())
+        with self.assertRaises(CancelledError):
+            f.result()
+
 
 if __name__ == "__main__":
     unittest.main()
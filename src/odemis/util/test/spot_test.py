@@ -218,5 +218,107 @@ class TestFindCenterCoordinates(unittest.TestCase):
                         self.assertAlmostEqual(i, yc + 0.5 * (n - 1))
 
 
+class TestFindCenterCoordinatesBatch(unittest.TestCase):
+    """
+    Unit test class to test the behavior of FindCenterCoordinatesBatch in
+    odemis.util.spot.
+    """
+
+    def setUp(self):
+        self.imgdata = tiff.read_data(os.path.join(TEST_IMAGE_PATH, 'spotdata.tif'))
+
+    def test_same_as_single(self):
+        """
+        FindCenterCoordinatesBatch should give the same result as
+        FindCenterCoordinates on each image.
+        """
+        imgs = numpy.asarray(self.imgdata)
+        for smoothing in (True, False):
+            coords = numpy.array([spot.FindCenterCoordinates(i, smoothing) for i in imgs])
+            coords_batch = spot.FindCenterCoordinatesBatch(imgs, smoothing)
+            self.assertEqual(coords_batch.shape, (len(imgs), 2))
+            numpy.testing.assert_allclose(coords_batch, coords, rtol=0, atol=1e-9)
+
+    def test_same_as_single_noise(self):
+        """
+        FindCenterCoordinatesBatch should give the same result as
+        FindCenterCoordinates, also on non square noisy images.
+        """
+        rng = numpy.random.RandomState(0)
+        imgs = rng.randint(0, 4096, (50, 13, 17)).astype(numpy.uint16)
+        coords = numpy.array([spot.FindCenterCoordinates(i) for i in imgs])
+        coords_batch = spot.FindCenterCoordinatesBatch(imgs)
+        numpy.testing.assert_allclose(coords_batch, coords, rtol=0, atol=1e-9)
+
+    def test_same_as_single_flat(self):
+        """
+        On flat images (eg, saturated), FindCenterCoordinatesBatch should give
+        the same result as FindCenterCoordinates: the center of the image.
+        """
+        rng = numpy.random.RandomState(0)
+        imgs = rng.randint(0, 4096, (3, 9, 9)).astype(numpy.uint16)
+        imgs[1] = 0
+        imgs[2] = 4095
+        coords = numpy.array([spot.FindCenterCoordinates(i) for i in imgs])
+        coords_batch = spot.FindCenterCoordinatesBatch(imgs)
+        self.assertTrue(numpy.all(numpy.isfinite(coords_batch)))
+        numpy.testing.assert_allclose(coords_batch, coords, rtol=0, atol=1e-9)
+        numpy.testing.assert_array_equal(coords_batch[1:], [(0, 0), (0, 0)])
+
+    def test_sanity(self):
+        """
+        Stack of images consisting of all zeros and a single pixel with value
+        one. FindCenterCoordinatesBatch should return the coordinates of each
+        of these pixels.
+        """
+        n, m = 9, 11
+        expected = []
+        imgs = []
+        for i in range(2, n - 2):
+            for j in range(2, m - 2):
+                img = numpy.zeros((n, m))
+                img[i, j] = 1
+                imgs.append(img)
+                expected.append((j - 0.5 * (m - 1), i - 0.5 * (n - 1)))
+        coords = spot.FindCenterCoordinatesBatch(imgs)
+        numpy.testing.assert_almost_equal(coords, expected)
+
+    def test_wrong_shape(self):
+        with self.assertRaises(ValueError):
+            spot.FindCenterCoordinatesBatch(numpy.zeros((9, 9)))
+
+
+class TestMaximaFind(unittest.TestCase):
+    """
+    Unit test class to test the behavior of MaximaFind in odemis.util.spot.
+    """
+
+    def test_grid(self):
+        """
+        MaximaFind should find the sub-pixel position of all the spots of a
+        grid, including the ones close to the border of the image.
+        """
+        shape = (256, 300)
+        rng = numpy.random.RandomState(0)
+        exp_pos = []
+        for y in numpy.linspace(8, shape[0] - 8, 8):
+            for x in numpy.linspace(8, shape[1] - 8, 8):
+                exp_pos.append((x + rng.uniform(-0.5, 0.5), y + rng.uniform(-0.5, 0.5)))
+        exp_pos = numpy.array(exp_pos)
+
+        yy, xx = numpy.mgrid[0:shape[0], 0:shape[1]]
+        image = numpy.zeros(shape)
+        for x, y in exp_pos:
+            image += 1000 * numpy.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * 2.0 ** 2))
+        image = image.astype(numpy.uint16)
+
+        pos = spot.MaximaFind(image, len(exp_pos))
+        self.assertEqual(pos.shape, exp_pos.shape)
+        # Match each found position to the closest expected position
+        for p in pos:
+            d = numpy.hypot(*(exp_pos - p).T)
+            self.assertLess(d.min(), 0.2)
+
+
 if __name__ == "__main__":
     unittest.main()